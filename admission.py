@@ -0,0 +1,100 @@
+"""
+Контроль допуска событий при перегрузке (load shedding).
+
+Когда пул БД исчерпан, обработчики без ограничения ждут соединения, задержка растет, а бот
+продолжает брать новую работу. AdmissionMiddleware (inner middleware событий) вместо этого:
+- ограничивает число одновременно обрабатываемых событий (ADMISSION_MAX_IN_FLIGHT);
+- тяжелые отчеты (обработчики с флагом heavy: /month, /report, /year) отклоняет первыми:
+  сверх ADMISSION_MAX_HEAVY одновременных или если в основном пуле осталось меньше
+  ADMISSION_RESERVED_CONNECTIONS свободных соединений - они нужны записи еды;
+- DatabaseBusyError (соединение не получено за DB_ACQUIRE_TIMEOUT) превращает в быстрый
+  ответ "бот перегружен, попробуйте еще раз". Состояние FSM при этом не сбрасывается,
+  и пользователь может повторить ввод с того же шага.
+"""
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+import config
+import database as db
+
+logger = logging.getLogger(__name__)
+
+HEAVY_FLAG = "heavy" # flags={"heavy": True} у обработчиков тяжелых отчетов
+
+BUSY_TEXT = "⏳ Бот сейчас перегружен. Попробуйте еще раз через минуту."
+HEAVY_BUSY_TEXT = "⏳ Отчеты временно недоступны из-за нагрузки. Попробуйте позже - добавлять еду можно как обычно."
+
+# admitted - пропущено событий, shed_in_flight / shed_heavy - отклонено по лимиту одновременных
+# событий / тяжелых отчетов, db_busy - обработчиков, не дождавшихся соединения с БД
+admission_stats: Dict[str, int] = {"admitted": 0, "shed_in_flight": 0, "shed_heavy": 0, "db_busy": 0}
+
+_in_flight = 0
+_heavy_in_flight = 0
+
+
+def free_connections(pool) -> Optional[int]:
+    """Свободные и еще не открытые соединения пула (None - пула нет)."""
+    if pool is None:
+        return None
+    return pool.get_idle_size() + pool.get_max_size() - pool.get_size()
+
+
+def rejection_reason(heavy: bool) -> Optional[str]:
+    """Причина отклонения нового события (ключ admission_stats) или None, если его можно обработать."""
+    if 0 < config.ADMISSION_MAX_IN_FLIGHT <= _in_flight:
+        return "shed_in_flight"
+    if heavy:
+        if 0 < config.ADMISSION_MAX_HEAVY <= _heavy_in_flight:
+            return "shed_heavy"
+        free = free_connections(db.db_pool)
+        if free is not None and free < config.ADMISSION_RESERVED_CONNECTIONS:
+            return "shed_heavy"
+    return None
+
+
+async def reply_busy(event: TelegramObject, text: str = BUSY_TEXT):
+    """Быстрый ответ о перегрузке (сообщением или всплывающим уведомлением на кнопке)."""
+    try:
+        if isinstance(event, Message):
+            await event.answer(text)
+        elif isinstance(event, CallbackQuery):
+            await event.answer(text, show_alert=True)
+    except Exception as e:
+        logger.warning(f"Не удалось ответить о перегрузке: {e}")
+
+
+class AdmissionMiddleware(BaseMiddleware):
+    """Inner middleware событий: лимиты одновременной обработки и ответ при перегрузке БД."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        global _in_flight, _heavy_in_flight
+        heavy = bool(get_flag(data, HEAVY_FLAG))
+        reason = rejection_reason(heavy)
+        if reason is not None:
+            admission_stats[reason] += 1
+            logger.info(f"Событие отклонено ({reason}): в обработке {_in_flight}, тяжелых {_heavy_in_flight}.")
+            await reply_busy(event, HEAVY_BUSY_TEXT if reason == "shed_heavy" else BUSY_TEXT)
+            return None
+
+        admission_stats["admitted"] += 1
+        _in_flight += 1
+        _heavy_in_flight += heavy
+        try:
+            return await handler(event, data)
+        except db.DatabaseBusyError as e:
+            admission_stats["db_busy"] += 1
+            logger.warning(f"{e}: обработчик прерван, пользователю отправлен ответ о перегрузке.")
+            await reply_busy(event, HEAVY_BUSY_TEXT if heavy else BUSY_TEXT)
+            return None
+        finally:
+            _in_flight -= 1
+            _heavy_in_flight -= heavy
@@ -0,0 +1,173 @@
+"""
+Пакетные расчеты для дайджестов, аналитики и офлайн-задач: нормы калорий за период
+и дневные нормы по профилям сразу для многих пользователей.
+
+Если установлен NumPy, расчеты векторизованы (операции над плоскими массивами всех
+пользователей). Без NumPy используются построчные функции из handlers.reports и utils,
+результаты обоих вариантов совпадают.
+"""
+import logging
+from datetime import date
+from operator import itemgetter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import utils
+from handlers.reports import calculate_total_norm_for_period
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - зависит от установленного пакета numpy
+    np = None
+
+logger = logging.getLogger(__name__)
+
+NormResult = Tuple[int, int, bool] # (total_norm_period, average_norm_period, norm_calculated)
+
+_effective_date = itemgetter('effective_date')
+_daily_goal = itemgetter('daily_calorie_goal')
+
+
+def _calculate_period_norms_python(
+    period_start_date: date,
+    period_days: int,
+    history_by_user: Dict[int, List[dict]],
+    current_goals: Dict[int, Optional[int]],
+    user_ids: Iterable[int],
+) -> Dict[int, NormResult]:
+    return {
+        user_id: calculate_total_norm_for_period(
+            period_start_date, period_days, history_by_user.get(user_id, []), current_goals.get(user_id)
+        )
+        for user_id in user_ids
+    }
+
+
+def calculate_period_norms_batch(
+    period_start_date: date,
+    period_days: int,
+    history_by_user: Dict[int, List[dict]],
+    current_goals: Dict[int, Optional[int]],
+    use_numpy: bool = True,
+) -> Dict[int, NormResult]:
+    """
+    Рассчитывает суммарную и среднюю норму за период для множества пользователей.
+
+    history_by_user: {user_id: записи goal_history (effective_date, daily_calorie_goal)}
+    current_goals: {user_id: текущая daily_calorie_goal} - используется для дней до начала истории.
+    Возвращает {user_id: (total_norm_period, average_norm_period, norm_calculated)}
+    для всех пользователей из обоих словарей - как calculate_total_norm_for_period для каждого.
+    """
+    user_ids = sorted(set(current_goals) | set(history_by_user))
+    if period_days <= 0:
+        return {user_id: (0, 0, False) for user_id in user_ids}
+    if np is None or not use_numpy:
+        return _calculate_period_norms_python(period_start_date, period_days, history_by_user, current_goals, user_ids)
+
+    user_positions = {user_id: position for position, user_id in enumerate(user_ids)}
+    period_start = period_start_date.toordinal()
+    period_end = period_start + period_days # не включительно
+
+    # Плоские массивы истории всех пользователей: (позиция пользователя, дата, норма)
+    flat_users: List[int] = []
+    flat_dates: List[int] = []
+    flat_goals: List[int] = []
+    for user_id, records in history_by_user.items():
+        flat_users.extend([user_positions[user_id]] * len(records))
+        flat_dates.extend(map(date.toordinal, map(_effective_date, records)))
+        flat_goals.extend(map(_daily_goal, records))
+
+    users = np.asarray(flat_users, dtype=np.int64)
+    dates = np.asarray(flat_dates, dtype=np.int64)
+    goals = np.asarray(flat_goals, dtype=np.int64)
+    # Сортировка по (пользователь, дата, порядок в истории); при повторе даты побеждает последняя запись
+    order = np.lexsort((np.arange(len(users)), dates, users))
+    users, dates, goals = users[order], dates[order], goals[order]
+    is_last_for_date = np.ones(len(users), dtype=bool)
+    is_last_for_date[:-1] = (users[1:] != users[:-1]) | (dates[1:] != dates[:-1])
+    users, dates, goals = users[is_last_for_date], dates[is_last_for_date], goals[is_last_for_date]
+
+    # Каждая запись истории действует до следующей записи того же пользователя (или до конца периода)
+    same_user_next = np.zeros(len(users), dtype=bool)
+    same_user_next[:-1] = users[1:] == users[:-1]
+    next_dates = np.full(len(dates), period_end, dtype=np.int64)
+    next_dates[:-1] = np.where(same_user_next[:-1], dates[1:], period_end)
+    segment_days = np.clip(np.minimum(next_dates, period_end) - np.maximum(dates, period_start), 0, None)
+
+    count = len(user_ids)
+    totals = np.zeros(count, dtype=np.int64)
+    np.add.at(totals, users, goals * segment_days)
+    found = np.zeros(count, dtype=bool)
+    found[users[segment_days > 0]] = True
+
+    # Дни до первой записи истории (или весь период без истории) считаются по текущей норме
+    first_dates = np.full(count, period_end, dtype=np.int64)
+    is_first = np.ones(len(users), dtype=bool)
+    is_first[1:] = users[1:] != users[:-1]
+    first_dates[users[is_first]] = np.minimum(dates[is_first], period_end)
+    days_before_history = np.clip(first_dates - period_start, 0, None)
+    current = np.asarray([current_goals.get(user_id) or 0 for user_id in user_ids], dtype=np.int64)
+    totals += current * days_before_history
+    found |= (current != 0) & (days_before_history > 0)
+
+    totals = np.where(found, totals, 0)
+    averages = np.rint(totals / period_days).astype(np.int64)
+    return {
+        user_id: (int(totals[position]), int(averages[position]), bool(found[position]))
+        for position, user_id in enumerate(user_ids)
+    }
+
+
+def _calculate_daily_goals_python(profiles: List[dict]) -> List[Optional[int]]:
+    goals: List[Optional[int]] = []
+    for profile in profiles:
+        weight, height, gender, goal = (profile.get(key) for key in ('current_weight', 'height', 'gender', 'goal'))
+        if not all([weight, height, gender, goal]):
+            goals.append(None)
+            continue
+        lbm = utils.calculate_lbm(weight_kg=float(weight), height_cm=height, gender=gender)
+        _, calories = (utils.calculate_target_macros_and_calories(lbm=lbm, goal=goal) if lbm else None) or (None, None)
+        goals.append(calories)
+    return goals
+
+
+def calculate_daily_goals_batch(profiles: List[dict], use_numpy: bool = True) -> List[Optional[int]]:
+    """
+    Рассчитывает дневную норму калорий (daily_calorie_goal) для списка профилей.
+
+    profiles: записи с полями current_weight, height, gender, goal (как в таблице users).
+    Формулы и проверки те же, что в utils.calculate_lbm и utils.calculate_target_macros_and_calories
+    (включая текущие MACRO_TARGETS_PER_LBM_KG и CALORIES_PER_GRAM). Возвращает список норм
+    в порядке профилей; None - норму рассчитать нельзя (как в recalculate_and_save_goal).
+    """
+    if np is None or not use_numpy:
+        return _calculate_daily_goals_python(profiles)
+    if not profiles:
+        return []
+
+    goal_names = list(utils.MACRO_TARGETS_PER_LBM_KG)
+    goal_codes = {name: code for code, name in enumerate(goal_names)}
+    gender_codes = {'male': 1, 'female': 2}
+    weights = np.asarray([float(profile['current_weight'] or 0) for profile in profiles], dtype=np.float64)
+    heights = np.asarray([profile['height'] or 0 for profile in profiles], dtype=np.float64)
+    genders = np.asarray([gender_codes.get(profile['gender'], 0) for profile in profiles], dtype=np.int64)
+    goals = np.asarray([goal_codes.get(profile['goal'], -1) for profile in profiles], dtype=np.int64)
+
+    # LBM по формулам utils.calculate_lbm (порядок операций тот же, поэтому результат совпадает до бита)
+    male_w, male_h, male_c = utils.LBM_COEFFICIENTS['male']
+    female_w, female_h, female_c = utils.LBM_COEFFICIENTS['female']
+    lbm = np.where(
+        genders == 1,
+        (male_w * weights) + (male_h * heights) - male_c,
+        (female_w * weights) + (female_h * heights) - female_c,
+    )
+    valid = (weights != 0) & (heights != 0) & (genders != 0) & (goals >= 0)
+    valid &= (lbm > 0) & (lbm <= weights * utils.LBM_MAX_WEIGHT_RATIO)
+
+    # Граммы БЖУ на кг LBM для цели каждого пользователя, округление как у round() (к четному)
+    safe_goals = np.where(goals >= 0, goals, 0)
+    total_calories = np.zeros(len(profiles), dtype=np.int64)
+    for macro, calories_per_gram in utils.CALORIES_PER_GRAM.items():
+        per_lbm_kg = np.asarray([utils.MACRO_TARGETS_PER_LBM_KG[name][macro] for name in goal_names], dtype=np.float64)
+        grams = np.rint(per_lbm_kg[safe_goals] * lbm).astype(np.int64)
+        total_calories += grams * calories_per_gram
+    return [int(calories) if ok else None for calories, ok in zip(total_calories.tolist(), valid.tolist())]
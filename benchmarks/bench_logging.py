@@ -0,0 +1,125 @@
+"""
+Микробенчмарк логирования на горячем пути /today (get_todays_food_entries).
+
+Сравнивает время в потоке цикла событий на один вызов:
+- прежний вариант: синхронный StreamHandler в файл, f-строки с [DEBUG]-сообщениями на уровне INFO
+  и строка с astimezone() на каждую запись;
+- текущий: log_config (очередь + поток вывода), ленивое %-форматирование на уровне DEBUG
+  при уровне логгера INFO (записи отбрасываются до форматирования);
+- текущий с включенным DEBUG: записи форматируются в потоке вывода, построчный вывод
+  ограничен RateLimitFilter.
+
+Запуск из корня проекта: python benchmarks/bench_logging.py [--entries N] [--calls N]
+"""
+import argparse
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import tempfile
+import timeit
+from datetime import datetime, time, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# Для импорта модулей бота достаточно фиктивных настроек
+os.environ.setdefault("BOT_TOKEN", "bench-token")
+os.environ.setdefault("DB_USER", "bench-user")
+os.environ.setdefault("DB_PASS", "bench-pass")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_NAME", "bench-db")
+
+import pytz
+
+import log_config
+
+
+def make_entries(count: int, user_tz) -> list[dict]:
+    start = datetime.now(pytz.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    return [{'entry_timestamp': start + timedelta(minutes=17 * i), 'product_name': f"продукт {i}"} for i in range(count)]
+
+
+def legacy_log(logger: logging.Logger, user_id: int, tz_name: str, user_tz, entries: list[dict]):
+    """Прежнее логирование get_todays_food_entries и get_food_entries_for_period."""
+    now_local = datetime.now(user_tz)
+    today_start_local = user_tz.localize(datetime.combine(now_local.date(), time.min))
+    next_day_start_local = today_start_local + timedelta(days=1)
+    logger.info(f"[DEBUG] get_todays_food_entries для {user_id} (TZ: {tz_name}) now_local={now_local}, today_start_local={today_start_local}, next_day_start_local={next_day_start_local}")
+    logger.info(f"[DEBUG] UTC-границы: start={today_start_local.astimezone(pytz.utc)}, end={next_day_start_local.astimezone(pytz.utc)}")
+    sql = "SELECT product_name, weight_grams, calories_consumed, entry_timestamp FROM food_entries WHERE user_id = $1 AND entry_timestamp >= $2 AND entry_timestamp < $3 ORDER BY entry_timestamp;"
+    logger.debug(f"SQL Запрос для get_food_entries_for_period ({user_id}):\nSQL = {sql}\nPARAMS = user_id={user_id}")
+    logger.debug(f"Получено {len(entries)} записей для {user_id} за период.")
+    for entry in entries:
+        logger.info(f"[DEBUG] entry_timestamp (UTC): {entry['entry_timestamp']}, entry_timestamp (local): {entry['entry_timestamp'].astimezone(user_tz)}")
+
+
+def current_log(logger: logging.Logger, user_id: int, tz_name: str, user_tz, entries: list[dict]):
+    """Текущее логирование тех же функций (database.py)."""
+    now_local = datetime.now(user_tz)
+    today_start_local = user_tz.localize(datetime.combine(now_local.date(), time.min))
+    next_day_start_local = today_start_local + timedelta(days=1)
+    logger.debug("Записи за сегодня для %s (TZ: %s): [%s, %s)", user_id, tz_name, today_start_local, next_day_start_local)
+    logger.debug("Записи за период для %s: UTC [%s, %s)", user_id, today_start_local, next_day_start_local)
+    logger.debug("Получено %d записей для %s за период.", len(entries), user_id)
+    if logger.isEnabledFor(logging.DEBUG):
+        for entry in entries:
+            logger.debug("Запись %s (UTC) = %s (local)", entry['entry_timestamp'], entry['entry_timestamp'].astimezone(user_tz))
+
+
+def configure_legacy(path: str) -> logging.Handler:
+    handler = logging.FileHandler(path, encoding="utf-8")
+    handler.setFormatter(logging.Formatter(log_config.TEXT_FORMAT))
+    return handler
+
+
+def configure_current(path: str, debug_rate: float):
+    output = logging.FileHandler(path, encoding="utf-8")
+    output.setFormatter(log_config.create_formatter("json"))
+    log_queue = queue.SimpleQueue()
+    handler = log_config.DeferredQueueHandler(log_queue)
+    handler.addFilter(log_config.RateLimitFilter(debug_rate))
+    listener = logging.handlers.QueueListener(log_queue, output)
+    listener.start()
+    return handler, listener
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=15, help="записей о еде за день")
+    parser.add_argument("--calls", type=int, default=2000, help="вызовов /today на замер")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    tz_name = "Europe/Moscow"
+    user_tz = pytz.timezone(tz_name)
+    entries = make_entries(args.entries, user_tz)
+    logger = logging.getLogger("bench.database")
+    logger.propagate = False
+
+    def best(func) -> float:
+        return min(timeit.repeat(func, number=args.calls, repeat=args.repeat)) / args.calls
+
+    print(f"Записей за день: {args.entries}, вызовов на замер: {args.calls}")
+    with tempfile.TemporaryDirectory() as tmp:
+        logger.handlers[:] = [configure_legacy(os.path.join(tmp, "legacy.log"))]
+        logger.setLevel(logging.INFO)
+        legacy = best(lambda: legacy_log(logger, 1, tz_name, user_tz, entries))
+        logger.handlers[0].close()
+        print(f"Прежний (f-строки, INFO, синхронно):    {legacy * 1e6:9.1f} мкс/вызов")
+
+        handler, listener = configure_current(os.path.join(tmp, "current.log"), debug_rate=10)
+        logger.handlers[:] = [handler]
+        current = best(lambda: current_log(logger, 1, tz_name, user_tz, entries))
+        print(f"Текущий (ленивые DEBUG, уровень INFO):  {current * 1e6:9.1f} мкс/вызов  (x{legacy / current:.0f})")
+
+        logger.setLevel(logging.DEBUG)
+        debug = best(lambda: current_log(logger, 1, tz_name, user_tz, entries))
+        listener.stop()
+        print(f"Текущий с DEBUG (очередь + лимит):      {debug * 1e6:9.1f} мкс/вызов  (x{legacy / debug:.1f})")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
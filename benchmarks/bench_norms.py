@@ -0,0 +1,123 @@
+"""
+Микробенчмарк расчета норм за период на длинных историях целей.
+
+Сравнивает прежний расчет (перебор истории для каждого дня), текущий
+calculate_total_norm_for_period (бинарный поиск + проход отрезками)
+и пакетный calculate_period_norms_batch (NumPy, если установлен).
+
+Запуск из корня проекта: python benchmarks/bench_norms.py [--users N] [--history N] [--days N]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# Для импорта модулей бота достаточно фиктивных настроек
+os.environ.setdefault("BOT_TOKEN", "bench-token")
+os.environ.setdefault("DB_USER", "bench-user")
+os.environ.setdefault("DB_PASS", "bench-pass")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_NAME", "bench-db")
+
+import analytics
+from handlers.reports import calculate_total_norm_for_period
+
+
+def legacy_total_norm_for_period(period_start_date, period_days, historical_norms_records, current_daily_goal):
+    """Прежняя реализация: O(дней x записей истории), оставлена для сравнения."""
+    if period_days <= 0:
+        return 0, 0, False
+    if not historical_norms_records:
+        if current_daily_goal:
+            return current_daily_goal * period_days, current_daily_goal, True
+        return 0, 0, False
+    norms_dict = {record['effective_date']: record['daily_calorie_goal'] for record in historical_norms_records}
+    history_dates_sorted = sorted(norms_dict.keys())
+    total_norm_period = 0
+    found = False
+    for i in range(period_days):
+        entry_date = period_start_date + timedelta(days=i)
+        applicable_norm = None
+        for history_date in reversed(history_dates_sorted):
+            if history_date <= entry_date:
+                applicable_norm = norms_dict[history_date]
+                break
+        if applicable_norm is not None:
+            total_norm_period += applicable_norm
+            found = True
+        elif current_daily_goal:
+            total_norm_period += current_daily_goal
+            found = True
+    if not found:
+        return 0, 0, False
+    return total_norm_period, round(total_norm_period / period_days), True
+
+
+def make_history(rng: random.Random, history_len: int, first_date: date) -> list[dict]:
+    """История с изменением цели в среднем раз в 3 дня (например, после ежедневных взвешиваний)."""
+    records, current = [], first_date
+    for _ in range(history_len):
+        current += timedelta(days=rng.randint(1, 5))
+        records.append({'effective_date': current, 'daily_calorie_goal': rng.randint(1400, 3200)})
+    return records
+
+
+def trim_history(records: list[dict], period_start: date, period_end: date) -> list[dict]:
+    """Оставляет записи, которые вернул бы database.get_historical_norms: последнюю до периода и все внутри него."""
+    before = [record for record in records if record['effective_date'] < period_start]
+    inside = [record for record in records if period_start <= record['effective_date'] <= period_end]
+    return before[-1:] + inside
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10000, help="пользователей в пакетном расчете")
+    parser.add_argument("--history", type=int, default=1000, help="записей истории на пользователя")
+    parser.add_argument("--days", type=int, default=366, help="длина периода в днях")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    history_start = date(2020, 1, 1)
+    period_start = history_start + timedelta(days=args.history * 3 // 2)
+    histories = {user_id: make_history(rng, args.history, history_start) for user_id in range(args.users)}
+    goals = {user_id: rng.choice([None, 2000, 2500]) for user_id in range(args.users)}
+
+    sample = histories[0]
+    expected = legacy_total_norm_for_period(period_start, args.days, sample, goals[0])
+    assert calculate_total_norm_for_period(period_start, args.days, sample, goals[0]) == expected
+    batch = analytics.calculate_period_norms_batch(period_start, args.days, histories, goals) # полная история
+    assert all(
+        batch[user_id] == calculate_total_norm_for_period(period_start, args.days, histories[user_id], goals[user_id])
+        for user_id in range(min(args.users, 50))
+    )
+
+    def best(func, number) -> float:
+        return min(timeit.repeat(func, number=number, repeat=args.repeat)) / number
+
+    print(f"История: {args.history} записей, период: {args.days} дн., пользователей в пакете: {args.users}")
+    legacy = best(lambda: legacy_total_norm_for_period(period_start, args.days, sample, goals[0]), 3)
+    sweep = best(lambda: calculate_total_norm_for_period(period_start, args.days, sample, goals[0]), 50)
+    print(f"Один пользователь, прежний перебор:   {legacy * 1e3:9.3f} мс")
+    print(f"Один пользователь, бинарный поиск:    {sweep * 1e3:9.3f} мс  (x{legacy / sweep:.0f})")
+
+    # В пакет попадает история в том виде, в каком ее отдает БД для периода (как get_historical_norms)
+    period_end = period_start + timedelta(days=args.days - 1)
+    batch_histories = {user_id: trim_history(records, period_start, period_end) for user_id, records in histories.items()}
+    loop = best(lambda: analytics.calculate_period_norms_batch(period_start, args.days, batch_histories, goals, use_numpy=False), 1)
+    print(f"{args.users} пользователей, цикл:           {loop * 1e3:9.1f} мс")
+    if analytics.np is not None:
+        vectorized = best(lambda: analytics.calculate_period_norms_batch(period_start, args.days, batch_histories, goals), 1)
+        print(f"{args.users} пользователей, NumPy:          {vectorized * 1e3:9.1f} мс  (x{loop / vectorized:.1f})")
+    else:
+        print("NumPy не установлен, векторизованный вариант пропущен.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,311 @@
+"""
+Набор микробенчмарков горячих путей с порогом регрессии.
+
+Замеряет (лучшее время из --repeat повторов, в секундах на вызов):
+- norms_long_history - calculate_total_norm_for_period на истории из 1000 целей за год;
+- group_by_day_month - группировка записей по локальным дням (database.group_calories_by_day,
+  ветка SQLite для /week и /month);
+- parse_off_response - разбор ответа поиска Open Food Facts (parse_off_products);
+- keyboard_* - сборка клавиатур из keyboards.py;
+- sql_search_user_products@<backend> / sql_entries_for_period@<backend> - запросы database.py
+  к заранее заполненной большой базе. Backend по умолчанию - DB_BACKEND из настроек:
+  для postgres рядом с DB_NAME создается временная база DB_NAME_bench_<pid> (нужно право CREATEDB),
+  заполняется и удаляется после замера; для sqlite - временный файл. --backend выбирает явно.
+
+Результаты сравниваются с benchmarks/baselines.json: если бенчмарк медленнее базового значения
+больше чем на threshold_pct процентов, набор завершается с кодом 1. Базовые значения зависят от
+машины - после смены железа или намеренного изменения их нужно перезаписать через --update.
+
+Базовые значения SQL-бенчмарков хранятся отдельно для каждого backend (имя@backend).
+Бенчмарк без базового значения (например, первый запуск на postgres) тоже завершает набор
+с кодом 1, иначе проверка регрессий для него молча отключена: запишите значения через --update.
+
+Запуск из корня проекта: python benchmarks/suite.py [--only ИМЯ] [--backend sqlite|postgres] [--update] [--threshold ПРОЦЕНТ]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import timeit
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# Для импорта модулей бота достаточно фиктивных настроек
+os.environ.setdefault("BOT_TOKEN", "bench-token")
+os.environ.setdefault("DB_USER", "bench-user")
+os.environ.setdefault("DB_PASS", "bench-pass")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_NAME", "bench-db")
+os.environ.setdefault("CACHE_ENABLED", "false")
+
+import asyncpg
+import pytz
+
+import config
+import database as db
+import keyboards
+import storage_sqlite
+from handlers.add_food import parse_off_products
+from handlers.reports import calculate_total_norm_for_period
+
+BASELINES_PATH = Path(__file__).resolve().parent / "baselines.json"
+DEFAULT_THRESHOLD_PCT = 50.0
+
+SEED_USERS = 200
+SEED_PRODUCTS_PER_USER = 300
+SEED_ENTRIES_PER_USER = 1500 # ~5 записей в день за 300 дней
+SEED_START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+BENCH_USER_ID = 1
+BACKENDS = ("sqlite", "postgres")
+
+
+def make_history(rng: random.Random, history_len: int, first_date: date) -> List[dict]:
+    """История с изменением цели в среднем раз в 3 дня."""
+    records, current = [], first_date
+    for _ in range(history_len):
+        current += timedelta(days=rng.randint(1, 5))
+        records.append({'effective_date': current, 'daily_calorie_goal': rng.randint(1400, 3200)})
+    return records
+
+
+def make_entries(rng: random.Random, count: int, start: datetime) -> List[dict]:
+    """Записи о еде с шагом 1-7 часов, как их возвращает get_food_entries_for_period."""
+    entries, current = [], start
+    for i in range(count):
+        current += timedelta(minutes=rng.randint(60, 420))
+        entries.append({
+            'product_name': f"продукт {i % 50}", 'weight_grams': rng.randint(50, 400),
+            'calories_consumed': rng.randint(20, 900), 'entry_timestamp': current,
+        })
+    return entries
+
+
+def make_off_response(rng: random.Random, count: int) -> dict:
+    """Ответ поиска OFF: часть продуктов без калорий, часть в кДж, часть со строковыми значениями."""
+    products = []
+    for i in range(count):
+        kind = i % 4
+        if kind == 0: nutriments = {"energy-kcal_100g": rng.randint(10, 900)}
+        elif kind == 1: nutriments = {"energy_100g": str(rng.randint(100, 3500)), "energy_unit": "kJ"}
+        elif kind == 2: nutriments = {"energy-kcal_100g": f"{rng.uniform(10, 900):.1f}"}
+        else: nutriments = {"proteins_100g": 3.2}
+        products.append({"product_name": f"  Продукт OFF {i} с длинным названием  ", "nutriments": nutriments})
+    return {"count": count, "page_size": count, "products": products}
+
+
+async def seed_database(pool, rng: random.Random):
+    """Заполняет пустую базу: SEED_USERS пользователей с продуктами и историей записей."""
+    await db.create_tables_if_not_exist(pool)
+    users, products, entries = [], [], []
+    for user_id in range(1, SEED_USERS + 1):
+        users.append((user_id, f"user{user_id}", "Europe/Moscow"))
+        for i in range(SEED_PRODUCTS_PER_USER):
+            prefix = rng.choice(["гречка", "греческий йогурт", "груша", "курица", "кефир", "творог", "сыр", "яблоко"])
+            last_used = SEED_START + timedelta(minutes=rng.randint(0, 400000))
+            products.append((user_id, f"{prefix} {i}", rng.randint(20, 900), last_used))
+        current = SEED_START
+        for _ in range(SEED_ENTRIES_PER_USER):
+            current += timedelta(minutes=rng.randint(60, 200))
+            entries.append((user_id, "продукт", rng.randint(50, 400), rng.randint(20, 900), current))
+    async with db.acquire(pool) as connection:
+        await connection.executemany("INSERT INTO users (user_id, first_name, timezone) VALUES ($1, $2, $3);", users)
+        await connection.executemany(
+            "INSERT INTO user_products (user_id, product_name, calories_per_100g, last_used_at) VALUES ($1, $2, $3, $4);", products
+        )
+        await connection.executemany(
+            "INSERT INTO food_entries (user_id, product_name, weight_grams, calories_consumed, entry_timestamp) VALUES ($1, $2, $3, $4, $5);",
+            entries,
+        )
+        if not isinstance(pool, storage_sqlite.SqlitePool):
+            await connection.execute("ANALYZE;") # Свежая статистика, иначе планировщик не видит объем данных
+
+
+def build_cases(loop: asyncio.AbstractEventLoop, pool, backend: str = "sqlite") -> Dict[str, tuple[Callable[[], object], int]]:
+    """Бенчмарки: имя -> (функция без аргументов, число вызовов в одном замере). SQL-бенчмарки - с суффиксом @backend."""
+    rng = random.Random(42)
+    history_start = date(2020, 1, 1)
+    period_start = history_start + timedelta(days=1500)
+    history = make_history(rng, 1000, history_start)
+    user_tz = pytz.timezone("Europe/Moscow")
+    month_entries = make_entries(rng, 150, datetime(2024, 3, 1, tzinfo=timezone.utc))
+    off_response = make_off_response(rng, 24)
+    api_options = [[product["name"], product["calories"]] for product in parse_off_products(off_response)]
+    suggestions = [
+        {'product_id': i, 'product_name': f"греческий йогурт {i} с очень длинным названием", 'calories_per_100g': 60 + i}
+        for i in range(5)
+    ]
+    period_from = user_tz.localize(datetime(2024, 3, 1))
+    period_to = user_tz.localize(datetime(2024, 4, 1))
+
+    cases = {
+        "norms_long_history": (lambda: calculate_total_norm_for_period(period_start, 366, history, 2000), 50),
+        "group_by_day_month": (lambda: db.group_calories_by_day(month_entries, user_tz), 200),
+        "parse_off_response": (lambda: parse_off_products(off_response), 500),
+        "keyboard_api_products": (lambda: keyboards.select_api_product_keyboard(api_options), 200),
+        "keyboard_product_suggestions": (lambda: keyboards.product_suggestions_keyboard(suggestions), 200),
+        "keyboard_settings_main": (lambda: keyboards.settings_main_keyboard(), 200),
+    }
+    if pool is not None:
+        cases[f"sql_search_user_products@{backend}"] = (
+            lambda: loop.run_until_complete(db.search_user_products(pool, BENCH_USER_ID, "гре", limit=5)), 50
+        )
+        cases[f"sql_entries_for_period@{backend}"] = (
+            lambda: loop.run_until_complete(db.get_food_entries_for_period(pool, BENCH_USER_ID, period_from, period_to)), 50
+        )
+    return cases
+
+
+async def create_sqlite_pool(tmp_dir: str):
+    return await storage_sqlite.create_pool(os.path.join(tmp_dir, "bench.sqlite3"), max_size=1)
+
+
+def scratch_database_name() -> str:
+    return f"{config.DB_NAME}_bench_{os.getpid()}"
+
+
+async def create_postgres_database(database: str):
+    """Создает пустую временную базу на том же сервере, что и DB_NAME."""
+    connection = await asyncpg.connect(config.DATABASE_URL)
+    try:
+        await connection.execute(f'CREATE DATABASE "{database}";')
+    finally:
+        await connection.close()
+
+
+async def drop_postgres_database(database: str):
+    connection = await asyncpg.connect(config.DATABASE_URL)
+    try:
+        await connection.execute(f'DROP DATABASE IF EXISTS "{database}";')
+    finally:
+        await connection.close()
+
+
+def case_selected(name: str, only: List[str]) -> bool:
+    """--only принимает и полное имя (sql_entries_for_period@postgres), и имя без backend."""
+    return name in only or name.split("@", 1)[0] in only
+
+
+def run_cases(cases: Dict[str, tuple[Callable[[], object], int]], repeat: int) -> Dict[str, float]:
+    results = {}
+    for name, (func, number) in cases.items():
+        func() # Прогрев (ленивые импорты, кэш подготовленных запросов)
+        results[name] = min(timeit.repeat(func, number=number, repeat=repeat)) / number
+    return results
+
+
+def load_baselines(path: Path) -> dict:
+    if not path.exists():
+        return {"threshold_pct": DEFAULT_THRESHOLD_PCT, "benchmarks": {}}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def compare(results: Dict[str, float], baselines: Dict[str, dict], threshold_pct: float) -> List[dict]:
+    """Сравнение с базовыми значениями: status - ok, regression или new (базового значения нет)."""
+    rows = []
+    for name, seconds in results.items():
+        baseline = baselines.get(name, {}).get("seconds")
+        if not baseline:
+            rows.append({"name": name, "seconds": seconds, "baseline": None, "change_pct": None, "status": "new"})
+            continue
+        change_pct = (seconds / baseline - 1) * 100
+        status = "regression" if change_pct > threshold_pct else "ok"
+        rows.append({"name": name, "seconds": seconds, "baseline": baseline, "change_pct": change_pct, "status": status})
+    return rows
+
+
+def format_rows(rows: List[dict], threshold_pct: float) -> str:
+    lines = [f"{'бенчмарк':<34} {'сейчас, мкс':>12} {'база, мкс':>12} {'изменение':>10}  (порог +{threshold_pct:g}%)"]
+    for row in rows:
+        baseline = f"{row['baseline'] * 1e6:12.1f}" if row["baseline"] else f"{'-':>12}"
+        change = f"{row['change_pct']:+9.1f}%" if row["change_pct"] is not None else f"{'-':>10}"
+        marker = {"ok": "", "new": "  НЕТ БАЗОВОГО ЗНАЧЕНИЯ", "regression": "  РЕГРЕССИЯ"}[row["status"]]
+        lines.append(f"{row['name']:<34} {row['seconds'] * 1e6:12.1f} {baseline} {change}{marker}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", action="append", help="запустить только указанные бенчмарки (можно повторять)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--threshold", type=float, help="допустимое замедление в процентах (по умолчанию из файла базовых значений)")
+    parser.add_argument("--baselines", type=Path, default=BASELINES_PATH)
+    parser.add_argument("--update", action="store_true", help="перезаписать базовые значения текущими результатами")
+    parser.add_argument("--no-sql", action="store_true", help="пропустить SQL-бенчмарки (без заполнения базы)")
+    parser.add_argument(
+        "--backend", choices=BACKENDS, default=config.DB_BACKEND,
+        help="база для SQL-бенчмарков (по умолчанию DB_BACKEND; postgres - временная база рядом с DB_NAME)",
+    )
+    args = parser.parse_args(argv)
+
+    baselines = load_baselines(args.baselines)
+    threshold_pct = args.threshold if args.threshold is not None else baselines.get("threshold_pct", DEFAULT_THRESHOLD_PCT)
+    wants_sql = not args.no_sql and (not args.only or any(name.startswith("sql_") for name in args.only))
+
+    loop = asyncio.new_event_loop()
+    pool, scratch_database = None, None
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            if wants_sql:
+                print(
+                    f"Заполнение {args.backend}: {SEED_USERS} польз. x {SEED_PRODUCTS_PER_USER} продуктов, "
+                    f"{SEED_ENTRIES_PER_USER} записей..."
+                )
+                if args.backend == "postgres":
+                    try:
+                        loop.run_until_complete(create_postgres_database(scratch_database_name()))
+                    except (OSError, asyncpg.PostgresError) as e:
+                        print(f"Не удалось создать временную базу {scratch_database_name()} ({config.DATABASE_URL_LOG}): {e}")
+                        return 2
+                    scratch_database = scratch_database_name()
+                    pool = loop.run_until_complete(
+                        asyncpg.create_pool(config.DATABASE_URL, database=scratch_database, min_size=1, max_size=2)
+                    )
+                else:
+                    pool = loop.run_until_complete(create_sqlite_pool(tmp_dir))
+                loop.run_until_complete(seed_database(pool, random.Random(7)))
+            cases = build_cases(loop, pool, args.backend)
+            if args.only:
+                unknown = {name for name in args.only if not any(case_selected(case, [name]) for case in cases)}
+                if unknown:
+                    parser.error(f"неизвестные бенчмарки: {', '.join(sorted(unknown))}")
+                cases = {name: case for name, case in cases.items() if case_selected(name, args.only)}
+            results = run_cases(cases, args.repeat)
+        finally:
+            if pool is not None:
+                loop.run_until_complete(pool.close())
+            if scratch_database is not None:
+                try:
+                    loop.run_until_complete(drop_postgres_database(scratch_database))
+                except (OSError, asyncpg.PostgresError) as e:
+                    print(f"Не удалось удалить временную базу {scratch_database}: {e}")
+            loop.close()
+
+    rows = compare(results, baselines.get("benchmarks", {}), threshold_pct)
+    print(format_rows(rows, threshold_pct))
+
+    if args.update:
+        baselines.setdefault("threshold_pct", threshold_pct)
+        baselines.setdefault("benchmarks", {}).update({name: {"seconds": float(f"{seconds:.3g}")} for name, seconds in results.items()})
+        args.baselines.write_text(json.dumps(baselines, ensure_ascii=False, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+        print(f"Базовые значения записаны в {args.baselines}")
+        return 0
+    regressions = [row["name"] for row in rows if row["status"] == "regression"]
+    missing = [row["name"] for row in rows if row["status"] == "new"]
+    if regressions:
+        print(f"Замедление больше {threshold_pct:g}%: {', '.join(regressions)}")
+    if missing:
+        print(
+            f"Нет базовых значений в {args.baselines}: {', '.join(missing)} - регрессия не проверена. "
+            f"Запишите их на эталонной машине через --update."
+        )
+    return 1 if regressions or missing else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,271 @@
+"""
+Кэш в Redis для горячих данных бота.
+
+Сводка "за сегодня": для каждого пользователя хранится сумма калорий и список
+записей за текущие локальные сутки. Ключи живут до локальной полуночи пользователя,
+обновляются атомарно (Lua) при добавлении записи и пересобираются из БД при промахе.
+
+Отчеты: суммы калорий за уже закончившиеся локальные дни (см. раздел ниже).
+Если Redis недоступен, все функции возвращают промах и бот работает напрямую с БД.
+"""
+import json
+import logging
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytz
+
+import config
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # pragma: no cover - зависит от установленного пакета redis
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+redis_client: Optional["aioredis.Redis"] = None
+
+SEQ_TTL_SECONDS = 2 * 24 * 3600 # Счетчик записей живет дольше суток, чтобы пережить смену даты
+
+# Перед записью в БД увеличивается счетчик версий (begin_food_entry): сводки, собранные из БД
+# до этого момента, помечены меньшей версией. После записи RECORD_ENTRY_LUA снова увеличивает счетчик
+# (сборка, прочитавшая БД до коммита, уже не сохранится) и дописывает запись к сводке, только если
+# сводка собрана до begin_food_entry - тогда новой строки в ней точно нет. Более новую сводку
+# (строка могла попасть в нее из БД) удаляем: ее пересоберет следующее чтение.
+# KEYS: summary, entries, seq; ARGV: calories, entry_json, seq_ttl, begin_seq
+RECORD_ENTRY_LUA = """
+redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], ARGV[3])
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+local built = tonumber(redis.call('HGET', KEYS[1], 'seq') or '')
+if built ~= nil and built < tonumber(ARGV[4]) then
+    redis.call('HINCRBY', KEYS[1], 'total', ARGV[1])
+    redis.call('RPUSH', KEYS[2], ARGV[2])
+    return 1
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+return -1
+"""
+
+# Сохранение собранной из БД сводки: пишем, только если с момента чтения не было новых записей,
+# и запоминаем версию, на которой сводка собрана.
+# KEYS: summary, entries, seq; ARGV: expected_seq, expire_at, date, tz, total, entry_json...
+STORE_SUMMARY_LUA = """
+local seq = redis.call('GET', KEYS[3]) or ''
+if seq ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+redis.call('HSET', KEYS[1], 'date', ARGV[3], 'tz', ARGV[4], 'total', ARGV[5], 'seq', tonumber(ARGV[1]) or 0)
+if #ARGV > 5 then
+    redis.call('RPUSH', KEYS[2], unpack(ARGV, 6))
+end
+redis.call('EXPIREAT', KEYS[1], ARGV[2])
+redis.call('EXPIREAT', KEYS[2], ARGV[2])
+return 1
+"""
+
+
+async def init_cache():
+    """Создает клиент Redis для кэша (если кэш включен)."""
+    global redis_client
+    if not config.CACHE_ENABLED:
+        logger.info("Кэш в Redis отключен (CACHE_ENABLED=false).")
+        return
+    if aioredis is None:
+        logger.warning("Пакет redis недоступен, кэш в Redis отключен.")
+        return
+    redis_client = aioredis.from_url(config.CACHE_REDIS_URL, decode_responses=True)
+    try:
+        await redis_client.ping()
+        logger.info(f"Кэш в Redis подключен: {config.CACHE_REDIS_URL}")
+    except Exception as e:
+        # Клиент оставляем: при восстановлении Redis кэш заработает сам
+        logger.warning(f"Redis для кэша недоступен ({e}). Запросы пойдут напрямую в БД.")
+
+
+async def close_cache():
+    """Закрывает клиент Redis."""
+    global redis_client
+    if redis_client is not None:
+        await redis_client.aclose()
+        redis_client = None
+
+
+def _today_keys(user_id: int) -> Tuple[str, str, str]:
+    return f"today:{user_id}", f"today:{user_id}:entries", f"today:{user_id}:seq"
+
+
+def next_local_midnight(user_tz: pytz.BaseTzInfo, local_date: date) -> datetime:
+    """Возвращает момент начала следующих локальных суток (с учетом перехода на летнее время)."""
+    return user_tz.localize(datetime.combine(local_date + timedelta(days=1), time.min))
+
+
+async def get_today_summary(user_id: int, tz_name: str, local_date: date) -> Tuple[Optional[Tuple[int, List[Dict[str, Any]]]], str]:
+    """
+    Читает сводку за сегодня одним запросом к Redis.
+    Возвращает ((total, entries) или None при промахе, версию для последующего store_today_summary).
+    """
+    if redis_client is None:
+        return None, ""
+    summary_key, entries_key, seq_key = _today_keys(user_id)
+    try:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            summary, raw_entries, seq = await pipe.hgetall(summary_key).lrange(entries_key, 0, -1).get(seq_key).execute()
+    except Exception as e:
+        logger.warning(f"Ошибка чтения сводки из Redis для {user_id}: {e}")
+        return None, ""
+    if not summary or summary.get('date') != local_date.isoformat() or summary.get('tz') != tz_name:
+        return None, seq or ""
+    return (int(summary['total']), [json.loads(item) for item in raw_entries]), seq or ""
+
+
+async def store_today_summary(user_id: int, tz_name: str, local_date: date, expire_at: datetime, entries: List[Dict[str, Any]], seq: str):
+    """Сохраняет собранную из БД сводку до локальной полуночи (если не было конкурентных записей)."""
+    if redis_client is None:
+        return
+    total = sum(entry['calories_consumed'] for entry in entries)
+    args = [seq, int(expire_at.timestamp()), local_date.isoformat(), tz_name, total]
+    args.extend(json.dumps(entry, ensure_ascii=False) for entry in entries)
+    try:
+        await redis_client.eval(STORE_SUMMARY_LUA, 3, *_today_keys(user_id), *args)
+    except Exception as e:
+        logger.warning(f"Ошибка сохранения сводки в Redis для {user_id}: {e}")
+
+
+async def begin_food_entry(user_id: int) -> Optional[int]:
+    """
+    Вызывается до записи в БД: увеличивает версию сводки и возвращает ее для record_food_entry
+    (None - Redis недоступен, тогда record_food_entry просто сбросит сводку).
+    """
+    if redis_client is None:
+        return None
+    _, _, seq_key = _today_keys(user_id)
+    try:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            seq, _ = await pipe.incr(seq_key).expire(seq_key, SEQ_TTL_SECONDS).execute()
+        return int(seq)
+    except Exception as e:
+        logger.warning(f"Ошибка обновления версии сводки в Redis для {user_id}: {e}")
+        return None
+
+
+async def record_food_entry(user_id: int, entry: Dict[str, Any], begin_seq: Optional[int]):
+    """Атомарно добавляет записанную в БД запись к сводке за сегодня (begin_seq - из begin_food_entry)."""
+    if redis_client is None:
+        return
+    if begin_seq is None:
+        await invalidate_today(user_id)
+        return
+    try:
+        await redis_client.eval(
+            RECORD_ENTRY_LUA, 3, *_today_keys(user_id),
+            entry['calories_consumed'], json.dumps(entry, ensure_ascii=False), SEQ_TTL_SECONDS, begin_seq
+        )
+    except Exception as e:
+        # Сводка могла устареть - удаляем ее, чтобы следующее чтение пересобрало данные из БД
+        logger.warning(f"Ошибка обновления сводки в Redis для {user_id}: {e}")
+        await invalidate_today(user_id)
+
+
+async def invalidate_today(user_id: int):
+    """Сбрасывает сводку пользователя (например, при смене часового пояса)."""
+    if redis_client is None:
+        return
+    summary_key, entries_key, seq_key = _today_keys(user_id)
+    try:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            await pipe.delete(summary_key, entries_key).incr(seq_key).expire(seq_key, SEQ_TTL_SECONDS).execute()
+    except Exception as e:
+        logger.warning(f"Ошибка сброса сводки в Redis для {user_id}: {e}")
+
+
+# --- Кэш отчетов за завершенные дни ---
+# Потребление за день, который в часовом поясе пользователя уже закончился, больше не меняется:
+# новые записи всегда получают текущее время. Поэтому суммы закрытых дней хранятся долго
+# в хэшах report:{user_id}:{tz}:{YYYY-MM} (поле - день месяца, значение - ккал или '-' если записей нет).
+# Пересчитывается только открытый день (сегодня), остальное берется из кэша.
+REPORT_CACHE_TTL_SECONDS = 400 * 24 * 3600 # Не вечно, чтобы не копить данные неактивных пользователей
+CLOSED_DAY_GRACE = timedelta(minutes=10) # Запас на расхождение часов между экземплярами бота
+NO_ENTRIES_MARK = "-"
+
+
+def _report_key(user_id: int, tz_name: str, year: int, month: int) -> str:
+    return f"report:{user_id}:{tz_name}:{year:04d}-{month:02d}"
+
+
+def _report_index_key(user_id: int) -> str:
+    return f"report:{user_id}:keys"
+
+
+def _months_between(start_date: date, end_date: date) -> List[Tuple[int, int]]:
+    months = []
+    year, month = start_date.year, start_date.month
+    while (year, month) <= (end_date.year, end_date.month):
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def last_closed_day(user_tz: pytz.BaseTzInfo, now_utc: Optional[datetime] = None) -> date:
+    """Последний локальный день, в который уже не могут попасть новые записи."""
+    now_utc = now_utc or datetime.now(pytz.utc)
+    return (now_utc - CLOSED_DAY_GRACE).astimezone(user_tz).date() - timedelta(days=1)
+
+
+async def get_closed_day_totals(user_id: int, tz_name: str, start_date: date, end_date: date) -> Dict[date, Optional[int]]:
+    """
+    Читает из кэша суммы закрытых дней периода одним запросом.
+    Возвращает {дата: ккал или None (записей не было)} только для закэшированных дней.
+    """
+    if redis_client is None or start_date > end_date:
+        return {}
+    months = _months_between(start_date, end_date)
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for year, month in months:
+                pipe.hgetall(_report_key(user_id, tz_name, year, month))
+            results = await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Ошибка чтения кэша отчетов для {user_id}: {e}")
+        return {}
+    totals: Dict[date, Optional[int]] = {}
+    for (year, month), fields in zip(months, results):
+        for day, value in fields.items():
+            day_date = date(year, month, int(day))
+            if start_date <= day_date <= end_date:
+                totals[day_date] = None if value == NO_ENTRIES_MARK else int(value)
+    return totals
+
+
+async def store_closed_day_totals(user_id: int, tz_name: str, totals: Dict[date, Optional[int]]):
+    """Сохраняет суммы закрытых дней (None - записей за день не было)."""
+    if redis_client is None or not totals:
+        return
+    by_key: Dict[str, Dict[str, str]] = {}
+    for day_date, calories in totals.items():
+        key = _report_key(user_id, tz_name, day_date.year, day_date.month)
+        by_key.setdefault(key, {})[str(day_date.day)] = NO_ENTRIES_MARK if calories is None else str(calories)
+    try:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            for key, fields in by_key.items():
+                pipe.hset(key, mapping=fields).expire(key, REPORT_CACHE_TTL_SECONDS)
+            pipe.sadd(_report_index_key(user_id), *by_key.keys()).expire(_report_index_key(user_id), REPORT_CACHE_TTL_SECONDS)
+            await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Ошибка сохранения кэша отчетов для {user_id}: {e}")
+
+
+async def invalidate_reports(user_id: int):
+    """Сбрасывает все закэшированные отчеты пользователя (при записи задним числом)."""
+    if redis_client is None:
+        return
+    index_key = _report_index_key(user_id)
+    try:
+        keys = await redis_client.smembers(index_key)
+        await redis_client.delete(index_key, *keys)
+    except Exception as e:
+        logger.warning(f"Ошибка сброса кэша отчетов для {user_id}: {e}")
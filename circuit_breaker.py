@@ -0,0 +1,66 @@
+"""
+Предохранитель (circuit breaker) для внешних сервисов.
+
+После failure_threshold неудачных вызовов подряд предохранитель размыкается: вызовы сразу
+отклоняются (без ожидания таймаутов и повторов), и пользователь без задержки переходит
+к ручному вводу. Через reset_timeout секунд пропускается одна пробная попытка:
+успех замыкает предохранитель, неудача снова размыкает его на reset_timeout.
+Состояние всех предохранителей показывается в /readyz и метриках.
+"""
+import logging
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open" # Пропущена пробная попытка, ждем ее результата
+
+breakers: Dict[str, "CircuitBreaker"] = {}
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0 # Неудач подряд
+        self.opened_at = 0.0 # time.monotonic() размыкания или последней пробной попытки
+        self.rejected = 0 # Отклонено вызовов, пока предохранитель разомкнут
+        breakers[name] = self
+
+    def allow(self, now: Optional[float] = None) -> bool:
+        """Можно ли выполнить вызов сейчас."""
+        if self.state == CLOSED or self.failure_threshold <= 0:
+            return True
+        now = time.monotonic() if now is None else now
+        if now - self.opened_at < self.reset_timeout:
+            self.rejected += 1
+            return False
+        # Одна пробная попытка раз в reset_timeout (если она оборвется, через reset_timeout будет следующая)
+        self.state = HALF_OPEN
+        self.opened_at = now
+        return True
+
+    def record_success(self):
+        if self.state != CLOSED:
+            logger.info(f"Предохранитель {self.name}: сервис снова отвечает, вызовы возобновлены.")
+        self.state = CLOSED
+        self.failures = 0
+
+    def record_failure(self, now: Optional[float] = None):
+        self.failures += 1
+        if self.state == CLOSED and self.failures < self.failure_threshold:
+            return
+        if self.state == CLOSED:
+            logger.warning(
+                f"Предохранитель {self.name} разомкнут после {self.failures} неудач подряд, "
+                f"вызовы отклоняются {self.reset_timeout:g} с."
+            )
+        self.state = OPEN
+        self.opened_at = time.monotonic() if now is None else now
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"state": self.state, "failures": self.failures, "rejected": self.rejected}
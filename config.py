@@ -12,6 +12,12 @@ load_dotenv()
 # BOT_TOKEN - токен для доступа к API Telegram-бота
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
+# --- Бэкенд хранилища ---
+# DB_BACKEND - 'postgres' (по умолчанию) или 'sqlite' (встроенная БД для небольших установок и тестов)
+# SQLITE_PATH - путь к файлу SQLite (используется при DB_BACKEND=sqlite)
+DB_BACKEND = os.getenv("DB_BACKEND", "postgres").strip().lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "calories_bot.sqlite3")
+
 # --- Данные для подключения к БД ---
 # DB_USER - имя пользователя для подключения к базе данных
 # DB_PASS - пароль пользователя для подключения к базе данных
@@ -24,23 +30,157 @@ DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT", 5432)
 DB_NAME = os.getenv("DB_NAME")
 
+# --- Реплика PostgreSQL для чтения (опционально) ---
+# DB_REPLICA_HOST - хост streaming-реплики; если не задан, все запросы идут в основной сервер
+# DB_REPLICA_PORT - порт реплики (по умолчанию совпадает с DB_PORT)
+# DB_REPLICA_MAX_LAG - допустимое отставание реплики в секундах. При большем отставании
+#   чтение уходит на основной сервер; столько же секунд после записи пользователя
+#   его запросы читаются с основного сервера (read-your-writes)
+DB_REPLICA_HOST = os.getenv("DB_REPLICA_HOST")
+DB_REPLICA_PORT = os.getenv("DB_REPLICA_PORT", DB_PORT)
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", 5))
+
 # --- Настройки FSM хранилища ---
 # FSM_STORAGE - тип хранилища FSM: 'memory' или 'redis'
 # REDIS_URL - URL подключения к Redis (например redis://redis:6379/0)
 FSM_STORAGE = os.getenv("FSM_STORAGE", "redis").strip().lower()
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+# FSM_FLOW_TIMEOUT_MINUTES - через сколько минут без активности незавершенный сценарий
+#   (добавление продукта, настройки) сбрасывается и его инлайн-кнопки убираются (0 - не сбрасывать)
+# FSM_SWEEP_INTERVAL - как часто искать брошенные сценарии, секунд
+# FSM_STATE_TTL / FSM_DATA_TTL - TTL ключей состояния и данных FSM в Redis, секунд
+#   (страховка на случай, если очистка не работает; должен быть больше FSM_FLOW_TIMEOUT_MINUTES)
+# FSM_MEMORY_MAX_KEYS - максимум ключей FSM в памяти (без Redis), при превышении вытесняются старые
+FSM_FLOW_TIMEOUT_MINUTES = int(os.getenv("FSM_FLOW_TIMEOUT_MINUTES", 60))
+FSM_SWEEP_INTERVAL = int(os.getenv("FSM_SWEEP_INTERVAL", 300))
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", 24 * 3600))
+FSM_DATA_TTL = int(os.getenv("FSM_DATA_TTL", FSM_STATE_TTL))
+FSM_MEMORY_MAX_KEYS = int(os.getenv("FSM_MEMORY_MAX_KEYS", 10000))
+
+# --- Защита от повторной доставки апдейтов ---
+# UPDATE_DEDUP_TTL - сколько секунд помнить обработанные update_id в Redis
+# UPDATE_DEDUP_LEASE - сколько секунд держится отметка апдейта, который еще обрабатывается
+# (если процесс упал посреди обработки, повторная доставка выполнится после ее истечения)
+UPDATE_DEDUP_TTL = int(os.getenv("UPDATE_DEDUP_TTL", 24 * 3600))
+UPDATE_DEDUP_LEASE = int(os.getenv("UPDATE_DEDUP_LEASE", 120))
+
+# --- Настройки кэша в Redis ---
+# CACHE_ENABLED - включить кэш сводки за сегодня и отчетов ('true'/'false')
+# CACHE_REDIS_URL - URL Redis для кэша (по умолчанию совпадает с REDIS_URL)
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", REDIS_URL)
+
+# --- Вечерний дайджест ---
+# DIGEST_ENABLED - рассылать итоги дня ('true'/'false', по умолчанию выключено)
+# DIGEST_TIME - локальное время отправки в часовом поясе пользователя (ЧЧ:ММ)
+# DIGEST_MAX_DELAY_MINUTES - сколько минут после DIGEST_TIME дайджест еще отправляется
+#   (чтобы после долгого простоя бот не рассылал итоги дня посреди ночи)
+# DIGEST_RATE - ограничение рассылки, сообщений в секунду
+DIGEST_ENABLED = os.getenv("DIGEST_ENABLED", "false").strip().lower() in ("1", "true", "yes")
+DIGEST_TIME = os.getenv("DIGEST_TIME", "21:00")
+DIGEST_MAX_DELAY_MINUTES = int(os.getenv("DIGEST_MAX_DELAY_MINUTES", 120))
+DIGEST_RATE = float(os.getenv("DIGEST_RATE", 20))
+
+# --- Очередь исходящих сообщений (лимиты Telegram Bot API) ---
+# SEND_GLOBAL_RATE - сообщений в секунду на весь бот (лимит Telegram около 30)
+# SEND_CHAT_RATE - сообщений в секунду в один чат (лимит Telegram около 1)
+# SEND_MAX_RETRIES - сколько раз повторять запрос после TelegramRetryAfter
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", 28))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", 1))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", 3))
+
+# --- Метрики ---
+# METRICS_PORT - порт HTTP-эндпоинта /metrics (0 - выключен)
+# METRICS_HOST - адрес, на котором слушает эндпоинт (по умолчанию только локальный)
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# --- Open Food Facts ---
+# OFF_BASE_URL - адрес API (для тестов и бенчмарков - локальный tools/off_stub.py)
+OFF_BASE_URL = os.getenv("OFF_BASE_URL", "https://world.openfoodfacts.org").rstrip("/")
+# OFF_BREAKER_FAILURES - после стольких неудачных поисков подряд запросы к OFF приостанавливаются (0 - никогда)
+# OFF_BREAKER_RESET - на сколько секунд приостанавливаются (потом пробный запрос)
+OFF_BREAKER_FAILURES = int(os.getenv("OFF_BREAKER_FAILURES", 3))
+OFF_BREAKER_RESET = float(os.getenv("OFF_BREAKER_RESET", 60))
+
+# --- Проверки здоровья (/healthz, /readyz на сервере метрик) ---
+# HEALTH_POLL_STALE_SECONDS - /healthz падает, если столько секунд не было успешного getUpdates
+# HEALTH_MAX_LOOP_LAG_MS - /readyz падает, если последняя задержка цикла событий больше
+# HEALTH_CHECK_TIMEOUT - таймаут проверки БД и Redis, сек
+HEALTH_POLL_STALE_SECONDS = float(os.getenv("HEALTH_POLL_STALE_SECONDS", 90))
+HEALTH_MAX_LOOP_LAG_MS = float(os.getenv("HEALTH_MAX_LOOP_LAG_MS", 1000))
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", 1))
+
+# --- Контроль цикла событий и профилирование ---
+# LOOP_LAG_INTERVAL - период замера задержки цикла событий, сек (0 - выключено)
+# LOOP_LAG_WARN_MS - задержка, после которой в лог пишется предупреждение (0 - не предупреждать)
+# LOOP_BLOCK_DUMP_MS - если цикл заблокирован дольше, в лог выводится стек его потока (0 - выключено)
+# PROFILE_TOKEN - токен для GET /debug/profile на сервере метрик (пусто - эндпоинт выключен)
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", 0.5))
+LOOP_LAG_WARN_MS = float(os.getenv("LOOP_LAG_WARN_MS", 100))
+LOOP_BLOCK_DUMP_MS = float(os.getenv("LOOP_BLOCK_DUMP_MS", 1000))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+
+# --- Логирование ---
+# LOG_LEVEL - уровень корневого логгера (DEBUG, INFO, WARNING...)
+# LOG_FORMAT - 'text' (читаемый) или 'json' (по JSON-объекту на строку, для сборщиков логов)
+# LOG_FILE - дополнительно писать в файл (по умолчанию только stderr)
+# LOG_DEBUG_RATE - сколько DEBUG-записей в секунду пропускать с одного места в коде (0 - без ограничения)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").strip().upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").strip().lower()
+LOG_FILE = os.getenv("LOG_FILE", "")
+LOG_DEBUG_RATE = float(os.getenv("LOG_DEBUG_RATE", 10))
+
+# --- Защита от перегрузки БД ---
+# DB_ACQUIRE_TIMEOUT - сколько секунд ждать свободного соединения пула; дольше - пользователю
+#   отвечают "бот перегружен" вместо зависания (0 - ждать без ограничения)
+# ADMISSION_MAX_IN_FLIGHT - не больше стольких одновременно обрабатываемых событий (0 - без ограничения)
+# ADMISSION_MAX_HEAVY - не больше стольких одновременных тяжелых отчетов (/month, /report, /year)
+# ADMISSION_RESERVED_CONNECTIONS - тяжелые отчеты не запускаются, если свободных (и еще не открытых)
+#   соединений основного пула меньше: они остаются для записи еды и коротких запросов
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", 5))
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", 100))
+ADMISSION_MAX_HEAVY = int(os.getenv("ADMISSION_MAX_HEAVY", 4))
+ADMISSION_RESERVED_CONNECTIONS = int(os.getenv("ADMISSION_RESERVED_CONNECTIONS", 2))
+
+# --- Журнал медленных запросов ---
+# DB_SLOW_QUERY_MS - запросы дольше стольких миллисекунд пишутся в лог и в метрики (0 - выключено)
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", 200))
+
+# --- Трассировка апдейтов ---
+# TRACE_SAMPLE_RATE - доля трассируемых апдейтов от 0 до 1 (0 - выключено)
+# TRACE_FILE - JSONL-файл для span'ов (по строке на span)
+# TRACE_OTLP_URL - если задан, span'ы отправляются в коллектор по OTLP/HTTP (JSON) вместо файла,
+#   например http://localhost:4318/v1/traces
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0))
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_OTLP_URL = os.getenv("TRACE_OTLP_URL", "")
+
+if DB_BACKEND not in ("postgres", "sqlite"):
+    raise RuntimeError(f"Ошибка: Неизвестный DB_BACKEND '{DB_BACKEND}' (ожидается 'postgres' или 'sqlite').")
 
 # Проверка наличия всех необходимых переменных окружения
 # Если какой-либо из параметров подключения отсутствует, логируем критическую ошибку и выходим из программы
-if not all([BOT_TOKEN, DB_USER, DB_PASS, DB_HOST, DB_NAME]):
+# Для SQLite параметры подключения к PostgreSQL не нужны
+if not BOT_TOKEN or (DB_BACKEND == "postgres" and not all([DB_USER, DB_PASS, DB_HOST, DB_NAME])):
     logger.critical("Не хватает переменных окружения для запуска бота и подключения к БД!")
     raise RuntimeError("Ошибка: Необходимые переменные окружения не установлены.")
 
 # URL-кодируем пароль
-DB_PASS_ENCODED = quote_plus(DB_PASS)
+DB_PASS_ENCODED = quote_plus(DB_PASS or "")
 
 # Строка подключения к PostgreSQL
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS_ENCODED}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
 # Строка подключения для логирования (без пароля)
 DATABASE_URL_LOG = f"postgresql://{DB_USER}:******@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+# Строка подключения к реплике (None, если реплика не настроена)
+DATABASE_REPLICA_URL = (
+    f"postgresql://{DB_USER}:{DB_PASS_ENCODED}@{DB_REPLICA_HOST}:{DB_REPLICA_PORT}/{DB_NAME}"
+    if DB_REPLICA_HOST else None
+)
+DATABASE_REPLICA_URL_LOG = (
+    f"postgresql://{DB_USER}:******@{DB_REPLICA_HOST}:{DB_REPLICA_PORT}/{DB_NAME}"
+    if DB_REPLICA_HOST else None
+)
@@ -1,43 +1,172 @@
+import asyncio
 import logging
+import time as time_module
+from contextlib import AsyncExitStack, asynccontextmanager
 from datetime import datetime, time, date, timedelta, timezone
 import asyncpg
 import pytz
 from typing import Optional, List, Dict, Any
 
+import cache
+import config
 from config import DATABASE_URL, DATABASE_URL_LOG
+import query_log
+import storage_sqlite
+from storage_sqlite import SqlitePool
 
 logger = logging.getLogger(__name__)
 
-db_pool: asyncpg.Pool | None = None
+# Основной пул: asyncpg.Pool (PostgreSQL) или storage_sqlite.SqlitePool (DB_BACKEND=sqlite).
+# Оба реализуют один интерфейс, поэтому функции ниже не зависят от бэкенда.
+db_pool: asyncpg.Pool | SqlitePool | None = None
+# Пул к streaming-реплике для read-only запросов (None, если реплика не настроена)
+db_replica_pool: asyncpg.Pool | None = None
+# Последнее измеренное отставание реплики в секундах (None - неизвестно)
+replica_lag_seconds: float | None = None
+
+REPLICA_LAG_CHECK_INTERVAL = 1.0 # Период проверки отставания реплики в секундах
+_replica_monitor_task: asyncio.Task | None = None
+# Время (time.monotonic()) последней записи пользователя - для read-your-writes
+_last_write_at: Dict[int, float] = {}
+
+class DatabaseBusyError(Exception):
+    """Свободное соединение пула не получено за DB_ACQUIRE_TIMEOUT (пул исчерпан)."""
+
+
+@asynccontextmanager
+async def acquire(pool: asyncpg.Pool | SqlitePool):
+    """pool.acquire() с ограничением ожидания DB_ACQUIRE_TIMEOUT; по истечении - DatabaseBusyError."""
+    async with AsyncExitStack() as stack:
+        try:
+            connection = await stack.enter_async_context(pool.acquire(timeout=config.DB_ACQUIRE_TIMEOUT or None))
+        except asyncio.TimeoutError:
+            raise DatabaseBusyError(f"Нет свободного соединения с БД за {config.DB_ACQUIRE_TIMEOUT:g} с") from None
+        yield connection
+
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp())
+    END;
+"""
 
 # ... (функции create_db_pool, close_db_pool, create_tables_if_not_exist - без изменений) ...
 async def create_db_pool():
     """Создает пул соединений с базой данных."""
     global db_pool
     if db_pool: return db_pool
+    if config.DB_BACKEND == "sqlite":
+        logger.info(f"Открытие встроенной БД SQLite: {config.SQLITE_PATH}")
+        try:
+            db_pool = await storage_sqlite.create_pool(config.SQLITE_PATH, init=query_log.init_connection)
+            await create_tables_if_not_exist(db_pool)
+        except Exception as e:
+            logger.critical(f"Не удалось открыть БД SQLite: {e}", exc_info=True)
+            raise RuntimeError("Ошибка подключения к БД") from e
+        return db_pool
     logger.info("Создание пула соединений с PostgreSQL...")
     logger.info(f"Используется строка подключения: {DATABASE_URL_LOG}")
     try:
-        db_pool = await asyncpg.create_pool(DATABASE_URL, max_size=10)
+        # init подключает журнал медленных запросов и счетчик запросов к каждому соединению
+        db_pool = await asyncpg.create_pool(DATABASE_URL, max_size=10, init=query_log.init_connection)
         logger.info("Пул соединений успешно создан.")
         await create_tables_if_not_exist(db_pool)
     except Exception as e:
         logger.critical(f"Не удалось подключиться к базе данных: {e}", exc_info=True)
         raise RuntimeError("Ошибка подключения к БД") from e
+    await create_replica_pool()
     return db_pool
 
+async def create_replica_pool():
+    """Создает пул к реплике (если настроена) и запускает мониторинг ее отставания."""
+    global db_replica_pool, _replica_monitor_task
+    if db_replica_pool or not config.DATABASE_REPLICA_URL: return db_replica_pool
+    logger.info(f"Создание пула соединений с репликой: {config.DATABASE_REPLICA_URL_LOG}")
+    try:
+        db_replica_pool = await asyncpg.create_pool(config.DATABASE_REPLICA_URL, max_size=10, init=query_log.init_connection)
+    except Exception as e:
+        # Реплика не обязательна: без нее все запросы идут в основной сервер
+        logger.error(f"Не удалось подключиться к реплике, чтение идет с основного сервера: {e}", exc_info=True)
+        return None
+    _replica_monitor_task = asyncio.create_task(_monitor_replica_lag())
+    logger.info("Пул соединений с репликой создан.")
+    return db_replica_pool
+
+async def _monitor_replica_lag():
+    """Периодически измеряет отставание реплики и чистит устаревшие отметки записей."""
+    global replica_lag_seconds
+    while db_replica_pool:
+        try:
+            async with acquire(db_replica_pool) as connection:
+                lag = await connection.fetchval(REPLICA_LAG_SQL)
+            replica_lag_seconds = float(lag) if lag is not None else None
+            if replica_lag_seconds is None:
+                logger.warning("Не удалось определить отставание реплики (сервер не в режиме восстановления?).")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            replica_lag_seconds = None
+            logger.warning(f"Ошибка проверки отставания реплики: {e}")
+        # Отметки старше допустимого отставания больше не влияют на маршрутизацию
+        threshold = time_module.monotonic() - config.DB_REPLICA_MAX_LAG
+        for user_id in [uid for uid, ts in _last_write_at.items() if ts < threshold]:
+            _last_write_at.pop(user_id, None)
+        await asyncio.sleep(REPLICA_LAG_CHECK_INTERVAL)
+
+def _mark_user_write(user_id: int):
+    """Запоминает момент записи пользователя, чтобы его чтения шли на основной сервер."""
+    _last_write_at[user_id] = time_module.monotonic()
+
+def read_pool(user_id: int) -> asyncpg.Pool | None:
+    """
+    Возвращает пул для read-only запросов пользователя.
+    Реплика используется, только если ее отставание известно и не превышает DB_REPLICA_MAX_LAG,
+    а пользователь ничего не записывал последние DB_REPLICA_MAX_LAG секунд.
+    """
+    if db_replica_pool is None:
+        return db_pool
+    if replica_lag_seconds is None or replica_lag_seconds > config.DB_REPLICA_MAX_LAG:
+        return db_pool
+    last_write = _last_write_at.get(user_id)
+    if last_write is not None and time_module.monotonic() - last_write < config.DB_REPLICA_MAX_LAG:
+        return db_pool
+    return db_replica_pool
+
 async def close_db_pool():
     """Закрывает пул соединений с базой данных."""
-    global db_pool
+    global db_pool, db_replica_pool, _replica_monitor_task, replica_lag_seconds
+    if _replica_monitor_task:
+        _replica_monitor_task.cancel()
+        _replica_monitor_task = None
+    if db_replica_pool:
+        logger.info("Закрытие пула соединений с репликой...")
+        await db_replica_pool.close()
+        db_replica_pool = None
+        replica_lag_seconds = None
     if db_pool:
         logger.info("Закрытие пула соединений...")
         await db_pool.close()
         db_pool = None
         logger.info("Пул соединений закрыт.")
 
+FOOD_ENTRIES_IDEMPOTENCY_INDEX_SQL = """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_food_entries_idempotency_key ON food_entries (idempotency_key)
+    WHERE idempotency_key IS NOT NULL;
+"""
+
 async def create_tables_if_not_exist(pool: asyncpg.Pool):
     """Создает все необходимые таблицы, если они еще не существуют."""
-    async with pool.acquire() as connection:
+    if isinstance(pool, SqlitePool):
+        async with acquire(pool) as connection:
+            await connection.execute(storage_sqlite.SCHEMA_SQL)
+            # Базы, созданные до появления ключа идемпотентности
+            columns = {row['name'] for row in await connection.fetch("PRAGMA table_info(food_entries);")}
+            if 'idempotency_key' not in columns:
+                await connection.execute("ALTER TABLE food_entries ADD COLUMN idempotency_key TEXT;")
+            await connection.execute(FOOD_ENTRIES_IDEMPOTENCY_INDEX_SQL)
+        logger.info("Проверка и создание таблиц SQLite завершены.")
+        return
+    async with acquire(pool) as connection:
         async with connection.transaction():
             # Таблица users
             await connection.execute("""
@@ -77,6 +206,9 @@ async def create_tables_if_not_exist(pool: asyncpg.Pool):
             await connection.execute("""
                 CREATE INDEX IF NOT EXISTS idx_food_entries_user_id_timestamp ON food_entries (user_id, entry_timestamp);
             """)
+            # Ключ идемпотентности: повторная доставка апдейта не создает вторую запись
+            await connection.execute("ALTER TABLE food_entries ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR(128);")
+            await connection.execute(FOOD_ENTRIES_IDEMPOTENCY_INDEX_SQL)
             # Таблица goal_history
             await connection.execute("""
                 CREATE TABLE IF NOT EXISTS goal_history (
@@ -88,6 +220,18 @@ async def create_tables_if_not_exist(pool: asyncpg.Pool):
             await connection.execute("""
                 CREATE INDEX IF NOT EXISTS idx_goal_history_user_date ON goal_history (user_id, effective_date);
             """)
+            # Дайджест: группировка пользователей по часовому поясу и журнал рассылок
+            await connection.execute("""
+                CREATE INDEX IF NOT EXISTS idx_users_timezone ON users ((COALESCE(timezone, 'UTC')));
+            """)
+            await connection.execute("""
+                CREATE TABLE IF NOT EXISTS digest_runs (
+                    timezone VARCHAR(64) NOT NULL, digest_date DATE NOT NULL,
+                    started_at TIMESTAMPTZ NOT NULL DEFAULT NOW(), finished_at TIMESTAMPTZ,
+                    sent INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (timezone, digest_date)
+                );
+            """)
             # Функция и триггер для updated_at
             await connection.execute("""
                 CREATE OR REPLACE FUNCTION update_updated_at_column() RETURNS TRIGGER AS $$
@@ -103,28 +247,30 @@ async def create_tables_if_not_exist(pool: asyncpg.Pool):
 # ... (функции add_or_update_user, get_user_profile_data, update_user_profile_field, get_user_timezone, update_user_timezone_db, update_user_daily_goal, add_goal_history_entry, get_historical_norms, get_first_goal_history_date - без изменений) ...
 async def add_or_update_user(pool: asyncpg.Pool, user_id: int, first_name: str | None, last_name: str | None, username: str | None):
     sql = """INSERT INTO users (user_id, first_name, last_name, username) VALUES ($1, $2, $3, $4) ON CONFLICT (user_id) DO UPDATE SET first_name = EXCLUDED.first_name, last_name = EXCLUDED.last_name, username = EXCLUDED.username, updated_at = NOW() RETURNING created_at = updated_at;"""
-    async with pool.acquire() as connection:
-        try: is_new_user = await connection.fetchval(sql, user_id, first_name, last_name, username); logger.info(f"Пользователь {user_id} {'зарегистрирован' if is_new_user else 'обновлен'}."); return is_new_user
+    async with acquire(pool) as connection:
+        try: is_new_user = await connection.fetchval(sql, user_id, first_name, last_name, username); _mark_user_write(user_id); logger.info(f"Пользователь {user_id} {'зарегистрирован' if is_new_user else 'обновлен'}."); return is_new_user
         except Exception as e: logger.error(f"Ошибка при добавлении/обновлении пользователя {user_id}: {e}", exc_info=True); return False
 async def get_user_profile_data(pool: asyncpg.Pool, user_id: int) -> Optional[asyncpg.Record]:
-    sql = "SELECT current_weight, height, gender, goal, daily_calorie_goal FROM users WHERE user_id = $1;"
-    async with pool.acquire() as connection:
-        try: row = await connection.fetchrow(sql, user_id); logger.debug(f"Данные профиля для {user_id} из БД: {dict(row) if row else 'Не найден'}"); return row
+    sql = "SELECT current_weight, height, gender, goal, daily_calorie_goal, timezone FROM users WHERE user_id = $1;"
+    async with acquire(pool) as connection:
+        try: row = await connection.fetchrow(sql, user_id); logger.debug("Данные профиля для %s из БД: %s", user_id, row); return row
         except Exception as e: logger.error(f"Ошибка при получении профиля {user_id}: {e}", exc_info=True); return None
 async def update_user_profile_field(pool: asyncpg.Pool, user_id: int, field: str, value: Any) -> bool:
     allowed_fields = ["current_weight", "height", "gender", "goal", "timezone", "daily_calorie_goal"]
     if field not in allowed_fields: logger.error(f"Попытка обновить неразрешенное поле '{field}' для пользователя {user_id}"); return False
     sql = f"UPDATE users SET {field} = $1, updated_at = NOW() WHERE user_id = $2;"
-    async with pool.acquire() as connection:
+    async with acquire(pool) as connection:
         try:
             result = await connection.execute(sql, value, user_id)
+            _mark_user_write(user_id)
+            if field == "timezone": await cache.invalidate_today(user_id) # Границы "сегодня" сдвинулись
             if result == 'UPDATE 1': logger.info(f"Поле '{field}' для пользователя {user_id} обновлено на '{value}'."); return True
             else: logger.warning(f"Не удалось обновить поле '{field}' для {user_id} (пользователь не найден?)."); return False
         except Exception as e: logger.error(f"Ошибка при обновлении поля '{field}' для {user_id}: {e}", exc_info=True); return False
 async def get_user_timezone(pool: asyncpg.Pool, user_id: int) -> str:
     sql = "SELECT timezone FROM users WHERE user_id = $1;"
-    async with pool.acquire() as connection:
-        try: tz_name = await connection.fetchval(sql, user_id); logger.debug(f"Получен часовой пояс для {user_id}: '{tz_name}' (возвращаем '{tz_name if tz_name else 'UTC'}')"); return tz_name if tz_name else 'UTC'
+    async with acquire(pool) as connection:
+        try: tz_name = await connection.fetchval(sql, user_id); logger.debug("Получен часовой пояс для %s: '%s'", user_id, tz_name); return tz_name if tz_name else 'UTC'
         except Exception as e: logger.error(f"Ошибка при получении часового пояса для {user_id}: {e}", exc_info=True); return 'UTC'
 async def update_user_timezone_db(pool: asyncpg.Pool, user_id: int, timezone: str):
     try: pytz.timezone(timezone)
@@ -134,20 +280,111 @@ async def update_user_daily_goal(pool: asyncpg.Pool, user_id: int, calories: Opt
     await update_user_profile_field(pool, user_id, "daily_calorie_goal", calories)
 async def add_goal_history_entry(pool: asyncpg.Pool, user_id: int, effective_date: date, daily_calorie_goal: int):
     sql = """INSERT INTO goal_history (user_id, effective_date, daily_calorie_goal) VALUES ($1, $2, $3) ON CONFLICT (user_id, effective_date) DO UPDATE SET daily_calorie_goal = EXCLUDED.daily_calorie_goal;"""
-    async with pool.acquire() as connection:
-        try: await connection.execute(sql, user_id, effective_date, daily_calorie_goal); logger.info(f"Запись в goal_history для {user_id} на {effective_date} добавлена/обновлена: {daily_calorie_goal} ккал.")
+    async with acquire(pool) as connection:
+        try: await connection.execute(sql, user_id, effective_date, daily_calorie_goal); _mark_user_write(user_id); logger.info(f"Запись в goal_history для {user_id} на {effective_date} добавлена/обновлена: {daily_calorie_goal} ккал.")
         except Exception as e: logger.error(f"Ошибка при добавлении/обновлении goal_history для {user_id} на {effective_date}: {e}", exc_info=True)
 async def get_historical_norms(pool: asyncpg.Pool, user_id: int, start_date: date, end_date: date) -> List[asyncpg.Record]:
-    sql = """(SELECT effective_date, daily_calorie_goal FROM goal_history WHERE user_id = $1 AND effective_date < $2 ORDER BY effective_date DESC LIMIT 1) UNION ALL (SELECT effective_date, daily_calorie_goal FROM goal_history WHERE user_id = $1 AND effective_date >= $2 AND effective_date <= $3) ORDER BY effective_date ASC;"""
-    async with pool.acquire() as connection:
-        try: rows = await connection.fetch(sql, user_id, start_date, end_date); logger.debug(f"Получено {len(rows)} записей истории норм для {user_id} за период [{start_date}, {end_date}]."); return rows
+    # Последняя норма до начала периода + все изменения внутри периода (запрос переносим между PostgreSQL и SQLite)
+    sql = """SELECT effective_date, daily_calorie_goal FROM goal_history WHERE user_id = $1 AND ((effective_date >= $2 AND effective_date <= $3) OR effective_date = (SELECT MAX(effective_date) FROM goal_history WHERE user_id = $1 AND effective_date < $2)) ORDER BY effective_date ASC;"""
+    async with acquire(pool) as connection:
+        try: rows = await connection.fetch(sql, user_id, start_date, end_date); logger.debug("Получено %d записей истории норм для %s за период [%s, %s].", len(rows), user_id, start_date, end_date); return rows
         except Exception as e: logger.error(f"Ошибка при получении истории норм для {user_id}: {e}", exc_info=True); return []
 async def get_first_goal_history_date(pool: asyncpg.Pool, user_id: int) -> Optional[date]:
-    sql = "SELECT MIN(effective_date) FROM goal_history WHERE user_id = $1;"
-    async with pool.acquire() as connection:
-        try: first_date = await connection.fetchval(sql, user_id); logger.debug(f"Первая дата в истории норм для {user_id}: {first_date}"); return first_date
+    sql = "SELECT effective_date FROM goal_history WHERE user_id = $1 ORDER BY effective_date ASC LIMIT 1;"
+    async with acquire(pool) as connection:
+        try: first_date = await connection.fetchval(sql, user_id); logger.debug("Первая дата в истории норм для %s: %s", user_id, first_date); return first_date
         except Exception as e: logger.error(f"Ошибка при получении первой даты истории норм для {user_id}: {e}", exc_info=True); return None
 
+async def get_user_profiles_batch(pool: asyncpg.Pool, after_user_id: int, limit: int) -> List[asyncpg.Record]:
+    """Порция профилей с user_id > after_user_id (постраничное чтение по первичному ключу для офлайн-задач)."""
+    sql = """
+        SELECT user_id, current_weight, height, gender, goal, daily_calorie_goal
+        FROM users WHERE user_id > $1 ORDER BY user_id LIMIT $2;
+    """
+    async with acquire(pool) as connection:
+        return await connection.fetch(sql, after_user_id, limit)
+
+async def bulk_update_daily_goals(pool: asyncpg.Pool, user_ids: List[int], goals: List[Optional[int]], effective_date: date) -> int:
+    """
+    Записывает пересчитанные нормы пачкой в одной транзакции: users.daily_calorie_goal
+    и goal_history на effective_date (для ненулевых норм), как recalculate_and_save_goal для каждого.
+    В PostgreSQL - одним UPDATE ... FROM unnest(...) и одним INSERT ... SELECT FROM unnest(...).
+    Ошибки не перехватываются: вызывающая офлайн-задача должна остановиться, а не пропустить пачку.
+    Возвращает число обновленных строк users.
+    """
+    if not user_ids:
+        return 0
+    async with acquire(pool) as connection:
+        async with connection.transaction():
+            if isinstance(pool, SqlitePool):
+                rows = list(zip(goals, user_ids))
+                await connection.executemany("UPDATE users SET daily_calorie_goal = $1, updated_at = NOW() WHERE user_id = $2;", rows)
+                await connection.executemany(
+                    """INSERT INTO goal_history (user_id, effective_date, daily_calorie_goal) VALUES ($1, $2, $3)
+                       ON CONFLICT (user_id, effective_date) DO UPDATE SET daily_calorie_goal = EXCLUDED.daily_calorie_goal;""",
+                    [(user_id, effective_date, goal) for user_id, goal in zip(user_ids, goals) if goal is not None]
+                )
+                return len(rows)
+            result = await connection.execute("""
+                UPDATE users AS u SET daily_calorie_goal = v.goal, updated_at = NOW()
+                FROM unnest($1::bigint[], $2::integer[]) AS v(user_id, goal)
+                WHERE u.user_id = v.user_id;
+            """, user_ids, goals)
+            await connection.execute("""
+                INSERT INTO goal_history (user_id, effective_date, daily_calorie_goal)
+                SELECT v.user_id, $3, v.goal FROM unnest($1::bigint[], $2::integer[]) AS v(user_id, goal)
+                WHERE v.goal IS NOT NULL
+                ON CONFLICT (user_id, effective_date) DO UPDATE SET daily_calorie_goal = EXCLUDED.daily_calorie_goal;
+            """, user_ids, goals, effective_date)
+            return int(result.split()[-1])
+
+# --- Дайджест ---
+async def get_user_timezones(pool: asyncpg.Pool) -> Dict[str, int]:
+    """Возвращает {часовой пояс: число пользователей} (пустой пояс считается UTC)."""
+    sql = "SELECT COALESCE(timezone, 'UTC') AS tz, COUNT(*) AS users FROM users GROUP BY COALESCE(timezone, 'UTC');"
+    async with acquire(pool) as connection:
+        try: rows = await connection.fetch(sql); return {row['tz']: row['users'] for row in rows}
+        except Exception as e: logger.error(f"Ошибка при получении часовых поясов пользователей: {e}", exc_info=True); return {}
+
+async def claim_digest_run(pool: asyncpg.Pool, tz_name: str, digest_date: date) -> bool:
+    """Занимает рассылку дайджеста для пояса на дату. False - ее уже выполнил (или выполняет) другой экземпляр."""
+    sql = "INSERT INTO digest_runs (timezone, digest_date) VALUES ($1, $2) ON CONFLICT (timezone, digest_date) DO NOTHING;"
+    async with acquire(pool) as connection:
+        return await connection.execute(sql, tz_name, digest_date) == "INSERT 0 1"
+
+async def finish_digest_run(pool: asyncpg.Pool, tz_name: str, digest_date: date, sent: int, failed: int):
+    sql = "UPDATE digest_runs SET finished_at = NOW(), sent = $3, failed = $4 WHERE timezone = $1 AND digest_date = $2;"
+    async with acquire(pool) as connection:
+        try: await connection.execute(sql, tz_name, digest_date, sent, failed)
+        except Exception as e: logger.error(f"Ошибка при сохранении итогов дайджеста {tz_name} на {digest_date}: {e}", exc_info=True)
+
+async def get_digest_rows(pool: asyncpg.Pool, tz_name: str, digest_date: date) -> List[asyncpg.Record]:
+    """
+    Итоги дня для всех пользователей часового пояса одним запросом: потребление за локальные сутки,
+    число записей и норма на этот день (последняя запись goal_history не позже даты, иначе текущая норма).
+    Границы суток у всех пользователей пояса одинаковые, поэтому хватает одного диапазона по entry_timestamp.
+    """
+    user_tz = pytz.timezone(tz_name)
+    start_utc = user_tz.localize(datetime.combine(digest_date, time.min)).astimezone(pytz.utc)
+    end_utc = user_tz.localize(datetime.combine(digest_date + timedelta(days=1), time.min)).astimezone(pytz.utc)
+    sql = """
+        SELECT u.user_id, COALESCE(SUM(f.calories_consumed), 0) AS consumed, COUNT(f.entry_id) AS entries,
+               COALESCE((
+                   SELECT g.daily_calorie_goal FROM goal_history g
+                   WHERE g.user_id = u.user_id AND g.effective_date <= $4
+                   ORDER BY g.effective_date DESC LIMIT 1
+               ), u.daily_calorie_goal) AS norm
+        FROM users u
+        LEFT JOIN food_entries f ON f.user_id = u.user_id AND f.entry_timestamp >= $2 AND f.entry_timestamp < $3
+        WHERE COALESCE(u.timezone, 'UTC') = $1
+        GROUP BY u.user_id, u.daily_calorie_goal
+        ORDER BY u.user_id;
+    """
+    async with acquire(pool) as connection:
+        rows = await connection.fetch(sql, tz_name, start_utc, end_utc, digest_date)
+        logger.debug("Дайджест %s на %s: %d пользователей.", tz_name, digest_date, len(rows))
+        return rows
+
 async def get_food_entries_for_period(pool: asyncpg.Pool, user_id: int, start_dt_local: datetime, end_dt_exclusive_local: datetime) -> List[asyncpg.Record]:
     """Получает список записей о еде пользователя за указанный период [start, end)."""
     start_dt_utc = start_dt_local.astimezone(pytz.utc)
@@ -158,11 +395,11 @@ async def get_food_entries_for_period(pool: asyncpg.Pool, user_id: int, start_dt
         WHERE user_id = $1 AND entry_timestamp >= $2 AND entry_timestamp < $3
         ORDER BY entry_timestamp ASC;
     """
-    logger.debug(f"SQL Запрос для get_food_entries_for_period ({user_id}):\nSQL = {sql}\nPARAMS = user_id={user_id}, start_utc={start_dt_utc}, end_exclusive_utc={end_dt_exclusive_utc}")
-    async with pool.acquire() as connection:
+    logger.debug("Записи за период для %s: UTC [%s, %s)", user_id, start_dt_utc, end_dt_exclusive_utc)
+    async with acquire(pool) as connection:
         try:
             rows = await connection.fetch(sql, user_id, start_dt_utc, end_dt_exclusive_utc)
-            logger.debug(f"Получено {len(rows)} записей для {user_id} за период.")
+            logger.debug("Получено %d записей для %s за период.", len(rows), user_id)
             return rows
         except Exception as e:
             logger.error(f"Ошибка при получении записей за период (UTC {start_dt_utc} - {end_dt_exclusive_utc}) для {user_id}: {e}", exc_info=True); return []
@@ -177,13 +414,65 @@ async def get_todays_food_entries(pool: asyncpg.Pool, user_id: int, tz_name: str
     now_local = datetime.now(user_tz)
     today_start_local = user_tz.localize(datetime.combine(now_local.date(), time.min))
     next_day_start_local = today_start_local + timedelta(days=1)
-    logger.info(f"[DEBUG] get_todays_food_entries для {user_id} (TZ: {tz_name}) now_local={now_local}, today_start_local={today_start_local}, next_day_start_local={next_day_start_local}")
-    logger.info(f"[DEBUG] UTC-границы: start={today_start_local.astimezone(pytz.utc)}, end={next_day_start_local.astimezone(pytz.utc)}")
+    logger.debug("Записи за сегодня для %s (TZ: %s): [%s, %s)", user_id, tz_name, today_start_local, next_day_start_local)
     entries = await get_food_entries_for_period(pool, user_id, today_start_local, next_day_start_local)
-    for entry in entries:
-        logger.info(f"[DEBUG] entry_timestamp (UTC): {entry['entry_timestamp']}, entry_timestamp (local): {entry['entry_timestamp'].astimezone(user_tz)}")
+    if logger.isEnabledFor(logging.DEBUG): # astimezone() по каждой записи - только если вывод включен
+        for entry in entries:
+            logger.debug("Запись %s (UTC) = %s (local)", entry['entry_timestamp'], entry['entry_timestamp'].astimezone(user_tz))
     return entries
 
+async def get_todays_summary(pool: asyncpg.Pool, user_id: int, tz_name: str) -> tuple[int, List[Dict[str, Any]]]:
+    """
+    Возвращает (сумма калорий, список записей) за сегодня в часовом поясе пользователя.
+    Сначала читает кэш в Redis; при промахе собирает сводку из БД и сохраняет ее до локальной полуночи.
+    """
+    try: user_tz = pytz.timezone(tz_name)
+    except pytz.UnknownTimeZoneError: logger.warning(f"Некорректный TZ '{tz_name}' для {user_id}. Используется UTC."); user_tz = pytz.utc
+    local_date = datetime.now(user_tz).date()
+    cached, seq = await cache.get_today_summary(user_id, tz_name, local_date)
+    if cached is not None:
+        return cached
+    records = await get_todays_food_entries(pool, user_id, tz_name)
+    entries = [
+        {'product_name': r['product_name'], 'weight_grams': r['weight_grams'], 'calories_consumed': r['calories_consumed']}
+        for r in records
+    ]
+    await cache.store_today_summary(user_id, tz_name, local_date, cache.next_local_midnight(user_tz, local_date), entries, seq)
+    return sum(entry['calories_consumed'] for entry in entries), entries
+
+def group_calories_by_day(entries, user_tz) -> Dict[date, int]:
+    """Суммы калорий записей по локальным датам пользователя (группировка для SQLite)."""
+    totals: Dict[date, int] = {}
+    for entry in entries:
+        entry_date = entry['entry_timestamp'].astimezone(user_tz).date()
+        totals[entry_date] = totals.get(entry_date, 0) + entry['calories_consumed']
+    return totals
+
+async def get_daily_totals(pool: asyncpg.Pool, user_id: int, tz_name: str, start_date: date, end_date: date) -> Dict[date, int]:
+    """
+    Возвращает суммы калорий по локальным датам [start_date, end_date] (только дни с записями).
+    В PostgreSQL группировка выполняется в БД, для SQLite - по строкам в Python.
+    """
+    try: user_tz = pytz.timezone(tz_name)
+    except pytz.UnknownTimeZoneError: logger.warning(f"Некорректный TZ '{tz_name}' для {user_id}. Используется UTC."); user_tz = pytz.utc; tz_name = 'UTC'
+    start_dt_local = user_tz.localize(datetime.combine(start_date, time.min))
+    end_dt_exclusive_local = user_tz.localize(datetime.combine(end_date + timedelta(days=1), time.min))
+    if isinstance(pool, SqlitePool):
+        return group_calories_by_day(await get_food_entries_for_period(pool, user_id, start_dt_local, end_dt_exclusive_local), user_tz)
+    sql = """
+        SELECT (entry_timestamp AT TIME ZONE $4)::date AS day, SUM(calories_consumed) AS calories
+        FROM food_entries
+        WHERE user_id = $1 AND entry_timestamp >= $2 AND entry_timestamp < $3
+        GROUP BY day;
+    """
+    async with acquire(pool) as connection:
+        try:
+            rows = await connection.fetch(sql, user_id, start_dt_local.astimezone(pytz.utc), end_dt_exclusive_local.astimezone(pytz.utc), tz_name)
+            logger.debug("Получено %d дневных сумм для %s за [%s, %s].", len(rows), user_id, start_date, end_date)
+            return {row['day']: row['calories'] for row in rows}
+        except Exception as e:
+            logger.error(f"Ошибка при получении дневных сумм для {user_id} за [{start_date}, {end_date}]: {e}", exc_info=True); return {}
+
 async def get_last_n_days_entries(pool: asyncpg.Pool, user_id: int, tz_name: str, days: int = 7) -> List[asyncpg.Record]:
     """Получает список записей о еде пользователя за последние N дней (в его часовом поясе)."""
     try: user_tz = pytz.timezone(tz_name)
@@ -208,30 +497,50 @@ async def add_user_product(pool: asyncpg.Pool, user_id: int, product_name: str,
     normalized_product_name = ' '.join(product_name.strip().split()).lower()
     sql = """
         INSERT INTO user_products (user_id, product_name, calories_per_100g, last_used_at) VALUES ($1, $2, $3, NOW())
-        ON CONFLICT ON CONSTRAINT user_products_user_id_product_name_key DO UPDATE SET calories_per_100g = EXCLUDED.calories_per_100g, last_used_at = NOW();
+        ON CONFLICT (user_id, product_name) DO UPDATE SET calories_per_100g = EXCLUDED.calories_per_100g, last_used_at = NOW();
     """
-    async with pool.acquire() as connection:
-        try: await connection.execute(sql, user_id, normalized_product_name, calories_100g); logger.info(f"Продукт '{normalized_product_name}' добавлен/обновлен для {user_id}.")
+    async with acquire(pool) as connection:
+        try: await connection.execute(sql, user_id, normalized_product_name, calories_100g); _mark_user_write(user_id); logger.info(f"Продукт '{normalized_product_name}' добавлен/обновлен для {user_id}.")
         except Exception as e: logger.error(f"Ошибка при добавлении/обновлении продукта '{normalized_product_name}' для {user_id}: {e}", exc_info=True); raise
     return normalized_product_name
 
 # --- ИЗМЕНЕНО: Добавляем RETURNING entry_timestamp и логируем результат ---
-async def add_food_entry(pool: asyncpg.Pool, user_id: int, product_name: str, weight_grams: int, calories_consumed: int):
-    """Добавляет запись о приеме пищи с текущим временем UTC."""
+async def add_food_entry(
+    pool: asyncpg.Pool, user_id: int, product_name: str, weight_grams: int, calories_consumed: int,
+    idempotency_key: Optional[str] = None,
+) -> bool:
+    """
+    Добавляет запись о приеме пищи с текущим временем UTC.
+    idempotency_key (см. idempotency.py) - запись с таким ключом создается только один раз.
+    Возвращает False, если запись с этим ключом уже есть (повторная доставка апдейта).
+    """
     current_utc_time = datetime.now(timezone.utc) # Получаем текущее время UTC
-    logger.debug(f"Добавление записи для {user_id}: Продукт='{product_name}', Вес={weight_grams}, Ккал={calories_consumed}, Время UTC={current_utc_time}")
+    logger.debug("Добавление записи для %s: Продукт='%s', Вес=%s, Ккал=%s, Время UTC=%s", user_id, product_name, weight_grams, calories_consumed, current_utc_time)
     sql = """
-        INSERT INTO food_entries (user_id, product_name, weight_grams, calories_consumed, entry_timestamp)
-        VALUES ($1, $2, $3, $4, $5)
+        INSERT INTO food_entries (user_id, product_name, weight_grams, calories_consumed, entry_timestamp, idempotency_key)
+        VALUES ($1, $2, $3, $4, $5, $6)
+        ON CONFLICT (idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
         RETURNING entry_timestamp; -- Возвращаем записанное время
     """
-    async with pool.acquire() as connection:
+    # Версия сводки "за сегодня" увеличивается до коммита: иначе параллельная пересборка из БД
+    # может уже содержать эту запись, и record_food_entry посчитает ее второй раз
+    summary_seq = await cache.begin_food_entry(user_id)
+    async with acquire(pool) as connection:
         try:
             # Выполняем запрос и получаем записанное время
             inserted_timestamp = await connection.fetchval(
-                sql, user_id, product_name, weight_grams, calories_consumed, current_utc_time
+                sql, user_id, product_name, weight_grams, calories_consumed, current_utc_time, idempotency_key
             )
+            if inserted_timestamp is None:
+                logger.info(f"Запись о еде для {user_id} с ключом {idempotency_key} уже добавлена, повтор пропущен.")
+                return False
+            _mark_user_write(user_id)
             logger.info(f"Запись о еде добавлена для {user_id}. Записанный Timestamp: {inserted_timestamp}")
+            await cache.record_food_entry(user_id, {'product_name': product_name, 'weight_grams': weight_grams, 'calories_consumed': calories_consumed}, summary_seq)
+            # Запись задним числом может попасть в уже закэшированный закрытый день
+            if inserted_timestamp < datetime.now(timezone.utc) - cache.CLOSED_DAY_GRACE:
+                await cache.invalidate_reports(user_id)
+            return True
         except Exception as e:
             logger.error(f"Ошибка при добавлении записи о еде для {user_id}: {e}", exc_info=True)
             raise
@@ -240,13 +549,13 @@ async def add_food_entry(pool: asyncpg.Pool, user_id: int, product_name: str, we
 async def get_user_product(pool: asyncpg.Pool, user_id: int, product_name: str) -> Optional[asyncpg.Record]:
     normalized_product_name = ' '.join(product_name.strip().split()).lower()
     sql = "SELECT product_id, product_name, calories_per_100g FROM user_products WHERE user_id = $1 AND product_name = $2;"
-    async with pool.acquire() as connection:
+    async with acquire(pool) as connection:
         try: row = await connection.fetchrow(sql, user_id, normalized_product_name); logger.info(f"Поиск точного совпадения для '{normalized_product_name}' у {user_id}: {'Найден' if row else 'Не найден'}"); return row
         except Exception as e: logger.error(f"Ошибка при точном поиске продукта '{normalized_product_name}' для {user_id}: {e}", exc_info=True); return None
 
 async def get_user_product_by_id(pool: asyncpg.Pool, user_id: int, product_id: int) -> Optional[asyncpg.Record]:
     sql = "SELECT product_id, product_name, calories_per_100g FROM user_products WHERE user_id = $1 AND product_id = $2;"
-    async with pool.acquire() as connection:
+    async with acquire(pool) as connection:
         try:
             row = await connection.fetchrow(sql, user_id, product_id)
             if row: logger.info(f"Поиск по ID={product_id} у {user_id}: Найден '{row['product_name']}'")
@@ -260,7 +569,7 @@ async def search_user_products(pool: asyncpg.Pool, user_id: int, search_query: s
         SELECT product_id, product_name, calories_per_100g FROM user_products
         WHERE user_id = $1 AND product_name LIKE $2 ORDER BY last_used_at DESC NULLS LAST LIMIT $3;
     """
-    async with pool.acquire() as connection:
+    async with acquire(pool) as connection:
         try: rows = await connection.fetch(sql, user_id, pattern, limit); logger.info(f"Контекстный поиск для '{normalized_query}%' у {user_id}: Найдено {len(rows)} записей."); return rows
         except Exception as e:
             if isinstance(e, asyncpg.UndefinedFunctionError) and 'gin_trgm_ops' in str(e): logger.error(f"Ошибка контекстного поиска: Расширение 'pg_trgm' не установлено? Выполните 'CREATE EXTENSION IF NOT EXISTS pg_trgm;' в БД.")
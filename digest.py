@@ -0,0 +1,241 @@
+"""
+Вечерний дайджест: итоги дня всем пользователям в DIGEST_TIME по их локальному времени.
+
+Пользователи группируются по users.timezone: у всех пользователей пояса одинаковые границы суток,
+поэтому потребление и нормы всей группы считаются одним агрегирующим запросом (db.get_digest_rows),
+а не вызовом /today для каждого. Сообщения ограничены DIGEST_RATE и уходят через общую очередь
+отправки с низким приоритетом (send_queue.bulk_sends), не задерживая ответы пользователям.
+
+Рассылку выполняет только один экземпляр бота - лидер (advisory lock в PostgreSQL на отдельном
+соединении; при потере соединения блокировка снимается и лидером становится другой экземпляр).
+Повторную отправку после смены лидера исключает журнал digest_runs (пояс + дата занимаются один раз).
+"""
+import asyncio
+import logging
+import time as time_module
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, List, Optional
+
+import asyncpg
+import pytz
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError
+
+import config
+import database as db
+from send_queue import TokenBucket, bulk_sends
+from storage_sqlite import SqlitePool
+
+logger = logging.getLogger(__name__)
+
+CHECK_INTERVAL = 60 # Проверка наступления DIGEST_TIME раз в минуту (с выравниванием на начало минуты)
+DIGEST_LOCK_KEY = 7_340_032_001 # Ключ pg_advisory_lock для выбора лидера
+SEND_WORKERS = 8 # Параллельных отправок внутри ограничения DIGEST_RATE
+
+_scheduler_task: Optional[asyncio.Task] = None
+_leader_connection: Optional[asyncpg.Connection] = None
+is_leader = False
+
+# Накопленная статистика рассылок и итоги последнего запуска (для логов и метрик)
+digest_stats: Dict[str, Any] = {"runs": 0, "sent": 0, "failed": 0, "last_run": None}
+
+
+def parse_digest_time(value: str) -> Optional[time]:
+    try:
+        return datetime.strptime(value.strip(), "%H:%M").time()
+    except ValueError:
+        return None
+
+
+def digest_target(user_tz: pytz.BaseTzInfo, local_date: date, send_time: time) -> datetime:
+    """Момент отправки дайджеста за local_date (локальное время send_time в поясе user_tz)."""
+    return user_tz.localize(datetime.combine(local_date, send_time))
+
+
+def due_digest_date(user_tz: pytz.BaseTzInfo, now_utc: datetime, send_time: time, max_delay: timedelta) -> Optional[date]:
+    """Локальная дата, дайджест за которую пора отправлять сейчас, или None."""
+    local_date = now_utc.astimezone(user_tz).date()
+    target = digest_target(user_tz, local_date, send_time)
+    if target <= now_utc < target + max_delay:
+        return local_date
+    return None
+
+
+def format_digest(row, digest_date: date) -> Optional[str]:
+    """Текст дайджеста для строки db.get_digest_rows. None - пользователю нечего сообщать."""
+    consumed, entries, norm = row['consumed'], row['entries'], row['norm']
+    if not entries and not norm:
+        return None
+    lines = [f"🌙 <b>Итоги дня ({digest_date.strftime('%d.%m.%Y')})</b>"]
+    if not entries:
+        lines.append("Сегодня записей не было. Добавить прием пищи: /add")
+    elif norm:
+        lines.append(f"Потреблено: <b>{consumed}</b> из ~{norm} ккал ({round(consumed / norm * 100)}%), записей: {entries}")
+        lines.append(f"Разница с нормой: {consumed - norm:+d} ккал")
+    else:
+        lines.append(f"Потреблено: <b>{consumed}</b> ккал, записей: {entries}")
+    lines.append("Подробности: /today")
+    return "\n".join(lines)
+
+
+async def _send_digest_message(bot: Bot, user_id: int, text: str) -> bool:
+    # Повторы после TelegramRetryAfter выполняет очередь отправки (send_queue)
+    try:
+        with bulk_sends():
+            await bot.send_message(user_id, text)
+        return True
+    except TelegramForbiddenError:
+        logger.info(f"Дайджест: пользователь {user_id} заблокировал бота")
+    except TelegramAPIError as e:
+        logger.warning(f"Дайджест: ошибка отправки {user_id}: {e}")
+    return False
+
+
+async def run_digest_for_timezone(
+    pool, bot: Bot, tz_name: str, digest_date: date, send_time: time, limiter: TokenBucket
+) -> Optional[Dict[str, Any]]:
+    """
+    Рассылает дайджест пользователям одного пояса. Возвращает статистику запуска
+    или None, если рассылка за эту дату уже занята другим экземпляром.
+    """
+    if not await db.claim_digest_run(pool, tz_name, digest_date):
+        return None
+    user_tz = pytz.timezone(tz_name)
+    target = digest_target(user_tz, digest_date, send_time)
+    started = time_module.perf_counter()
+    rows = await db.get_digest_rows(pool, tz_name, digest_date)
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for row in rows:
+        text = format_digest(row, digest_date)
+        if text:
+            queue.put_nowait((row['user_id'], text))
+    result = {"timezone": tz_name, "date": digest_date, "users": len(rows), "queued": queue.qsize(), "sent": 0, "failed": 0}
+    lags: List[float] = []
+
+    async def worker():
+        while True:
+            try:
+                user_id, text = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await asyncio.sleep(limiter.take())
+            if await _send_digest_message(bot, user_id, text):
+                result["sent"] += 1
+                lags.append((datetime.now(pytz.utc) - target).total_seconds())
+            else:
+                result["failed"] += 1
+
+    await asyncio.gather(*(worker() for _ in range(SEND_WORKERS)))
+    await db.finish_digest_run(pool, tz_name, digest_date, result["sent"], result["failed"])
+
+    elapsed = time_module.perf_counter() - started
+    result.update(
+        seconds=elapsed,
+        users_per_second=len(rows) / elapsed if elapsed else 0.0,
+        lag_first=min(lags) if lags else None,
+        lag_last=max(lags) if lags else None,
+    )
+    digest_stats["runs"] += 1
+    digest_stats["sent"] += result["sent"]
+    digest_stats["failed"] += result["failed"]
+    digest_stats["last_run"] = result
+    lag_text = f"{result['lag_first']:.1f}..{result['lag_last']:.1f} с" if lags else "-"
+    logger.info(
+        f"Дайджест {tz_name} за {digest_date}: пользователей {len(rows)}, отправлено {result['sent']}, "
+        f"ошибок {result['failed']}, {result['users_per_second']:.0f} польз./с, отставание от {send_time:%H:%M} {lag_text}"
+    )
+    return result
+
+
+async def run_due_digests(pool, bot: Bot, send_time: time, limiter: TokenBucket, now_utc: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """Отправляет дайджест всем поясам, где наступило время рассылки."""
+    now_utc = now_utc or datetime.now(pytz.utc)
+    max_delay = timedelta(minutes=config.DIGEST_MAX_DELAY_MINUTES)
+    results = []
+    for tz_name in await db.get_user_timezones(pool):
+        try:
+            user_tz = pytz.timezone(tz_name)
+        except pytz.UnknownTimeZoneError:
+            logger.debug(f"Дайджест: пропущен некорректный часовой пояс '{tz_name}'")
+            continue
+        digest_date = due_digest_date(user_tz, now_utc, send_time, max_delay)
+        if digest_date is None:
+            continue
+        result = await run_digest_for_timezone(pool, bot, tz_name, digest_date, send_time, limiter)
+        if result:
+            results.append(result)
+    return results
+
+
+async def _release_leadership():
+    global _leader_connection, is_leader
+    if _leader_connection is not None:
+        try:
+            await _leader_connection.close()
+        except Exception:
+            pass
+    _leader_connection = None
+    is_leader = False
+
+
+async def ensure_leadership() -> bool:
+    """Проверяет или пытается получить лидерство. Со встроенной SQLite бот работает в одном экземпляре."""
+    global _leader_connection, is_leader
+    if isinstance(db.db_pool, SqlitePool):
+        is_leader = True
+        return True
+    try:
+        if _leader_connection is None:
+            _leader_connection = await asyncpg.connect(config.DATABASE_URL)
+            is_leader = await _leader_connection.fetchval("SELECT pg_try_advisory_lock($1);", DIGEST_LOCK_KEY)
+            if not is_leader:
+                await _release_leadership()
+            else:
+                logger.info("Дайджест: этот экземпляр стал лидером рассылки.")
+        else:
+            await _leader_connection.fetchval("SELECT 1;")
+    except Exception as e:
+        if is_leader:
+            logger.warning(f"Дайджест: лидерство потеряно ({e}).")
+        await _release_leadership()
+    return is_leader
+
+
+async def _scheduler_loop(bot: Bot, send_time: time):
+    limiter = TokenBucket(config.DIGEST_RATE, max(config.DIGEST_RATE, 1.0))
+    while True:
+        # Проверка в начале каждой минуты: DIGEST_TIME задается с точностью до минуты
+        await asyncio.sleep(CHECK_INTERVAL - time_module.time() % CHECK_INTERVAL)
+        try:
+            if db.db_pool and await ensure_leadership():
+                await run_due_digests(db.db_pool, bot, send_time, limiter)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка планировщика дайджеста: {e}", exc_info=True)
+
+
+async def start_digest_scheduler(bot: Bot):
+    """Запускает планировщик дайджеста (если DIGEST_ENABLED)."""
+    global _scheduler_task
+    if not config.DIGEST_ENABLED or _scheduler_task is not None:
+        return
+    send_time = parse_digest_time(config.DIGEST_TIME)
+    if send_time is None:
+        logger.error(f"Некорректный DIGEST_TIME '{config.DIGEST_TIME}' (ожидается ЧЧ:ММ). Дайджест отключен.")
+        return
+    _scheduler_task = asyncio.create_task(_scheduler_loop(bot, send_time))
+    logger.info(f"Планировщик дайджеста запущен: {send_time:%H:%M} по местному времени, до {config.DIGEST_RATE} сообщ./с.")
+
+
+async def stop_digest_scheduler():
+    global _scheduler_task
+    if _scheduler_task is not None:
+        _scheduler_task.cancel()
+        try:
+            await _scheduler_task
+        except asyncio.CancelledError:
+            pass
+        _scheduler_task = None
+    await _release_leadership()
@@ -0,0 +1,245 @@
+"""
+Кэш FSM на время обработки одного апдейта.
+
+Обработчики (особенно в handlers/add_food.py) за один апдейт по несколько раз вызывают
+state.get_data()/update_data()/set_state(). С RedisStorage каждый вызов - отдельный запрос к Redis.
+UpdateCachedStorage оборачивает хранилище: при первом обращении к ключу состояние и данные
+читаются вместе (одним pipeline для Redis), дальнейшие чтения и записи идут в память,
+а измененное записывается одним pipeline после обработки апдейта (FSMCacheMiddleware).
+
+Вне апдейта (фоновые задачи, тесты) обращения проходят в хранилище напрямую.
+Для Redis в том же pipeline обновляется индекс активности FSM_ACTIVITY_KEY (время последнего
+апдейта по ключам с незавершенным сценарием - и при смене состояния, и при одном update_data
+или чтении), по нему fsm_expiry находит брошенные сценарии.
+Предполагается, что апдейты одного пользователя не обрабатываются параллельно
+с конкурирующими записями в FSM (как и без кэша: update_data - это чтение и запись).
+"""
+import json
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.types import TelegramObject
+
+try:
+    from aiogram.fsm.storage.redis import RedisStorage
+except ImportError:  # pragma: no cover - зависит от установленного extra redis
+    RedisStorage = None
+
+logger = logging.getLogger(__name__)
+
+_UNKNOWN = object() # Значение еще не прочитано из хранилища
+FSM_ACTIVITY_KEY = "fsm:activity" # ZSET: ключ FSM -> время последнего апдейта в незавершенном сценарии
+
+# Статистика: operations - обращений обработчиков к FSM (столько запросов было бы без кэша),
+# round_trips - фактических запросов к хранилищу (pipeline считается за один)
+fsm_cache_stats: Dict[str, int] = {"updates": 0, "operations": 0, "round_trips": 0}
+
+
+def round_trips_saved() -> int:
+    return fsm_cache_stats["operations"] - fsm_cache_stats["round_trips"]
+
+
+def encode_storage_key(key: StorageKey) -> str:
+    """Ключ FSM как строка для индекса активности."""
+    return json.dumps([key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny])
+
+
+def decode_storage_key(value: str | bytes) -> StorageKey:
+    bot_id, chat_id, user_id, thread_id, business_connection_id, destiny = json.loads(value)
+    return StorageKey(
+        bot_id=bot_id, chat_id=chat_id, user_id=user_id, thread_id=thread_id,
+        business_connection_id=business_connection_id, destiny=destiny,
+    )
+
+
+class _CachedRecord:
+    __slots__ = ("state", "data", "state_dirty", "data_dirty")
+
+    def __init__(self):
+        self.state: Any = _UNKNOWN
+        self.data: Any = _UNKNOWN
+        self.state_dirty = False
+        self.data_dirty = False
+
+
+_update_records: ContextVar[Optional[Dict[StorageKey, _CachedRecord]]] = ContextVar("fsm_update_records", default=None)
+
+
+class UpdateCachedStorage(BaseStorage):
+    """Обертка над FSM-хранилищем с кэшем на время апдейта и отложенной записью."""
+
+    def __init__(self, storage: BaseStorage):
+        self.storage = storage
+
+    def _is_redis(self) -> bool:
+        return RedisStorage is not None and isinstance(self.storage, RedisStorage)
+
+    async def _load(self, key: StorageKey, record: _CachedRecord):
+        """Читает состояние и данные ключа одним запросом (для Redis) и дополняет запись кэша."""
+        if self._is_redis():
+            builder = self.storage.key_builder
+            async with self.storage.redis.pipeline(transaction=False) as pipe:
+                pipe.get(builder.build(key, "state"))
+                pipe.get(builder.build(key, "data"))
+                raw_state, raw_data = await pipe.execute()
+            fsm_cache_stats["round_trips"] += 1
+            if isinstance(raw_state, bytes):
+                raw_state = raw_state.decode("utf-8")
+            if isinstance(raw_data, bytes):
+                raw_data = raw_data.decode("utf-8")
+            state, data = raw_state, (self.storage.json_loads(raw_data) if raw_data is not None else {})
+        else:
+            state, data = await self.storage.get_state(key), await self.storage.get_data(key)
+            fsm_cache_stats["round_trips"] += 2
+        # Уже записанное в этом апдейте не перезаписываем прочитанным
+        if record.state is _UNKNOWN:
+            record.state = state
+        if record.data is _UNKNOWN:
+            record.data = data
+
+    def _record(self, key: StorageKey) -> Optional[_CachedRecord]:
+        records = _update_records.get()
+        if records is None:
+            return None
+        record = records.get(key)
+        if record is None:
+            record = records[key] = _CachedRecord()
+        return record
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        fsm_cache_stats["operations"] += 1
+        record = self._record(key)
+        if record is None:
+            fsm_cache_stats["round_trips"] += 1
+            await self.storage.set_state(key, state)
+            return
+        record.state = state.state if isinstance(state, State) else state
+        record.state_dirty = True
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        fsm_cache_stats["operations"] += 1
+        record = self._record(key)
+        if record is None:
+            fsm_cache_stats["round_trips"] += 1
+            return await self.storage.get_state(key)
+        if record.state is _UNKNOWN:
+            await self._load(key, record)
+        return record.state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        fsm_cache_stats["operations"] += 1
+        record = self._record(key)
+        if record is None:
+            fsm_cache_stats["round_trips"] += 1
+            await self.storage.set_data(key, data)
+            return
+        record.data = dict(data)
+        record.data_dirty = True
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        fsm_cache_stats["operations"] += 1
+        record = self._record(key)
+        if record is None:
+            fsm_cache_stats["round_trips"] += 1
+            return await self.storage.get_data(key)
+        if record.data is _UNKNOWN:
+            await self._load(key, record)
+        return dict(record.data)
+
+    async def update_data(self, key: StorageKey, data: Mapping[str, Any]) -> Dict[str, Any]:
+        record = self._record(key)
+        if record is None:
+            return await super().update_data(key, data)
+        fsm_cache_stats["operations"] += 2 # Без кэша: чтение и запись
+        if record.data is _UNKNOWN:
+            await self._load(key, record)
+        record.data = {**record.data, **data}
+        record.data_dirty = True
+        return dict(record.data)
+
+    async def flush(self, records: Dict[StorageKey, _CachedRecord]):
+        """
+        Записывает измененные за апдейт состояния и данные (для Redis - одним pipeline).
+        Для Redis отметка активности обновляется у всех ключей апдейта с незавершенным сценарием,
+        даже если состояние не менялось (например, только update_data при уточнении подсказок).
+        """
+        dirty = [(key, record) for key, record in records.items() if record.state_dirty or record.data_dirty]
+        if self._is_redis():
+            active = [key for key, record in records.items() if record.state is not _UNKNOWN and record.state is not None]
+            if not dirty and not active:
+                return
+            storage = self.storage
+            now = time.time()
+            async with storage.redis.pipeline(transaction=False) as pipe:
+                if active:
+                    pipe.zadd(FSM_ACTIVITY_KEY, {encode_storage_key(key): now for key in active})
+                for key, record in dirty:
+                    if record.state_dirty:
+                        state_key = storage.key_builder.build(key, "state")
+                        if record.state is None:
+                            pipe.delete(state_key)
+                            pipe.zrem(FSM_ACTIVITY_KEY, encode_storage_key(key))
+                        else:
+                            pipe.set(state_key, record.state, ex=storage.state_ttl)
+                    if record.data_dirty:
+                        data_key = storage.key_builder.build(key, "data")
+                        if not record.data:
+                            pipe.delete(data_key)
+                        else:
+                            pipe.set(data_key, storage.json_dumps(record.data), ex=storage.data_ttl)
+                await pipe.execute()
+            fsm_cache_stats["round_trips"] += 1
+            return
+        # BoundedMemoryStorage отмечает активность при каждом обращении к ключу
+        for key, record in dirty:
+            if record.state_dirty:
+                await self.storage.set_state(key, record.state)
+                fsm_cache_stats["round_trips"] += 1
+            if record.data_dirty:
+                await self.storage.set_data(key, record.data)
+                fsm_cache_stats["round_trips"] += 1
+
+    async def close(self) -> None:
+        await self.storage.close()
+
+
+class FSMCacheMiddleware(BaseMiddleware):
+    """Outer-middleware апдейта: включает кэш FSM и записывает изменения после обработки."""
+
+    def __init__(self, storage: UpdateCachedStorage):
+        self.storage = storage
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        records: Dict[StorageKey, _CachedRecord] = {}
+        token = _update_records.set(records)
+        fsm_cache_stats["updates"] += 1
+        try:
+            return await handler(event, data)
+        finally:
+            _update_records.reset(token)
+            # Изменения, сделанные до ошибки в обработчике, сохраняются, как и без кэша
+            await self.storage.flush(records)
+
+
+def install_fsm_cache(dp: Dispatcher):
+    """
+    Подключает FSMCacheMiddleware снаружи FSMContextMiddleware диспетчера, чтобы в кэш попало
+    и первое чтение состояния (raw_state), а запись происходила после обработчика.
+    Хранилище диспетчера должно быть UpdateCachedStorage.
+    """
+    storage = dp.fsm.storage
+    if not isinstance(storage, UpdateCachedStorage):
+        raise TypeError("Для кэша FSM хранилище диспетчера должно быть UpdateCachedStorage")
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(FSMCacheMiddleware(storage))
+    dp.update.outer_middleware(dp.fsm)
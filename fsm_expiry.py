@@ -0,0 +1,220 @@
+"""
+Ограничение времени жизни и объема FSM.
+
+Брошенные сценарии (AddFood, Settings без ввода веса или /cancel) раньше хранились бессрочно.
+Теперь:
+- ключи Redis получают TTL (FSM_STATE_TTL/FSM_DATA_TTL) - страховка, если очистка не работает;
+- без Redis используется BoundedMemoryStorage: не больше FSM_MEMORY_MAX_KEYS ключей (LRU),
+  пустые записи не хранятся;
+- фоновая очистка раз в FSM_SWEEP_INTERVAL секунд сбрасывает сценарии без активности дольше
+  FSM_FLOW_TIMEOUT_MINUTES и убирает инлайн-клавиатуру из сообщения бота (last_bot_msg_id),
+  чтобы по ней нельзя было нажать в уже сброшенном сценарии.
+Для Redis брошенные сценарии находятся по индексу активности fsm_cache.FSM_ACTIVITY_KEY.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import DataNotDictLikeError, TelegramAPIError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage, MemoryStorageRecord
+
+import config
+from fsm_cache import FSM_ACTIVITY_KEY, UpdateCachedStorage, decode_storage_key, encode_storage_key
+from send_queue import bulk_sends
+
+try:
+    from aiogram.fsm.storage.redis import RedisStorage
+except ImportError:  # pragma: no cover - зависит от установленного extra redis
+    RedisStorage = None
+
+logger = logging.getLogger(__name__)
+
+SWEEP_BATCH = 500 # Сколько брошенных сценариев Redis обрабатывать за один проход
+
+# Захват брошенных сценариев: ZREM только тех, чья отметка активности все еще не новее cutoff.
+# Если пользователь успел вернуться (ZADD обновил время), сценарий не трогаем.
+# KEYS: индекс активности; ARGV: cutoff, member... Возвращает захваченные member.
+CLAIM_STALE_LUA = """
+local claimed = {}
+for i = 2, #ARGV do
+    local score = redis.call('ZSCORE', KEYS[1], ARGV[i])
+    if score and tonumber(score) <= tonumber(ARGV[1]) then
+        redis.call('ZREM', KEYS[1], ARGV[i])
+        claimed[#claimed + 1] = ARGV[i]
+    end
+end
+return claimed
+"""
+
+_sweeper_task: Optional[asyncio.Task] = None
+
+# expired - сброшено брошенных сценариев, keyboards_removed - убрано инлайн-клавиатур,
+# evicted - вытеснено записей BoundedMemoryStorage при превышении FSM_MEMORY_MAX_KEYS
+fsm_expiry_stats: Dict[str, int] = {"sweeps": 0, "expired": 0, "keyboards_removed": 0, "evicted": 0}
+
+
+@dataclass
+class _TimedRecord(MemoryStorageRecord):
+    updated_at: float = 0.0 # Время последнего обращения (time.time())
+
+
+class BoundedMemoryStorage(MemoryStorage):
+    """MemoryStorage с ограничением числа ключей: при переполнении вытесняются давно не использованные."""
+
+    def __init__(self, max_keys: int):
+        super().__init__()
+        self.max_keys = max_keys
+        self.storage: "OrderedDict[StorageKey, _TimedRecord]" = OrderedDict()
+
+    def _get(self, key: StorageKey) -> Optional[_TimedRecord]:
+        record = self.storage.get(key)
+        if record is not None:
+            record.updated_at = time.time()
+            self.storage.move_to_end(key)
+        return record
+
+    def _get_or_create(self, key: StorageKey) -> _TimedRecord:
+        record = self._get(key)
+        if record is None:
+            record = self.storage[key] = _TimedRecord(updated_at=time.time())
+            while len(self.storage) > self.max_keys:
+                self.storage.popitem(last=False)
+                fsm_expiry_stats["evicted"] += 1
+        return record
+
+    def _drop_if_empty(self, key: StorageKey, record: _TimedRecord):
+        if record.state is None and not record.data:
+            self.storage.pop(key, None)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._get_or_create(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._drop_if_empty(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self._get(key)
+        return record.state if record else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        record = self._get_or_create(key)
+        record.data = data.copy()
+        self._drop_if_empty(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self._get(key)
+        return record.data.copy() if record else {}
+
+    async def get_value(self, storage_key: StorageKey, dict_key: str, default: Any = None) -> Any:
+        return (await self.get_data(storage_key)).get(dict_key, default)
+
+    def stale_keys(self, cutoff: float) -> List[StorageKey]:
+        """Ключи незавершенных сценариев без обращений с момента cutoff (самые старые - в начале)."""
+        stale = []
+        for key, record in self.storage.items():
+            if record.updated_at >= cutoff:
+                break # Дальше записи только новее (порядок LRU)
+            if record.state is not None:
+                stale.append(key)
+        return stale
+
+
+async def _stale_keys(storage: BaseStorage, cutoff: float) -> List[StorageKey]:
+    if isinstance(storage, BoundedMemoryStorage):
+        return storage.stale_keys(cutoff)
+    if RedisStorage is not None and isinstance(storage, RedisStorage):
+        members = await storage.redis.zrangebyscore(FSM_ACTIVITY_KEY, "-inf", cutoff, start=0, num=SWEEP_BATCH)
+        if not members:
+            return []
+        # Атомарный захват: при нескольких экземплярах бота сценарий обработает только один,
+        # а сценарий, активный между ZRANGEBYSCORE и захватом, останется
+        claimed = await storage.redis.eval(CLAIM_STALE_LUA, 1, FSM_ACTIVITY_KEY, cutoff, *members)
+        return [decode_storage_key(member) for member in claimed]
+    return []
+
+
+async def _still_stale(storage: BaseStorage, key: StorageKey, cutoff: float) -> bool:
+    """Повторная проверка перед сбросом: пользователь мог вернуться уже после захвата."""
+    if isinstance(storage, BoundedMemoryStorage):
+        record = storage.storage.get(key)
+        return record is not None and record.updated_at < cutoff
+    if RedisStorage is not None and isinstance(storage, RedisStorage):
+        # После захвата отметки нет; новая смена состояния добавляет ее снова
+        score = await storage.redis.zscore(FSM_ACTIVITY_KEY, encode_storage_key(key))
+        return score is None or score <= cutoff
+    return True
+
+
+async def _remove_keyboard(bot: Bot, key: StorageKey, message_id: int) -> bool:
+    try:
+        with bulk_sends():
+            await bot.edit_message_reply_markup(chat_id=key.chat_id, message_id=message_id, reply_markup=None)
+        return True
+    except TelegramAPIError as e:
+        # Сообщение удалено, слишком старое или уже без клавиатуры
+        logger.debug(f"FSM: не удалось убрать клавиатуру сообщения {message_id} в чате {key.chat_id}: {e}")
+        return False
+
+
+async def sweep_stale_flows(bot: Bot, storage: BaseStorage, now: Optional[float] = None) -> int:
+    """Сбрасывает брошенные сценарии и убирает их инлайн-клавиатуры. Возвращает число сброшенных."""
+    if isinstance(storage, UpdateCachedStorage):
+        storage = storage.storage
+    cutoff = (now or time.time()) - config.FSM_FLOW_TIMEOUT_MINUTES * 60
+    expired = 0
+    for key in await _stale_keys(storage, cutoff):
+        if not await _still_stale(storage, key, cutoff):
+            continue
+        state = await storage.get_state(key)
+        data = await storage.get_data(key)
+        if state is None:
+            continue # Сценарий уже завершен
+        await storage.set_state(key, None)
+        await storage.set_data(key, {})
+        expired += 1
+        last_bot_msg_id = data.get('last_bot_msg_id')
+        if last_bot_msg_id and await _remove_keyboard(bot, key, last_bot_msg_id):
+            fsm_expiry_stats["keyboards_removed"] += 1
+    fsm_expiry_stats["sweeps"] += 1
+    fsm_expiry_stats["expired"] += expired
+    if expired:
+        logger.info(f"FSM: сброшено брошенных сценариев: {expired} (всего {fsm_expiry_stats['expired']}).")
+    return expired
+
+
+async def _sweeper_loop(bot: Bot, storage: BaseStorage):
+    while True:
+        await asyncio.sleep(config.FSM_SWEEP_INTERVAL)
+        try:
+            await sweep_stale_flows(bot, storage)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка очистки FSM: {e}", exc_info=True)
+
+
+async def start_fsm_sweeper(bot: Bot, dispatcher: Dispatcher):
+    """Запускает фоновую очистку брошенных сценариев (FSM_FLOW_TIMEOUT_MINUTES > 0)."""
+    global _sweeper_task
+    if config.FSM_FLOW_TIMEOUT_MINUTES <= 0 or _sweeper_task is not None:
+        return
+    _sweeper_task = asyncio.create_task(_sweeper_loop(bot, dispatcher.storage))
+    logger.info(f"Очистка FSM запущена: сценарии без активности дольше {config.FSM_FLOW_TIMEOUT_MINUTES} мин сбрасываются.")
+
+
+async def stop_fsm_sweeper():
+    global _sweeper_task
+    if _sweeper_task is not None:
+        _sweeper_task.cancel()
+        try:
+            await _sweeper_task
+        except asyncio.CancelledError:
+            pass
+        _sweeper_task = None
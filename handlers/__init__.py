@@ -5,6 +5,7 @@ from .common import router as common_router
 from .add_food import router as add_food_router
 from .reports import router as reports_router
 from .settings import router as settings_router # <--- Добавили импорт
+from .inline import router as inline_router
 
 # Создаем главный роутер для всех обработчиков
 all_routers = Router()
@@ -14,5 +15,6 @@ all_routers = Router()
 all_routers.include_router(settings_router) # <--- Добавили роутер настроек
 all_routers.include_router(add_food_router)
 all_routers.include_router(reports_router)
+all_routers.include_router(inline_router) # Inline-поиск продуктов (@bot название вес)
 all_routers.include_router(common_router) # Общие команды (включая /start, /help) регистрируем последними
 
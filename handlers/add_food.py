@@ -2,12 +2,15 @@ import logging
 import asyncio
 import aiohttp
 import re
+import time
 from typing import List, Dict, Any, Optional
 from aiogram import Router, F, Bot
 from aiogram.filters import Command, StateFilter
 from aiogram.types import Message, ReplyKeyboardRemove, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from html import escape
+from contextlib import suppress
+from aiogram.exceptions import TelegramBadRequest
 
 # Импортируем состояния, клавиатуры, функции БД и т.д.
 from states import AddFood
@@ -24,10 +27,18 @@ from keyboards import (
     CONFIRM_API_TEXT,
     EDIT_API_TEXT,
     MANUAL_INPUT_TEXT,
-    PRODUCT_SELECT_CALLBACK_PREFIX
+    MANUAL_INPUT_INDEX,
+    ProductSelect,
+    ApiChoice
 )
+import config
 import database as db
-from .reports import handle_today # Для показа сводки после действий
+import metrics
+from circuit_breaker import CircuitBreaker
+import tracing
+from idempotency import message_idempotency_key
+from responses import respond
+from .reports import handle_today, show_today_after_save # Для показа сводки после действий
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
@@ -41,6 +52,69 @@ MIN_QUERY_LEN_FOR_SUGGEST = 2 # Минимальная длина ввода д
 API_TIMEOUT = 20 # Таймаут ожидания ответа от API в секундах
 API_RETRY_ATTEMPTS = 3 # Количество попыток запроса к API
 API_RETRY_DELAY = 2 # Задержка между попытками в секундах
+OFF_SEARCH_PATH = "/cgi/search.pl" # Относительно config.OFF_BASE_URL
+# Ответ на повторную доставку уже сохраненного сообщения (add_food_entry вернул False)
+ALREADY_SAVED_TEXT = "Эта запись уже сохранена, повторно не добавлена."
+
+# Предохранитель OFF: после OFF_BREAKER_FAILURES неудачных поисков подряд запросы к API
+# не выполняются OFF_BREAKER_RESET секунд - пользователь сразу переходит к ручному вводу
+off_breaker = CircuitBreaker("off", config.OFF_BREAKER_FAILURES, config.OFF_BREAKER_RESET)
+
+def _observe_off_attempt(started: float, attempt: int, outcome: str):
+    """Время попытки запроса к OFF: метрика bot_off_request_duration_seconds и span трассы."""
+    metrics.OFF_LATENCY.observe(time.perf_counter() - started, attempt=attempt + 1, outcome=outcome)
+    tracing.record_span(
+        "off.request", started, error=outcome not in ("found", "not_found"), attempt=attempt + 1, outcome=outcome
+    )
+
+
+def parse_off_products(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Разбирает ответ поиска OFF: до MAX_API_OPTIONS продуктов с названием и калорийностью
+    в виде [{'name': str, 'calories': int}] (ккал на 100 г; кДж пересчитываются).
+    """
+    product_options = [] # Список для валидных вариантов
+    # Проверяем, есть ли продукты в ответе
+    if not isinstance(data, dict) or not (data.get("count", 0) > 0 and isinstance(data.get("products"), list)):
+        return product_options
+    # Обрабатываем найденные продукты
+    for product in data["products"]:
+        # Ограничиваем количество опций
+        if len(product_options) >= MAX_API_OPTIONS: break
+
+        if not isinstance(product, dict): continue
+        nutriments = product.get("nutriments")
+        if not isinstance(nutriments, dict): nutriments = {} # null или мусор вместо словаря
+        product_name_found = product.get('product_name')
+        # Пропускаем продукты без имени
+        if not product_name_found or not isinstance(product_name_found, str): continue
+
+        logger.debug("Обработка продукта: %s. Nutriments: %s", product_name_found, nutriments)
+
+        calories_int: int | None = None
+        # 1. Пытаемся найти калории в ккал ('energy-kcal_100g')
+        calories_kcal = nutriments.get("energy-kcal_100g")
+        if calories_kcal:
+            try: calories_int = int(float(calories_kcal))
+            except (ValueError, TypeError, OverflowError): pass # Игнорируем ошибки конвертации
+
+        # 2. Если ккал не найдены, пытаемся найти энергию в кДж ('energy_100g') и пересчитать
+        if calories_int is None:
+            energy_kj = nutriments.get("energy_100g")
+            if energy_kj:
+                try:
+                    unit = str(nutriments.get("energy_unit") or "").lower()
+                    if unit == 'kcal': calories_int = int(float(energy_kj)) # Если вдруг тут ккал
+                    elif unit == 'kj' or not unit: calories_int = int(float(energy_kj) / 4.184) # Пересчет из кДж
+                except (ValueError, TypeError, OverflowError): pass # Игнорируем ошибки конвертации
+
+        # Если калорийность найдена (и не отрицательная), добавляем продукт в опции
+        if calories_int is not None and calories_int >= 0:
+            product_options.append({"name": product_name_found.strip(), "calories": calories_int})
+        else:
+            logger.info(f"OFF API: Не найдено данных о калорийности для '{product_name_found}', пропускаем.")
+    return product_options
+
 
 # --- Функция для запроса к Open Food Facts API с повторными попытками ---
 async def fetch_products_from_off(product_name: str) -> Optional[List[Dict[str, Any]]]:
@@ -51,12 +125,15 @@ async def fetch_products_from_off(product_name: str) -> Optional[List[Dict[str,
     # Нормализуем поисковый запрос (нижний регистр, замена ',', удаление %, лишние пробелы)
     search_term = product_name.lower().replace(',', '.').replace('%', '').strip()
     search_term = re.sub(r'\s+', ' ', search_term)
+    if not off_breaker.allow():
+        logger.warning(f"OFF API временно не запрашивается (предохранитель разомкнут), '{search_term}' - ручной ввод.")
+        return None
     if not search_term: # Если запрос пустой после нормализации
         logger.warning("Пустой поисковый запрос после нормализации.")
         return None
 
     # URL и параметры для запроса к API
-    search_url = "https://world.openfoodfacts.org/cgi/search.pl"
+    search_url = f"{config.OFF_BASE_URL}{OFF_SEARCH_PATH}"
     params = {
         "search_terms": search_term,
         "search_simple": 1,
@@ -72,76 +149,47 @@ async def fetch_products_from_off(product_name: str) -> Optional[List[Dict[str,
     last_exception = None
     for attempt in range(API_RETRY_ATTEMPTS):
         logger.info(f"Попытка {attempt + 1}/{API_RETRY_ATTEMPTS} запроса к OFF API для '{search_term}'...")
+        attempt_started = time.perf_counter()
         try:
             # Создаем сессию aiohttp для выполнения запроса
             async with aiohttp.ClientSession(headers=headers) as session:
                 async with session.get(search_url, params=params, timeout=API_TIMEOUT) as response:
                     response.raise_for_status() # Генерируем исключение для HTTP ошибок (4xx, 5xx)
                     data = await response.json() # Читаем ответ как JSON
-                    logger.debug(f"Ответ OFF API (попытка {attempt + 1}): {data}") # Логируем сырой ответ
-
-                    # Проверяем, есть ли продукты в ответе
-                    if data.get("count", 0) > 0 and data.get("products"):
-                        products_found = data["products"]
-                        product_options = [] # Список для валидных вариантов
-                        # Обрабатываем найденные продукты
-                        for product in products_found:
-                            # Ограничиваем количество опций
-                            if len(product_options) >= MAX_API_OPTIONS: break
-
-                            nutriments = product.get("nutriments", {})
-                            product_name_found = product.get('product_name')
-                            # Пропускаем продукты без имени
-                            if not product_name_found: continue
-
-                            logger.debug(f"Обработка продукта: {product_name_found}. Nutriments: {nutriments}")
-
-                            calories_int: int | None = None
-                            # 1. Пытаемся найти калории в ккал ('energy-kcal_100g')
-                            calories_kcal = nutriments.get("energy-kcal_100g")
-                            if calories_kcal:
-                                try: calories_int = int(float(calories_kcal))
-                                except (ValueError, TypeError): pass # Игнорируем ошибки конвертации
-
-                            # 2. Если ккал не найдены, пытаемся найти энергию в кДж ('energy_100g') и пересчитать
-                            if calories_int is None:
-                                energy_kj = nutriments.get("energy_100g")
-                                if energy_kj:
-                                    try:
-                                        unit = nutriments.get("energy_unit", "").lower()
-                                        if unit == 'kcal': calories_int = int(float(energy_kj)) # Если вдруг тут ккал
-                                        elif unit == 'kj' or not unit: calories_int = int(float(energy_kj) / 4.184) # Пересчет из кДж
-                                    except (ValueError, TypeError): pass # Игнорируем ошибки конвертации
-
-                            # Если калорийность найдена, добавляем продукт в опции
-                            if calories_int is not None:
-                                product_options.append({"name": product_name_found.strip(), "calories": calories_int})
-                            else:
-                                logger.info(f"OFF API: Не найдено данных о калорийности для '{product_name_found}', пропускаем.")
-
-                        # Если собрали хотя бы один валидный вариант
-                        if product_options:
-                            logger.info(f"Запрос к OFF API успешен на попытке {attempt + 1}.")
-                            return product_options # Возвращаем список вариантов
+                    logger.debug("Ответ OFF API (попытка %d): %s", attempt + 1, data) # Сырой ответ форматируется, только если DEBUG включен
+
+                    product_options = parse_off_products(data)
+                    # Если собрали хотя бы один валидный вариант
+                    if product_options:
+                        logger.info(f"Запрос к OFF API успешен на попытке {attempt + 1}.")
+                        _observe_off_attempt(attempt_started, attempt, "found")
+                        off_breaker.record_success()
+                        return product_options # Возвращаем список вариантов
 
                     # Если API ответило, но продуктов нет или нет валидных
                     logger.info(f"OFF API не нашло валидных продуктов для '{search_term}' на попытке {attempt + 1}.")
+                    _observe_off_attempt(attempt_started, attempt, "not_found")
+                    off_breaker.record_success() # API ответило - сервис доступен
                     return None # Считаем, что продукт не найден, выходим из retry
 
         # Ловим сетевые ошибки и таймауты для повторной попытки
         except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             last_exception = e
+            _observe_off_attempt(attempt_started, attempt, "timeout" if isinstance(e, asyncio.TimeoutError) else "network_error")
             logger.warning(f"Попытка {attempt + 1} не удалась для '{search_term}': {e}. Повтор через {API_RETRY_DELAY} сек...")
             if attempt < API_RETRY_ATTEMPTS - 1: # Если это не последняя попытка
                 await asyncio.sleep(API_RETRY_DELAY) # Пауза перед следующей попыткой
             else:
                 # Если все попытки исчерпаны
                 logger.error(f"Все {API_RETRY_ATTEMPTS} попыток запроса к API для '{search_term}' не удались. Последняя ошибка: {e}")
+                off_breaker.record_failure()
                 return None # Возвращаем None после всех неудачных попыток
 
         # Ловим другие неожиданные ошибки (не повторяем)
         except Exception as e:
             last_exception = e
+            _observe_off_attempt(attempt_started, attempt, "error")
+            off_breaker.record_failure()
             logger.error(f"Неожиданная ошибка при запросе к OFF API (попытка {attempt + 1}) для '{search_term}': {e}", exc_info=True)
             return None # Выходим из retry при неожиданной ошибке
 
@@ -172,7 +220,7 @@ async def cancel_add_food_handler(message: Message, state: FSMContext):
             # Игнорируем ошибки (например, сообщение не найдено или уже без клавиатуры)
             logger.debug(f"Не удалось убрать инлайн-клавиатуру при отмене: {e}")
     await state.clear() # Очищаем состояние FSM
-    await message.answer("Добавление продукта отменено.", reply_markup=main_action_keyboard()) # Возвращаем основную клавиатуру
+    await respond(message, "Добавление продукта отменено.", reply_markup=main_action_keyboard()) # Возвращаем основную клавиатуру
     await handle_today(message) # Показываем сводку
 
 # Запуск FSM добавления продукта (/add или кнопка)
@@ -216,7 +264,7 @@ async def process_product_name_input(message: Message, state: FSMContext, bot: B
     suggestions = []
     # Ищем подсказки, если введено достаточно символов и есть подключение к БД
     if len(product_name_input) >= MIN_QUERY_LEN_FOR_SUGGEST and db.db_pool:
-        suggestions = await db.search_user_products(db.db_pool, user_id, product_name_input)
+        suggestions = await db.search_user_products(db.read_pool(user_id), user_id, product_name_input)
 
     # --- Логика в зависимости от наличия подсказок ---
     if suggestions:
@@ -252,7 +300,7 @@ async def process_product_name_input(message: Message, state: FSMContext, bot: B
 
         # Проверяем точное совпадение введенного имени в базе пользователя
         found_product = None
-        if db.db_pool: found_product = await db.get_user_product(db.db_pool, user_id, product_name_input)
+        if db.db_pool: found_product = await db.get_user_product(db.read_pool(user_id), user_id, product_name_input)
 
         if found_product:
             # Точное совпадение найдено: переходим к вводу веса
@@ -274,24 +322,18 @@ async def process_product_name_input(message: Message, state: FSMContext, bot: B
 
 
 # Обработчик нажатия на инлайн-кнопку с подсказкой
-@router.callback_query(StateFilter(AddFood.waiting_for_product_name), F.data.startswith(PRODUCT_SELECT_CALLBACK_PREFIX))
-async def handle_product_suggestion_callback(callback: CallbackQuery, state: FSMContext):
+@router.callback_query(StateFilter(AddFood.waiting_for_product_name), ProductSelect.filter())
+async def handle_product_suggestion_callback(callback: CallbackQuery, callback_data: ProductSelect, state: FSMContext):
     """Обрабатывает выбор продукта из инлайн-подсказок."""
     user_id = callback.from_user.id
-    try:
-        # Извлекаем ID продукта из callback_data
-        selected_product_id = int(callback.data[len(PRODUCT_SELECT_CALLBACK_PREFIX):])
-    except (ValueError, TypeError):
-        logger.error(f"Ошибка извлечения product_id из callback_data: {callback.data}")
-        await callback.answer("Ошибка данных кнопки.", show_alert=True)
-        return
+    selected_product_id = callback_data.product_id
 
     logger.info(f"Пользователь {user_id} выбрал подсказку с ID: {selected_product_id}")
 
     # Получаем данные продукта из базы по ID
     found_product = None
     if db.db_pool:
-        found_product = await db.get_user_product_by_id(db.db_pool, user_id, selected_product_id)
+        found_product = await db.get_user_product_by_id(db.read_pool(user_id), user_id, selected_product_id)
 
     if found_product:
         # Продукт найден в базе
@@ -357,12 +399,14 @@ async def process_weight(message: Message, state: FSMContext):
         # Запись в БД
         if db.db_pool:
             try:
-                await db.add_food_entry(db.db_pool, user_id, product_name, weight, calories_consumed)
-                await message.answer(f"✅ Добавлено: {escape(product_name)} ({weight}г) - {calories_consumed} ккал.", reply_markup=main_action_keyboard())
-                await state.clear(); await handle_today(message) # Очищаем состояние и показываем сводку
+                added = await db.add_food_entry(db.db_pool, user_id, product_name, weight, calories_consumed, message_idempotency_key(message))
+            except db.DatabaseBusyError: # Запись не сохранена: ответит AdmissionMiddleware, шаг FSM сохраняется для повтора
+                raise
             except Exception as e:
                 logger.error(f"Ошибка сохранения food_entry для {user_id}: {e}", exc_info=True)
-                await message.answer("Ошибка сохранения.", reply_markup=main_action_keyboard()); await state.clear()
+                await message.answer("Ошибка сохранения.", reply_markup=main_action_keyboard()); await state.clear(); return
+            await respond(message, f"✅ Добавлено: {escape(product_name)} ({weight}г) - {calories_consumed} ккал." if added else ALREADY_SAVED_TEXT, reply_markup=main_action_keyboard())
+            await state.clear(); await show_today_after_save(message) # Очищаем состояние и показываем сводку
         else:
             # Если нет подключения к БД
             logger.warning("Пул БД не инициализирован при сохранении (найденный продукт).")
@@ -405,9 +449,10 @@ async def process_calories_or_api(message: Message, state: FSMContext):
             else:
                 # Несколько результатов -> Предлагаем выбор
                 logger.info(f"API -> {len(api_results)} результатов. Предлагаем выбор.")
-                await state.update_data(api_options=api_results)
-                options_keyboard = select_api_product_keyboard(api_results)
-                await message.answer("Я нашел несколько вариантов. Выберите:", reply_markup=options_keyboard)
+                # В состоянии только пары [название, ккал]; кнопка передает индекс варианта
+                api_options = [[result['name'], result['calories']] for result in api_results]
+                options_message = await message.answer("Я нашел несколько вариантов. Выберите:", reply_markup=select_api_product_keyboard(api_options))
+                await state.update_data(api_options=api_options, last_bot_msg_id=options_message.message_id)
                 await state.set_state(AddFood.waiting_for_api_choice)
         else:
             # API ничего не нашло
@@ -436,57 +481,63 @@ async def process_calories_or_api(message: Message, state: FSMContext):
     if db.db_pool:
         try:
             normalized_product_name = await db.add_user_product(db.db_pool, user_id, product_name_original, calories_100g_manual)
-            await db.add_food_entry(db.db_pool, user_id, normalized_product_name, weight, calories_consumed)
-            await message.answer(f"✅ Добавлено: {escape(product_name_original)} ({weight}г) - {calories_consumed} ккал.", reply_markup=main_action_keyboard())
-            await state.clear(); await handle_today(message) # Очистка состояния и показ сводки
+            added = await db.add_food_entry(db.db_pool, user_id, normalized_product_name, weight, calories_consumed, message_idempotency_key(message))
+        except db.DatabaseBusyError: # Запись не сохранена: ответит AdmissionMiddleware, шаг FSM сохраняется для повтора
+            raise
         except Exception as e:
             logger.error(f"Ошибка сохранения БД (ручной ввод) для {user_id}: {e}", exc_info=True)
-            await message.answer("Ошибка сохранения.", reply_markup=main_action_keyboard()); await state.clear()
+            await message.answer("Ошибка сохранения.", reply_markup=main_action_keyboard()); await state.clear(); return
+        await respond(message, f"✅ Добавлено: {escape(product_name_original)} ({weight}г) - {calories_consumed} ккал." if added else ALREADY_SAVED_TEXT, reply_markup=main_action_keyboard())
+        await state.clear(); await show_today_after_save(message) # Очистка состояния и показ сводки
     else:
         logger.warning("Пул БД не инициализирован при ручном вводе.")
         await message.answer("Проблема с БД.", reply_markup=main_action_keyboard()); await state.clear()
 
 
-# Обработка выбора из нескольких вариантов API
-@router.message(StateFilter(AddFood.waiting_for_api_choice), F.text)
-async def process_api_choice(message: Message, state: FSMContext):
+# Обработка выбора из нескольких вариантов API (инлайн-кнопка с индексом варианта)
+@router.callback_query(StateFilter(AddFood.waiting_for_api_choice), ApiChoice.filter())
+async def process_api_choice(callback: CallbackQuery, callback_data: ApiChoice, state: FSMContext):
     """Обрабатывает выбор пользователя из предложенных API вариантов."""
-    user_id = message.from_user.id; selected_option_text = message.text.strip()
+    user_id = callback.from_user.id; message = callback.message
     user_data = await state.get_data(); api_options = user_data.get('api_options')
     # Проверка наличия опций в состоянии
     if not api_options:
         logger.error(f"Ошибка опций API FSM для {user_id}. Сброс.")
-        await state.clear(); await message.answer("Произошла ошибка...", reply_markup=main_action_keyboard()); return
+        await state.clear(); await message.answer("Произошла ошибка...", reply_markup=main_action_keyboard())
+        await callback.answer(); return
+
+    index = callback_data.index
+    if index != MANUAL_INPUT_INDEX and not 0 <= index < len(api_options):
+        logger.warning(f"Некорректный индекс варианта API {index} от {user_id}.")
+        await callback.answer("Пожалуйста, выберите один из предложенных вариантов.", show_alert=True); return
 
-    selected_product = None
-    # Ищем выбранный продукт по тексту кнопки
-    for option in api_options:
-        button_text_part = f"{option['name'][:30]}... ({option['calories']} ккал)" if len(option['name']) > 30 else f"{option['name']} ({option['calories']} ккал)"
-        if selected_option_text == button_text_part: selected_product = option; break
-        button_text_full = f"{option['name']} ({option['calories']} ккал)"
-        if selected_option_text == button_text_full: selected_product = option; break
+    # Убираем кнопки вариантов из сообщения
+    with suppress(TelegramBadRequest):
+        await message.edit_reply_markup(reply_markup=None)
+    await callback.answer()
 
     # Вариант 1: Выбран ручной ввод
-    if selected_option_text == MANUAL_INPUT_TEXT:
+    if index == MANUAL_INPUT_INDEX:
         logger.info(f"Пользователь {user_id} выбрал ручной ввод после списка API.")
         await message.answer("Хорошо, введите калорийность на 100г:", reply_markup=cancel_keyboard())
         # Возвращаемся к состоянию ввода калорий, очищаем опции API
-        await state.set_state(AddFood.waiting_for_calories); await state.update_data(api_options=None); return
+        await state.set_state(AddFood.waiting_for_calories); await state.update_data(api_options=None, last_bot_msg_id=None); return
 
     # Вариант 2: Выбран конкретный продукт
-    if selected_product:
-        selected_calories = selected_product['calories']; selected_name = selected_product['name']
-        logger.info(f"Пользователь {user_id} выбрал вариант API: '{selected_name}' ({selected_calories} ккал). Запрос подтверждения.")
-        # Сохраняем выбор в состояние, очищаем опции
-        await state.update_data(api_calories=selected_calories, api_product_name=selected_name, api_options=None)
-        # Переходим к подтверждению
-        await message.answer(f"Вы выбрали: <b>{escape(selected_name)}</b> ({selected_calories} ккал/100г).\nИспользовать?", reply_markup=confirm_edit_keyboard())
-        await state.set_state(AddFood.waiting_for_api_confirmation)
-    else:
-        # Ввод не соответствует ни одной кнопке
-        logger.warning(f"Некорректный ввод '{selected_option_text}' в состоянии waiting_for_api_choice от {user_id}.")
-        options_keyboard = select_api_product_keyboard(api_options)
-        await message.reply("Пожалуйста, выберите один из предложенных вариантов.", reply_markup=options_keyboard)
+    selected_name, selected_calories = api_options[index]
+    logger.info(f"Пользователь {user_id} выбрал вариант API: '{selected_name}' ({selected_calories} ккал). Запрос подтверждения.")
+    # Сохраняем выбор в состояние, очищаем опции
+    await state.update_data(api_calories=selected_calories, api_product_name=selected_name, api_options=None, last_bot_msg_id=None)
+    # Переходим к подтверждению
+    await message.answer(f"Вы выбрали: <b>{escape(selected_name)}</b> ({selected_calories} ккал/100г).\nИспользовать?", reply_markup=confirm_edit_keyboard())
+    await state.set_state(AddFood.waiting_for_api_confirmation)
+
+
+# Текст вместо нажатия кнопки в состоянии выбора варианта API
+@router.message(StateFilter(AddFood.waiting_for_api_choice), F.text)
+async def process_api_choice_text(message: Message):
+    logger.warning(f"Некорректный ввод '{message.text}' в состоянии waiting_for_api_choice от {message.from_user.id}.")
+    await message.reply("Пожалуйста, выберите один из вариантов кнопкой под сообщением или /cancel")
 
 
 # Обработка подтверждения/редактирования калорий из API
@@ -511,12 +562,14 @@ async def process_api_confirmation(message: Message, state: FSMContext):
         if db.db_pool:
             try:
                 normalized_product_name = await db.add_user_product(db.db_pool, user_id, product_name_to_save, api_calories)
-                await db.add_food_entry(db.db_pool, user_id, normalized_product_name, weight, calories_consumed)
-                await message.answer(f"✅ Добавлено: {escape(product_name_to_save)} ({weight}г) - {calories_consumed} ккал (API).", reply_markup=main_action_keyboard())
-                await state.clear(); await handle_today(message) # Очистка состояния и показ сводки
+                added = await db.add_food_entry(db.db_pool, user_id, normalized_product_name, weight, calories_consumed, message_idempotency_key(message))
+            except db.DatabaseBusyError: # Запись не сохранена: ответит AdmissionMiddleware, шаг FSM сохраняется для повтора
+                raise
             except Exception as e:
                 logger.error(f"Ошибка сохранения подтвержденных API для {user_id}: {e}", exc_info=True)
-                await message.answer("Ошибка сохранения.", reply_markup=main_action_keyboard()); await state.clear()
+                await message.answer("Ошибка сохранения.", reply_markup=main_action_keyboard()); await state.clear(); return
+            await respond(message, f"✅ Добавлено: {escape(product_name_to_save)} ({weight}г) - {calories_consumed} ккал (API)." if added else ALREADY_SAVED_TEXT, reply_markup=main_action_keyboard())
+            await state.clear(); await show_today_after_save(message) # Очистка состояния и показ сводки
         else:
             logger.warning("Пул БД не инициализирован при подтверждении API.")
             await message.answer("Проблема с БД.", reply_markup=main_action_keyboard()); await state.clear()
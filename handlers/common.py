@@ -10,6 +10,7 @@ import database as db
 from .reports import handle_today
 # Импортируем основную клавиатуру
 from keyboards import main_action_keyboard
+from responses import respond
 
 # Настраиваем логирование
 logger = logging.getLogger(__name__)
@@ -26,6 +27,8 @@ async def set_main_menu(bot: Bot):
         BotCommand(command="/today", description="📊 Сводка за сегодня"),
         BotCommand(command="/week", description="📅 Отчет за неделю"),
         BotCommand(command="/month", description="🗓️ Отчет за месяц"),
+        BotCommand(command="/year", description="📈 Отчет за год"),
+        BotCommand(command="/report", description="📈 Отчет за период"),
         BotCommand(command="/settings", description="⚙️ Настройки профиля"),
         BotCommand(command="/setweight", description="⚖️ Указать вес"),
         BotCommand(command="/timezone", description="🕒 Часовой пояс"),
@@ -82,8 +85,8 @@ async def handle_start_command(message: Message, state: FSMContext):
             "пожалуйста, укажите данные вашего профиля в /settings."
         )
 
-    await message.answer(greeting_text)
-    # Показываем сводку за сегодня (она покажет основную клавиатуру)
+    await respond(message, greeting_text)
+    # Показываем сводку за сегодня (она покажет основную клавиатуру) - одним сообщением с приветствием
     await handle_today(message)
 
 
@@ -100,6 +103,8 @@ async def handle_help_command(message: Message):
         "/today - посмотреть, что съедено сегодня и вашу норму калорий.\n"
         "/week - отчет по калориям за последние 7 дней.\n"
         "/month - отчет по калориям за текущий месяц.\n"
+        "/year [год] - помесячный отчет за текущий (или указанный) год.\n"
+        "/report ДД.ММ.ГГГГ ДД.ММ.ГГГГ - отчет по дням за произвольный период.\n"
         "/settings - настроить ваш профиль (рост, вес, пол, цель) для расчета нормы.\n"
         "/setweight - быстро обновить ваш текущий вес.\n"
         "/timezone - установить ваш часовой пояс.\n"
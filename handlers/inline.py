@@ -0,0 +1,125 @@
+import logging
+import re
+from html import escape
+from typing import Optional, Tuple
+
+from aiogram import Router
+from aiogram.types import (
+    ChosenInlineResult, InlineQuery, InlineQueryResultArticle, InlineQueryResultsButton,
+    InputTextMessageContent
+)
+
+import database as db
+from idempotency import update_idempotency_key
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Создаем роутер для обработчиков этого модуля
+router = Router()
+
+# --- Константы ---
+INLINE_RESULTS_LIMIT = 20 # Сколько продуктов показывать в выдаче (максимум Telegram - 50)
+INLINE_CACHE_TIME = 30 # Сколько секунд Telegram хранит выдачу для одинакового запроса пользователя
+DEFAULT_INLINE_WEIGHT = 100 # Вес порции, если в запросе он не указан
+MAX_INLINE_WEIGHT = 10000 # Больше - скорее опечатка, чем порция
+
+# "гречка 150", "гречка 150г", "гречка 150 g" -> ("гречка", 150)
+WEIGHT_SUFFIX_RE = re.compile(r'^(?P<name>.*?)\s+(?P<weight>\d{1,5})\s*(?:г|гр|g)?\.?$', re.IGNORECASE)
+
+
+def parse_inline_query(query: str) -> Tuple[str, int]:
+    """Разбирает запрос вида '<начало названия> [вес]' на название и вес порции в граммах."""
+    query = ' '.join(query.split())
+    match = WEIGHT_SUFFIX_RE.match(query)
+    if match:
+        weight = int(match.group('weight'))
+        if 0 < weight <= MAX_INLINE_WEIGHT:
+            return match.group('name'), weight
+    return query, DEFAULT_INLINE_WEIGHT
+
+
+def make_result_id(product_id: int, weight: int) -> str:
+    """ID результата несет все, что нужно для записи при выборе: продукт и вес."""
+    return f"{product_id}:{weight}"
+
+
+def parse_result_id(result_id: str) -> Optional[Tuple[int, int]]:
+    try:
+        product_id, weight = (int(part) for part in result_id.split(':'))
+    except ValueError:
+        return None
+    if not 0 < weight <= MAX_INLINE_WEIGHT:
+        return None
+    return product_id, weight
+
+
+@router.inline_query()
+async def handle_inline_query(inline_query: InlineQuery):
+    """
+    Поиск по продуктам пользователя прямо в поле ввода (@bot греч 150).
+    Выдача персональная (is_personal) и кэшируется Telegram на INLINE_CACHE_TIME секунд,
+    поэтому повторный ввод того же текста до бота не доходит.
+    """
+    user_id = inline_query.from_user.id
+    name_query, weight = parse_inline_query(inline_query.query)
+
+    products = []
+    if db.db_pool:
+        # Пустой запрос - последние использованные продукты
+        products = await db.search_user_products(db.read_pool(user_id), user_id, name_query, limit=INLINE_RESULTS_LIMIT)
+
+    results = []
+    for product in products:
+        name = product['product_name']; calories_100g = product['calories_per_100g']
+        calories_consumed = round((calories_100g / 100) * weight)
+        results.append(InlineQueryResultArticle(
+            id=make_result_id(product['product_id'], weight),
+            title=f"{name} - {weight}г",
+            description=f"{calories_consumed} ккал ({calories_100g} ккал/100г)",
+            input_message_content=InputTextMessageContent(
+                message_text=f"🍽 {escape(name)} ({weight}г) - {calories_consumed} ккал"
+            ),
+        ))
+    logger.info(f"Inline-поиск '{name_query}' ({weight}г) для {user_id}: найдено {len(results)}.")
+
+    await inline_query.answer(
+        results,
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=True,
+        # Если ничего не нашлось - кнопка перехода в личный чат к обычному добавлению
+        button=None if results else InlineQueryResultsButton(text="➕ Добавить продукт в боте", start_parameter="add"),
+    )
+
+
+@router.chosen_inline_result()
+async def handle_chosen_inline_result(chosen_result: ChosenInlineResult):
+    """
+    Записывает прием пищи при выборе результата inline-поиска.
+    Требует включенного inline feedback (BotFather: /setinlinefeedback).
+    """
+    user_id = chosen_result.from_user.id
+    parsed = parse_result_id(chosen_result.result_id)
+    if parsed is None:
+        logger.warning(f"Некорректный ID inline-результата от {user_id}: {chosen_result.result_id}")
+        return
+    product_id, weight = parsed
+
+    if not db.db_pool:
+        logger.warning("Пул БД не инициализирован при записи inline-результата.")
+        return
+    product = await db.get_user_product_by_id(db.db_pool, user_id, product_id)
+    if not product:
+        logger.warning(f"Inline: продукт ID={product_id} не найден у {user_id}, запись пропущена.")
+        return
+
+    product_name = product['product_name']
+    calories_consumed = round((product['calories_per_100g'] / 100) * weight)
+    try:
+        added = await db.add_food_entry(
+            db.db_pool, user_id, product_name, weight, calories_consumed, update_idempotency_key(user_id)
+        )
+        if added:
+            logger.info(f"Inline: добавлено '{product_name}' ({weight}г, {calories_consumed} ккал) для {user_id}.")
+    except Exception as e:
+        logger.error(f"Ошибка сохранения inline-записи для {user_id}: {e}", exc_info=True)
@@ -1,25 +1,31 @@
 import logging
+from bisect import bisect_right
 # Импортируем необходимые модули для работы с датой/временем и часовыми поясами
 from datetime import datetime, time, date, timedelta
 import pytz
-# defaultdict удобен для группировки по дням
-from collections import defaultdict
 # escape для безопасного вывода текста в HTML-разметке
 from html import escape
 # Импорты aiogram для роутера, фильтров и типов
 from aiogram import Router
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.types import Message
 
-# Импортируем наши модули: функции БД и клавиатуры
+# Импортируем наши модули: функции БД, кэш отчетов и клавиатуры
+import cache
 import database as db
 from keyboards import main_action_keyboard
+from responses import respond
 # utils нам здесь не нужен, т.к. норма уже рассчитана и хранится в БД
 
 # Настраиваем логирование для этого модуля
 logger = logging.getLogger(__name__)
 
 
+def profile_timezone(profile_data) -> str:
+    """Часовой пояс из строки профиля (get_user_profile_data), как в db.get_user_timezone - 'UTC' по умолчанию."""
+    return (profile_data['timezone'] if profile_data else None) or 'UTC'
+
+
 # Критический расчётный функционал (вынесен для юнит-тестов)
 def calculate_average_for_period(total_value: int, period_days: int) -> int:
     """Возвращает среднее значение за полный период (округление до int)."""
@@ -53,24 +59,32 @@ def calculate_total_norm_for_period(
         for record in historical_norms_records
     }
     history_dates_sorted = sorted(norms_dict.keys())
+    period_end_date = period_start_date + timedelta(days=period_days) # не включительно
 
     total_norm_period = 0
     applicable_norm_found_for_any_day = False
 
-    for i in range(period_days):
-        entry_date = period_start_date + timedelta(days=i)
-        applicable_norm = None
-        for history_date in reversed(history_dates_sorted):
-            if history_date <= entry_date:
-                applicable_norm = norms_dict[history_date]
-                break
-
-        if applicable_norm is not None:
-            total_norm_period += applicable_norm
-            applicable_norm_found_for_any_day = True
-        elif current_daily_goal:
-            total_norm_period += current_daily_goal
+    # Норма постоянна между соседними датами истории, поэтому период проходится отрезками:
+    # бинарным поиском находим норму, действующую на первый день, дальше идем по датам изменений.
+    index = bisect_right(history_dates_sorted, period_start_date) - 1
+    if index < 0:
+        # Дни до первой записи истории считаются по текущей норме
+        first_history_date = history_dates_sorted[0]
+        days_before_history = (min(first_history_date, period_end_date) - period_start_date).days
+        if current_daily_goal:
+            total_norm_period += current_daily_goal * days_before_history
             applicable_norm_found_for_any_day = True
+        index = 0
+
+    while index < len(history_dates_sorted) and history_dates_sorted[index] < period_end_date:
+        segment_start = max(history_dates_sorted[index], period_start_date)
+        if index + 1 < len(history_dates_sorted):
+            segment_end = min(history_dates_sorted[index + 1], period_end_date)
+        else:
+            segment_end = period_end_date
+        total_norm_period += norms_dict[history_dates_sorted[index]] * (segment_end - segment_start).days
+        applicable_norm_found_for_any_day = True
+        index += 1
 
     if not applicable_norm_found_for_any_day:
         return 0, 0, False
@@ -78,6 +92,78 @@ def calculate_total_norm_for_period(
     return total_norm_period, round(total_norm_period / period_days), True
 
 
+async def load_calories_by_day(
+    user_id: int, tz_name: str, user_tz, start_date: date, end_date: date
+) -> dict[date, int]:
+    """
+    Возвращает потребление по локальным дням периода (только дни с записями).
+    Закрытые дни берутся из кэша отчетов (недостающие агрегируются в БД и кэшируются),
+    заново считается только открытый день - для сегодняшнего используется кэш сводки /today.
+    """
+    pool = db.read_pool(user_id)
+    calories_by_day: dict[date, int] = {}
+
+    closed_end = min(end_date, cache.last_closed_day(user_tz))
+    if start_date <= closed_end:
+        cached = await cache.get_closed_day_totals(user_id, tz_name, start_date, closed_end)
+        missing = [
+            start_date + timedelta(days=i)
+            for i in range((closed_end - start_date).days + 1)
+            if start_date + timedelta(days=i) not in cached
+        ]
+        if missing:
+            fetched = await db.get_daily_totals(pool, user_id, tz_name, missing[0], missing[-1])
+            fresh = {day: fetched.get(day) for day in missing}
+            await cache.store_closed_day_totals(user_id, tz_name, fresh)
+            cached.update(fresh)
+        calories_by_day.update({day: cals for day, cals in cached.items() if cals is not None})
+
+    open_start = max(start_date, closed_end + timedelta(days=1))
+    if open_start <= end_date:
+        today_local = datetime.now(user_tz).date()
+        if open_start == end_date == today_local:
+            total_today, entries_today = await db.get_todays_summary(pool, user_id, tz_name)
+            if entries_today:
+                calories_by_day[today_local] = total_today
+        else:
+            calories_by_day.update(await db.get_daily_totals(pool, user_id, tz_name, open_start, end_date))
+    return calories_by_day
+
+
+TELEGRAM_MESSAGE_LIMIT = 4096 # Максимальная длина текста одного сообщения Telegram
+MAX_REPORT_DAYS = 366 # Максимальная длина произвольного периода для /report
+REPORT_DATE_FORMATS = ("%d.%m.%Y", "%Y-%m-%d")
+
+
+def split_message(lines: list[str], limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[str]:
+    """Собирает строки в сообщения не длиннее limit символов (строки не разрываются)."""
+    pages: list[str] = []
+    current: list[str] = []
+    current_len = 0
+    for line in lines:
+        line = line[:limit]
+        added_len = len(line) + (1 if current else 0)
+        if current and current_len + added_len > limit:
+            pages.append("\n".join(current))
+            current, current_len = [], 0
+            added_len = len(line)
+        current.append(line)
+        current_len += added_len
+    if current:
+        pages.append("\n".join(current))
+    return pages
+
+
+def parse_report_date(value: str) -> date | None:
+    """Разбирает дату в формате ДД.ММ.ГГГГ или ГГГГ-ММ-ДД."""
+    for fmt in REPORT_DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
 # Словарь с русскими названиями месяцев для красивого вывода
 RUSSIAN_MONTHS = {
     1: "Январь", 2: "Февраль", 3: "Март", 4: "Апрель",
@@ -92,7 +178,7 @@ router = Router()
 async def handle_today(message: Message):
     """Обработчик команды /today. Показывает сводку, норму и мотивацию."""
     user_id = message.from_user.id
-    logger.info(f"Пользователь {user_id} запросил сводку за сегодня.")
+    logger.info("Пользователь %s запросил сводку за сегодня.", user_id)
 
     # Проверяем наличие пула соединений с БД
     if not db.db_pool:
@@ -103,8 +189,9 @@ async def handle_today(message: Message):
         return
 
     # --- Получаем часовой пояс и данные профиля пользователя ---
-    tz_name = await db.get_user_timezone(db.db_pool, user_id)
-    profile_data = await db.get_user_profile_data(db.db_pool, user_id) # Получаем профиль
+    # Один запрос: часовой пояс берется из того же профиля
+    profile_data = await db.get_user_profile_data(db.read_pool(user_id), user_id)
+    tz_name = profile_timezone(profile_data)
 
     try:
         # Пытаемся создать объект часового пояса
@@ -117,11 +204,8 @@ async def handle_today(message: Message):
         )
         user_tz = pytz.utc # Используем UTC как fallback
 
-    # Получаем записи о еде за сегодня с учетом часового пояса
-    entries = await db.get_todays_food_entries(db.db_pool, user_id, tz_name)
-
-    # Считаем общую калорийность потребленную за сегодня
-    total_calories_consumed = sum(entry['calories_consumed'] for entry in entries)
+    # Получаем сумму и записи о еде за сегодня с учетом часового пояса (из кэша или БД)
+    total_calories_consumed, entries = await db.get_todays_summary(db.read_pool(user_id), user_id, tz_name)
 
     # Формируем список продуктов
     entries_text_parts = []
@@ -205,13 +289,25 @@ async def handle_today(message: Message):
         entries_text
     ])
 
-    # Отправляем собранное сообщение
-    await message.answer(
+    # Отправляем собранное сообщение (объединяется с предыдущим ответом, например "✅ Добавлено")
+    await respond(
+        message,
         "\n".join(part for part in final_message_parts if part),
         reply_markup=main_action_keyboard()
     )
 
 
+async def show_today_after_save(message: Message):
+    """
+    Сводка после успешной записи. Перегрузка БД здесь не повод отвечать "попробуйте еще раз":
+    запись уже сохранена и состояние FSM сброшено, повтор создал бы вторую запись.
+    """
+    try:
+        await handle_today(message)
+    except db.DatabaseBusyError as e:
+        logger.warning(f"{e}: сводка после сохранения для {message.from_user.id} пропущена.")
+        await message.answer("Сводка за сегодня сейчас недоступна из-за нагрузки - посмотрите ее позже через /today.")
+
 # --- Отчет за неделю (с исторической нормой) ---
 @router.message(Command("week"))
 async def handle_week(message: Message):
@@ -225,8 +321,8 @@ async def handle_week(message: Message):
         return
 
     # Получаем пояс и текущий профиль
-    tz_name = await db.get_user_timezone(db.db_pool, user_id)
-    profile_data = await db.get_user_profile_data(db.db_pool, user_id)
+    profile_data = await db.get_user_profile_data(db.read_pool(user_id), user_id)
+    tz_name = profile_timezone(profile_data)
     current_daily_goal = profile_data.get('daily_calorie_goal') if profile_data else None
 
     try:
@@ -237,37 +333,30 @@ async def handle_week(message: Message):
         )
         user_tz = pytz.utc
 
-    # Получаем записи о еде за период
+    # Определяем границы периода
     num_days_report = 7
-    entries = await db.get_last_n_days_entries(
-        db.db_pool, user_id, tz_name, days=num_days_report
+    report_end_date = datetime.now(user_tz).date()
+    report_start_date = report_end_date - timedelta(days=num_days_report - 1)
+
+    # Потребление по локальным датам (закрытые дни - из кэша отчетов)
+    calories_by_day = await load_calories_by_day(
+        user_id, tz_name, user_tz, report_start_date, report_end_date
     )
 
-    if not entries:
+    if not calories_by_day:
         await message.answer(
             f"📅 За последние {num_days_report} дней записей не найдено.",
             reply_markup=main_action_keyboard()
         )
         return
 
-    # Группируем потребление по локальным датам
-    calories_by_day = defaultdict(int)
-    for entry in entries:
-        entry_local_time = entry['entry_timestamp'].astimezone(user_tz)
-        entry_date = entry_local_time.date()
-        calories_by_day[entry_date] += entry['calories_consumed']
-
     total_calories_consumed = sum(calories_by_day.values())
     average_calories_consumed = calculate_average_for_period(total_calories_consumed, num_days_report)
 
     # --- Расчет исторической нормы ---
-    # Определяем границы периода
-    report_end_date = datetime.now(user_tz).date()
-    report_start_date = report_end_date - timedelta(days=num_days_report - 1)
-
     # Получаем историю
     historical_norms_records = await db.get_historical_norms(
-        db.db_pool, user_id, report_start_date, report_end_date
+        db.read_pool(user_id), user_id, report_start_date, report_end_date
     )
 
     total_norm_period, average_norm_period, norm_calculated = calculate_total_norm_for_period(
@@ -310,7 +399,7 @@ async def handle_week(message: Message):
 
 
 # --- Отчет за месяц (с исторической нормой) ---
-@router.message(Command("month"))
+@router.message(Command("month"), flags={"heavy": True})
 async def handle_month(message: Message):
     """Обработчик команды /month. Показывает отчет за текущий месяц с исторической нормой."""
     user_id = message.from_user.id
@@ -322,8 +411,8 @@ async def handle_month(message: Message):
         return
 
     # Получаем пояс и текущий профиль
-    tz_name = await db.get_user_timezone(db.db_pool, user_id)
-    profile_data = await db.get_user_profile_data(db.db_pool, user_id)
+    profile_data = await db.get_user_profile_data(db.read_pool(user_id), user_id)
+    tz_name = profile_timezone(profile_data)
     current_daily_goal = profile_data.get('daily_calorie_goal') if profile_data else None
 
     try:
@@ -334,36 +423,31 @@ async def handle_month(message: Message):
         )
         user_tz = pytz.utc
 
-    # Получаем записи о еде за месяц
-    entries = await db.get_current_month_entries(db.db_pool, user_id, tz_name)
+    # Определяем границы месяца
+    now_local = datetime.now(user_tz)
+    report_start_date = date(now_local.year, now_local.month, 1)
+    report_end_date = now_local.date() # Конец - сегодняшний день
+    days_in_period = now_local.day
+
+    # Потребление по дням (закрытые дни - из кэша отчетов)
+    calories_by_day = await load_calories_by_day(
+        user_id, tz_name, user_tz, report_start_date, report_end_date
+    )
 
-    if not entries:
+    if not calories_by_day:
         await message.answer(
             f"🗓️ За текущий месяц записей пока нет.",
             reply_markup=main_action_keyboard()
         )
         return
 
-    # Группируем потребление по дням
-    calories_by_day = defaultdict(int)
-    for entry in entries:
-        entry_local_time = entry['entry_timestamp'].astimezone(user_tz)
-        entry_date = entry_local_time.date()
-        calories_by_day[entry_date] += entry['calories_consumed']
-
     total_calories_consumed = sum(calories_by_day.values())
-
-    # Определяем границы месяца
-    now_local = datetime.now(user_tz)
-    report_start_date = date(now_local.year, now_local.month, 1)
-    report_end_date = now_local.date() # Конец - сегодняшний день
-    days_in_period = now_local.day
     average_calories_consumed = calculate_average_for_period(total_calories_consumed, days_in_period)
 
     # --- Расчет исторической нормы ---
     # Получаем историю
     historical_norms_records = await db.get_historical_norms(
-        db.db_pool, user_id, report_start_date, report_end_date
+        db.read_pool(user_id), user_id, report_start_date, report_end_date
     )
 
     total_norm_period, average_norm_period, norm_calculated = calculate_total_norm_for_period(
@@ -399,3 +483,167 @@ async def handle_month(message: Message):
 
     # Отправляем отчет
     await message.answer("\n".join(report_parts), reply_markup=main_action_keyboard())
+
+
+# --- Отчеты за произвольный период и за год (по дневным агрегатам) ---
+async def send_range_report(
+    message: Message, user_id: int, start_date: date | None, end_date: date | None,
+    title: str, by_month: bool
+):
+    """
+    Строит отчет за [start_date, end_date] по дневным суммам из кэша отчетов
+    (помесячно или по дням) и отправляет его, разбивая на сообщения по лимиту Telegram.
+    None в границах означает начало/конец текущего года в часовом поясе пользователя.
+    """
+    profile_data = await db.get_user_profile_data(db.read_pool(user_id), user_id)
+    current_daily_goal = profile_data.get('daily_calorie_goal') if profile_data else None
+    tz_name = profile_timezone(profile_data)
+    try:
+        user_tz = pytz.timezone(tz_name)
+    except pytz.UnknownTimeZoneError:
+        logger.warning(f"Некорректный TZ '{tz_name}' для {user_id} в отчете. Используется UTC.")
+        user_tz = pytz.utc
+
+    today_local = datetime.now(user_tz).date()
+    start_date = start_date or date(today_local.year, 1, 1)
+    end_date = min(end_date or today_local, today_local) # Будущие дни не показываем
+    if start_date > end_date:
+        await message.answer("За этот период данных еще нет.", reply_markup=main_action_keyboard())
+        return
+    period_days = (end_date - start_date).days + 1
+
+    calories_by_day = await load_calories_by_day(user_id, tz_name, user_tz, start_date, end_date)
+    if not calories_by_day:
+        await message.answer(
+            f"📈 За период {start_date.strftime('%d.%m.%Y')} - {end_date.strftime('%d.%m.%Y')} записей не найдено.",
+            reply_markup=main_action_keyboard()
+        )
+        return
+
+    historical_norms_records = await db.get_historical_norms(
+        db.read_pool(user_id), user_id, start_date, end_date
+    )
+
+    report_lines = [f"📈 <b>{title} ({tz_name}):</b>\n"]
+    if by_month:
+        report_lines.append("По месяцам (потреблено / норма):")
+        month_start = start_date
+        while month_start <= end_date:
+            next_month = date(month_start.year + 1, 1, 1) if month_start.month == 12 else date(month_start.year, month_start.month + 1, 1)
+            month_end = min(end_date, next_month - timedelta(days=1))
+            month_days = (month_end - month_start).days + 1
+            month_total = sum(
+                cals for day, cals in calories_by_day.items() if month_start <= day <= month_end
+            )
+            month_norm, _, month_norm_calculated = calculate_total_norm_for_period(
+                period_start_date=month_start,
+                period_days=month_days,
+                historical_norms_records=historical_norms_records,
+                current_daily_goal=current_daily_goal,
+            )
+            month_name = RUSSIAN_MONTHS.get(month_start.month, f"Месяц {month_start.month}")
+            norm_text = f" / ~{month_norm}" if month_norm_calculated else ""
+            report_lines.append(
+                f"- {month_name} {month_start.year}: {month_total}{norm_text} ккал "
+                f"(~{calculate_average_for_period(month_total, month_days)} ккал/день)"
+            )
+            month_start = next_month
+    else:
+        report_lines.append("По дням (потреблено):")
+        for i in range(period_days):
+            current_date = start_date + timedelta(days=i)
+            report_lines.append(f"- {current_date.strftime('%d.%m.%Y')}: {calories_by_day.get(current_date, 0)} ккал")
+
+    # Норма за весь период - тем же расчетом, что и в /week, /month
+    total_calories_consumed = sum(calories_by_day.values())
+    average_calories_consumed = calculate_average_for_period(total_calories_consumed, period_days)
+    total_norm_period, average_norm_period, norm_calculated = calculate_total_norm_for_period(
+        period_start_date=start_date,
+        period_days=period_days,
+        historical_norms_records=historical_norms_records,
+        current_daily_goal=current_daily_goal,
+    )
+    report_lines.append(f"\n--------------------")
+    if norm_calculated:
+        report_lines.append(
+            f"Потреблено всего: <b>{total_calories_consumed}</b> ккал "
+            f"(при норме ~{total_norm_period} ккал)"
+        )
+        report_lines.append(
+            f"Среднесуточное: <b>{average_calories_consumed}</b> ккал "
+            f"(при норме ~{average_norm_period} ккал)"
+        )
+    else:
+        report_lines.append(f"Потреблено всего: <b>{total_calories_consumed}</b> ккал")
+        report_lines.append(
+            f"Среднесуточное: <b>{average_calories_consumed}</b> ккал "
+            f"(за {period_days} дн.)"
+        )
+        report_lines.append(f"<i>(Норма не рассчитана. Заполните профиль в /settings)</i>")
+
+    # Длинный отчет отправляем несколькими сообщениями, клавиатура - у последнего
+    pages = split_message(report_lines)
+    for page_number, page in enumerate(pages, start=1):
+        await message.answer(
+            page, reply_markup=main_action_keyboard() if page_number == len(pages) else None
+        )
+
+
+@router.message(Command("report"), flags={"heavy": True})
+async def handle_report(message: Message, command: CommandObject):
+    """Обработчик команды /report <с> <по>. Отчет за произвольный период (до MAX_REPORT_DAYS дней)."""
+    user_id = message.from_user.id
+    logger.info(f"Пользователь {user_id} запросил отчет за период: {command.args}")
+
+    if not db.db_pool:
+        logger.warning("Пул БД не инициализирован для /report.")
+        await message.answer("Проблема с БД.")
+        return
+
+    args = (command.args or "").split()
+    dates = [parse_report_date(arg) for arg in args]
+    if len(dates) != 2 or None in dates:
+        await message.answer(
+            "Укажите период: <code>/report 01.01.2026 31.03.2026</code>",
+            reply_markup=main_action_keyboard()
+        )
+        return
+    start_date, end_date = dates
+    if start_date > end_date:
+        start_date, end_date = end_date, start_date
+    if (end_date - start_date).days + 1 > MAX_REPORT_DAYS:
+        await message.answer(
+            f"Период слишком длинный (максимум {MAX_REPORT_DAYS} дн.). Для отчета за год используйте /year.",
+            reply_markup=main_action_keyboard()
+        )
+        return
+
+    await send_range_report(
+        message, user_id, start_date, end_date,
+        title=f"Отчет за {start_date.strftime('%d.%m.%Y')} - {end_date.strftime('%d.%m.%Y')}",
+        by_month=False
+    )
+
+
+@router.message(Command("year"), flags={"heavy": True})
+async def handle_year(message: Message, command: CommandObject):
+    """Обработчик команды /year [ГГГГ]. Помесячный отчет за текущий (или указанный) год."""
+    user_id = message.from_user.id
+    logger.info(f"Пользователь {user_id} запросил отчет за год: {command.args}")
+
+    if not db.db_pool:
+        logger.warning("Пул БД не инициализирован для /year.")
+        await message.answer("Проблема с БД.")
+        return
+
+    year_arg = (command.args or "").strip()
+    if year_arg:
+        if not year_arg.isdigit() or not (2000 <= int(year_arg) <= 2100):
+            await message.answer("Укажите год, например: <code>/year 2025</code>", reply_markup=main_action_keyboard())
+            return
+        year = int(year_arg)
+        start_date, end_date, title = date(year, 1, 1), date(year, 12, 31), f"Отчет за {year} год"
+    else:
+        start_date, end_date, title = None, None, "Отчет за текущий год"
+
+    await send_range_report(message, user_id, start_date, end_date, title=title, by_month=True)
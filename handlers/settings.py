@@ -15,13 +15,13 @@ from states import Settings # Используем состояния для н
 from keyboards import (
     cancel_keyboard, main_action_keyboard, settings_main_keyboard,
     select_goal_keyboard, select_gender_keyboard,
-    SETTINGS_ACTION_CALLBACK_PREFIX, GENDER_SELECT_CALLBACK_PREFIX,
-    GOAL_SELECT_CALLBACK_PREFIX, CANCEL_TEXT,
-    SETTINGS_SHOW_MENU_ACTION # Импортируем новое действие
+    SettingsAction, GoalSelect, GenderSelect, CANCEL_TEXT,
+    SETTINGS_SHOW_MENU_ACTION, SettingsMenuAction, GOAL_VALUES, GENDER_VALUES
 )
 import database as db
 import utils # Наш модуль с расчетами
-from .reports import handle_today # Для показа сводки после
+from responses import respond, respond_edit
+from .reports import handle_today, show_today_after_save # Для показа сводки после
 
 # Настраиваем логирование
 logger = logging.getLogger(__name__)
@@ -45,7 +45,7 @@ async def recalculate_and_save_goal(user_id: int, state: FSMContext):
         logger.error(f"Нет подключения к БД для пересчета нормы {user_id}")
         return None
 
-    profile_data = await db.get_user_profile_data(db.db_pool, user_id)
+    profile_data = await db.get_user_profile_data(db.read_pool(user_id), user_id)
     if not profile_data:
         logger.warning(f"Нет данных профиля для пересчета нормы {user_id}")
         await db.update_user_daily_goal(db.db_pool, user_id, None)
@@ -103,6 +103,16 @@ async def recalculate_and_save_goal(user_id: int, state: FSMContext):
         return None
 
 
+def remember_keyboard_message(state: FSMContext):
+    """
+    on_sent для respond(): сохраняет id сообщения с инлайн-клавиатурой настроек в last_bot_msg_id,
+    как AddFood, чтобы fsm_expiry убрал клавиатуру при сбросе брошенного сценария.
+    """
+    async def remember(bot_message: Message):
+        await state.update_data(last_bot_msg_id=bot_message.message_id)
+    return remember
+
+
 # --- Функция для отображения главного меню настроек ---
 async def show_settings_menu(
     message_or_callback: Message | CallbackQuery, state: FSMContext
@@ -112,11 +122,7 @@ async def show_settings_menu(
     с кнопками для их изменения.
     """
     user_id = message_or_callback.from_user.id
-    # Определяем метод ответа (новое сообщение или редактирование)
-    if isinstance(message_or_callback, Message):
-        answer_method = message_or_callback.answer
-    else: # CallbackQuery
-        answer_method = message_or_callback.message.answer
+    if isinstance(message_or_callback, CallbackQuery):
         # Отвечаем на callback, чтобы убрать "часики"
         await message_or_callback.answer()
 
@@ -129,7 +135,7 @@ async def show_settings_menu(
     current_norm_text = "Не рассчитана"
 
     if db.db_pool:
-        profile_data = await db.get_user_profile_data(db.db_pool, user_id)
+        profile_data = await db.get_user_profile_data(db.read_pool(user_id), user_id)
         if profile_data:
             goal = profile_data.get('goal')
             if goal == 'deficit': current_goal_text = "📉 Дефицит"
@@ -169,18 +175,18 @@ async def show_settings_menu(
         f"Выберите, что хотите изменить:"
     )
 
-    # Отправляем или редактируем сообщение
+    # Для кнопки меню заменяем сообщение с кнопкой (вместе с "✅ ... обновлен!", если он есть),
+    # для текстового ввода отправляем новое сообщение
     if isinstance(message_or_callback, CallbackQuery):
-         with suppress(TelegramBadRequest): # Игнорируем ошибку
-              await message_or_callback.message.edit_text(
-                  settings_text,
-                  reply_markup=settings_main_keyboard()
-              )
-              await state.set_state(Settings.waiting_for_action)
-              return # Выходим после успешного редактирования
-
-    # Отправляем новое сообщение
-    await answer_method(settings_text, reply_markup=settings_main_keyboard())
+        await respond_edit(
+            message_or_callback.message, settings_text, reply_markup=settings_main_keyboard(),
+            on_sent=remember_keyboard_message(state)
+        )
+    else:
+        await respond(
+            message_or_callback, settings_text, reply_markup=settings_main_keyboard(),
+            on_sent=remember_keyboard_message(state)
+        )
     await state.set_state(Settings.waiting_for_action)
 
 
@@ -205,12 +211,12 @@ async def handle_setweight_command(message: Message, state: FSMContext):
 
 # --- Обработчики CallbackQuery для основного меню настроек ---
 @router.callback_query(
-    F.data.startswith(SETTINGS_ACTION_CALLBACK_PREFIX),
+    SettingsAction.filter(),
     StateFilter(Settings.waiting_for_action)
 )
-async def handle_settings_action(callback: CallbackQuery, state: FSMContext):
+async def handle_settings_action(callback: CallbackQuery, callback_data: SettingsAction, state: FSMContext):
     """Обрабатывает нажатия кнопок в главном меню настроек И возврат из подменю."""
-    action = callback.data.split(":")[1]
+    action = callback_data.action
     user_id = callback.from_user.id
     message = callback.message
 
@@ -221,7 +227,7 @@ async def handle_settings_action(callback: CallbackQuery, state: FSMContext):
         return # Выходим, т.к. действие выполнено
 
     # Обработка кнопки "Закрыть настройки"
-    if action == "back":
+    if action == SettingsMenuAction.CLOSE:
         logger.info(f"Пользователь {user_id} нажал 'Закрыть настройки'.")
         with suppress(TelegramBadRequest):
             await message.edit_reply_markup(reply_markup=None)
@@ -235,64 +241,65 @@ async def handle_settings_action(callback: CallbackQuery, state: FSMContext):
         await message.edit_reply_markup(reply_markup=None)
 
     # Обработка остальных действий
-    if action == "change_goal":
+    if action == SettingsMenuAction.GOAL:
         logger.info(f"Пользователь {user_id} выбрал изменить цель.")
-        await message.answer(
+        bot_message = await message.answer(
             "Выберите вашу основную цель:", reply_markup=select_goal_keyboard()
         )
+        await state.update_data(last_bot_msg_id=bot_message.message_id)
         await state.set_state(Settings.waiting_for_action)
-    elif action == "change_gender":
+    elif action == SettingsMenuAction.GENDER:
         logger.info(f"Пользователь {user_id} выбрал изменить пол.")
-        await message.answer(
+        bot_message = await message.answer(
             "Выберите ваш пол:", reply_markup=select_gender_keyboard()
         )
+        await state.update_data(last_bot_msg_id=bot_message.message_id)
         await state.set_state(Settings.waiting_for_action)
-    elif action == "change_height":
+    elif action == SettingsMenuAction.HEIGHT:
         logger.info(f"Пользователь {user_id} выбрал изменить рост.")
         await message.answer(
             "Введите ваш рост в сантиметрах (например, 180):",
             reply_markup=cancel_keyboard()
         )
+        await state.update_data(last_bot_msg_id=None) # Клавиатура меню уже убрана, дальше ввод текстом
         await state.set_state(Settings.waiting_for_height)
-    elif action == "change_weight":
+    elif action == SettingsMenuAction.WEIGHT:
         logger.info(f"Пользователь {user_id} выбрал изменить вес.")
         await message.answer(
             "Введите ваш текущий вес в килограммах (например, 75.5):",
             reply_markup=cancel_keyboard()
         )
+        await state.update_data(last_bot_msg_id=None)
         await state.set_state(Settings.waiting_for_weight)
 
     await callback.answer()
 
 # --- Обработчики CallbackQuery для выбора цели и пола ---
 @router.callback_query(
-    F.data.startswith(GOAL_SELECT_CALLBACK_PREFIX),
+    GoalSelect.filter(),
     StateFilter(Settings.waiting_for_action)
 )
-async def handle_goal_selection(callback: CallbackQuery, state: FSMContext):
+async def handle_goal_selection(callback: CallbackQuery, callback_data: GoalSelect, state: FSMContext):
     """Обрабатывает выбор цели."""
-    goal = callback.data.split(":")[1]
+    goal_to_save = GOAL_VALUES[callback_data.goal]
     user_id = callback.from_user.id
     message = callback.message
 
-    with suppress(TelegramBadRequest):
-        await message.edit_reply_markup(reply_markup=None)
-
-    goal_to_save = goal if goal != "none" else None
-
     if db.db_pool:
         success = await db.update_user_profile_field(
             db.db_pool, user_id, "goal", goal_to_save
         )
         if success:
-            logger.info(f"Цель для {user_id} установлена на '{goal}'. Пересчет нормы...")
+            logger.info(f"Цель для {user_id} установлена на '{goal_to_save}'. Пересчет нормы...")
             await recalculate_and_save_goal(user_id, state)
-            await message.answer(f"✅ Цель обновлена!")
-            await show_settings_menu(callback, state)
+            await respond(message, f"✅ Цель обновлена!")
+            await show_settings_menu(callback, state) # Меню заменит сообщение с выбором цели
         else:
-            await message.answer("Не удалось обновить цель.")
+            await respond(message, "Не удалось обновить цель.")
             await show_settings_menu(callback, state)
     else:
+        with suppress(TelegramBadRequest):
+            await message.edit_reply_markup(reply_markup=None)
         await message.answer("Ошибка подключения к БД.")
         await state.clear()
         await handle_today(message)
@@ -300,18 +307,15 @@ async def handle_goal_selection(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 @router.callback_query(
-    F.data.startswith(GENDER_SELECT_CALLBACK_PREFIX),
+    GenderSelect.filter(),
     StateFilter(Settings.waiting_for_action)
 )
-async def handle_gender_selection(callback: CallbackQuery, state: FSMContext):
+async def handle_gender_selection(callback: CallbackQuery, callback_data: GenderSelect, state: FSMContext):
     """Обрабатывает выбор пола."""
-    gender = callback.data.split(":")[1]
+    gender = GENDER_VALUES[callback_data.gender]
     user_id = callback.from_user.id
     message = callback.message
 
-    with suppress(TelegramBadRequest):
-        await message.edit_reply_markup(reply_markup=None)
-
     if db.db_pool:
         success = await db.update_user_profile_field(
             db.db_pool, user_id, "gender", gender
@@ -319,12 +323,14 @@ async def handle_gender_selection(callback: CallbackQuery, state: FSMContext):
         if success:
             logger.info(f"Пол для {user_id} установлен на '{gender}'. Пересчет нормы...")
             await recalculate_and_save_goal(user_id, state)
-            await message.answer(f"✅ Пол обновлен!")
-            await show_settings_menu(callback, state)
+            await respond(message, f"✅ Пол обновлен!")
+            await show_settings_menu(callback, state) # Меню заменит сообщение с выбором пола
         else:
-            await message.answer("Не удалось обновить пол.")
+            await respond(message, "Не удалось обновить пол.")
             await show_settings_menu(callback, state)
     else:
+        with suppress(TelegramBadRequest):
+            await message.edit_reply_markup(reply_markup=None)
         await message.answer("Ошибка подключения к БД.")
         await state.clear()
         await handle_today(message)
@@ -353,7 +359,8 @@ async def process_height_input(message: Message, state: FSMContext):
         if success:
             logger.info(f"Рост для {user_id} установлен на {height} см. Пересчет нормы...")
             await recalculate_and_save_goal(user_id, state)
-            await message.answer(f"✅ Рост обновлен!", reply_markup=ReplyKeyboardRemove())
+            # Убрать reply-клавиатуру и показать инлайн-меню одним сообщением нельзя - здесь два сообщения
+            await respond(message, f"✅ Рост обновлен!", reply_markup=ReplyKeyboardRemove())
             await show_settings_menu(message, state)
         else:
             await message.answer(
@@ -390,7 +397,7 @@ async def process_weight_input(message: Message, state: FSMContext):
         if success:
             logger.info(f"Вес для {user_id} установлен на {weight} кг. Пересчет нормы...")
             await recalculate_and_save_goal(user_id, state)
-            await message.answer(f"✅ Вес обновлен!", reply_markup=ReplyKeyboardRemove())
+            await respond(message, f"✅ Вес обновлен!", reply_markup=ReplyKeyboardRemove())
             await show_settings_menu(message, state)
         else:
             await message.answer(
@@ -427,7 +434,7 @@ async def handle_timezone_command(message: Message, state: FSMContext):
     if not db.db_pool:
         await message.answer("Проблема с БД.", reply_markup=main_action_keyboard())
         return
-    current_tz = await db.get_user_timezone(db.db_pool, user_id)
+    current_tz = await db.get_user_timezone(db.read_pool(user_id), user_id)
     await message.answer(
         f"Ваш текущий пояс: <b>{current_tz}</b>\n\n"
         f"Введите новый (напр., <code>Europe/Berlin</code>) или /cancel.\n"
@@ -451,18 +458,21 @@ async def process_timezone_input(message: Message, state: FSMContext):
         if db.db_pool:
             try:
                 await db.update_user_timezone_db(db.db_pool, user_id, timezone_input)
-                await message.answer(
-                    f"✅ Пояс установлен: <b>{timezone_input}</b>",
-                    reply_markup=main_action_keyboard()
-                )
-                await state.clear()
-                await handle_today(message)
+            except db.DatabaseBusyError: # Пояс не сохранен: ответит AdmissionMiddleware, шаг FSM сохраняется
+                raise
             except Exception as e:
                 logger.error(f"Ошибка обновления TZ в БД для {user_id}: {e}", exc_info=True)
                 await message.answer(
                     "Ошибка сохранения. Попробуйте еще раз.",
                     reply_markup=cancel_keyboard()
                 )
+                return
+            await respond(
+                message, f"✅ Пояс установлен: <b>{timezone_input}</b>",
+                reply_markup=main_action_keyboard()
+            )
+            await state.clear()
+            await show_today_after_save(message)
         else:
             logger.error("Пул БД не инициализирован при обновлении TZ.")
             await message.answer("Проблема с БД.", reply_markup=main_action_keyboard())
@@ -487,8 +497,8 @@ async def process_timezone_input(message: Message, state: FSMContext):
 async def cancel_timezone_handler(message: Message, state: FSMContext):
     logger.info(f"Пользователь {message.from_user.id} отменил установку часового пояса.")
     await state.clear()
-    await message.answer(
-        "Установка часового пояса отменена.", reply_markup=main_action_keyboard()
+    await respond(
+        message, "Установка часового пояса отменена.", reply_markup=main_action_keyboard()
     )
     await handle_today(message)
 
@@ -0,0 +1,168 @@
+"""
+Проверки здоровья бота для оркестратора (эндпоинты на сервере метрик, см. metrics.create_app).
+
+- GET /healthz (liveness): процесс жив и опрашивает Telegram. Падает (503), если успешного
+  getUpdates не было дольше HEALTH_POLL_STALE_SECONDS - цикл опроса завис, нужен перезапуск.
+- GET /readyz (readiness): бот может принимать нагрузку. Падает (503), если основной пул БД
+  исчерпан (нет свободных соединений при максимальном размере) или не отвечает на SELECT 1,
+  Redis FSM не отвечает на PING, либо цикл событий отстает дольше HEALTH_MAX_LOOP_LAG_MS.
+  Состояние предохранителя OFF и время с последнего обработанного апдейта только показываются:
+  без OFF бот работает (ручной ввод), а тишина в чате - не признак неготовности.
+Оба эндпоинта отвечают JSON с подробностями по каждой проверке.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import GetUpdates, TelegramMethod
+from aiogram.types import TelegramObject
+from aiohttp import web
+
+try:
+    from aiogram.fsm.storage.redis import RedisStorage
+except ImportError:  # pragma: no cover - зависит от установленного extra redis
+    RedisStorage = None
+
+import circuit_breaker
+import config
+import database as db
+import loop_monitor
+from fsm_cache import UpdateCachedStorage
+
+logger = logging.getLogger(__name__)
+
+# time.monotonic() запуска, последнего успешного getUpdates и последнего обработанного апдейта
+_started_at: Optional[float] = None
+_last_poll_at: Optional[float] = None
+_last_update_at: Optional[float] = None
+_fsm_storage = None
+
+
+class PollingHeartbeatMiddleware(BaseRequestMiddleware):
+    """Request middleware сессии бота: отмечает каждый успешный getUpdates."""
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        global _last_poll_at
+        result = await make_request(bot, method)
+        if isinstance(method, GetUpdates):
+            _last_poll_at = time.monotonic()
+        return result
+
+
+class UpdateActivityMiddleware(BaseMiddleware):
+    """Outer middleware апдейтов: время последнего обработанного апдейта."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        global _last_update_at
+        try:
+            return await handler(event, data)
+        finally:
+            _last_update_at = time.monotonic()
+
+
+async def init_health(dispatcher: Dispatcher):
+    """Startup-обработчик: запоминает хранилище FSM и время запуска."""
+    global _started_at, _fsm_storage
+    _started_at = time.monotonic()
+    _fsm_storage = dispatcher.storage
+
+
+def _age(moment: Optional[float], now: float) -> Optional[float]:
+    return round(now - moment, 3) if moment is not None else None
+
+
+def liveness(now: Optional[float] = None) -> Tuple[bool, Dict[str, Any]]:
+    """Жив ли цикл опроса. До первого getUpdates отсчет идет от запуска."""
+    now = time.monotonic() if now is None else now
+    reference = _last_poll_at if _last_poll_at is not None else _started_at
+    poll_age = _age(reference, now)
+    ok = poll_age is None or poll_age <= config.HEALTH_POLL_STALE_SECONDS
+    return ok, {
+        "last_poll_age": _age(_last_poll_at, now),
+        "last_update_age": _age(_last_update_at, now),
+        "loop_lag": round(loop_monitor.loop_lag_stats["last_lag"], 4),
+    }
+
+
+def pool_status(pool) -> Optional[Dict[str, Any]]:
+    """Размер, занятые и свободные соединения пула; saturated - свободных нет и расти некуда."""
+    if pool is None:
+        return None
+    size, idle, max_size = pool.get_size(), pool.get_idle_size(), pool.get_max_size()
+    return {
+        "size": size,
+        "idle": idle,
+        "used": size - idle,
+        "max": max_size,
+        "saturated": idle == 0 and size >= max_size,
+    }
+
+
+async def _check_database() -> Dict[str, Any]:
+    status = pool_status(db.db_pool)
+    if status is None:
+        return {"ok": False, "error": "пул не создан"}
+    if status["saturated"]:
+        return {"ok": False, **status}
+    try:
+        async with db.db_pool.acquire(timeout=config.HEALTH_CHECK_TIMEOUT) as connection:
+            await asyncio.wait_for(connection.fetchval("SELECT 1"), config.HEALTH_CHECK_TIMEOUT)
+    except Exception as e:
+        return {"ok": False, "error": f"{type(e).__name__}: {e}", **status}
+    return {"ok": True, **status}
+
+
+async def _check_fsm_storage() -> Dict[str, Any]:
+    storage = _fsm_storage.storage if isinstance(_fsm_storage, UpdateCachedStorage) else _fsm_storage
+    if RedisStorage is None or not isinstance(storage, RedisStorage):
+        return {"ok": True, "backend": type(storage).__name__ if storage is not None else None}
+    try:
+        await asyncio.wait_for(storage.redis.ping(), config.HEALTH_CHECK_TIMEOUT)
+    except Exception as e:
+        return {"ok": False, "backend": "redis", "error": f"{type(e).__name__}: {e}"}
+    return {"ok": True, "backend": "redis"}
+
+
+async def readiness() -> Tuple[bool, Dict[str, Any]]:
+    """Готов ли бот к нагрузке: БД, Redis FSM, задержка цикла событий."""
+    lag = loop_monitor.loop_lag_stats["last_lag"]
+    checks = {
+        "database": await _check_database(),
+        "fsm_storage": await _check_fsm_storage(),
+        "event_loop": {"ok": lag * 1000 <= config.HEALTH_MAX_LOOP_LAG_MS, "lag": round(lag, 4)},
+    }
+    replica = pool_status(db.db_replica_pool)
+    details: Dict[str, Any] = {
+        "checks": checks,
+        "replica_pool": replica, # Без реплики чтение уходит в основной пул - не влияет на готовность
+        "breakers": {name: breaker.snapshot() for name, breaker in circuit_breaker.breakers.items()},
+        "last_update_age": _age(_last_update_at, time.monotonic()),
+    }
+    return all(check["ok"] for check in checks.values()), details
+
+
+def _response(ok: bool, details: Dict[str, Any]) -> web.Response:
+    return web.json_response({"status": "ok" if ok else "fail", **details}, status=200 if ok else 503)
+
+
+async def healthz_view(request: web.Request) -> web.Response:
+    ok, details = liveness()
+    if not ok:
+        logger.warning(f"/healthz: успешного getUpdates не было дольше {config.HEALTH_POLL_STALE_SECONDS:g} с.")
+    return _response(ok, details)
+
+
+async def readyz_view(request: web.Request) -> web.Response:
+    ok, details = await readiness()
+    if not ok:
+        failed = [name for name, check in details["checks"].items() if not check["ok"]]
+        logger.warning(f"/readyz: бот не готов ({', '.join(failed)}).")
+    return _response(ok, details)
@@ -0,0 +1,112 @@
+"""
+Защита от повторной обработки апдейтов Telegram.
+
+Telegram доставляет апдейт повторно, если бот не подтвердил его (таймаут вебхука, перезапуск
+посреди обработки). Два уровня защиты:
+- UpdateDeduplicationMiddleware: update_id занимается до обработки (SET NX в Redis на короткое
+  время UPDATE_DEDUP_LEASE, без Redis - в памяти процесса), повтор пропускается. После обработки
+  отметка продлевается до UPDATE_DEDUP_TTL. Если обработка упала с ошибкой, отметка снимается;
+  если упал процесс, она истекает сама, и повторная доставка выполнится;
+- ключ идемпотентности записи food_entries (database.add_food_entry): даже если апдейт
+  обработан дважды (процесс упал после записи, отметка в памяти потеряна при перезапуске), запись одна.
+"""
+import logging
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message, TelegramObject, Update
+
+import cache
+import config
+
+logger = logging.getLogger(__name__)
+
+LOCAL_MAX_UPDATES = 10_000 # Сколько последних update_id помнить без Redis
+
+_local_updates: "OrderedDict[str, None]" = OrderedDict()
+_current_update_key: ContextVar[Optional[str]] = ContextVar("current_update_key", default=None)
+
+dedup_stats: Dict[str, int] = {"duplicates": 0}
+
+
+def _update_marker(bot_id: int, update_id: int) -> str:
+    return f"upd:{bot_id}:{update_id}"
+
+
+async def claim_update(bot_id: int, update_id: int) -> bool:
+    """Отмечает апдейт как обрабатываемый (на UPDATE_DEDUP_LEASE). False - апдейт уже обрабатывается или обработан."""
+    marker = _update_marker(bot_id, update_id)
+    if cache.redis_client is not None:
+        try:
+            return bool(await cache.redis_client.set(marker, "processing", nx=True, ex=config.UPDATE_DEDUP_LEASE))
+        except Exception as e:
+            logger.warning(f"Redis недоступен для дедупликации апдейтов ({e}), используется память процесса.")
+    if marker in _local_updates:
+        return False
+    _local_updates[marker] = None
+    while len(_local_updates) > LOCAL_MAX_UPDATES:
+        _local_updates.popitem(last=False)
+    return True
+
+
+async def complete_update(bot_id: int, update_id: int):
+    """Апдейт обработан: отметка хранится UPDATE_DEDUP_TTL."""
+    if cache.redis_client is None:
+        return
+    try:
+        await cache.redis_client.set(_update_marker(bot_id, update_id), "done", xx=True, ex=config.UPDATE_DEDUP_TTL)
+    except Exception as e:
+        # Отметка истечет через UPDATE_DEDUP_LEASE; повтор после этого не создаст второй записи (ключ идемпотентности)
+        logger.warning(f"Не удалось продлить отметку апдейта {update_id}: {e}")
+
+
+async def release_update(bot_id: int, update_id: int):
+    """Снимает отметку (обработка не удалась - повторная доставка должна выполниться)."""
+    marker = _update_marker(bot_id, update_id)
+    _local_updates.pop(marker, None)
+    if cache.redis_client is not None:
+        try:
+            await cache.redis_client.delete(marker)
+        except Exception as e:
+            logger.warning(f"Не удалось снять отметку апдейта {update_id}: {e}")
+
+
+def message_idempotency_key(message: Message) -> str:
+    """Ключ записи, созданной в ответ на сообщение пользователя (сообщение в чате уникально)."""
+    return f"m:{message.chat.id}:{message.message_id}"
+
+
+def update_idempotency_key(user_id: int) -> Optional[str]:
+    """Ключ записи по текущему апдейту (для событий без сообщения, например chosen_inline_result)."""
+    update_key = _current_update_key.get()
+    return f"{update_key}:{user_id}" if update_key else None
+
+
+class UpdateDeduplicationMiddleware(BaseMiddleware):
+    """Outer-middleware апдейта: пропускает уже обработанные update_id."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, Update):
+            return await handler(event, data)
+        bot_id = data["bot"].id
+        if not await claim_update(bot_id, event.update_id):
+            dedup_stats["duplicates"] += 1
+            logger.info(f"Апдейт {event.update_id} уже обработан, повтор пропущен.")
+            return None
+        token = _current_update_key.set(f"u:{bot_id}:{event.update_id}")
+        try:
+            result = await handler(event, data)
+        except Exception:
+            await release_update(bot_id, event.update_id)
+            raise
+        finally:
+            _current_update_key.reset(token)
+        await complete_update(bot_id, event.update_id)
+        return result
@@ -1,18 +1,63 @@
-import logging
+from aiogram.filters.callback_data import CallbackData
 from aiogram.types import (
     ReplyKeyboardMarkup, KeyboardButton,
     InlineKeyboardMarkup, InlineKeyboardButton
 )
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
-from typing import List, Dict, Any
+from enum import IntEnum
+from typing import List, Dict, Any, Optional
 
-# --- Callback Data Префиксы ---
-PRODUCT_SELECT_CALLBACK_PREFIX = "prod_select:"
-SETTINGS_ACTION_CALLBACK_PREFIX = "set_action:"
-GENDER_SELECT_CALLBACK_PREFIX = "set_gender:"
-GOAL_SELECT_CALLBACK_PREFIX = "set_goal:"
-# --- НОВЫЙ ПРЕФИКС/ДЕЙСТВИЕ для возврата в меню настроек ---
-SETTINGS_SHOW_MENU_ACTION = "show_menu"
+# --- Callback Data ---
+# Короткие префиксы и целые индексы: данные кнопки укладываются в лимит Telegram (64 байта)
+# без проверок, а обработчик получает уже разобранные поля (callback_data: ProductSelect и т.д.)
+class ProductSelect(CallbackData, prefix="p"):
+    """Выбор продукта из контекстных подсказок."""
+    product_id: int
+
+class ApiChoice(CallbackData, prefix="a"):
+    """Выбор варианта Open Food Facts по индексу в списке api_options (MANUAL_INPUT_INDEX - ручной ввод)."""
+    index: int
+
+# Настройки передают числовые коды, а не названия и значения из БД: смена подписи или значения
+# не меняет и не удлиняет callback_data. Код, которого нет в перечислении (кнопка из старой
+# версии бота), не проходит фильтр CallbackData.filter()
+class SettingsMenuAction(IntEnum):
+    MENU = 0 # Возврат в главное меню настроек из подменю
+    GOAL = 1
+    GENDER = 2
+    HEIGHT = 3
+    WEIGHT = 4
+    CLOSE = 5
+
+class GoalCode(IntEnum):
+    NONE = 0 # "Не устанавливать"
+    DEFICIT = 1
+    MAINTENANCE = 2
+    SURPLUS = 3
+
+class GenderCode(IntEnum):
+    MALE = 1
+    FEMALE = 2
+
+# Код кнопки -> значение поля goal/gender в таблице users
+GOAL_VALUES: Dict[GoalCode, Optional[str]] = {
+    GoalCode.NONE: None, GoalCode.DEFICIT: "deficit", GoalCode.MAINTENANCE: "maintenance", GoalCode.SURPLUS: "surplus",
+}
+GENDER_VALUES: Dict[GenderCode, str] = {GenderCode.MALE: "male", GenderCode.FEMALE: "female"}
+
+class SettingsAction(CallbackData, prefix="s"):
+    """Действие главного меню настроек."""
+    action: SettingsMenuAction
+
+class GoalSelect(CallbackData, prefix="sg"):
+    goal: GoalCode
+
+class GenderSelect(CallbackData, prefix="sx"):
+    gender: GenderCode
+
+MANUAL_INPUT_INDEX = -1
+# --- Действие для возврата в меню настроек ---
+SETTINGS_SHOW_MENU_ACTION = SettingsMenuAction.MENU
 
 # --- Тексты для Reply кнопок ---
 CANCEL_TEXT = "/cancel"
@@ -23,8 +68,6 @@ EDIT_API_TEXT = "✏️ Изменить калории"
 MANUAL_INPUT_TEXT = "⌨️ Ввести вручную"
 
 # --- Reply клавиатуры ---
-# (Функции cancel_keyboard, request_calories_keyboard, main_action_keyboard,
-# confirm_edit_keyboard, select_api_product_keyboard остаются без изменений)
 def cancel_keyboard() -> ReplyKeyboardMarkup:
     builder = ReplyKeyboardBuilder(); builder.add(KeyboardButton(text=CANCEL_TEXT))
     return builder.as_markup(resize_keyboard=True, one_time_keyboard=False)
@@ -37,48 +80,47 @@ def main_action_keyboard() -> ReplyKeyboardMarkup:
 def confirm_edit_keyboard() -> ReplyKeyboardMarkup:
     builder = ReplyKeyboardBuilder(); builder.row(KeyboardButton(text=CONFIRM_API_TEXT), KeyboardButton(text=EDIT_API_TEXT)); builder.row(KeyboardButton(text=CANCEL_TEXT))
     return builder.as_markup(resize_keyboard=True, one_time_keyboard=False)
-def select_api_product_keyboard(options: List[Dict[str, Any]]) -> ReplyKeyboardMarkup:
-    builder = ReplyKeyboardBuilder()
-    for option in options: name = option['name']; calories = option['calories']; button_text = f"{name[:30]}... ({calories} ккал)" if len(name) > 30 else f"{name} ({calories} ккал)"; builder.add(KeyboardButton(text=button_text))
-    builder.add(KeyboardButton(text=MANUAL_INPUT_TEXT)); builder.add(KeyboardButton(text=CANCEL_TEXT)); builder.adjust(2)
-    return builder.as_markup(resize_keyboard=True)
 
 # --- Inline клавиатуры ---
+def select_api_product_keyboard(options: List[List[Any]]) -> InlineKeyboardMarkup:
+    """Варианты Open Food Facts: options - список [название, ккал/100г] из состояния AddFood."""
+    builder = InlineKeyboardBuilder()
+    for index, (name, calories) in enumerate(options):
+        button_text = f"{name[:30]}... ({calories} ккал)" if len(name) > 30 else f"{name} ({calories} ккал)"
+        builder.button(text=button_text, callback_data=ApiChoice(index=index))
+    builder.button(text=MANUAL_INPUT_TEXT, callback_data=ApiChoice(index=MANUAL_INPUT_INDEX))
+    builder.adjust(1); return builder.as_markup()
+
 def product_suggestions_keyboard(suggestions: List[Dict[str, Any]]) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     for item in suggestions:
-        product_id = item['product_id']; name = item['product_name']; calories = item['calories_per_100g']
+        name = item['product_name']; calories = item['calories_per_100g']
         button_text = f"{name[:30]}.. ({calories})" if len(name) > 30 else f"{name} ({calories})"
-        callback_data = f"{PRODUCT_SELECT_CALLBACK_PREFIX}{product_id}"
-        if len(callback_data.encode('utf-8')) <= 64: builder.add(InlineKeyboardButton(text=button_text, callback_data=callback_data))
-        else: logging.warning(f"Callback data for product_id {product_id} is too long: {callback_data}")
+        builder.button(text=button_text, callback_data=ProductSelect(product_id=item['product_id']))
     builder.adjust(1); return builder.as_markup()
 
 def settings_main_keyboard() -> InlineKeyboardMarkup:
     """Главное меню настроек профиля."""
     builder = InlineKeyboardBuilder()
-    builder.row(InlineKeyboardButton(text="🎯 Изменить Цель", callback_data=f"{SETTINGS_ACTION_CALLBACK_PREFIX}change_goal"), InlineKeyboardButton(text="🧍 Изменить Пол", callback_data=f"{SETTINGS_ACTION_CALLBACK_PREFIX}change_gender"))
-    builder.row(InlineKeyboardButton(text="📏 Изменить Рост", callback_data=f"{SETTINGS_ACTION_CALLBACK_PREFIX}change_height"), InlineKeyboardButton(text="⚖️ Изменить Вес", callback_data=f"{SETTINGS_ACTION_CALLBACK_PREFIX}change_weight"))
+    builder.row(InlineKeyboardButton(text="🎯 Изменить Цель", callback_data=SettingsAction(action=SettingsMenuAction.GOAL).pack()), InlineKeyboardButton(text="🧍 Изменить Пол", callback_data=SettingsAction(action=SettingsMenuAction.GENDER).pack()))
+    builder.row(InlineKeyboardButton(text="📏 Изменить Рост", callback_data=SettingsAction(action=SettingsMenuAction.HEIGHT).pack()), InlineKeyboardButton(text="⚖️ Изменить Вес", callback_data=SettingsAction(action=SettingsMenuAction.WEIGHT).pack()))
     # Кнопка "Назад" из главного меню - закрывает настройки
-    builder.row(InlineKeyboardButton(text="🔙 Закрыть настройки", callback_data=f"{SETTINGS_ACTION_CALLBACK_PREFIX}back")) # Можно изменить текст для ясности
+    builder.row(InlineKeyboardButton(text="🔙 Закрыть настройки", callback_data=SettingsAction(action=SettingsMenuAction.CLOSE).pack()))
     return builder.as_markup()
 
 def select_goal_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура для выбора цели."""
     builder = InlineKeyboardBuilder()
-    builder.row(InlineKeyboardButton(text="📉 Дефицит", callback_data=f"{GOAL_SELECT_CALLBACK_PREFIX}deficit"))
-    builder.row(InlineKeyboardButton(text="維持 Поддержание", callback_data=f"{GOAL_SELECT_CALLBACK_PREFIX}maintenance"))
-    builder.row(InlineKeyboardButton(text="📈 Профицит", callback_data=f"{GOAL_SELECT_CALLBACK_PREFIX}surplus"))
-    builder.row(InlineKeyboardButton(text="🚫 Не устанавливать", callback_data=f"{GOAL_SELECT_CALLBACK_PREFIX}none"))
-    # --- ИЗМЕНЕНО: Используем новый callback_data для возврата в меню ---
-    builder.row(InlineKeyboardButton(text="🔙 Назад в настройки", callback_data=f"{SETTINGS_ACTION_CALLBACK_PREFIX}{SETTINGS_SHOW_MENU_ACTION}"))
+    builder.row(InlineKeyboardButton(text="📉 Дефицит", callback_data=GoalSelect(goal=GoalCode.DEFICIT).pack()))
+    builder.row(InlineKeyboardButton(text="維持 Поддержание", callback_data=GoalSelect(goal=GoalCode.MAINTENANCE).pack()))
+    builder.row(InlineKeyboardButton(text="📈 Профицит", callback_data=GoalSelect(goal=GoalCode.SURPLUS).pack()))
+    builder.row(InlineKeyboardButton(text="🚫 Не устанавливать", callback_data=GoalSelect(goal=GoalCode.NONE).pack()))
+    builder.row(InlineKeyboardButton(text="🔙 Назад в настройки", callback_data=SettingsAction(action=SETTINGS_SHOW_MENU_ACTION).pack()))
     return builder.as_markup()
 
 def select_gender_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура для выбора пола."""
     builder = InlineKeyboardBuilder()
-    builder.row(InlineKeyboardButton(text="👨 Мужской", callback_data=f"{GENDER_SELECT_CALLBACK_PREFIX}male"), InlineKeyboardButton(text="👩 Женский", callback_data=f"{GENDER_SELECT_CALLBACK_PREFIX}female"))
-    # --- ИЗМЕНЕНО: Используем новый callback_data для возврата в меню ---
-    builder.row(InlineKeyboardButton(text="🔙 Назад в настройки", callback_data=f"{SETTINGS_ACTION_CALLBACK_PREFIX}{SETTINGS_SHOW_MENU_ACTION}"))
+    builder.row(InlineKeyboardButton(text="👨 Мужской", callback_data=GenderSelect(gender=GenderCode.MALE).pack()), InlineKeyboardButton(text="👩 Женский", callback_data=GenderSelect(gender=GenderCode.FEMALE).pack()))
+    builder.row(InlineKeyboardButton(text="🔙 Назад в настройки", callback_data=SettingsAction(action=SETTINGS_SHOW_MENU_ACTION).pack()))
     return builder.as_markup()
-
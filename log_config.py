@@ -0,0 +1,131 @@
+"""
+Настройка логирования бота.
+
+- Записи уходят в очередь (QueueHandler), а форматирование и вывод выполняет поток QueueListener:
+  вызов logger.info() в обработчике не блокирует цикл событий на записи в stderr или файл.
+  Записи кладутся в очередь без предварительного форматирования, поэтому аргументы
+  %-стиля (logger.debug("... %s", value)) форматируются только в потоке вывода и только
+  для записей, прошедших уровень.
+- LOG_FORMAT=json - одна JSON-строка на запись: время, уровень, логгер, сообщение,
+  поля из extra={...} и трассировка исключения; text - прежний читаемый формат.
+- RateLimitFilter ограничивает DEBUG-записи одного места в коде (файл и строка) до
+  LOG_DEBUG_RATE в секунду: построчный отладочный вывод в циклах не забивает очередь.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+import config
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(name)s - %(message)s'
+
+# Атрибуты LogRecord, которые не считаются полями extra
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "suppressed"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога как одна JSON-строка."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if getattr(record, "suppressed", 0):
+            payload["suppressed"] = record.suppressed
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Не больше rate DEBUG-записей в секунду с одного места в коде (token bucket на файл и строку).
+    Первая прошедшая после паузы запись получает атрибут suppressed - сколько было пропущено.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self._buckets: Dict[Tuple[str, int], list] = {} # место -> [токены, время, пропущено]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate <= 0:
+            return True
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now, 0]
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            bucket[2] += 1
+            return False
+        bucket[0] -= 1
+        if bucket[2]:
+            record.suppressed = bucket[2]
+            bucket[2] = 0
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler без форматирования в вызывающем потоке (в отличие от стандартного prepare())."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def create_formatter(log_format: str) -> logging.Formatter:
+    return JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT)
+
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """Настраивает корневой логгер: очередь -> поток вывода в stderr (и LOG_FILE, если задан)."""
+    global _listener
+    if _listener is not None:
+        return _listener
+    formatter = create_formatter(config.LOG_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if config.LOG_FILE:
+        handlers.append(logging.FileHandler(config.LOG_FILE, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(config.LOG_DEBUG_RATE))
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(config.LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Дописывает оставшиеся в очереди записи и останавливает поток вывода."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
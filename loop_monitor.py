@@ -0,0 +1,123 @@
+"""
+Контроль задержек цикла событий.
+
+Фоновая задача засыпает на LOOP_LAG_INTERVAL секунд и измеряет, насколько позже проснулась:
+это время цикл был занят чужим синхронным кодом (pytz.timezone, разбор большого JSON от OFF,
+обработка длинных списков записей). Задержка пишется в гистограмму bot_event_loop_lag_seconds,
+превышение LOOP_LAG_WARN_MS - в лог (не чаще раза в LAG_ALERT_INTERVAL секунд).
+
+Если цикл заблокирован дольше LOOP_BLOCK_DUMP_MS, сторожевой поток выводит в лог стек потока
+цикла событий в этот момент - видно, какая именно функция его держит.
+"""
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, Optional
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LAG_ALERT_INTERVAL = 10.0 # Не чаще раза в столько секунд предупреждать о задержке
+
+# last_lag - последняя измеренная задержка (с), max_lag - наибольшая с запуска,
+# alerts - превышений LOOP_LAG_WARN_MS, blocked_dumps - выведенных стеков заблокированного цикла
+loop_lag_stats: Dict[str, float] = {"last_lag": 0.0, "max_lag": 0.0, "alerts": 0, "blocked_dumps": 0}
+
+_sampler_task: Optional[asyncio.Task] = None
+_watchdog: Optional["_BlockWatchdog"] = None
+_last_tick = 0.0 # time.monotonic() последнего пробуждения задачи-измерителя
+_last_alert_at = float("-inf")
+_alerts_suppressed = 0
+
+
+def record_lag(lag: float, now: Optional[float] = None):
+    """Учитывает измеренную задержку цикла: метрика, максимум и предупреждение с ограничением частоты."""
+    global _last_alert_at, _alerts_suppressed
+    metrics.EVENT_LOOP_LAG.observe(lag)
+    loop_lag_stats["last_lag"] = lag
+    loop_lag_stats["max_lag"] = max(loop_lag_stats["max_lag"], lag)
+    if config.LOOP_LAG_WARN_MS <= 0 or lag * 1000 < config.LOOP_LAG_WARN_MS:
+        return
+    loop_lag_stats["alerts"] += 1
+    now = time.monotonic() if now is None else now
+    if now - _last_alert_at < LAG_ALERT_INTERVAL:
+        _alerts_suppressed += 1
+        return
+    suppressed = f" (еще {_alerts_suppressed} превышений с прошлого предупреждения)" if _alerts_suppressed else ""
+    logger.warning(f"Цикл событий отстает на {lag * 1000:.0f} мс (порог {config.LOOP_LAG_WARN_MS:.0f} мс){suppressed}.")
+    _last_alert_at = now
+    _alerts_suppressed = 0
+
+
+async def _sample_loop_lag(interval: float):
+    global _last_tick
+    while True:
+        started = time.monotonic()
+        _last_tick = started
+        await asyncio.sleep(interval)
+        record_lag(max(0.0, time.monotonic() - started - interval))
+
+
+class _BlockWatchdog(threading.Thread):
+    """Поток, который выводит стек потока цикла событий, если тот не просыпается дольше порога."""
+
+    def __init__(self, loop_thread_id: int, threshold: float, interval: float):
+        super().__init__(name="loop-watchdog", daemon=True)
+        self.loop_thread_id = loop_thread_id
+        self.threshold = threshold
+        self.interval = interval
+        self.stopped = threading.Event()
+        self._dumped = False # Стек текущей блокировки уже выведен
+
+    def check(self, now: float) -> bool:
+        """Проверяет блокировку цикла; True - стек выведен."""
+        blocked = now - _last_tick - self.interval # Сверх обычного сна измерителя
+        if blocked < self.threshold:
+            self._dumped = False
+            return False
+        if self._dumped:
+            return False
+        self._dumped = True
+        frame = sys._current_frames().get(self.loop_thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else "(стек недоступен)"
+        loop_lag_stats["blocked_dumps"] += 1
+        logger.error(f"Цикл событий заблокирован дольше {blocked * 1000:.0f} мс. Стек потока цикла:\n{stack}")
+        return True
+
+    def run(self):
+        while not self.stopped.wait(self.threshold / 2):
+            self.check(time.monotonic())
+
+
+async def start_loop_monitor():
+    """Запускает измерение задержек цикла (LOOP_LAG_INTERVAL > 0) и сторожевой поток (LOOP_BLOCK_DUMP_MS > 0)."""
+    global _sampler_task, _watchdog, _last_tick
+    if config.LOOP_LAG_INTERVAL <= 0 or _sampler_task is not None:
+        return
+    _last_tick = time.monotonic()
+    _sampler_task = asyncio.create_task(_sample_loop_lag(config.LOOP_LAG_INTERVAL))
+    if config.LOOP_BLOCK_DUMP_MS > 0:
+        _watchdog = _BlockWatchdog(threading.get_ident(), config.LOOP_BLOCK_DUMP_MS / 1000, config.LOOP_LAG_INTERVAL)
+        _watchdog.start()
+    logger.info(
+        f"Контроль цикла событий: замер раз в {config.LOOP_LAG_INTERVAL} с, предупреждение от {config.LOOP_LAG_WARN_MS:.0f} мс."
+    )
+
+
+async def stop_loop_monitor():
+    global _sampler_task, _watchdog
+    if _watchdog is not None:
+        _watchdog.stopped.set()
+        _watchdog = None
+    if _sampler_task is not None:
+        _sampler_task.cancel()
+        try:
+            await _sampler_task
+        except asyncio.CancelledError:
+            pass
+        _sampler_task = None
@@ -1,9 +1,10 @@
 import asyncio
 import logging
+from typing import Optional
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.base import BaseSession
 
 try:
     from aiogram.fsm.storage.redis import RedisStorage
@@ -12,19 +13,28 @@ except ImportError:  # pragma: no cover - зависит от установле
 
 # Импортируем конфигурацию
 import config
-# Импортируем функции для работы с БД
+# Импортируем функции для работы с БД и кэш
 import database as db
+import cache
+import admission
+import health
+import log_config
+import loop_monitor
+import metrics
+import query_log
+import tracing
+import digest
+import send_queue
+from fsm_cache import UpdateCachedStorage, install_fsm_cache
+import fsm_expiry
+from idempotency import UpdateDeduplicationMiddleware
+from fsm_expiry import BoundedMemoryStorage
+from responses import ResponseCoalescingMiddleware
 # Импортируем главный роутер из пакета handlers
 from handlers import all_routers
 # Импортируем функцию установки меню
 from handlers.common import set_main_menu
 
-# --- Настройка логирования ---
-# Устанавливаем базовую конфигурацию логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(name)s - %(message)s'
-)
 # Получаем логгер для этого модуля
 logger = logging.getLogger(__name__)
 
@@ -39,43 +49,99 @@ def create_fsm_storage():
                 "FSM_STORAGE=redis, но RedisStorage недоступен. "
                 "Используется MemoryStorage fallback."
             )
-            return MemoryStorage()
+            return BoundedMemoryStorage(config.FSM_MEMORY_MAX_KEYS)
 
         try:
             logger.info(f"Используется Redis FSM storage: {config.REDIS_URL}")
-            return RedisStorage.from_url(config.REDIS_URL)
+            return RedisStorage.from_url(
+                config.REDIS_URL,
+                state_ttl=config.FSM_STATE_TTL or None,
+                data_ttl=config.FSM_DATA_TTL or None,
+            )
         except Exception as e:
             logger.warning(
                 f"Не удалось инициализировать RedisStorage ({e}). "
                 "Используется MemoryStorage fallback."
             )
-            return MemoryStorage()
+            return BoundedMemoryStorage(config.FSM_MEMORY_MAX_KEYS)
 
     logger.info("Используется MemoryStorage для FSM.")
-    return MemoryStorage()
-
-# --- Основная функция запуска ---
-async def main():
-    """Главная асинхронная функция для запуска бота."""
-    logger.info("Запуск бота...")
-
-    # Инициализация хранилища FSM
-    storage = create_fsm_storage()
+    return BoundedMemoryStorage(config.FSM_MEMORY_MAX_KEYS)
 
+def create_bot(token: str = config.BOT_TOKEN, session: Optional[BaseSession] = None) -> Bot:
+    """Бот с настройками по умолчанию и request middleware сессии (tools/loadgen.py передает свою сессию)."""
     # Инициализация бота с настройками по умолчанию (HTML parse_mode)
     defaults = DefaultBotProperties(parse_mode="HTML")
-    bot = Bot(token=config.BOT_TOKEN, default=defaults)
+    bot = Bot(token=token, session=session, default=defaults)
+    # Span'ы запросов к Bot API (снаружи очереди отправки, чтобы учитывалось ожидание в ней)
+    tracing.install_tracing(bot)
+    # Время последнего успешного getUpdates для /healthz
+    bot.session.middleware(health.PollingHeartbeatMiddleware())
+    # Все исходящие запросы проходят через очередь с лимитами Telegram
+    send_queue.install_send_queue(bot)
+    return bot
+
+
+def create_dispatcher() -> Dispatcher:
+    """Диспетчер со всеми middleware, роутерами и обработчиками startup/shutdown."""
+    # Инициализация хранилища FSM (с кэшем на время обработки апдейта)
+    storage = UpdateCachedStorage(create_fsm_storage())
 
     # Инициализация диспетчера
     dp = Dispatcher(storage=storage)
+    # Корневой span трассы для выбранной доли апдейтов (TRACE_SAMPLE_RATE)
+    dp.update.outer_middleware(tracing.TracingMiddleware())
+    # Время последнего обработанного апдейта (показывается в /healthz и /readyz)
+    dp.update.outer_middleware(health.UpdateActivityMiddleware())
+    # Повторно доставленные апдейты пропускаются до загрузки FSM и обработчиков
+    dp.update.outer_middleware(UpdateDeduplicationMiddleware())
+    # Состояние и данные FSM читаются один раз за апдейт и записываются одним запросом
+    install_fsm_cache(dp)
+
+    # Время запросов к БД: обертки функций database.py (вызываются как db.<функция>)
+    metrics.instrument_module(db)
+    tracing.instrument_module(db)
 
     # Подключаем роутеры из папки handlers
     dp.include_router(all_routers)
+    # Время обработчиков и число их запросов к БД (снаружи объединения ответов, чтобы учитывалась и отправка)
+    for observer in (dp.message, dp.callback_query, dp.inline_query, dp.chosen_inline_result):
+        observer.middleware(metrics.HandlerMetricsMiddleware())
+        observer.middleware(tracing.HandlerTracingMiddleware())
+        observer.middleware(query_log.QueryCounterMiddleware())
+        # Лимиты одновременной обработки и быстрый ответ "бот перегружен" вместо ожидания пула БД
+        observer.middleware(admission.AdmissionMiddleware())
+    # Ответы обработчика на одно действие пользователя уходят одним сообщением
+    dp.message.middleware(ResponseCoalescingMiddleware())
+    dp.callback_query.middleware(ResponseCoalescingMiddleware())
 
     # Регистрируем асинхронные функции на события startup и shutdown
     dp.startup.register(db.create_db_pool)  # Создаем пул соединений при старте
+    dp.startup.register(health.init_health) # Хранилище FSM и время запуска для /healthz, /readyz
+    dp.startup.register(metrics.start_metrics_server) # Эндпоинт /metrics (если задан METRICS_PORT)
+    dp.startup.register(tracing.start_tracing) # Выгрузка трасс (если TRACE_SAMPLE_RATE > 0)
+    dp.startup.register(loop_monitor.start_loop_monitor) # Замер задержек цикла событий
+    dp.startup.register(cache.init_cache)   # Подключаем кэш в Redis
     dp.startup.register(set_main_menu)      # Устанавливаем меню команд
+    dp.startup.register(digest.start_digest_scheduler) # Вечерний дайджест (если включен)
+    dp.startup.register(fsm_expiry.start_fsm_sweeper) # Сброс брошенных сценариев FSM
+    dp.shutdown.register(fsm_expiry.stop_fsm_sweeper)
+    dp.shutdown.register(digest.stop_digest_scheduler)
     dp.shutdown.register(db.close_db_pool) # Закрываем пул соединений при остановке
+    dp.shutdown.register(cache.close_cache) # Закрываем клиент кэша
+    dp.shutdown.register(send_queue.close_send_queue)
+    dp.shutdown.register(metrics.stop_metrics_server)
+    dp.shutdown.register(tracing.stop_tracing)
+    dp.shutdown.register(loop_monitor.stop_loop_monitor)
+    return dp
+
+
+# --- Основная функция запуска ---
+async def main():
+    """Главная асинхронная функция для запуска бота."""
+    logger.info("Запуск бота...")
+    bot = create_bot()
+    dp = create_dispatcher()
 
     # Удаляем вебхук перед запуском в режиме polling
     await bot.delete_webhook(drop_pending_updates=True)
@@ -91,6 +157,8 @@ async def main():
 
 
 if __name__ == "__main__":
+    # Логирование через очередь и отдельный поток вывода (LOG_LEVEL, LOG_FORMAT, LOG_FILE)
+    log_config.setup_logging()
     try:
         # Запускаем асинхронную функцию main
         asyncio.run(main())
@@ -100,3 +168,5 @@ if __name__ == "__main__":
     except Exception as e:
         # Логируем критические ошибки при запуске
         logger.critical(f"Критическая ошибка при запуске бота: {e}", exc_info=True)
+    finally:
+        log_config.stop_logging()
@@ -0,0 +1,361 @@
+"""
+Метрики в текстовом формате Prometheus на локальном HTTP-эндпоинте /metrics.
+
+Собирается:
+- bot_handler_duration_seconds{handler} - время обработчиков (HandlerMetricsMiddleware);
+- bot_db_call_duration_seconds{function} - время функций database.py (instrument_module);
+- bot_off_request_duration_seconds{attempt,outcome} - запросы к Open Food Facts по попыткам;
+- датчики пула БД, FSM, очереди отправки, дайджеста и объединения ответов (собираются при запросе).
+
+Формат реализован здесь же (гистограммы и датчики), отдельная зависимость не нужна.
+Сервер включается METRICS_PORT (0 - выключен) и по умолчанию слушает только localhost.
+"""
+import functools
+import inspect
+import logging
+import time
+from bisect import bisect_left
+from types import ModuleType
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from aiohttp import web
+
+import config
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+GaugeSample = Tuple[Dict[str, str], float]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Histogram:
+    """Гистограмма с метками: накопительные корзины, сумма и число наблюдений."""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelValues, List[float]] = {} # корзины..., сумма, число
+
+    def observe(self, value: float, **labels: Any):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+        index = bisect_left(self.buckets, value) # Значения больше последней границы попадают только в +Inf
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def count(self, **labels: Any) -> int:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        series = self._series.get(key)
+        return int(series[-1]) if series else 0
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            cumulative = 0.0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), series[:-2] + [0.0]):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(bound) + '"'
+                value = series[-1] if bound == float("inf") else cumulative
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {_format_value(value)}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {_format_value(series[-1])}")
+        return lines
+
+
+class GaugeCollector:
+    """Датчик, значения которого вычисляются при каждом запросе /metrics."""
+
+    def __init__(self, name: str, documentation: str, collect: Callable[[], Iterable[GaugeSample]], metric_type: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+        self.metric_type = metric_type
+
+    def expose(self) -> List[str]:
+        try:
+            samples = list(self.collect())
+        except Exception as e:
+            logger.debug(f"Метрика {self.name} недоступна: {e}")
+            return []
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        for labels, value in samples:
+            if value is None:
+                continue
+            lines.append(f"{self.name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+        return lines
+
+
+_registry: List[Any] = []
+
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def gauge(name: str, documentation: str, metric_type: str = "gauge"):
+    """Декоратор: функция без аргументов возвращает список (метки, значение) или одно число."""
+    def decorator(func: Callable[[], Any]):
+        def collect() -> Iterable[GaugeSample]:
+            value = func()
+            return value if isinstance(value, list) else [({}, value)]
+        register(GaugeCollector(name, documentation, collect, metric_type))
+        return func
+    return decorator
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
+
+
+# --- Метрики бота ---
+HANDLER_LATENCY = register(Histogram(
+    "bot_handler_duration_seconds", "Время выполнения обработчика апдейта", ("handler",)
+))
+DB_LATENCY = register(Histogram(
+    "bot_db_call_duration_seconds", "Время выполнения функций database.py", ("function",)
+))
+DB_QUERIES_PER_UPDATE = register(Histogram(
+    "bot_db_queries_per_update", "Число запросов к БД за обработку апдейта", ("handler",),
+    buckets=(0, 1, 2, 3, 4, 6, 8, 12, 20),
+))
+EVENT_LOOP_LAG = register(Histogram(
+    "bot_event_loop_lag_seconds", "Задержка пробуждения задачи в цикле событий (цикл занят синхронным кодом)", (),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+))
+OFF_LATENCY = register(Histogram(
+    "bot_off_request_duration_seconds", "Запросы к Open Food Facts по номеру попытки и результату",
+    ("attempt", "outcome"), buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0),
+))
+
+
+def time_call(histogram: Histogram, **labels: Any):
+    """Декоратор асинхронной функции: записывает время выполнения в гистограмму."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, **labels)
+        wrapper.__wrapped_metrics__ = True
+        return wrapper
+    return decorator
+
+
+def query_functions(module: ModuleType) -> List[str]:
+    """
+    Имена публичных корутин модуля, принимающих первым аргументом pool (запросы database.py).
+    Функции жизненного цикла пула не входят - их вызывает aiogram по сигнатуре.
+    """
+    names = []
+    for name, func in vars(module).items():
+        if name.startswith("_") or not inspect.iscoroutinefunction(func) or getattr(func, "__module__", None) != module.__name__:
+            continue
+        if next(iter(inspect.signature(func).parameters), None) == "pool":
+            names.append(name)
+    return names
+
+
+def instrument_module(module: ModuleType, histogram: Histogram = DB_LATENCY, label: str = "function") -> int:
+    """
+    Оборачивает таймером запросы модуля (см. query_functions).
+    Вызовы через атрибут модуля (db.get_...) и внутри модуля идут через обертку.
+    Возвращает число обернутых функций.
+    """
+    count = 0
+    for name in query_functions(module):
+        func = getattr(module, name)
+        if getattr(func, "__wrapped_metrics__", False):
+            continue
+        setattr(module, name, time_call(histogram, **{label: name})(func))
+        count += 1
+    return count
+
+
+def handler_name(event: TelegramObject, data: Dict[str, Any]) -> str:
+    """Имя функции обработчика, выбранного для события (из data["handler"])."""
+    callback = getattr(data.get("handler"), "callback", None)
+    return getattr(callback, "__name__", type(event).__name__)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner-middleware: время обработчика с меткой имени функции."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        name = handler_name(event, data)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, handler=name)
+
+
+# --- Датчики других подсистем (импорт внутри, чтобы metrics не зависел от порядка импорта) ---
+@gauge("bot_db_pool_connections", "Соединения пула БД: size и idle")
+def _db_pool_gauge():
+    import database as db
+    pools = [("primary", db.db_pool), ("replica", db.db_replica_pool)]
+    samples = []
+    for role, pool in pools:
+        if pool is None:
+            continue
+        samples.append(({"pool": role, "kind": "size"}, pool.get_size()))
+        samples.append(({"pool": role, "kind": "idle"}, pool.get_idle_size()))
+        samples.append(({"pool": role, "kind": "max"}, pool.get_max_size()))
+    return samples
+
+
+@gauge("bot_admission_total", "Контроль допуска: пропущено событий, отклонено по лимитам, прервано из-за занятого пула БД", "counter")
+def _admission_gauge():
+    from admission import admission_stats
+    return [({"kind": kind}, value) for kind, value in admission_stats.items()]
+
+
+@gauge("bot_circuit_breaker", "Предохранители внешних сервисов: open (1 - разомкнут), неудач подряд, отклонено вызовов")
+def _circuit_breaker_gauge():
+    from circuit_breaker import CLOSED, breakers
+    samples = []
+    for name, breaker in breakers.items():
+        samples.append(({"breaker": name, "stat": "open"}, int(breaker.state != CLOSED)))
+        samples.append(({"breaker": name, "stat": "failures"}, breaker.failures))
+        samples.append(({"breaker": name, "stat": "rejected"}, breaker.rejected))
+    return samples
+
+
+@gauge("bot_fsm_cache_total", "Кэш FSM: апдейты, обращения к FSM и фактические запросы к хранилищу", "counter")
+def _fsm_cache_gauge():
+    from fsm_cache import fsm_cache_stats
+    return [({"kind": kind}, value) for kind, value in fsm_cache_stats.items()]
+
+
+@gauge("bot_fsm_expiry_total", "Очистка FSM: проходы, сброшенные сценарии, убранные клавиатуры, вытеснения", "counter")
+def _fsm_expiry_gauge():
+    from fsm_expiry import fsm_expiry_stats
+    return [({"kind": kind}, value) for kind, value in fsm_expiry_stats.items()]
+
+
+@gauge("bot_send_queue", "Очередь отправки: глубина, отправлено, повторы, перцентили ожидания и задержки (с)")
+def _send_queue_gauge():
+    import send_queue
+    if send_queue.send_queue is None:
+        return []
+    return [({"stat": stat}, value) for stat, value in send_queue.send_queue.stats().items()]
+
+
+@gauge("bot_digest_total", "Дайджест: запуски, отправлено, ошибок", "counter")
+def _digest_gauge():
+    from digest import digest_stats
+    return [({"kind": kind}, digest_stats[kind]) for kind in ("runs", "sent", "failed")]
+
+
+@gauge("bot_coalesced_messages_total", "Сообщений, не отправленных благодаря объединению ответов", "counter")
+def _coalesced_gauge():
+    import responses
+    return responses.coalesced_messages
+
+
+@gauge("bot_duplicate_updates_total", "Пропущено повторно доставленных апдейтов", "counter")
+def _duplicates_gauge():
+    from idempotency import dedup_stats
+    return dedup_stats["duplicates"]
+
+
+@gauge("bot_traces_total", "Трассировка: выбранные апдейты, записанные, выгруженные и отброшенные span'ы", "counter")
+def _tracing_gauge():
+    from tracing import trace_stats
+    return [({"kind": kind}, value) for kind, value in trace_stats.items()]
+
+
+@gauge("bot_db_slow_queries_total", "Медленные запросы (дольше DB_SLOW_QUERY_MS) по отпечатку запроса", "counter")
+def _slow_queries_gauge():
+    from query_log import slow_query_stats
+    return [({"fingerprint": key}, stats["count"]) for key, stats in slow_query_stats.items()]
+
+
+@gauge("bot_db_slow_query_seconds_total", "Суммарное время медленных запросов по отпечатку запроса", "counter")
+def _slow_query_seconds_gauge():
+    from query_log import slow_query_stats
+    return [({"fingerprint": key}, stats["total"]) for key, stats in slow_query_stats.items()]
+
+
+@gauge("bot_event_loop", "Цикл событий: наибольшая задержка (с), предупреждения, выведенные стеки блокировок")
+def _event_loop_gauge():
+    from loop_monitor import loop_lag_stats
+    return [({"stat": stat}, value) for stat, value in loop_lag_stats.items()]
+
+
+# --- HTTP-сервер ---
+_runner: Optional[web.AppRunner] = None
+app_routes = web.RouteTableDef()
+
+
+@app_routes.get("/metrics")
+async def _metrics_view(request: web.Request) -> web.Response:
+    return web.Response(body=render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+
+def create_app() -> web.Application:
+    from health import healthz_view, readyz_view # Проверки для оркестратора
+    from profiler import profile_view # Снятие профиля по запросу оператора (если задан PROFILE_TOKEN)
+    app = web.Application()
+    app.add_routes(app_routes)
+    app.router.add_get("/healthz", healthz_view)
+    app.router.add_get("/readyz", readyz_view)
+    app.router.add_get("/debug/profile", profile_view)
+    return app
+
+
+async def start_metrics_server():
+    """Запускает HTTP-сервер метрик (если METRICS_PORT не 0)."""
+    global _runner
+    if not config.METRICS_PORT or _runner is not None:
+        return
+    _runner = web.AppRunner(create_app(), access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, config.METRICS_HOST, config.METRICS_PORT).start()
+    logger.info(f"Метрики доступны на http://{config.METRICS_HOST}:{config.METRICS_PORT}/metrics")
+
+
+async def stop_metrics_server():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
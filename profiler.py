@@ -0,0 +1,96 @@
+"""
+Снятие профиля работающего бота по запросу оператора.
+
+GET /debug/profile на сервере метрик (см. metrics.create_app) в течение seconds секунд собирает:
+- kind=cpu - cProfile потока цикла событий (все обработчики и фоновые задачи), top функций
+  по накопленному времени;
+- kind=memory - разницу снимков tracemalloc в начале и в конце, top строк по выделенной памяти.
+Эндпоинт включается только при заданном PROFILE_TOKEN; токен передается заголовком X-Profile-Token.
+Одновременно выполняется один замер: профилирование само замедляет бота.
+"""
+import asyncio
+import cProfile
+import hmac
+import io
+import logging
+import pstats
+import tracemalloc
+
+from aiohttp import web
+
+import config
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MAX_SECONDS = 60
+PROFILE_DEFAULT_SECONDS = 10
+PROFILE_DEFAULT_TOP = 30
+PROFILE_MAX_TOP = 200
+TRACEMALLOC_FRAMES = 10 # Глубина стека, сохраняемая tracemalloc для выделения
+TOKEN_HEADER = "X-Profile-Token"
+
+_capture_running = False
+
+
+async def profile_cpu(seconds: float, top: int = PROFILE_DEFAULT_TOP) -> str:
+    """Профилирует поток цикла событий seconds секунд. Возвращает отчет pstats."""
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profile.disable()
+    out = io.StringIO()
+    out.write(f"CPU-профиль цикла событий за {seconds:g} с (top {top} по накопленному времени)\n")
+    pstats.Stats(profile, stream=out).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+    return out.getvalue()
+
+
+async def profile_allocations(seconds: float, top: int = PROFILE_DEFAULT_TOP) -> str:
+    """Сравнивает снимки tracemalloc в начале и в конце интервала. Возвращает top строк по памяти."""
+    started_here = not tracemalloc.is_tracing()
+    if started_here:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    try:
+        before = tracemalloc.take_snapshot()
+        await asyncio.sleep(seconds)
+        after = tracemalloc.take_snapshot()
+    finally:
+        if started_here:
+            tracemalloc.stop()
+    ignored = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"))
+    stats = after.filter_traces(ignored).compare_to(before.filter_traces(ignored), "lineno")[:top]
+    lines = [f"Выделения памяти за {seconds:g} с (top {top} строк по приросту)"]
+    lines.extend(str(stat) for stat in stats)
+    return "\n".join(lines) + "\n"
+
+
+def _bounded(request: web.Request, name: str, default: float, low: float, high: float, cast=float) -> float:
+    try:
+        value = cast(request.query.get(name, default))
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"Некорректный параметр {name}\n")
+    return min(max(value, low), high)
+
+
+async def profile_view(request: web.Request) -> web.Response:
+    """GET /debug/profile?kind=cpu|memory&seconds=N&top=N (заголовок X-Profile-Token)."""
+    global _capture_running
+    if not config.PROFILE_TOKEN:
+        raise web.HTTPNotFound()
+    if not hmac.compare_digest(request.headers.get(TOKEN_HEADER, "").encode(), config.PROFILE_TOKEN.encode()):
+        raise web.HTTPForbidden(text="Неверный токен\n")
+    kind = request.query.get("kind", "cpu")
+    if kind not in ("cpu", "memory"):
+        raise web.HTTPBadRequest(text="kind: cpu или memory\n")
+    seconds = _bounded(request, "seconds", PROFILE_DEFAULT_SECONDS, 0.01, PROFILE_MAX_SECONDS)
+    top = int(_bounded(request, "top", PROFILE_DEFAULT_TOP, 1, PROFILE_MAX_TOP, cast=int))
+    if _capture_running:
+        raise web.HTTPConflict(text="Замер уже выполняется\n")
+    _capture_running = True
+    logger.warning(f"Снятие профиля {kind} на {seconds:g} с по запросу {request.remote}.")
+    try:
+        report = await (profile_cpu(seconds, top) if kind == "cpu" else profile_allocations(seconds, top))
+    finally:
+        _capture_running = False
+    return web.Response(text=report)
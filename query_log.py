@@ -0,0 +1,143 @@
+"""
+Журнал медленных запросов и счетчик запросов к БД за обработку апдейта.
+
+log_query подключается логгером запросов к каждому соединению пула (init_connection: для asyncpg -
+Connection.add_query_logger, для SQLite - такой же интерфейс в storage_sqlite) и:
+- запросы дольше DB_SLOW_QUERY_MS пишет в лог и группирует по отпечатку (текст запроса без
+  литералов и лишних пробелов), чтобы сотня одинаковых медленных запросов была одной строкой отчета;
+- считает запросы текущего count_queries(): QueryCounterMiddleware считает их для каждого
+  обработчика (метрика bot_db_queries_per_update), а тесты - проверяют бюджет запросов обработчика.
+"""
+import asyncio
+import hashlib
+import logging
+import re
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MAX_FINGERPRINTS = 500 # Сверх этого новые отпечатки учитываются в одной группе "other"
+OTHER_FINGERPRINT = "other"
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w$?])\d+(?:\.\d+)?\b")
+_SPACE_RE = re.compile(r"\s+")
+
+# fingerprint -> {"query": нормализованный текст, "count", "total" (с), "max" (с)}
+slow_query_stats: Dict[str, Dict[str, Any]] = {}
+# queries - всего запросов через логгер, slow - из них медленных
+query_log_stats: Dict[str, int] = {"queries": 0, "slow": 0}
+
+
+def normalize_query(query: str) -> str:
+    """Текст запроса без строковых и числовых литералов и лишних пробелов ($1 остается)."""
+    query = _STRING_RE.sub("?", query)
+    query = _NUMBER_RE.sub("?", query)
+    return _SPACE_RE.sub(" ", query).strip().rstrip(";").strip()
+
+
+def fingerprint(query: str) -> str:
+    return hashlib.sha1(normalize_query(query).encode("utf-8")).hexdigest()[:12]
+
+
+class QueryCounter:
+    """Запросы к БД внутри count_queries(): число, суммарное время и нормализованные тексты."""
+
+    __slots__ = ("count", "elapsed", "queries", "parent")
+
+    def __init__(self, parent: Optional["QueryCounter"] = None):
+        self.count = 0
+        self.elapsed = 0.0
+        self.queries: List[str] = []
+        self.parent = parent
+
+
+_current_counter: ContextVar[Optional[QueryCounter]] = ContextVar("query_counter", default=None)
+
+
+@asynccontextmanager
+async def count_queries() -> AsyncIterator[QueryCounter]:
+    """
+    Считает запросы к БД внутри блока (с учетом вложенных блоков):
+        async with count_queries() as counter:
+            await handle_today(message)
+        assert counter.count <= 2
+    """
+    counter = QueryCounter(_current_counter.get())
+    token = _current_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        # asyncpg вызывает логгеры запросов через call_soon: даем выполниться последнему
+        await asyncio.sleep(0)
+        _current_counter.reset(token)
+
+
+def _record_slow(query: str, elapsed: float):
+    normalized = normalize_query(query)
+    key = fingerprint(query)
+    stats = slow_query_stats.get(key)
+    if stats is None:
+        if len(slow_query_stats) >= SLOW_QUERY_MAX_FINGERPRINTS:
+            key = OTHER_FINGERPRINT
+            stats = slow_query_stats.setdefault(key, {"query": "(прочие)", "count": 0, "total": 0.0, "max": 0.0})
+        else:
+            stats = slow_query_stats[key] = {"query": normalized, "count": 0, "total": 0.0, "max": 0.0}
+    stats["count"] += 1
+    stats["total"] += elapsed
+    stats["max"] = max(stats["max"], elapsed)
+    query_log_stats["slow"] += 1
+    logger.warning(
+        f"Медленный запрос [{key}] {elapsed * 1000:.0f} мс (раз: {stats['count']}, "
+        f"максимум {stats['max'] * 1000:.0f} мс): {normalized[:300]}"
+    )
+
+
+def log_query(record: Any):
+    """Логгер запросов соединения (record - asyncpg LoggedQuery или storage_sqlite.LoggedQuery)."""
+    query_log_stats["queries"] += 1
+    counter = _current_counter.get()
+    while counter is not None:
+        counter.count += 1
+        counter.elapsed += record.elapsed
+        counter.queries.append(normalize_query(record.query))
+        counter = counter.parent
+    if config.DB_SLOW_QUERY_MS > 0 and record.elapsed * 1000 >= config.DB_SLOW_QUERY_MS:
+        _record_slow(record.query, record.elapsed)
+
+
+async def init_connection(connection: Any):
+    """init для пула: подключает log_query к новому соединению."""
+    connection.add_query_logger(log_query)
+
+
+def slow_query_report(limit: int = 10) -> List[Tuple[str, Dict[str, Any]]]:
+    """Группы медленных запросов по убыванию суммарного времени."""
+    return sorted(slow_query_stats.items(), key=lambda item: item[1]["total"], reverse=True)[:limit]
+
+
+class QueryCounterMiddleware(BaseMiddleware):
+    """Inner-middleware: число запросов к БД за обработчик в метрику bot_db_queries_per_update."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        name = metrics.handler_name(event, data)
+        counter = QueryCounter()
+        try:
+            async with count_queries() as counter:
+                return await handler(event, data)
+        finally:
+            metrics.DB_QUERIES_PER_UPDATE.observe(counter.count, handler=name)
+            logger.debug(f"{name}: запросов к БД {counter.count} ({counter.elapsed * 1000:.1f} мс)")
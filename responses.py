@@ -0,0 +1,169 @@
+"""
+Объединение ответов: одно действие пользователя - одно сообщение бота.
+
+Обработчики отвечают через respond()/respond_edit() вместо message.answer()/edit_text().
+Пока обрабатывается апдейт (см. ResponseCoalescingMiddleware), ответы копятся в буфере
+и после обработчика уходят одним сообщением: например, "✅ Добавлено: ..." и сводка /today,
+которые раньше были двумя сообщениями. respond_edit() просит вместо нового сообщения
+отредактировать сообщение бота, на кнопку которого нажали.
+
+Части с несовместимыми клавиатурами (например, ReplyKeyboardRemove и инлайн-меню) объединить
+нельзя: накопленное отправляется отдельным сообщением, и буфер начинается заново.
+Вне middleware (например, в тестах или фоновых задачах) respond() отправляет сразу.
+Итоговое сообщение бота (например, чтобы запомнить id сообщения с инлайн-клавиатурой)
+можно получить через on_sent: он вызывается после отправки, когда сообщение уже есть.
+"""
+import logging
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup, Message, TelegramObject
+
+logger = logging.getLogger(__name__)
+
+SentCallback = Callable[[Message], Awaitable[None]]
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+PARTS_SEPARATOR = "\n\n"
+
+# Сколько сообщений удалось не отправлять благодаря объединению (для метрик)
+coalesced_messages = 0
+
+
+def _editable_markup(reply_markup: Any) -> bool:
+    return reply_markup is None or isinstance(reply_markup, InlineKeyboardMarkup)
+
+
+async def _notify_sent(sent: Any, callbacks: List[SentCallback]):
+    # edit_text для inline-сообщений возвращает True вместо Message
+    if sent is None or isinstance(sent, bool):
+        return
+    for callback in callbacks:
+        await callback(sent)
+
+
+class ResponseBuffer:
+    """Ответы, накопленные за обработку одного апдейта."""
+
+    def __init__(self):
+        self.message: Optional[Message] = None # Через какой объект отвечать (чат апдейта)
+        self.parts: List[str] = []
+        self.reply_markup: Any = None
+        self.options: Dict[str, Any] = {}
+        self.edit_target: Optional[Message] = None
+        self.on_sent: List[SentCallback] = []
+
+    def accepts(self, message: Message, reply_markup: Any, edit: bool) -> bool:
+        """Можно ли добавить часть к уже накопленным (тот же чат и совместимая клавиатура)."""
+        if not self.parts:
+            return True
+        if message.chat.id != self.message.chat.id:
+            return False
+        if edit and not _editable_markup(reply_markup if reply_markup is not None else self.reply_markup):
+            return False # Сообщение с reply-клавиатурой нельзя получить редактированием
+        return reply_markup is None or self.reply_markup is None or reply_markup == self.reply_markup
+
+    def add(
+        self, message: Message, text: str, reply_markup: Any, options: Dict[str, Any], edit_target: Optional[Message],
+        on_sent: Optional[SentCallback] = None,
+    ):
+        self.message = self.message or message
+        self.parts.append(text)
+        if reply_markup is not None:
+            self.reply_markup = reply_markup
+        self.options.update(options)
+        if edit_target is not None:
+            self.edit_target = edit_target
+        if on_sent is not None:
+            self.on_sent.append(on_sent)
+
+    async def flush(self):
+        """Отправляет накопленное одним сообщением (или редактированием) и очищает буфер."""
+        global coalesced_messages
+        if not self.parts:
+            return
+        parts, reply_markup, options, edit_target, message = self.parts, self.reply_markup, self.options, self.edit_target, self.message
+        on_sent = self.on_sent
+        self.parts, self.reply_markup, self.options, self.edit_target, self.message = [], None, {}, None, None
+        self.on_sent = []
+
+        text = PARTS_SEPARATOR.join(parts)
+        if len(text) > TELEGRAM_MESSAGE_LIMIT:
+            # Слишком длинно для одного сообщения - отправляем части по отдельности, клавиатуру с последней
+            for part in parts[:-1]:
+                await message.answer(part, **options)
+            await _notify_sent(await message.answer(parts[-1], reply_markup=reply_markup, **options), on_sent)
+            return
+        coalesced_messages += len(parts) - 1
+        if edit_target is not None and _editable_markup(reply_markup):
+            try:
+                sent = await edit_target.edit_text(text, reply_markup=reply_markup, **options)
+            except TelegramBadRequest as e:
+                # Сообщение слишком старое или не изменилось - отправляем новое
+                logger.debug(f"Не удалось отредактировать сообщение {edit_target.message_id}: {e}")
+            else:
+                await _notify_sent(sent, on_sent)
+                return
+        await _notify_sent(await message.answer(text, reply_markup=reply_markup, **options), on_sent)
+
+
+_current_buffer: ContextVar[Optional[ResponseBuffer]] = ContextVar("response_buffer", default=None)
+
+
+async def _respond(
+    message: Message, text: str, reply_markup: Any, options: Dict[str, Any], edit_target: Optional[Message],
+    on_sent: Optional[SentCallback] = None,
+):
+    buffer = _current_buffer.get()
+    if buffer is None:
+        callbacks = [on_sent] if on_sent is not None else []
+        if edit_target is not None and _editable_markup(reply_markup):
+            try:
+                sent = await edit_target.edit_text(text, reply_markup=reply_markup, **options)
+            except TelegramBadRequest as e:
+                logger.debug(f"Не удалось отредактировать сообщение {edit_target.message_id}: {e}")
+            else:
+                await _notify_sent(sent, callbacks)
+                return sent
+        sent = await message.answer(text, reply_markup=reply_markup, **options)
+        await _notify_sent(sent, callbacks)
+        return sent
+    if not buffer.accepts(message, reply_markup, edit_target is not None):
+        await buffer.flush()
+    buffer.add(message, text, reply_markup, options, edit_target, on_sent)
+
+
+async def respond(message: Message, text: str, reply_markup: Any = None, on_sent: Optional[SentCallback] = None, **options):
+    """Отвечает в чат сообщения; в рамках апдейта ответ объединяется с остальными."""
+    await _respond(message, text, reply_markup, options, None, on_sent)
+
+
+async def respond_edit(
+    bot_message: Message, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None,
+    on_sent: Optional[SentCallback] = None, **options,
+):
+    """Показывает текст вместо содержимого сообщения бота (например, меню после нажатия кнопки)."""
+    await _respond(bot_message, text, reply_markup, options, bot_message, on_sent)
+
+
+class ResponseCoalescingMiddleware(BaseMiddleware):
+    """Собирает ответы обработчика и отправляет их после него одним сообщением."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        buffer = ResponseBuffer()
+        token = _current_buffer.set(buffer)
+        try:
+            return await handler(event, data)
+        finally:
+            _current_buffer.reset(token)
+            try:
+                await buffer.flush()
+            except Exception as e:
+                logger.error(f"Ошибка отправки объединенного ответа: {e}", exc_info=True)
@@ -0,0 +1,224 @@
+"""
+Центральная очередь исходящих запросов к Bot API с учетом лимитов Telegram.
+
+Подключается к сессии бота как request middleware, поэтому через нее проходят все вызовы
+(message.answer, edit_text, bot.send_message и т.д.) без изменений в обработчиках.
+Запросы с chat_id проходят два token bucket:
+- по чату (SEND_CHAT_RATE сообщений в секунду, небольшой запас на ответ + редактирование);
+- общий (SEND_GLOBAL_RATE сообщений в секунду); здесь ожидающие запросы упорядочены по приоритету:
+  ответы пользователям (PRIORITY_INTERACTIVE) уходят раньше массовых рассылок (PRIORITY_BULK).
+Запросы без chat_id (getUpdates, answerCallbackQuery, answerInlineQuery) не ограничиваются.
+При TelegramRetryAfter чат блокируется на retry_after секунд и запрос повторяется.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+
+import config
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+CHAT_BURST = 3 # Запас сообщений в чат сверх SEND_CHAT_RATE (ответ + редактирование + подсказка)
+MAX_CHAT_BUCKETS = 10_000 # Сверх этого числа заполненные (неактивные) корзины чатов удаляются
+LATENCY_WINDOW = 1000 # По скольким последним запросам считаются перцентили задержки
+
+# Приоритет запросов текущей задачи (устанавливается через bulk_sends() для рассылок)
+send_priority: ContextVar[int] = ContextVar("send_priority", default=PRIORITY_INTERACTIVE)
+
+send_queue: Optional["SendQueue"] = None
+
+
+@contextmanager
+def bulk_sends():
+    """Помечает запросы внутри блока как массовые: они уступают очередь ответам пользователям."""
+    token = send_priority.set(PRIORITY_BULK)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+class TokenBucket:
+    """Token bucket с резервированием: take() сразу списывает токен и возвращает, сколько ждать."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Сколько секунд до появления целого токена (без списания)."""
+        self._refill(time.monotonic())
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> float:
+        """Списывает токен (баланс может уйти в минус) и возвращает время ожидания своей очереди."""
+        self._refill(time.monotonic())
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def block(self, seconds: float):
+        """Запрещает отправку на seconds секунд (после TelegramRetryAfter)."""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+    def is_idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class SendQueue:
+    """Приоритетная очередь на общий лимит плюс лимиты по чатам."""
+
+    def __init__(self, global_rate: float, chat_rate: float, max_retries: int = 3):
+        self.max_retries = max_retries
+        self._chat_rate = chat_rate
+        self._global = TokenBucket(global_rate, max(global_rate, 1.0))
+        self._chats: Dict[int | str, TokenBucket] = {}
+        self._heap: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.depth = 0 # Запросов в ожидании (в очереди чата или общей)
+        self.sent = 0
+        self.retries = 0
+        self._wait_times: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    def _chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                self._chats = {key: value for key, value in self._chats.items() if not value.is_idle()}
+            bucket = self._chats[chat_id] = TokenBucket(self._chat_rate, CHAT_BURST)
+        return bucket
+
+    async def _dispatch(self):
+        """Выдает общие токены ожидающим запросам в порядке приоритета."""
+        while True:
+            while not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            delay = self._global.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue # За время ожидания мог прийти более приоритетный запрос
+            _, _, waiter = heapq.heappop(self._heap)
+            if not waiter.done():
+                self._global.take()
+                waiter.set_result(None)
+
+    async def acquire(self, chat_id: int | str, priority: int):
+        """Ждет разрешения на отправку в чат: сначала лимит чата, затем общий лимит по приоритету."""
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        self.depth += 1
+        started = time.monotonic()
+        try:
+            chat_delay = self._chat_bucket(chat_id).take()
+            if chat_delay > 0:
+                await asyncio.sleep(chat_delay)
+            waiter = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._heap, (priority, next(self._counter), waiter))
+            self._wakeup.set()
+            await waiter
+        finally:
+            self.depth -= 1
+        self._wait_times.append(time.monotonic() - started)
+
+    def penalize(self, chat_id: int | str, seconds: float):
+        self._chat_bucket(chat_id).block(seconds)
+
+    def record_latency(self, seconds: float):
+        self.sent += 1
+        self._latencies.append(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очереди и задержки (ожидание в очереди и полное время запроса) по последним запросам."""
+        def percentile(values: Deque[float], q: float) -> float:
+            if not values:
+                return 0.0
+            ordered = sorted(values)
+            return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+        return {
+            "depth": self.depth,
+            "sent": self.sent,
+            "retries": self.retries,
+            "wait_p50": percentile(self._wait_times, 0.5),
+            "wait_p95": percentile(self._wait_times, 0.95),
+            "latency_p50": percentile(self._latencies, 0.5),
+            "latency_p95": percentile(self._latencies, 0.95),
+        }
+
+    async def close(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+
+
+class SendQueueMiddleware(BaseRequestMiddleware):
+    """Request middleware сессии бота: пропускает запросы с chat_id через SendQueue."""
+
+    def __init__(self, queue: SendQueue):
+        self.queue = queue
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+        priority = send_priority.get()
+        started = time.monotonic()
+        for attempt in range(self.queue.max_retries + 1):
+            await self.queue.acquire(chat_id, priority)
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self.queue.max_retries:
+                    raise
+                self.queue.retries += 1
+                self.queue.penalize(chat_id, e.retry_after)
+                logger.warning(f"Лимит Telegram для чата {chat_id} ({type(method).__name__}), повтор через {e.retry_after} с")
+                continue
+            self.queue.record_latency(time.monotonic() - started)
+            return response
+
+
+def install_send_queue(bot: Bot) -> SendQueue:
+    """Создает очередь и подключает ее к сессии бота."""
+    global send_queue
+    send_queue = SendQueue(config.SEND_GLOBAL_RATE, config.SEND_CHAT_RATE, config.SEND_MAX_RETRIES)
+    bot.session.middleware(SendQueueMiddleware(send_queue))
+    logger.info(
+        f"Очередь отправки: до {config.SEND_GLOBAL_RATE} сообщ./с всего, "
+        f"{config.SEND_CHAT_RATE} сообщ./с на чат, повторов при RetryAfter: {config.SEND_MAX_RETRIES}"
+    )
+    return send_queue
+
+
+async def close_send_queue():
+    global send_queue
+    if send_queue is not None:
+        await send_queue.close()
+        send_queue = None
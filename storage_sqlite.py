@@ -0,0 +1,279 @@
+"""
+Встроенное хранилище на SQLite (режим WAL) для небольших установок, CI и бенчмарков.
+
+SqlitePool реализует то подмножество интерфейса asyncpg.Pool/Connection,
+которое используется в database.py (acquire, execute, fetch, fetchrow, fetchval,
+transaction, close), поэтому функции database.py работают с любым из бэкендов.
+Запросы выполняются в отдельном потоке на каждое соединение, чтобы не блокировать event loop.
+Как и в asyncpg, к соединению подключаются логгеры запросов (add_query_logger), а пул
+принимает init - корутину, вызываемую для каждого нового соединения.
+"""
+import asyncio
+import logging
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timezone
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# Схема, эквивалентная PostgreSQL-схеме из database.create_tables_if_not_exist.
+# Время хранится текстом в UTC ('YYYY-MM-DD HH:MM:SS.ffffff+00:00'), поэтому
+# сравнение строк совпадает с хронологическим порядком.
+SQLITE_NOW = "strftime('%Y-%m-%d %H:%M:%f+00:00', 'now')"
+SCHEMA_SQL = f"""
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT,
+        username TEXT, created_at TIMESTAMPTZ NOT NULL DEFAULT ({SQLITE_NOW}),
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT ({SQLITE_NOW}), timezone TEXT DEFAULT 'UTC',
+        current_weight REAL, height INTEGER, gender TEXT, goal TEXT,
+        daily_calorie_goal INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS user_products (
+        product_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+        product_name TEXT NOT NULL, calories_per_100g INTEGER NOT NULL CHECK (calories_per_100g >= 0),
+        created_at TIMESTAMPTZ NOT NULL DEFAULT ({SQLITE_NOW}), last_used_at TIMESTAMPTZ,
+        CONSTRAINT user_products_user_id_product_name_key UNIQUE (user_id, product_name)
+    );
+    CREATE INDEX IF NOT EXISTS idx_user_products_user_id_name ON user_products (user_id, product_name);
+    CREATE TABLE IF NOT EXISTS food_entries (
+        entry_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+        product_name TEXT NOT NULL, weight_grams INTEGER NOT NULL CHECK (weight_grams > 0),
+        calories_consumed INTEGER NOT NULL CHECK (calories_consumed >= 0),
+        entry_timestamp TIMESTAMPTZ NOT NULL, idempotency_key TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_food_entries_user_id_timestamp ON food_entries (user_id, entry_timestamp);
+    CREATE TABLE IF NOT EXISTS goal_history (
+        history_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+        effective_date DATE NOT NULL, daily_calorie_goal INTEGER NOT NULL,
+        CONSTRAINT goal_history_user_date_key UNIQUE (user_id, effective_date)
+    );
+    CREATE INDEX IF NOT EXISTS idx_goal_history_user_date ON goal_history (user_id, effective_date);
+    CREATE INDEX IF NOT EXISTS idx_users_timezone ON users ((COALESCE(timezone, 'UTC')));
+    CREATE TABLE IF NOT EXISTS digest_runs (
+        timezone TEXT NOT NULL, digest_date DATE NOT NULL,
+        started_at TIMESTAMPTZ NOT NULL DEFAULT ({SQLITE_NOW}), finished_at TIMESTAMPTZ,
+        sent INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (timezone, digest_date)
+    );
+"""
+
+
+def _adapt_datetime(value: datetime) -> str:
+    """Приводит datetime к UTC-строке фиксированного формата (naive считается UTC)."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f+00:00')
+
+
+def _convert_timestamptz(value: bytes) -> datetime:
+    parsed = datetime.fromisoformat(value.decode())
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _convert_date(value: bytes) -> date:
+    return date.fromisoformat(value.decode()[:10])
+
+
+sqlite3.register_converter("TIMESTAMPTZ", _convert_timestamptz)
+sqlite3.register_converter("DATE", _convert_date)
+
+
+def _to_sqlite_param(value: Any) -> Any:
+    if isinstance(value, datetime): return _adapt_datetime(value)
+    if isinstance(value, date): return value.isoformat()
+    return value
+
+
+@lru_cache(maxsize=256)
+def translate_sql(sql: str) -> tuple[str, bool]:
+    """
+    Переводит запрос из диалекта PostgreSQL в диалект SQLite: $1 -> ?1, NOW() -> дополнительный параметр.
+    Как и в PostgreSQL, NOW() одинаково во всем выражении: значение передается параметром
+    (см. SqliteConnection._execute_sync). Возвращает (запрос, используется ли NOW()).
+    """
+    now_index = max((int(n) for n in re.findall(r'\$(\d+)', sql)), default=0) + 1
+    sql = re.sub(r'\$(\d+)', r'?\1', sql)
+    translated = re.sub(r'\bNOW\(\)', f'?{now_index}', sql, flags=re.IGNORECASE)
+    return translated, translated != sql
+
+
+class LoggedQuery(NamedTuple):
+    """Запись о выполненном запросе (поля как у asyncpg.connection.LoggedQuery)."""
+    query: str
+    args: Any
+    timeout: Optional[float]
+    elapsed: float
+    exception: Optional[BaseException]
+
+
+class SqliteRecord(dict):
+    """Строка результата с доступом по имени (как asyncpg.Record) и по индексу."""
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return list(self.values())[key]
+        return super().__getitem__(key)
+
+
+def _record_factory(cursor: sqlite3.Cursor, row: tuple) -> SqliteRecord:
+    return SqliteRecord(zip((column[0] for column in cursor.description), row))
+
+
+def _status(sql: str, cursor: sqlite3.Cursor) -> str:
+    """Формирует строку статуса в формате asyncpg ('INSERT 0 1', 'UPDATE 1', ...)."""
+    verb = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+    if verb == "INSERT": return f"INSERT 0 {cursor.rowcount}"
+    if verb in ("UPDATE", "DELETE"): return f"{verb} {cursor.rowcount}"
+    return verb
+
+
+class SqliteConnection:
+    """Соединение SQLite с асинхронным API в стиле asyncpg.Connection."""
+
+    def __init__(self, path: str):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._query_loggers: List[Callable[[LoggedQuery], Any]] = []
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def add_query_logger(self, callback: Callable[[LoggedQuery], Any]):
+        """Вызывать callback после каждого запроса (в отличие от asyncpg - сразу, а не через call_soon)."""
+        self._query_loggers.append(callback)
+
+    def remove_query_logger(self, callback: Callable[[LoggedQuery], Any]):
+        self._query_loggers.remove(callback)
+
+    async def _run_logged(self, sql: str, args: Any, func, *func_args):
+        """Выполняет запрос в потоке соединения и сообщает о нем логгерам запросов."""
+        started = time.monotonic()
+        exception = None
+        try:
+            return await self._run(func, *func_args)
+        except BaseException as e:
+            exception = e
+            raise
+        finally:
+            if self._query_loggers:
+                record = LoggedQuery(sql, args, None, time.monotonic() - started, exception)
+                for callback in self._query_loggers:
+                    callback(record)
+
+    def _open_sync(self):
+        conn = sqlite3.connect(
+            self._path, detect_types=sqlite3.PARSE_DECLTYPES,
+            isolation_level=None, check_same_thread=False
+        )
+        conn.row_factory = _record_factory
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute("PRAGMA foreign_keys=ON;")
+        conn.execute("PRAGMA busy_timeout=5000;")
+        self._conn = conn
+
+    async def open(self):
+        await self._run(self._open_sync)
+
+    def _execute_sync(self, sql: str, args: tuple) -> sqlite3.Cursor:
+        translated, uses_now = translate_sql(sql)
+        params = [_to_sqlite_param(arg) for arg in args]
+        if uses_now:
+            params.append(_adapt_datetime(datetime.now(timezone.utc)))
+        return self._conn.execute(translated, params)
+
+    async def execute(self, sql: str, *args) -> str:
+        if not args and sql.count(';') > 1:
+            # Скрипт из нескольких выражений (например, создание схемы)
+            await self._run_logged(sql, args, self._conn.executescript, sql)
+            return ""
+        def run():
+            cursor = self._execute_sync(sql, args)
+            return _status(sql, cursor)
+        return await self._run_logged(sql, args, run)
+
+    async def executemany(self, sql: str, args_list) -> None:
+        translated, uses_now = translate_sql(sql)
+        now = [_adapt_datetime(datetime.now(timezone.utc))] if uses_now else []
+        rows = [[_to_sqlite_param(arg) for arg in args] + now for args in args_list]
+        await self._run_logged(sql, args_list, self._conn.executemany, translated, rows)
+
+    async def fetch(self, sql: str, *args) -> List[SqliteRecord]:
+        return await self._run_logged(sql, args, lambda: self._execute_sync(sql, args).fetchall())
+
+    async def fetchrow(self, sql: str, *args) -> Optional[SqliteRecord]:
+        return await self._run_logged(sql, args, lambda: self._execute_sync(sql, args).fetchone())
+
+    async def fetchval(self, sql: str, *args) -> Any:
+        row = await self.fetchrow(sql, *args)
+        return row[0] if row else None
+
+    @asynccontextmanager
+    async def transaction(self):
+        await self._run_logged("BEGIN IMMEDIATE;", (), self._conn.execute, "BEGIN IMMEDIATE;")
+        try:
+            yield
+        except BaseException:
+            await self._run_logged("ROLLBACK;", (), self._conn.execute, "ROLLBACK;")
+            raise
+        await self._run_logged("COMMIT;", (), self._conn.execute, "COMMIT;")
+
+    async def close(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+
+class SqlitePool:
+    """Пул соединений SQLite с интерфейсом asyncpg.Pool (acquire/close/get_size/get_idle_size)."""
+
+    def __init__(self, path: str, max_size: int = 4, init: Optional[Callable[[SqliteConnection], Awaitable[None]]] = None):
+        self._path = path
+        self._init = init
+        # In-memory база существует только в рамках одного соединения
+        self._max_size = 1 if path == ":memory:" else max_size
+        self._connections: List[SqliteConnection] = []
+        self._idle: asyncio.Queue[SqliteConnection] = asyncio.Queue()
+
+    async def open(self) -> "SqlitePool":
+        for _ in range(self._max_size):
+            connection = SqliteConnection(self._path)
+            await connection.open()
+            if self._init is not None:
+                await self._init(connection)
+            self._connections.append(connection)
+            self._idle.put_nowait(connection)
+        return self
+
+    @asynccontextmanager
+    async def acquire(self, *, timeout: Optional[float] = None):
+        connection = await asyncio.wait_for(self._idle.get(), timeout)
+        try:
+            yield connection
+        finally:
+            self._idle.put_nowait(connection)
+
+    def get_size(self) -> int:
+        return len(self._connections)
+
+    def get_max_size(self) -> int:
+        return self._max_size
+
+    def get_idle_size(self) -> int:
+        return self._idle.qsize()
+
+    async def close(self):
+        for connection in self._connections:
+            await connection.close()
+        self._connections.clear()
+
+
+async def create_pool(path: str, max_size: int = 4, init: Optional[Callable[[SqliteConnection], Awaitable[None]]] = None) -> SqlitePool:
+    """Открывает пул соединений к файлу SQLite (файл создается при необходимости)."""
+    return await SqlitePool(path, max_size=max_size, init=init).open()
@@ -0,0 +1,225 @@
+import asyncio
+import os
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DB_USER", "test-user")
+os.environ.setdefault("DB_PASS", "test-pass")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_NAME", "test-db")
+
+import time
+from types import SimpleNamespace
+
+import pytest
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import admission
+import config
+import database as db
+import storage_sqlite
+from handlers import add_food, reports
+from states import AddFood
+
+
+@pytest.fixture(autouse=True)
+def reset_state(monkeypatch):
+    monkeypatch.setattr(admission, "admission_stats", {"admitted": 0, "shed_in_flight": 0, "shed_heavy": 0, "db_busy": 0})
+    monkeypatch.setattr(admission, "_in_flight", 0)
+    monkeypatch.setattr(admission, "_heavy_in_flight", 0)
+    monkeypatch.setattr(db, "db_pool", None)
+    replies = []
+
+    async def fake_reply_busy(event, text=admission.BUSY_TEXT):
+        replies.append((event, text))
+
+    monkeypatch.setattr(admission, "reply_busy", fake_reply_busy)
+    return replies
+
+
+def _data(heavy=False):
+    async def callback(event):
+        pass
+    return {"handler": HandlerObject(callback=callback, flags={"heavy": True} if heavy else {})}
+
+
+def test_acquire_gives_up_after_deadline(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DB_ACQUIRE_TIMEOUT", 0.05)
+
+    async def scenario():
+        pool = await storage_sqlite.create_pool(str(tmp_path / "busy.sqlite3"), max_size=1)
+        try:
+            async with db.acquire(pool):
+                started = time.monotonic()
+                with pytest.raises(db.DatabaseBusyError):
+                    async with db.acquire(pool):
+                        pass
+                waited = time.monotonic() - started
+            async with db.acquire(pool) as connection: # Соединение вернулось в пул
+                assert await connection.fetchval("SELECT 1") == 1
+            return waited
+        finally:
+            await pool.close()
+
+    assert asyncio.run(scenario()) < 1
+
+
+def test_db_busy_error_becomes_busy_reply(reset_state):
+    async def handler(event, data):
+        raise db.DatabaseBusyError("Нет свободного соединения с БД за 5 с")
+
+    result = asyncio.run(admission.AdmissionMiddleware()(handler, "event", _data()))
+
+    assert result is None
+    assert reset_state == [("event", admission.BUSY_TEXT)]
+    assert admission.admission_stats["db_busy"] == 1
+    assert admission._in_flight == 0
+
+
+def test_heavy_reports_are_shed_before_interactive_work(tmp_path, monkeypatch, reset_state):
+    monkeypatch.setattr(config, "ADMISSION_RESERVED_CONNECTIONS", 2)
+    calls = []
+
+    async def handler(event, data):
+        calls.append(event)
+
+    async def scenario():
+        pool = await storage_sqlite.create_pool(str(tmp_path / "shed.sqlite3"), max_size=3)
+        monkeypatch.setattr(db, "db_pool", pool)
+        try:
+            middleware = admission.AdmissionMiddleware()
+            await middleware(handler, "month-free", _data(heavy=True))
+            async with pool.acquire(), pool.acquire(): # Свободно одно соединение из трех
+                await middleware(handler, "month-busy", _data(heavy=True))
+                await middleware(handler, "add-food", _data())
+        finally:
+            await pool.close()
+
+    asyncio.run(scenario())
+
+    assert calls == ["month-free", "add-food"]
+    assert reset_state == [("month-busy", admission.HEAVY_BUSY_TEXT)]
+    assert admission.admission_stats["shed_heavy"] == 1
+
+
+def test_in_flight_limit(monkeypatch, reset_state):
+    monkeypatch.setattr(config, "ADMISSION_MAX_IN_FLIGHT", 2)
+    monkeypatch.setattr(config, "ADMISSION_MAX_HEAVY", 1)
+    release = asyncio.Event()
+    calls = []
+
+    async def handler(event, data):
+        calls.append(event)
+        await release.wait()
+
+    async def scenario():
+        middleware = admission.AdmissionMiddleware()
+        running = [
+            asyncio.create_task(middleware(handler, "year", _data(heavy=True))),
+            asyncio.create_task(middleware(handler, "month", _data(heavy=True))),
+            asyncio.create_task(middleware(handler, "today", _data())),
+            asyncio.create_task(middleware(handler, "week", _data())),
+        ]
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(*running)
+
+    asyncio.run(scenario())
+
+    assert calls == ["year", "today"]
+    assert [event for event, _ in reset_state] == ["month", "week"]
+    assert admission.admission_stats == {"admitted": 2, "shed_in_flight": 1, "shed_heavy": 1, "db_busy": 0}
+    assert admission._in_flight == 0 and admission._heavy_in_flight == 0
+
+
+def test_long_reports_are_flagged_heavy():
+    heavy = {
+        handler.callback.__name__
+        for handler in reports.router.message.handlers
+        if handler.flags.get(admission.HEAVY_FLAG)
+    }
+    assert heavy == {"handle_month", "handle_report", "handle_year"}
+
+
+class FakeMessage:
+    def __init__(self, text):
+        self.text, self.message_id = text, 10
+        self.from_user = SimpleNamespace(id=1)
+        self.chat = SimpleNamespace(id=1)
+        self.sent = []
+
+    async def answer(self, text, reply_markup=None, **options):
+        self.sent.append(text)
+
+    async def reply(self, text, reply_markup=None, **options):
+        self.sent.append(text)
+
+
+def _weight_step(monkeypatch, add_food_entry, handle_today):
+    monkeypatch.setattr(db, "db_pool", object())
+    monkeypatch.setattr(db, "add_food_entry", add_food_entry)
+    monkeypatch.setattr(reports, "handle_today", handle_today)
+    message = FakeMessage("150")
+
+    async def scenario():
+        state = FSMContext(storage=MemoryStorage(), key=StorageKey(bot_id=1, chat_id=1, user_id=1))
+        await state.set_state(AddFood.waiting_for_weight)
+        await state.update_data(product_found=True, product_name="гречка", calories_per_100g=330)
+        try:
+            await add_food.process_weight(message, state)
+            return None, await state.get_state()
+        except db.DatabaseBusyError as e:
+            return e, await state.get_state()
+
+    error, current_state = asyncio.run(scenario())
+    return message, error, current_state
+
+
+def test_busy_summary_after_save_is_not_a_retry(monkeypatch):
+    saved = []
+
+    async def add_food_entry(pool, user_id, *args):
+        saved.append(args)
+        return True
+
+    async def busy_today(message):
+        raise db.DatabaseBusyError("Нет свободного соединения с БД за 5 с")
+
+    message, error, current_state = _weight_step(monkeypatch, add_food_entry, busy_today)
+
+    assert error is None # AdmissionMiddleware не ответит "попробуйте еще раз"
+    assert len(saved) == 1 and current_state is None
+    assert message.sent[0].startswith("✅ Добавлено")
+    assert "/today" in message.sent[1]
+
+
+def test_busy_write_keeps_fsm_step_for_retry(monkeypatch):
+    async def busy_add_food_entry(pool, user_id, *args):
+        raise db.DatabaseBusyError("Нет свободного соединения с БД за 5 с")
+
+    async def handle_today(message):
+        raise AssertionError("Сводка не показывается, если запись не сохранена")
+
+    message, error, current_state = _weight_step(monkeypatch, busy_add_food_entry, handle_today)
+
+    assert isinstance(error, db.DatabaseBusyError)
+    assert current_state == AddFood.waiting_for_weight.state
+    assert message.sent == []
+
+
+def test_redelivered_message_is_not_confirmed_twice(monkeypatch):
+    shown_today = []
+
+    async def duplicate_add_food_entry(pool, user_id, *args):
+        return False # Запись с этим idempotency_key уже есть
+
+    async def handle_today(message):
+        shown_today.append(message)
+
+    message, error, current_state = _weight_step(monkeypatch, duplicate_add_food_entry, handle_today)
+
+    assert error is None and current_state is None
+    assert message.sent == [add_food.ALREADY_SAVED_TEXT]
+    assert len(shown_today) == 1
@@ -0,0 +1,114 @@
+import os
+import random
+from datetime import date, timedelta
+
+# Минимальный набор переменных, чтобы импорт модулей проходил в тестовой среде
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DB_USER", "test-user")
+os.environ.setdefault("DB_PASS", "test-pass")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_NAME", "test-db")
+
+import pytest
+
+import analytics
+from handlers.reports import calculate_total_norm_for_period
+
+
+def _random_histories(seed: int, users: int) -> tuple[dict, dict]:
+    rng = random.Random(seed)
+    histories, goals = {}, {}
+    for user_id in range(users):
+        records, current = [], date(2025, 11, 1) + timedelta(days=rng.randint(0, 90))
+        for _ in range(rng.randint(0, 6)):
+            records.append({"effective_date": current, "daily_calorie_goal": rng.randint(1500, 3000)})
+            current += timedelta(days=rng.randint(0, 20)) # 0 - повтор даты, побеждает последняя запись
+        rng.shuffle(records)
+        if records or rng.random() < 0.5:
+            histories[user_id] = records
+        goals[user_id] = rng.choice([None, 0, 2100])
+    return histories, goals
+
+
+@pytest.mark.parametrize("use_numpy", [False, True])
+def test_batch_matches_single_user_calculation(use_numpy):
+    if use_numpy and analytics.np is None:
+        pytest.skip("numpy не установлен")
+    histories, goals = _random_histories(seed=7, users=300)
+    start = date(2026, 1, 1)
+    for days in (1, 7, 31):
+        result = analytics.calculate_period_norms_batch(start, days, histories, goals, use_numpy=use_numpy)
+        assert set(result) == set(goals)
+        for user_id in goals:
+            expected = calculate_total_norm_for_period(start, days, histories.get(user_id, []), goals[user_id])
+            assert result[user_id] == expected, user_id
+
+
+def test_batch_zero_period_days():
+    result = analytics.calculate_period_norms_batch(date(2026, 1, 1), 0, {}, {1: 2000})
+    assert result == {1: (0, 0, False)}
+
+
+def _random_profiles(seed: int, count: int) -> list[dict]:
+    rng = random.Random(seed)
+    return [
+        {
+            "current_weight": rng.choice([None, 0, round(rng.uniform(35, 180), 1)]),
+            "height": rng.choice([None, rng.randint(120, 210), rng.randint(150, 200)]),
+            "gender": rng.choice([None, "male", "female", "other"]),
+            "goal": rng.choice([None, "deficit", "maintenance", "surplus", "unknown"]),
+        }
+        for _ in range(count)
+    ]
+
+
+@pytest.mark.parametrize("use_numpy", [False, True])
+def test_daily_goals_batch_matches_utils(use_numpy):
+    if use_numpy and analytics.np is None:
+        pytest.skip("numpy не установлен")
+    profiles = _random_profiles(seed=3, count=2000)
+    expected = analytics._calculate_daily_goals_python(profiles)
+    assert any(goal is not None for goal in expected)
+    assert analytics.calculate_daily_goals_batch(profiles, use_numpy=use_numpy) == expected
+
+
+def test_daily_goals_batch_known_profile():
+    profile = {"current_weight": 80.0, "height": 180, "gender": "male", "goal": "deficit"}
+    lbm = analytics.utils.calculate_lbm(80.0, 180, "male")
+    _, calories = analytics.utils.calculate_target_macros_and_calories(lbm, "deficit")
+    assert analytics.calculate_daily_goals_batch([profile]) == [calories]
+    assert analytics.calculate_daily_goals_batch([]) == []
+
+
+def _boundary_profiles() -> list[dict]:
+    """Профили с весом в окрестности границ LBM <= 0 и LBM > LBM_MAX_WEIGHT_RATIO * вес."""
+    profiles = []
+    for gender, (weight_coef, height_coef, offset) in analytics.utils.LBM_COEFFICIENTS.items():
+        for height in (50, 60, 150, 180, 210):
+            boundaries = [
+                (offset - height_coef * height) / weight_coef, # LBM = 0
+                (height_coef * height - offset) / (analytics.utils.LBM_MAX_WEIGHT_RATIO - weight_coef), # LBM = 1.05 * W
+            ]
+            for boundary in boundaries:
+                if boundary <= 0:
+                    continue
+                for step in range(-20, 21):
+                    weight = round(boundary + step * 0.01, 2)
+                    if weight > 0:
+                        profiles.append({"current_weight": weight, "height": height, "gender": gender, "goal": "maintenance"})
+    return profiles
+
+
+@pytest.mark.parametrize("use_numpy", [False, True])
+def test_daily_goals_batch_matches_utils_near_lbm_bounds(use_numpy):
+    if use_numpy and analytics.np is None:
+        pytest.skip("numpy не установлен")
+    profiles = _boundary_profiles()
+    expected = []
+    for profile in profiles:
+        lbm = analytics.utils.calculate_lbm(profile["current_weight"], profile["height"], profile["gender"])
+        expected.append(analytics.utils.calculate_target_macros_and_calories(lbm, profile["goal"])[1] if lbm else None)
+    # По обе стороны границ есть и рассчитанные нормы, и отказы
+    assert None in expected and any(goal is not None for goal in expected)
+
+    assert analytics.calculate_daily_goals_batch(profiles, use_numpy=use_numpy) == expected
@@ -0,0 +1,217 @@
+import asyncio
+import os
+from datetime import date, datetime
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DB_USER", "test-user")
+os.environ.setdefault("DB_PASS", "test-pass")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_NAME", "test-db")
+
+import pytest
+import pytz
+
+import cache
+
+
+def test_next_local_midnight_regular_day():
+    tz = pytz.timezone("Europe/Moscow")
+    midnight = cache.next_local_midnight(tz, date(2026, 1, 15))
+    assert midnight == tz.localize(datetime(2026, 1, 16))
+    assert midnight.astimezone(pytz.utc) == pytz.utc.localize(datetime(2026, 1, 15, 21, 0))
+
+
+def test_next_local_midnight_respects_dst_change():
+    tz = pytz.timezone("Europe/Berlin")
+    # 29.03.2026 переход на летнее время: сутки длятся 23 часа
+    start = tz.localize(datetime(2026, 3, 29))
+    midnight = cache.next_local_midnight(tz, date(2026, 3, 29))
+    assert (midnight - start).total_seconds() == 23 * 3600
+
+
+class FakePipeline:
+    """Очередь команд FakeRedis, выполняемая в execute()."""
+
+    def __init__(self, redis):
+        self.redis, self.calls = redis, []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self):
+        return [getattr(self.redis, f"_{name}")(*args, **kwargs) for name, args, kwargs in self.calls]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeRedis:
+    """
+    Минимальный Redis в памяти для ключей сводки "за сегодня".
+    Lua-скрипты cache.py выполняются их построчными аналогами на Python (eval ниже).
+    """
+
+    def __init__(self):
+        self.strings, self.hashes, self.lists = {}, {}, {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    # --- Команды ---
+    def _get(self, key):
+        return self.strings.get(key)
+
+    def _incr(self, key):
+        self.strings[key] = str(int(self.strings.get(key, 0)) + 1)
+        return int(self.strings[key])
+
+    def _expire(self, key, seconds):
+        return True
+
+    def _hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def _lrange(self, key, start, end):
+        return list(self.lists.get(key, []))
+
+    def _delete(self, *keys):
+        for key in keys:
+            self.strings.pop(key, None); self.hashes.pop(key, None); self.lists.pop(key, None)
+
+    async def eval(self, script, numkeys, *args):
+        keys, argv = [str(arg) for arg in args[:numkeys]], [str(arg) for arg in args[numkeys:]]
+        if script == cache.RECORD_ENTRY_LUA:
+            return self._record_entry(keys, argv)
+        if script == cache.STORE_SUMMARY_LUA:
+            return self._store_summary(keys, argv)
+        raise AssertionError("Неизвестный скрипт")
+
+    def _record_entry(self, keys, argv):
+        self._incr(keys[2])
+        if keys[0] not in self.hashes:
+            return 0
+        built = self.hashes[keys[0]].get('seq', '')
+        if built.isdigit() and int(built) < int(argv[3]):
+            self.hashes[keys[0]]['total'] = str(int(self.hashes[keys[0]]['total']) + int(argv[0]))
+            self.lists.setdefault(keys[1], []).append(argv[1])
+            return 1
+        self._delete(keys[0], keys[1])
+        return -1
+
+    def _store_summary(self, keys, argv):
+        if (self.strings.get(keys[2]) or '') != argv[0]:
+            return 0
+        self._delete(keys[0], keys[1])
+        self.hashes[keys[0]] = {'date': argv[2], 'tz': argv[3], 'total': argv[4], 'seq': argv[0] if argv[0].isdigit() else '0'}
+        if len(argv) > 5:
+            self.lists[keys[1]] = list(argv[5:])
+        return 1
+
+
+USER_ID, TZ = 7, "Europe/Moscow"
+TODAY = date(2026, 1, 15)
+MEAL = {'product_name': "гречка", 'weight_grams': 200, 'calories_consumed': 220}
+SNACK = {'product_name': "яблоко", 'weight_grams': 150, 'calories_consumed': 70}
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(cache, "redis_client", redis)
+    return redis
+
+
+def _store(rows, seq):
+    expire_at = cache.next_local_midnight(pytz.timezone(TZ), TODAY)
+    return cache.store_today_summary(USER_ID, TZ, TODAY, expire_at, rows, seq)
+
+
+async def _read():
+    return await cache.get_today_summary(USER_ID, TZ, TODAY)
+
+
+async def _today_total(db_rows):
+    """Чтение /today: кэш или пересборка из "БД"."""
+    cached, seq = await _read()
+    if cached is None:
+        await _store(db_rows, seq)
+        return sum(row['calories_consumed'] for row in db_rows)
+    return cached[0]
+
+
+def test_record_appends_to_summary_built_before_insert(fake_redis):
+    async def scenario():
+        assert await _today_total([MEAL]) == 220 # Сводка собрана из БД
+        seq = await cache.begin_food_entry(USER_ID)
+        await cache.record_food_entry(USER_ID, SNACK, seq) # INSERT закоммичен между begin и record
+        return await _read()
+
+    (total, entries), _ = asyncio.run(scenario())
+    assert total == 290
+    assert entries == [MEAL, SNACK]
+
+
+def test_rebuild_racing_with_insert_does_not_count_entry_twice(fake_redis):
+    async def scenario():
+        _, seq_before = await _read() # Пересборка прочитала версию...
+        begin_seq = await cache.begin_food_entry(USER_ID) # ...add_food_entry закоммитил запись...
+        await _store([MEAL], seq_before) # ...пересборка уже видит строку в БД, но сохранить не может
+        await cache.record_food_entry(USER_ID, MEAL, begin_seq)
+        return await _today_total([MEAL])
+
+    assert asyncio.run(scenario()) == 220
+
+
+def test_rebuild_after_begin_is_dropped_by_record(fake_redis):
+    async def scenario():
+        begin_seq = await cache.begin_food_entry(USER_ID)
+        _, seq = await _read() # Пересборка после begin: строка в БД может быть, а может и нет
+        await _store([MEAL], seq) # Видит закоммиченную строку и сохраняет сводку
+        await cache.record_food_entry(USER_ID, MEAL, begin_seq) # Не дописывает, а сбрасывает сводку
+        cached, _ = await _read()
+        return cached, await _today_total([MEAL])
+
+    cached, total = asyncio.run(scenario())
+    assert cached is None
+    assert total == 220
+
+
+def test_rebuild_read_before_commit_cannot_store_after_record(fake_redis):
+    async def scenario():
+        begin_seq = await cache.begin_food_entry(USER_ID)
+        _, seq = await _read() # Пересборка прочитала БД до коммита (строки нет)
+        await cache.record_food_entry(USER_ID, MEAL, begin_seq)
+        await _store([], seq) # Устаревшая сводка не сохраняется
+        return await _today_total([MEAL])
+
+    assert asyncio.run(scenario()) == 220
+
+
+def test_invalidate_drops_summary_and_in_flight_rebuild(fake_redis):
+    async def scenario():
+        await _today_total([MEAL])
+        _, seq = await _read()
+        await cache.invalidate_today(USER_ID)
+        after_invalidate, _ = await _read()
+        await _store([MEAL], seq) # Пересборка, начатая до сброса, не сохраняется
+        return after_invalidate, await _read()
+
+    after_invalidate, (cached, _) = asyncio.run(scenario())
+    assert after_invalidate is None
+    assert cached is None
+
+
+def test_record_without_begin_seq_invalidates(fake_redis):
+    async def scenario():
+        await _today_total([MEAL])
+        await cache.record_food_entry(USER_ID, SNACK, None) # Redis был недоступен до INSERT
+        return await _read()
+
+    cached, _ = asyncio.run(scenario())
+    assert cached is None
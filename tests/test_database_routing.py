@@ -0,0 +1,47 @@
+import os
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DB_USER", "test-user")
+os.environ.setdefault("DB_PASS", "test-pass")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_NAME", "test-db")
+
+import database as db
+
+
+PRIMARY = object()
+REPLICA = object()
+
+
+def _setup(monkeypatch, lag):
+    monkeypatch.setattr(db, "db_pool", PRIMARY)
+    monkeypatch.setattr(db, "db_replica_pool", REPLICA)
+    monkeypatch.setattr(db, "replica_lag_seconds", lag)
+    monkeypatch.setattr(db.config, "DB_REPLICA_MAX_LAG", 5.0)
+    monkeypatch.setattr(db, "_last_write_at", {})
+
+
+def test_read_pool_without_replica_returns_primary(monkeypatch):
+    monkeypatch.setattr(db, "db_pool", PRIMARY)
+    monkeypatch.setattr(db, "db_replica_pool", None)
+    assert db.read_pool(1) is PRIMARY
+
+
+def test_read_pool_uses_replica_within_lag_tolerance(monkeypatch):
+    _setup(monkeypatch, lag=0.5)
+    assert db.read_pool(1) is REPLICA
+
+
+def test_read_pool_falls_back_when_lag_too_high_or_unknown(monkeypatch):
+    _setup(monkeypatch, lag=10.0)
+    assert db.read_pool(1) is PRIMARY
+    monkeypatch.setattr(db, "replica_lag_seconds", None)
+    assert db.read_pool(1) is PRIMARY
+
+
+def test_read_pool_reads_own_writes_from_primary(monkeypatch):
+    _setup(monkeypatch, lag=0.0)
+    db._mark_user_write(1)
+    assert db.read_pool(1) is PRIMARY
+    # Другие пользователи продолжают читать с реплики
+    assert db.read_pool(2) is REPLICA
@@ -0,0 +1,89 @@
+import asyncio
+import os
+from datetime import date, datetime, time, timedelta
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DB_USER", "test-user")
+os.environ.setdefault("DB_PASS", "test-pass")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_NAME", "test-db")
+
+import pytz
+
+import database as db
+import digest
+import storage_sqlite
+from send_queue import TokenBucket
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+def test_due_digest_date_window():
+    tz = pytz.timezone("Asia/Tokyo")
+    send_time = time(21, 0)
+    delay = timedelta(hours=2)
+    at_target = tz.localize(datetime(2026, 3, 5, 21, 0)).astimezone(pytz.utc)
+    assert digest.due_digest_date(tz, at_target, send_time, delay) == date(2026, 3, 5)
+    assert digest.due_digest_date(tz, at_target - timedelta(minutes=1), send_time, delay) is None
+    assert digest.due_digest_date(tz, at_target + delay, send_time, delay) is None
+
+
+def test_format_digest_skips_inactive_users():
+    assert digest.format_digest({"consumed": 0, "entries": 0, "norm": None}, date(2026, 3, 5)) is None
+    text = digest.format_digest({"consumed": 1800, "entries": 3, "norm": 2000}, date(2026, 3, 5))
+    assert "1800" in text and "90%" in text and "-200" in text
+
+
+def test_run_digest_groups_timezone_and_runs_once(tmp_path):
+    tz = pytz.timezone("Europe/Moscow")
+    digest_date = date(2026, 3, 5)
+
+    async def scenario(pool):
+        for user_id in (1, 2, 3, 4):
+            await db.add_or_update_user(pool, user_id, f"U{user_id}", None, None)
+        for user_id in (1, 2, 3):
+            await db.update_user_timezone_db(pool, user_id, "Europe/Moscow")
+        await db.update_user_profile_field(pool, 1, "daily_calorie_goal", 2500)
+        await db.add_goal_history_entry(pool, 1, date(2026, 3, 1), 2000)
+        await db.update_user_profile_field(pool, 2, "daily_calorie_goal", 1800) # без записей - напоминание
+        async with pool.acquire() as connection:
+            for user_id, local_dt, calories in [
+                (1, datetime(2026, 3, 5, 0, 30), 500),
+                (1, datetime(2026, 3, 5, 23, 50), 700),
+                (1, datetime(2026, 3, 4, 23, 50), 999), # вчера по Москве
+                (4, datetime(2026, 3, 5, 12, 0), 300), # другой пояс
+            ]:
+                await connection.execute(
+                    "INSERT INTO food_entries (user_id, product_name, weight_grams, calories_consumed, entry_timestamp) VALUES ($1, 'x', 100, $2, $3)",
+                    user_id, calories, tz.localize(local_dt),
+                )
+        rows = {row["user_id"]: row for row in await db.get_digest_rows(pool, "Europe/Moscow", digest_date)}
+        bot = FakeBot()
+        limiter = TokenBucket(1000, 1000)
+        first = await digest.run_digest_for_timezone(pool, bot, "Europe/Moscow", digest_date, time(21, 0), limiter)
+        second = await digest.run_digest_for_timezone(pool, bot, "Europe/Moscow", digest_date, time(21, 0), limiter)
+        return rows, bot.sent, first, second
+
+    async def runner():
+        pool = await storage_sqlite.create_pool(str(tmp_path / "bot.sqlite3"))
+        try:
+            await db.create_tables_if_not_exist(pool)
+            return await scenario(pool)
+        finally:
+            await pool.close()
+
+    rows, sent, first, second = asyncio.run(runner())
+    assert set(rows) == {1, 2, 3}
+    assert (rows[1]["consumed"], rows[1]["entries"], rows[1]["norm"]) == (1200, 2, 2000)
+    assert (rows[2]["consumed"], rows[2]["norm"]) == (0, 1800)
+    assert sorted(chat_id for chat_id, _ in sent) == [1, 2]
+    assert (first["users"], first["sent"], first["failed"]) == (3, 2, 0)
+    assert first["lag_first"] is not None
+    assert second is None
+
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import os
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DB_USER", "test-user")
+os.environ.setdefault("DB_PASS", "test-pass")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_NAME", "test-db")
+
+from aiogram import Dispatcher
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.redis import RedisStorage
+
+import fsm_cache
+from states import AddFood
+
+KEY = StorageKey(bot_id=1, chat_id=1, user_id=1)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def get(self, key):
+        self.commands.append(("get", key))
+
+    def set(self, key, value, ex=None):
+        self.commands.append(("set", key, value))
+
+    def delete(self, key):
+        self.commands.append(("delete", key))
+
+    def zadd(self, key, mapping):
+        self.commands.append(("zadd", key, mapping))
+
+    def zrem(self, key, *members):
+        self.commands.append(("zrem", key, members))
+
+    async def execute(self):
+        self.redis.round_trips += 1
+        results = []
+        for command in self.commands:
+            if command[0] == "get":
+                results.append(self.redis.values.get(command[1]))
+            elif command[0] == "set":
+                self.redis.values[command[1]] = command[2]
+                results.append(True)
+            elif command[0] == "zadd":
+                self.redis.values.setdefault(command[1], {}).update(command[2])
+                results.append(len(command[2]))
+            elif command[0] == "zrem":
+                zset = self.redis.values.get(command[1], {})
+                results.append(sum(zset.pop(member, None) is not None for member in command[2]))
+            else:
+                results.append(self.redis.values.pop(command[1], None) is not None)
+        return results
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+        self.round_trips = 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def get(self, key):
+        self.round_trips += 1
+        return self.values.get(key)
+
+
+async def _process_weight_like(state: FSMContext):
+    # Те же обращения, что в add_food.process_weight для найденного продукта
+    await state.get_state() # raw_state в FSMContextMiddleware
+    await state.update_data(weight=150)
+    data = await state.get_data()
+    await state.set_state(None)
+    await state.set_data({})
+    return data
+
+
+def test_update_reads_once_and_writes_in_one_pipeline():
+    async def scenario():
+        redis = FakeRedis()
+        storage = fsm_cache.UpdateCachedStorage(RedisStorage(redis=redis))
+        state = FSMContext(storage=storage, key=KEY)
+        redis.values["fsm:1:1:state"] = AddFood.waiting_for_weight.state
+        redis.values["fsm:1:1:data"] = json.dumps({"product_name": "гречка"})
+
+        async def handler(event, data):
+            return await _process_weight_like(state)
+
+        before = dict(fsm_cache.fsm_cache_stats)
+        result = await fsm_cache.FSMCacheMiddleware(storage)(handler, None, {})
+        operations = fsm_cache.fsm_cache_stats["operations"] - before["operations"]
+        return redis, result, operations
+
+    redis, result, operations = asyncio.run(scenario())
+    assert result == {"product_name": "гречка", "weight": 150}
+    assert redis.round_trips == 2 # чтение состояния и данных + запись изменений
+    assert operations == 6
+    assert redis.values == {}
+
+
+def test_outside_update_passes_through_and_keeps_own_writes():
+    async def scenario():
+        storage = fsm_cache.UpdateCachedStorage(MemoryStorage())
+        state = FSMContext(storage=storage, key=KEY)
+        await state.set_state(AddFood.waiting_for_weight)
+
+        async def handler(event, data):
+            await state.set_data({"weight": 100})
+            # Записанное в апдейте видно сразу, даже если хранилище еще не прочитано
+            assert await state.get_data() == {"weight": 100}
+            return await state.get_state()
+
+        inside = await fsm_cache.FSMCacheMiddleware(storage)(handler, None, {})
+        return inside, await storage.storage.get_data(KEY)
+
+    inside, stored = asyncio.run(scenario())
+    assert inside == AddFood.waiting_for_weight.state
+    assert stored == {"weight": 100}
+
+
+def test_install_wraps_fsm_middleware():
+    dp = Dispatcher(storage=fsm_cache.UpdateCachedStorage(MemoryStorage()))
+    fsm_cache.install_fsm_cache(dp)
+    middlewares = list(dp.update.outer_middleware)
+    assert isinstance(middlewares[-2], fsm_cache.FSMCacheMiddleware)
+    assert middlewares[-1] is dp.fsm
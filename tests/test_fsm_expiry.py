@@ -0,0 +1,247 @@
+import asyncio
+import os
+import time
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DB_USER", "test-user")
+os.environ.setdefault("DB_PASS", "test-pass")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_NAME", "test-db")
+
+from types import SimpleNamespace
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.redis import RedisStorage
+
+import fsm_cache
+import fsm_expiry
+import responses
+from handlers import settings
+from states import AddFood
+
+
+def _key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+def test_bounded_memory_storage_evicts_least_recently_used():
+    async def scenario():
+        storage = fsm_expiry.BoundedMemoryStorage(max_keys=2)
+        await storage.set_state(_key(1), AddFood.waiting_for_weight)
+        await storage.set_state(_key(2), AddFood.waiting_for_weight)
+        await storage.get_state(_key(1)) # пользователь 1 снова активен
+        await storage.set_state(_key(3), AddFood.waiting_for_weight)
+        # Чтение несуществующего ключа и сброс состояния не оставляют записей
+        await storage.get_state(_key(4))
+        await storage.set_state(_key(3), None)
+        return set(storage.storage)
+
+    evicted_before = fsm_expiry.fsm_expiry_stats["evicted"]
+    assert asyncio.run(scenario()) == {_key(1)}
+    assert fsm_expiry.fsm_expiry_stats["evicted"] == evicted_before + 1
+
+
+class FakeBot:
+    def __init__(self):
+        self.edited = []
+
+    async def edit_message_reply_markup(self, chat_id, message_id, reply_markup=None):
+        self.edited.append((chat_id, message_id))
+
+
+def test_sweep_resets_abandoned_flows_and_removes_keyboards(monkeypatch):
+    monkeypatch.setattr(fsm_expiry.config, "FSM_FLOW_TIMEOUT_MINUTES", 60)
+
+    async def scenario():
+        storage = fsm_expiry.BoundedMemoryStorage(max_keys=100)
+        await storage.set_state(_key(1), AddFood.waiting_for_product_name)
+        await storage.set_data(_key(1), {"last_bot_msg_id": 55})
+        await storage.set_state(_key(2), AddFood.waiting_for_weight)
+        storage.storage[_key(1)].updated_at = time.time() - 2 * 3600 # брошен два часа назад
+        storage.storage.move_to_end(_key(2))
+
+        bot = FakeBot()
+        expired = await fsm_expiry.sweep_stale_flows(bot, fsm_cache.UpdateCachedStorage(storage))
+        return expired, bot.edited, await storage.get_state(_key(1)), await storage.get_state(_key(2))
+
+    expired, edited, abandoned_state, active_state = asyncio.run(scenario())
+    assert expired == 1
+    assert edited == [(1, 55)]
+    assert abandoned_state is None
+    assert active_state == AddFood.waiting_for_weight.state
+
+
+class FakeRedis:
+    """Redis для RedisStorage и индекса активности; on_zrange/on_eval - действия пользователя между вызовами."""
+
+    def __init__(self):
+        self.values, self.activity = {}, {}
+        self.on_zrange = self.on_eval = None
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def zrangebyscore(self, name, low, high, start=None, num=None):
+        members = [member for member, score in sorted(self.activity.items(), key=lambda item: item[1]) if score <= high]
+        if self.on_zrange:
+            self.on_zrange()
+        return members[:num]
+
+    async def zscore(self, name, member):
+        return self.activity.get(member)
+
+    async def eval(self, script, numkeys, *args):
+        assert script == fsm_expiry.CLAIM_STALE_LUA
+        cutoff, members = args[numkeys], args[numkeys + 1:]
+        claimed = [member for member in members if member in self.activity and self.activity[member] <= cutoff]
+        for member in claimed:
+            del self.activity[member]
+        if self.on_eval:
+            self.on_eval()
+        return claimed
+
+
+class FakePipeline:
+    """Pipeline FakeRedis: команды выполняются по порядку в execute()."""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((name, args, kwargs))
+
+    def zadd(self, name, mapping):
+        self.commands.append(("zadd", (mapping,), {}))
+
+    def zrem(self, name, *members):
+        self.commands.append(("zrem", members, {}))
+
+    async def execute(self):
+        results = []
+        for name, args, kwargs in self.commands:
+            if name == "zadd":
+                self.redis.activity.update(args[0])
+                results.append(len(args[0]))
+            elif name == "zrem":
+                results.append(sum(self.redis.activity.pop(member, None) is not None for member in args))
+            else:
+                results.append(await getattr(self.redis, name)(*args, **kwargs))
+        return results
+
+
+def _redis_flow(monkeypatch, now):
+    monkeypatch.setattr(fsm_expiry.config, "FSM_FLOW_TIMEOUT_MINUTES", 60)
+    redis = FakeRedis()
+    storage = RedisStorage(redis=redis)
+    member = fsm_cache.encode_storage_key(_key(1))
+
+    async def start():
+        await storage.set_state(_key(1), AddFood.waiting_for_weight)
+        await storage.set_data(_key(1), {"last_bot_msg_id": 55})
+        redis.activity[member] = now - 2 * 3600 # Брошен два часа назад
+
+    asyncio.run(start())
+    return redis, storage, member
+
+
+def _sweep(redis, storage, now):
+    async def scenario():
+        bot = FakeBot()
+        expired = await fsm_expiry.sweep_stale_flows(bot, storage, now=now)
+        return expired, bot.edited, await storage.get_state(_key(1))
+    return asyncio.run(scenario())
+
+
+def test_redis_sweep_resets_abandoned_flow(monkeypatch):
+    now = time.time()
+    redis, storage, member = _redis_flow(monkeypatch, now)
+
+    assert _sweep(redis, storage, now) == (1, [(1, 55)], None)
+    assert member not in redis.activity
+
+
+def test_redis_sweep_skips_flow_resumed_before_claim(monkeypatch):
+    now = time.time()
+    redis, storage, member = _redis_flow(monkeypatch, now)
+    redis.on_zrange = lambda: redis.activity.update({member: now}) # Пользователь ответил до захвата
+
+    assert _sweep(redis, storage, now) == (0, [], AddFood.waiting_for_weight.state)
+    assert redis.activity[member] == now
+
+
+def test_redis_sweep_skips_flow_resumed_after_claim(monkeypatch):
+    now = time.time()
+    redis, storage, member = _redis_flow(monkeypatch, now)
+    redis.on_eval = lambda: redis.activity.update({member: now}) # ...или сразу после захвата
+
+    assert _sweep(redis, storage, now) == (0, [], AddFood.waiting_for_weight.state)
+
+
+def test_redis_sweep_keeps_flow_with_data_only_updates(monkeypatch):
+    now = time.time()
+    redis, storage, member = _redis_flow(monkeypatch, now)
+    cached = fsm_cache.UpdateCachedStorage(storage)
+
+    async def refine_suggestions(event, data):
+        # Как process_product_name_input: состояние то же, меняются только данные
+        assert await cached.get_state(_key(1)) == AddFood.waiting_for_weight.state
+        await cached.update_data(_key(1), {"last_bot_msg_id": 56})
+
+    asyncio.run(fsm_cache.FSMCacheMiddleware(cached)(refine_suggestions, None, {}))
+
+    assert redis.activity[member] > now - 60
+    assert _sweep(redis, storage, now) == (0, [], AddFood.waiting_for_weight.state)
+
+
+class FakeUserMessage:
+    def __init__(self, user_id: int):
+        self.from_user = SimpleNamespace(id=user_id)
+        self.chat = SimpleNamespace(id=user_id)
+        self.sent = 100
+
+    async def answer(self, text, reply_markup=None, **options):
+        self.sent += 1
+        return SimpleNamespace(message_id=self.sent)
+
+
+def test_sweep_removes_settings_menu_keyboard(monkeypatch):
+    monkeypatch.setattr(fsm_expiry.config, "FSM_FLOW_TIMEOUT_MINUTES", 60)
+    monkeypatch.setattr(settings.db, "db_pool", None)
+
+    async def scenario():
+        storage = fsm_expiry.BoundedMemoryStorage(max_keys=100)
+        state = FSMContext(storage=storage, key=_key(1))
+
+        async def open_settings(event, data):
+            await settings.show_settings_menu(FakeUserMessage(1), state)
+
+        await responses.ResponseCoalescingMiddleware()(open_settings, None, {})
+        menu_data = await state.get_data()
+        storage.storage[_key(1)].updated_at = time.time() - 2 * 3600
+
+        bot = FakeBot()
+        expired = await fsm_expiry.sweep_stale_flows(bot, storage)
+        return menu_data, expired, bot.edited
+
+    menu_data, expired, edited = asyncio.run(scenario())
+    assert menu_data == {"last_bot_msg_id": 101}
+    assert expired == 1
+    assert edited == [(1, 101)]
@@ -0,0 +1,134 @@
+import asyncio
+import os
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DB_USER", "test-user")
+os.environ.setdefault("DB_PASS", "test-pass")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_NAME", "test-db")
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import circuit_breaker
+import config
+import database as db
+import health
+import loop_monitor
+import metrics
+import storage_sqlite
+from circuit_breaker import CircuitBreaker
+from handlers import add_food
+
+
+@pytest.fixture(autouse=True)
+def reset_state(monkeypatch):
+    monkeypatch.setattr(health, "_started_at", None)
+    monkeypatch.setattr(health, "_last_poll_at", None)
+    monkeypatch.setattr(health, "_last_update_at", None)
+    monkeypatch.setattr(health, "_fsm_storage", None)
+    monkeypatch.setattr(loop_monitor, "loop_lag_stats", {"last_lag": 0.0, "max_lag": 0.0, "alerts": 0, "blocked_dumps": 0})
+    monkeypatch.setattr(db, "db_pool", None)
+    monkeypatch.setattr(db, "db_replica_pool", None)
+
+
+def test_breaker_opens_after_threshold_and_allows_one_trial():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+
+    breaker.record_failure(now=0)
+    assert breaker.allow(now=1)
+    breaker.record_failure(now=1)
+    assert breaker.state == circuit_breaker.OPEN
+    assert not breaker.allow(now=10)
+
+    assert breaker.allow(now=31) # Пробная попытка
+    assert not breaker.allow(now=32) # Вторая, пока идет первая, отклоняется
+    breaker.record_failure(now=35)
+    assert not breaker.allow(now=60)
+    assert breaker.allow(now=65)
+    breaker.record_success()
+    assert breaker.state == circuit_breaker.CLOSED
+    assert breaker.allow(now=66)
+    assert breaker.snapshot() == {"state": "closed", "failures": 0, "rejected": 3}
+
+
+def test_open_breaker_skips_off_request(monkeypatch):
+    breaker = CircuitBreaker("off-test", failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    monkeypatch.setattr(add_food, "off_breaker", breaker)
+
+    class FailingSession:
+        def __init__(self, *args, **kwargs):
+            raise AssertionError("OFF не должен запрашиваться при разомкнутом предохранителе")
+
+    monkeypatch.setattr(add_food.aiohttp, "ClientSession", FailingSession)
+
+    assert asyncio.run(add_food.fetch_products_from_off("гречка")) is None
+    assert breaker.rejected == 1
+
+
+def test_liveness_fails_when_polling_stalls(monkeypatch):
+    monkeypatch.setattr(config, "HEALTH_POLL_STALE_SECONDS", 90)
+    monkeypatch.setattr(health, "_started_at", 1000.0)
+
+    assert health.liveness(now=1050.0)[0] # Первого getUpdates еще не было, но запуск недавний
+    assert not health.liveness(now=1100.0)[0]
+
+    monkeypatch.setattr(health, "_last_poll_at", 1095.0)
+    ok, details = health.liveness(now=1100.0)
+    assert ok
+    assert details["last_poll_age"] == 5.0
+
+
+def test_readiness_reports_pool_and_flips_on_saturation(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "HEALTH_CHECK_TIMEOUT", 0.05)
+
+    async def scenario():
+        pool = await storage_sqlite.create_pool(str(tmp_path / "health.sqlite3"), max_size=2)
+        monkeypatch.setattr(db, "db_pool", pool)
+        try:
+            async with TestClient(TestServer(metrics.create_app())) as client:
+                ready = await client.get("/readyz")
+                ready_body = await ready.json()
+                async with pool.acquire(), pool.acquire():
+                    saturated = await client.get("/readyz")
+                    saturated_body = await saturated.json()
+                return ready.status, ready_body, saturated.status, saturated_body
+        finally:
+            await pool.close()
+
+    status, body, saturated_status, saturated_body = asyncio.run(scenario())
+
+    assert status == 200
+    assert body["checks"]["database"] == {"ok": True, "size": 2, "idle": 2, "used": 0, "max": 2, "saturated": False}
+    assert "off" in body["breakers"]
+    assert saturated_status == 503
+    assert saturated_body["status"] == "fail"
+    assert saturated_body["checks"]["database"]["used"] == 2
+    assert saturated_body["checks"]["database"]["saturated"]
+
+
+def test_readiness_fails_on_loop_lag_and_missing_pool(monkeypatch):
+    monkeypatch.setattr(config, "HEALTH_MAX_LOOP_LAG_MS", 500)
+    loop_monitor.loop_lag_stats["last_lag"] = 0.8
+
+    ok, details = asyncio.run(health.readiness())
+
+    assert not ok
+    assert not details["checks"]["database"]["ok"]
+    assert not details["checks"]["event_loop"]["ok"]
+    assert details["checks"]["fsm_storage"]["ok"]
+
+
+def test_healthz_endpoint(monkeypatch):
+    monkeypatch.setattr(config, "HEALTH_POLL_STALE_SECONDS", 0.0)
+
+    async def scenario():
+        health._started_at = health.time.monotonic() - 1
+        async with TestClient(TestServer(metrics.create_app())) as client:
+            response = await client.get("/healthz")
+            return response.status, await response.json()
+
+    status, body = asyncio.run(scenario())
+    assert status == 503
+    assert body["status"] == "fail"
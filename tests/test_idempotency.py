@@ -0,0 +1,111 @@
+import asyncio
+import os
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DB_USER", "test-user")
+os.environ.setdefault("DB_PASS", "test-pass")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_NAME", "test-db")
+
+from types import SimpleNamespace
+
+import pytest
+from aiogram.types import Update
+
+import database as db
+import idempotency
+import storage_sqlite
+
+
+def test_food_entry_with_same_key_is_added_once(tmp_path):
+    async def scenario():
+        pool = await storage_sqlite.create_pool(str(tmp_path / "bot.sqlite3"))
+        try:
+            await db.create_tables_if_not_exist(pool)
+            await db.add_or_update_user(pool, 1, "Ann", None, "ann")
+            first = await db.add_food_entry(pool, 1, "гречка", 150, 495, "m:1:10")
+            repeat = await db.add_food_entry(pool, 1, "гречка", 150, 495, "m:1:10")
+            # Без ключа записи не считаются повторами
+            await db.add_food_entry(pool, 1, "гречка", 150, 495)
+            await db.add_food_entry(pool, 1, "гречка", 150, 495)
+            async with pool.acquire() as connection:
+                count = await connection.fetchval("SELECT COUNT(*) FROM food_entries;")
+            return first, repeat, count
+        finally:
+            await pool.close()
+
+    assert asyncio.run(scenario()) == (True, False, 3)
+
+
+def test_duplicate_update_is_skipped_and_failed_update_can_retry(monkeypatch):
+    monkeypatch.setattr(idempotency.cache, "redis_client", None)
+    monkeypatch.setattr(idempotency, "_local_updates", idempotency.OrderedDict())
+    middleware = idempotency.UpdateDeduplicationMiddleware()
+    data = {"bot": SimpleNamespace(id=1)}
+    keys = []
+
+    async def handler(event, handler_data):
+        keys.append(idempotency.update_idempotency_key(7))
+        return "ok"
+
+    async def failing(event, handler_data):
+        raise RuntimeError("обработка прервана")
+
+    async def scenario():
+        assert await middleware(handler, Update(update_id=100), data) == "ok"
+        assert await middleware(handler, Update(update_id=100), data) is None
+        with pytest.raises(RuntimeError):
+            await middleware(failing, Update(update_id=101), data)
+        assert await middleware(handler, Update(update_id=101), data) == "ok"
+
+    asyncio.run(scenario())
+    assert keys == ["u:1:100:7", "u:1:101:7"]
+
+
+class FakeRedis:
+    """SET с NX/XX/EX и часами, которые тест двигает вручную."""
+
+    def __init__(self):
+        self.now, self.values = 0.0, {}
+
+    def _alive(self, key):
+        value = self.values.get(key)
+        if value is not None and value[1] <= self.now:
+            del self.values[key]
+            value = None
+        return value
+
+    async def set(self, key, value, nx=False, xx=False, ex=None):
+        exists = self._alive(key) is not None
+        if (nx and exists) or (xx and not exists):
+            return None
+        self.values[key] = (value, self.now + ex)
+        return True
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+
+def test_interrupted_update_is_redelivered_after_lease(monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(idempotency.cache, "redis_client", redis)
+    monkeypatch.setattr(idempotency.config, "UPDATE_DEDUP_LEASE", 120)
+    monkeypatch.setattr(idempotency.config, "UPDATE_DEDUP_TTL", 24 * 3600)
+    middleware = idempotency.UpdateDeduplicationMiddleware()
+    data = {"bot": SimpleNamespace(id=1)}
+
+    async def handler(event, handler_data):
+        return "ok"
+
+    async def scenario():
+        # Процесс упал посреди обработки апдейта 200: отметка осталась "processing"
+        assert await idempotency.claim_update(1, 200)
+        assert await middleware(handler, Update(update_id=200), data) is None # Еще обрабатывается
+        redis.now += 121
+        assert await middleware(handler, Update(update_id=200), data) == "ok" # Повторная доставка выполнена
+        assert redis.values["upd:1:200"] == ("done", redis.now + 24 * 3600)
+        redis.now += 3600
+        assert await middleware(handler, Update(update_id=200), data) is None # Обработанный апдейт не повторяется
+
+    asyncio.run(scenario())
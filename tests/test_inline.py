@@ -0,0 +1,64 @@
+import asyncio
+import os
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DB_USER", "test-user")
+os.environ.setdefault("DB_PASS", "test-pass")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_NAME", "test-db")
+
+from types import SimpleNamespace
+
+import database as db
+import storage_sqlite
+from handlers import inline
+
+
+def test_parse_inline_query_weight_suffix():
+    assert inline.parse_inline_query("греч 150") == ("греч", 150)
+    assert inline.parse_inline_query("  гречка   отварная 200г ") == ("гречка отварная", 200)
+    assert inline.parse_inline_query("гречка") == ("гречка", inline.DEFAULT_INLINE_WEIGHT)
+    assert inline.parse_inline_query("молоко 3.2") == ("молоко 3.2", inline.DEFAULT_INLINE_WEIGHT)
+    assert inline.parse_inline_query("") == ("", inline.DEFAULT_INLINE_WEIGHT)
+
+
+def test_result_id_roundtrip():
+    assert inline.parse_result_id(inline.make_result_id(42, 150)) == (42, 150)
+    assert inline.parse_result_id("42") is None
+    assert inline.parse_result_id("42:0") is None
+
+
+class FakeInlineQuery:
+    def __init__(self, user_id, query):
+        self.from_user = SimpleNamespace(id=user_id)
+        self.query = query
+        self.answers = []
+
+    async def answer(self, results, **options):
+        self.answers.append((results, options))
+
+
+def test_inline_query_and_chosen_result_log_entry(tmp_path, monkeypatch):
+    async def scenario():
+        pool = await storage_sqlite.create_pool(str(tmp_path / "bot.sqlite3"))
+        monkeypatch.setattr(db, "db_pool", pool)
+        try:
+            await db.create_tables_if_not_exist(pool)
+            await db.add_or_update_user(pool, 1, "Ann", None, "ann")
+            await db.add_user_product(pool, 1, "Гречка", 330)
+            await db.add_user_product(pool, 1, "Творог", 120)
+
+            query = FakeInlineQuery(1, "греч 150")
+            await inline.handle_inline_query(query)
+            (results, options), = query.answers
+            chosen = SimpleNamespace(from_user=SimpleNamespace(id=1), result_id=results[0].id)
+            await inline.handle_chosen_inline_result(chosen)
+            _, entries = await db.get_todays_summary(pool, 1, "UTC")
+            return results, options, entries
+        finally:
+            await pool.close()
+
+    results, options, entries = asyncio.run(scenario())
+    assert [result.title for result in results] == ["гречка - 150г"]
+    assert options["is_personal"] is True and options["cache_time"] == inline.INLINE_CACHE_TIME
+    assert [(entry["product_name"], entry["weight_grams"], entry["calories_consumed"]) for entry in entries] == [("гречка", 150, 495)]
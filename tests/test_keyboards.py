@@ -0,0 +1,95 @@
+import asyncio
+import os
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DB_USER", "test-user")
+os.environ.setdefault("DB_PASS", "test-pass")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_NAME", "test-db")
+
+from types import SimpleNamespace
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import CallbackQuery, User
+
+import keyboards
+from handlers import add_food
+from states import AddFood
+
+
+def _callback_data(markup):
+    return [button.callback_data for row in markup.inline_keyboard for button in row]
+
+
+def test_callback_data_is_compact_and_typed():
+    data = _callback_data(keyboards.product_suggestions_keyboard(
+        [{'product_id': 123456789, 'product_name': "гречка" * 20, 'calories_per_100g': 330}]
+    ))
+    assert data == ["p:123456789"]
+    assert keyboards.ProductSelect.unpack(data[0]).product_id == 123456789
+    for markup in (keyboards.settings_main_keyboard(), keyboards.select_goal_keyboard(), keyboards.select_gender_keyboard()):
+        assert all(len(value.encode()) <= 4 for value in _callback_data(markup))
+
+
+def test_settings_callbacks_use_codes_mapped_to_profile_values():
+    goals = [keyboards.GoalSelect.unpack(value).goal for value in _callback_data(keyboards.select_goal_keyboard())[:-1]]
+    genders = [keyboards.GenderSelect.unpack(value).gender for value in _callback_data(keyboards.select_gender_keyboard())[:-1]]
+    actions = {keyboards.SettingsAction.unpack(value).action for value in _callback_data(keyboards.settings_main_keyboard())}
+
+    assert [keyboards.GOAL_VALUES[goal] for goal in goals] == ["deficit", "maintenance", "surplus", None]
+    assert [keyboards.GENDER_VALUES[gender] for gender in genders] == ["male", "female"]
+    assert actions == set(keyboards.SettingsMenuAction) - {keyboards.SETTINGS_SHOW_MENU_ACTION}
+
+    # Кнопка со старым строковым значением или неизвестным кодом не доходит до обработчика
+    for data in ("sg:deficit", "sg:9"):
+        query = CallbackQuery(id="1", from_user=User(id=1, is_bot=False, first_name="u"), chat_instance="c", data=data)
+        assert asyncio.run(keyboards.GoalSelect.filter()(query)) is False
+
+
+def test_api_options_keyboard_uses_indexes():
+    markup = keyboards.select_api_product_keyboard([["Гречка ядрица", 330], ["Гречка " + "x" * 40, 340]])
+    data = _callback_data(markup)
+    assert [keyboards.ApiChoice.unpack(value).index for value in data] == [0, 1, keyboards.MANUAL_INPUT_INDEX]
+    assert markup.inline_keyboard[1][0].text.endswith("... (340 ккал)")
+
+
+class FakeMessage:
+    def __init__(self):
+        self.sent = []
+
+    async def answer(self, text, reply_markup=None, **options):
+        self.sent.append(text)
+
+    async def edit_reply_markup(self, reply_markup=None):
+        pass
+
+
+class FakeCallback:
+    def __init__(self):
+        self.from_user = SimpleNamespace(id=1)
+        self.message = FakeMessage()
+        self.alerts = []
+
+    async def answer(self, text=None, show_alert=False):
+        self.alerts.append(text)
+
+
+def test_api_choice_selects_option_by_index():
+    async def scenario():
+        state = FSMContext(storage=MemoryStorage(), key=StorageKey(bot_id=1, chat_id=1, user_id=1))
+        await state.set_state(AddFood.waiting_for_api_choice)
+        await state.update_data(api_options=[["гречка", 330], ["рис", 340]], weight=150)
+
+        stale = FakeCallback()
+        await add_food.process_api_choice(stale, keyboards.ApiChoice(index=5), state)
+        callback = FakeCallback()
+        await add_food.process_api_choice(callback, keyboards.ApiChoice(index=1), state)
+        return stale, callback, await state.get_state(), await state.get_data()
+
+    stale, callback, current_state, data = asyncio.run(scenario())
+    assert stale.alerts and stale.message.sent == []
+    assert current_state == AddFood.waiting_for_api_confirmation.state
+    assert (data['api_product_name'], data['api_calories'], data['api_options']) == ("рис", 340, None)
+    assert "рис" in callback.message.sent[0]
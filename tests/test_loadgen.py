@@ -0,0 +1,83 @@
+import asyncio
+import os
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DB_USER", "test-user")
+os.environ.setdefault("DB_PASS", "test-pass")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_NAME", "test-db")
+
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from aiogram.methods import AnswerCallbackQuery, SendMessage
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from tools import loadgen
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def test_fake_session_answers_and_remembers_keyboards():
+    session = loadgen.FakeTelegramSession()
+    bot = loadgen.Bot(token=loadgen.LOADGEN_TOKEN, session=session)
+    markup = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Гречка", callback_data="p:7")]])
+
+    async def scenario():
+        sent = await session.make_request(bot, SendMessage(chat_id=5, text="Выберите:", reply_markup=markup))
+        answered = await session.make_request(bot, AnswerCallbackQuery(callback_query_id="1"))
+        downloaded = [chunk async for chunk in session.stream_content("https://api.telegram.org/file/bot/x")]
+        return sent, answered, downloaded
+
+    sent, answered, downloaded = asyncio.run(scenario())
+
+    assert sent.chat.id == 5 and sent.text == "Выберите:"
+    assert answered is True
+    assert downloaded == []
+    assert session.keyboards[5][0].message_id == sent.message_id
+    assert session.requests == {"sendMessage": 1, "answerCallbackQuery": 1}
+
+
+def test_load_stats_percentiles_and_db_queries():
+    stats = loadgen.LoadStats()
+    for ms in range(1, 101):
+        stats.record("handle_today", ms / 1000, 2)
+    stats.record("handle_month", 0.5, 4, error=True)
+
+    report = stats.report(elapsed=10.0)
+
+    assert report["updates"] == 101
+    assert report["updates_per_second"] == 10.1
+    assert report["handlers"]["handle_today"]["p50_ms"] == pytest.approx(51)
+    assert report["handlers"]["handle_today"]["p99_ms"] == pytest.approx(100)
+    assert report["handlers"]["handle_month"]["errors"] == 1
+    assert round(report["db_queries_per_update"], 2) == 2.02
+
+
+def test_loadgen_runs_flows_through_dispatcher(tmp_path):
+    env = {
+        **os.environ,
+        "DB_BACKEND": "sqlite",
+        "SQLITE_PATH": str(tmp_path / "load.sqlite3"),
+        "FSM_STORAGE": "memory",
+        "CACHE_ENABLED": "false",
+        "METRICS_PORT": "0",
+        "TRACE_SAMPLE_RATE": "0",
+    }
+    report_path = tmp_path / "report.json"
+    result = subprocess.run(
+        [sys.executable, "tools/loadgen.py", "--users", "3", "--duration", "1", "--think", "0",
+         "--api-latency", "0", "--off-latency", "0", "--no-send-limits", "--json", str(report_path)],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=120,
+    )
+
+    assert result.returncode == 0, result.stdout + result.stderr
+    report = json.loads(report_path.read_text(encoding="utf-8"))
+    assert report["errors"] == 0
+    assert report["updates"] > 10
+    assert {"handle_start_command", "start_add_food", "process_weight"} <= set(report["handlers"])
+    assert report["db_queries_per_update"] > 0
+    assert report["off"].get("error", 0) == 0
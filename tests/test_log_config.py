@@ -0,0 +1,87 @@
+import json
+import logging
+import os
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DB_USER", "test-user")
+os.environ.setdefault("DB_PASS", "test-pass")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_NAME", "test-db")
+
+import queue
+import sys
+
+import config
+import log_config
+
+
+def make_record(msg="Запись %s", args=(1,), level=logging.INFO, lineno=10, **extra):
+    record = logging.LogRecord("database", level, "/app/database.py", lineno, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_formatter_includes_extra_fields_and_exception():
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.LogRecord("database", logging.ERROR, "/app/database.py", 1, "Ошибка для %s", (42,), sys.exc_info())
+    record.user_id = 42
+
+    payload = json.loads(log_config.JsonFormatter().format(record))
+
+    assert payload["level"] == "ERROR" and payload["logger"] == "database"
+    assert payload["message"] == "Ошибка для 42"
+    assert payload["user_id"] == 42
+    assert "ValueError: boom" in payload["exc"]
+    assert payload["ts"].endswith("+00:00")
+
+
+def test_rate_limit_filter_limits_debug_per_call_site(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(log_config.time, "monotonic", lambda: now[0])
+    rate_filter = log_config.RateLimitFilter(rate=2)
+
+    passed = [rate_filter.filter(make_record(level=logging.DEBUG)) for _ in range(5)]
+    # Другое место в коде и записи выше DEBUG не ограничиваются
+    assert rate_filter.filter(make_record(level=logging.DEBUG, lineno=11))
+    assert all(rate_filter.filter(make_record(level=logging.INFO)) for _ in range(5))
+
+    assert passed == [True, True, False, False, False]
+    now[0] += 1.0
+    record = make_record(level=logging.DEBUG)
+    assert rate_filter.filter(record)
+    assert record.suppressed == 3
+
+
+def test_queue_handler_defers_formatting():
+    log_queue = queue.SimpleQueue()
+    handler = log_config.DeferredQueueHandler(log_queue)
+    record = make_record(msg="Записей: %d", args=(3,))
+
+    handler.handle(record)
+
+    queued = log_queue.get_nowait()
+    assert queued.msg == "Записей: %d" and queued.args == (3,)
+    assert queued.getMessage() == "Записей: 3"
+
+
+def test_setup_logging_routes_root_through_queue(tmp_path, monkeypatch):
+    log_file = tmp_path / "bot.log"
+    monkeypatch.setattr(config, "LOG_FORMAT", "json")
+    monkeypatch.setattr(config, "LOG_FILE", str(log_file))
+    monkeypatch.setattr(config, "LOG_LEVEL", "INFO")
+    root = logging.getLogger()
+    saved_handlers, saved_level = root.handlers[:], root.level
+    try:
+        log_config.setup_logging()
+        assert [type(handler) for handler in root.handlers] == [log_config.DeferredQueueHandler]
+        logging.getLogger("database").info("Пользователь %s запросил сводку", 7, extra={"user_id": 7})
+        logging.getLogger("database").debug("не попадет в лог")
+    finally:
+        log_config.stop_logging()
+        root.handlers[:] = saved_handlers
+        root.setLevel(saved_level)
+
+    lines = [json.loads(line) for line in log_file.read_text(encoding="utf-8").splitlines()]
+    assert [(line["message"], line["user_id"]) for line in lines] == [("Пользователь 7 запросил сводку", 7)]
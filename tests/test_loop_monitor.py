@@ -0,0 +1,135 @@
+import asyncio
+import os
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DB_USER", "test-user")
+os.environ.setdefault("DB_PASS", "test-pass")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_NAME", "test-db")
+
+import logging
+import threading
+import time
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import config
+import loop_monitor
+import metrics
+import profiler
+
+
+@pytest.fixture(autouse=True)
+def reset_state(monkeypatch):
+    monkeypatch.setattr(loop_monitor, "loop_lag_stats", {"last_lag": 0.0, "max_lag": 0.0, "alerts": 0, "blocked_dumps": 0})
+    monkeypatch.setattr(loop_monitor, "_last_alert_at", float("-inf"))
+    monkeypatch.setattr(loop_monitor, "_alerts_suppressed", 0)
+
+
+def test_lag_alerts_are_rate_limited(monkeypatch, caplog):
+    monkeypatch.setattr(config, "LOOP_LAG_WARN_MS", 100)
+    caplog.set_level(logging.WARNING, logger="loop_monitor")
+
+    loop_monitor.record_lag(0.01, now=0.0)
+    loop_monitor.record_lag(0.3, now=1.0)
+    loop_monitor.record_lag(0.2, now=2.0)
+    loop_monitor.record_lag(0.2, now=1.0 + loop_monitor.LAG_ALERT_INTERVAL)
+
+    warnings = [record.getMessage() for record in caplog.records]
+    assert len(warnings) == 2
+    assert "300 мс" in warnings[0]
+    assert "еще 1 превышений" in warnings[1]
+    assert loop_monitor.loop_lag_stats["alerts"] == 3
+    assert loop_monitor.loop_lag_stats["max_lag"] == 0.3
+
+
+def test_sampler_measures_blocked_loop(monkeypatch):
+    monkeypatch.setattr(config, "LOOP_LAG_INTERVAL", 0.02)
+    monkeypatch.setattr(config, "LOOP_BLOCK_DUMP_MS", 0)
+    before = metrics.EVENT_LOOP_LAG.count()
+
+    async def scenario():
+        await loop_monitor.start_loop_monitor()
+        try:
+            await asyncio.sleep(0.03)
+            time.sleep(0.15) # Синхронный код в цикле событий
+            await asyncio.sleep(0.05)
+        finally:
+            await loop_monitor.stop_loop_monitor()
+
+    asyncio.run(scenario())
+
+    assert metrics.EVENT_LOOP_LAG.count() > before
+    assert loop_monitor.loop_lag_stats["max_lag"] >= 0.1
+
+
+def test_watchdog_dumps_loop_thread_stack_once_per_block(monkeypatch, caplog):
+    caplog.set_level(logging.ERROR, logger="loop_monitor")
+    monkeypatch.setattr(loop_monitor, "_last_tick", 100.0)
+    watchdog = loop_monitor._BlockWatchdog(threading.get_ident(), threshold=1.0, interval=0.5)
+
+    assert not watchdog.check(101.0) # 0.5 с сверх сна измерителя - еще не блокировка
+    assert watchdog.check(102.0)
+    assert not watchdog.check(103.0) # Та же блокировка
+    monkeypatch.setattr(loop_monitor, "_last_tick", 103.0)
+    assert not watchdog.check(103.1)
+    assert watchdog.check(105.0)
+
+    assert loop_monitor.loop_lag_stats["blocked_dumps"] == 2
+    assert "test_watchdog_dumps_loop_thread_stack_once_per_block" in caplog.records[0].getMessage()
+
+
+def test_cpu_profile_reports_busy_function():
+    def busy_parse():
+        return sum(len(str(i)) for i in range(20000))
+
+    async def scenario():
+        async def worker():
+            while True:
+                busy_parse()
+                await asyncio.sleep(0)
+
+        task = asyncio.create_task(worker())
+        try:
+            return await profiler.profile_cpu(0.05, top=50)
+        finally:
+            task.cancel()
+
+    report = asyncio.run(scenario())
+    assert "busy_parse" in report
+
+
+def test_allocation_profile_reports_growth():
+    retained = []
+
+    async def scenario():
+        async def allocate():
+            await asyncio.sleep(0.01)
+            retained.append([bytearray(1024) for _ in range(200)])
+
+        task = asyncio.create_task(allocate())
+        report = await profiler.profile_allocations(0.05, top=5)
+        await task
+        return report
+
+    report = asyncio.run(scenario())
+    assert "test_loop_monitor.py" in report
+
+
+def test_profile_endpoint_requires_token(monkeypatch):
+    async def scenario(token):
+        monkeypatch.setattr(config, "PROFILE_TOKEN", token)
+        async with TestClient(TestServer(metrics.create_app())) as client:
+            statuses = []
+            for headers in ({}, {profiler.TOKEN_HEADER: "wrong"}, {profiler.TOKEN_HEADER: "secret"}):
+                response = await client.get("/debug/profile?seconds=0.01&kind=memory", headers=headers)
+                statuses.append((response.status, await response.text()))
+            return statuses
+
+    disabled = asyncio.run(scenario(""))
+    assert [status for status, _ in disabled] == [404, 404, 404]
+
+    enabled = asyncio.run(scenario("secret"))
+    assert [status for status, _ in enabled] == [403, 403, 200]
+    assert enabled[2][1].startswith("Выделения памяти")
@@ -11,8 +11,8 @@ import main
 
 class DummyRedisStorage:
     @staticmethod
-    def from_url(url: str):
-        return {"kind": "redis", "url": url}
+    def from_url(url: str, **kwargs):
+        return {"kind": "redis", "url": url, **kwargs}
 
 
 def test_create_fsm_storage_redis_success(monkeypatch):
@@ -22,7 +22,10 @@ def test_create_fsm_storage_redis_success(monkeypatch):
 
     storage = main.create_fsm_storage()
 
-    assert storage == {"kind": "redis", "url": "redis://redis:6379/0"}
+    assert storage == {
+        "kind": "redis", "url": "redis://redis:6379/0",
+        "state_ttl": main.config.FSM_STATE_TTL, "data_ttl": main.config.FSM_DATA_TTL,
+    }
 
 
 def test_create_fsm_storage_redis_fallback_when_import_missing(monkeypatch):
@@ -31,7 +34,7 @@ def test_create_fsm_storage_redis_fallback_when_import_missing(monkeypatch):
 
     storage = main.create_fsm_storage()
 
-    assert isinstance(storage, main.MemoryStorage)
+    assert isinstance(storage, main.BoundedMemoryStorage)
 
 
 def test_create_fsm_storage_memory(monkeypatch):
@@ -39,4 +42,4 @@ def test_create_fsm_storage_memory(monkeypatch):
 
     storage = main.create_fsm_storage()
 
-    assert isinstance(storage, main.MemoryStorage)
+    assert isinstance(storage, main.BoundedMemoryStorage)
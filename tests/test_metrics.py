@@ -0,0 +1,104 @@
+import asyncio
+import os
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DB_USER", "test-user")
+os.environ.setdefault("DB_PASS", "test-pass")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_NAME", "test-db")
+
+from types import ModuleType, SimpleNamespace
+
+import metrics
+
+
+def test_histogram_exposes_cumulative_buckets():
+    histogram = metrics.Histogram("test_seconds", "Тест", ("handler",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, handler="a")
+    histogram.observe(0.5, handler="a")
+    histogram.observe(5, handler="a")
+
+    lines = histogram.expose()
+
+    assert 'test_seconds_bucket{handler="a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{handler="a",le="1"} 2' in lines
+    assert 'test_seconds_bucket{handler="a",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{handler="a"} 3' in lines
+    assert 'test_seconds_sum{handler="a"} 5.55' in lines
+    assert histogram.count(handler="a") == 3
+    assert histogram.count(handler="b") == 0
+
+
+def test_label_values_are_escaped():
+    histogram = metrics.Histogram("test_seconds", "Тест", ("handler",), buckets=(1.0,))
+    histogram.observe(0.5, handler='a"b')
+
+    assert 'test_seconds_count{handler="a\\"b"} 1' in histogram.expose()
+
+
+def test_instrument_module_wraps_only_pool_queries():
+    module = ModuleType("fake_db")
+
+    async def get_entries(pool, user_id):
+        return [user_id]
+
+    async def create_db_pool():
+        return "pool"
+
+    async def _private(pool):
+        return None
+
+    for func in (get_entries, create_db_pool, _private):
+        func.__module__ = module.__name__
+        setattr(module, func.__name__, func)
+    histogram = metrics.Histogram("test_db_seconds", "Тест", ("function",))
+
+    assert metrics.instrument_module(module, histogram) == 1
+    # Повторное подключение не оборачивает функции второй раз
+    assert metrics.instrument_module(module, histogram) == 0
+    assert module.create_db_pool is create_db_pool
+    assert module._private is _private
+
+    assert asyncio.run(module.get_entries("pool", 7)) == [7]
+    assert histogram.count(function="get_entries") == 1
+
+
+def test_handler_middleware_records_handler_name():
+    async def cmd_today(message):
+        return "ok"
+
+    async def call_handler(event, data):
+        return await cmd_today(event)
+
+    middleware = metrics.HandlerMetricsMiddleware()
+    before = metrics.HANDLER_LATENCY.count(handler="cmd_today")
+
+    result = asyncio.run(middleware(call_handler, object(), {"handler": SimpleNamespace(callback=cmd_today)}))
+
+    assert result == "ok"
+    assert metrics.HANDLER_LATENCY.count(handler="cmd_today") == before + 1
+
+
+def test_render_includes_gauges_and_skips_failing_collectors():
+    metrics.register(metrics.GaugeCollector("test_queue_depth", "Тест", lambda: [({"queue": "send"}, 3)]))
+
+    def broken():
+        raise RuntimeError("нет данных")
+
+    metrics.register(metrics.GaugeCollector("test_broken", "Тест", broken))
+    try:
+        text = metrics.render()
+    finally:
+        del metrics._registry[-2:]
+
+    assert '# TYPE bot_handler_duration_seconds histogram' in text
+    assert 'test_queue_depth{queue="send"} 3' in text
+    assert 'bot_duplicate_updates_total ' in text
+    assert 'test_broken' not in text
+
+
+def test_metrics_view_returns_text_format():
+    response = asyncio.run(metrics._metrics_view(None))
+
+    assert response.headers["Content-Type"] == metrics.CONTENT_TYPE
+    assert b"# TYPE bot_db_call_duration_seconds histogram" in response.body
@@ -0,0 +1,90 @@
+import asyncio
+import os
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DB_USER", "test-user")
+os.environ.setdefault("DB_PASS", "test-pass")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_NAME", "test-db")
+
+import time
+
+import pytest
+
+import config
+from circuit_breaker import CircuitBreaker
+from handlers import add_food
+from tools import off_stub
+from tools.off_stub import OffStub
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(add_food, "API_RETRY_DELAY", 0)
+    monkeypatch.setattr(add_food, "off_breaker", CircuitBreaker("off-test", failure_threshold=10, reset_timeout=60))
+
+
+def _search(monkeypatch, stub: OffStub, term: str):
+    async def scenario():
+        monkeypatch.setattr(config, "OFF_BASE_URL", await stub.start())
+        try:
+            return await add_food.fetch_products_from_off(term)
+        finally:
+            await stub.close()
+    return asyncio.run(scenario())
+
+
+def test_recorded_response_is_parsed(monkeypatch):
+    stub = OffStub()
+
+    options = _search(monkeypatch, stub, "Гречка")
+
+    assert options == [
+        {"name": "Гречка ядрица", "calories": 313},
+        {"name": "Крупа гречневая ядрица Увелка", "calories": 308},
+        {"name": "Buckwheat groats", "calories": 343}, # 1439 кДж
+        {"name": "Гречневые хлопья", "calories": 325},
+    ]
+    assert stub.stats == {"requests": 1, "ok": 1}
+    assert add_food.off_breaker.failures == 0
+
+
+def test_synthetic_response_respects_page_size():
+    stub = OffStub(recordings={})
+    sizes = {len(stub.response_for(term)["products"]) for term in ("банан", "гречка", "сыр", "рис", "омлет", "кефир")}
+
+    assert sizes <= {0, 1, 4}
+    assert len(stub.response_for("рис отварной 4", page_size=2)["products"]) <= 2
+
+
+def test_server_errors_are_retried_then_counted_by_breaker(monkeypatch):
+    stub = OffStub(error_rate=1.0)
+
+    assert _search(monkeypatch, stub, "творог") is None
+    assert stub.stats == {"requests": add_food.API_RETRY_ATTEMPTS, "error": add_food.API_RETRY_ATTEMPTS}
+    assert add_food.off_breaker.failures == 1
+
+
+def test_hanging_responses_hit_client_timeout(monkeypatch):
+    monkeypatch.setattr(add_food, "API_TIMEOUT", 0.1)
+    stub = OffStub(timeout_rate=1.0, hang=5)
+
+    started = time.monotonic()
+    assert _search(monkeypatch, stub, "кефир") is None
+
+    assert time.monotonic() - started < 3
+    assert stub.stats["timeout"] == add_food.API_RETRY_ATTEMPTS
+    assert add_food.off_breaker.failures == 1
+
+
+def test_malformed_nutriments_are_skipped_not_failed(monkeypatch):
+    stub = OffStub(malformed_rate=1.0)
+
+    options = _search(monkeypatch, stub, "овсянка")
+
+    assert all(isinstance(option["calories"], int) and option["calories"] >= 0 for option in options or [])
+    assert stub.stats == {"requests": 1, "malformed": 1}
+    assert add_food.off_breaker.failures == 0 # Сервис ответил - это не сбой
+    for malform in off_stub.MALFORMED_NUTRIMENTS:
+        product = {"product_name": "Хлеб", "nutriments": malform({"energy-kcal_100g": 250})}
+        assert add_food.parse_off_products({"count": 1, "products": [product]}) == []
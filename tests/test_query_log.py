@@ -0,0 +1,123 @@
+import asyncio
+import os
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DB_USER", "test-user")
+os.environ.setdefault("DB_PASS", "test-pass")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_NAME", "test-db")
+
+from types import SimpleNamespace
+
+import config
+import database as db
+import metrics
+import query_log
+import storage_sqlite
+from handlers import reports
+
+
+class FakeMessage:
+    def __init__(self, user_id):
+        self.from_user = SimpleNamespace(id=user_id)
+        self.chat = SimpleNamespace(id=user_id)
+        self.answers = []
+
+    async def answer(self, text, **options):
+        self.answers.append(text)
+
+
+def test_fingerprint_ignores_literals_and_whitespace():
+    first = "SELECT * FROM users WHERE user_id = 42 AND name = 'Ann';"
+    second = "SELECT *\n    FROM users WHERE user_id = 7 AND name = 'Bob'"
+
+    assert query_log.normalize_query(first) == "SELECT * FROM users WHERE user_id = ? AND name = ?"
+    assert query_log.fingerprint(first) == query_log.fingerprint(second)
+    # Параметры запроса - часть текста, а не литералы
+    assert query_log.normalize_query("SELECT $1, ?2") == "SELECT $1, ?2"
+
+
+def test_slow_queries_are_grouped_by_fingerprint(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DB_SLOW_QUERY_MS", 1e-6)
+    monkeypatch.setattr(query_log, "slow_query_stats", {})
+
+    async def scenario():
+        pool = await storage_sqlite.create_pool(str(tmp_path / "bot.sqlite3"), init=query_log.init_connection)
+        try:
+            async with pool.acquire() as connection:
+                for value in (1, 2, 3):
+                    await connection.fetchval("SELECT $1 + 1;", value)
+                await connection.fetchval("SELECT 5;")
+        finally:
+            await pool.close()
+
+    asyncio.run(scenario())
+
+    report = query_log.slow_query_report()
+    assert [(stats["query"], stats["count"]) for _, stats in report] == [("SELECT $1 + ?", 3), ("SELECT ?", 1)]
+    assert report[0][1]["max"] <= report[0][1]["total"]
+
+
+def test_count_queries_counts_nested_blocks(tmp_path):
+    async def scenario():
+        pool = await storage_sqlite.create_pool(str(tmp_path / "bot.sqlite3"), init=query_log.init_connection)
+        try:
+            await db.create_tables_if_not_exist(pool)
+            async with query_log.count_queries() as outer:
+                await db.get_user_profile_data(pool, 1)
+                async with query_log.count_queries() as inner:
+                    await db.get_user_timezone(pool, 1)
+            return outer, inner
+        finally:
+            await pool.close()
+
+    outer, inner = asyncio.run(scenario())
+    assert (outer.count, inner.count) == (2, 1)
+    assert inner.queries == ["SELECT timezone FROM users WHERE user_id = $1"]
+
+
+def test_today_stays_within_query_budget(tmp_path, monkeypatch):
+    async def scenario():
+        pool = await storage_sqlite.create_pool(str(tmp_path / "bot.sqlite3"), init=query_log.init_connection)
+        monkeypatch.setattr(db, "db_pool", pool)
+        try:
+            await db.create_tables_if_not_exist(pool)
+            await db.add_or_update_user(pool, 1, "Ann", None, "ann")
+            await db.update_user_profile_field(pool, 1, "timezone", "Europe/Moscow")
+            await db.add_food_entry(pool, 1, "гречка", 150, 495)
+            message = FakeMessage(1)
+            async with query_log.count_queries() as counter:
+                await reports.handle_today(message)
+            return counter, message
+        finally:
+            await pool.close()
+
+    counter, message = asyncio.run(scenario())
+    # Профиль (вместе с часовым поясом) и записи за сегодня; без Redis кэша сводки нет
+    assert counter.count <= 2, counter.queries
+    assert "Europe/Moscow" in message.answers[0] and "495" in message.answers[0]
+
+
+def test_middleware_observes_queries_per_handler(tmp_path):
+    async def scenario():
+        pool = await storage_sqlite.create_pool(str(tmp_path / "bot.sqlite3"), init=query_log.init_connection)
+
+        async def handle_week(message):
+            await db.get_user_timezone(pool, 1)
+            await db.get_user_timezone(pool, 1)
+            return "ok"
+
+        async def call_handler(event, data):
+            return await handle_week(event)
+
+        try:
+            await db.create_tables_if_not_exist(pool)
+            middleware = query_log.QueryCounterMiddleware()
+            return await middleware(call_handler, object(), {"handler": SimpleNamespace(callback=handle_week)})
+        finally:
+            await pool.close()
+
+    before = metrics.DB_QUERIES_PER_UPDATE.count(handler="handle_week")
+    assert asyncio.run(scenario()) == "ok"
+    assert metrics.DB_QUERIES_PER_UPDATE.count(handler="handle_week") == before + 1
+    assert 'bot_db_queries_per_update_bucket{handler="handle_week",le="2"} 1' in metrics.DB_QUERIES_PER_UPDATE.expose()
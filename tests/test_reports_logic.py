@@ -8,7 +8,12 @@ os.environ.setdefault("DB_PASS", "test-pass")
 os.environ.setdefault("DB_HOST", "localhost")
 os.environ.setdefault("DB_NAME", "test-db")
 
-from handlers.reports import calculate_average_for_period, calculate_total_norm_for_period
+from handlers.reports import (
+    calculate_average_for_period,
+    calculate_total_norm_for_period,
+    parse_report_date,
+    split_message,
+)
 
 
 def test_calculate_average_for_period_regular_case():
@@ -82,3 +87,53 @@ def test_calculate_total_norm_zero_period_days():
         current_daily_goal=2000,
     )
     assert (total, avg, ok) == (0, 0, False)
+
+
+def test_split_message_keeps_short_report_in_one_page():
+    assert split_message(["a", "b", "c"], limit=10) == ["a\nb\nc"]
+
+
+def test_split_message_splits_on_line_boundaries():
+    lines = [f"- {i:02d}.01.2026: 1000 ккал" for i in range(1, 32)]
+    pages = split_message(lines, limit=100)
+    assert len(pages) > 1
+    assert all(len(page) <= 100 for page in pages)
+    assert "\n".join(pages).split("\n") == lines
+
+
+def test_parse_report_date_formats():
+    assert parse_report_date("05.02.2026") == date(2026, 2, 5)
+    assert parse_report_date("2026-02-05") == date(2026, 2, 5)
+    assert parse_report_date("31.02.2026") is None
+
+
+def test_calculate_total_norm_history_starts_after_period():
+    history = [
+        {"effective_date": date(2026, 2, 1), "daily_calorie_goal": 2300},
+    ]
+    total, avg, ok = calculate_total_norm_for_period(
+        period_start_date=date(2026, 1, 1),
+        period_days=7,
+        historical_norms_records=history,
+        current_daily_goal=None,
+    )
+    assert (total, avg, ok) == (0, 0, False)
+
+
+def test_calculate_total_norm_uses_last_change_before_period():
+    history = [
+        {"effective_date": date(2025, 12, 1), "daily_calorie_goal": 1800},
+        {"effective_date": date(2025, 12, 20), "daily_calorie_goal": 1900},
+        {"effective_date": date(2026, 1, 6), "daily_calorie_goal": 2000},
+        {"effective_date": date(2026, 1, 10), "daily_calorie_goal": 2500},
+    ]
+    total, avg, ok = calculate_total_norm_for_period(
+        period_start_date=date(2026, 1, 1),
+        period_days=7,
+        historical_norms_records=history,
+        current_daily_goal=None,
+    )
+    # days 1-5: 1900, days 6-7: 2000; the change after the period is ignored
+    assert ok is True
+    assert total == (5 * 1900) + (2 * 2000)
+    assert avg == round(total / 7)
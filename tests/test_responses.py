@@ -0,0 +1,120 @@
+import asyncio
+import os
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DB_USER", "test-user")
+os.environ.setdefault("DB_PASS", "test-pass")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_NAME", "test-db")
+
+from types import SimpleNamespace
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardRemove
+
+import responses
+
+
+class FakeMessage:
+    def __init__(self, chat_id=1, message_id=10, edit_error=False):
+        self.chat = SimpleNamespace(id=chat_id)
+        self.message_id = message_id
+        self.edit_error = edit_error
+        self.calls = []
+
+    async def answer(self, text, reply_markup=None, **options):
+        self.calls.append(("answer", text, reply_markup))
+        return SimpleNamespace(message_id=self.message_id + len(self.calls))
+
+    async def edit_text(self, text, reply_markup=None, **options):
+        if self.edit_error:
+            raise TelegramBadRequest(method=None, message="message can't be edited")
+        self.calls.append(("edit", text, reply_markup))
+        return self
+
+
+def _inline():
+    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Меню", callback_data="menu")]])
+
+
+def _run_handler(handler):
+    async def wrapped(event, data):
+        return await handler()
+    return asyncio.run(responses.ResponseCoalescingMiddleware()(wrapped, None, {}))
+
+
+def test_replies_of_one_update_become_one_message():
+    message = FakeMessage()
+    markup = _inline()
+
+    async def handler():
+        await responses.respond(message, "✅ Добавлено")
+        await responses.respond(message, "Сводка за сегодня", reply_markup=markup)
+
+    _run_handler(handler)
+    assert message.calls == [("answer", "✅ Добавлено\n\nСводка за сегодня", markup)]
+
+
+def test_incompatible_markups_are_sent_separately():
+    message = FakeMessage()
+    markup = _inline()
+
+    async def handler():
+        await responses.respond(message, "✅ Рост обновлен!", reply_markup=ReplyKeyboardRemove())
+        await responses.respond(message, "Настройки", reply_markup=markup)
+
+    _run_handler(handler)
+    assert [call[:2] for call in message.calls] == [("answer", "✅ Рост обновлен!"), ("answer", "Настройки")]
+
+
+def test_edit_replaces_pressed_message_with_all_parts():
+    message = FakeMessage()
+    markup = _inline()
+
+    async def handler():
+        await responses.respond(message, "✅ Цель обновлена!")
+        await responses.respond_edit(message, "Настройки", reply_markup=markup)
+
+    _run_handler(handler)
+    assert message.calls == [("edit", "✅ Цель обновлена!\n\nНастройки", markup)]
+
+
+def test_failed_edit_falls_back_to_new_message():
+    message = FakeMessage(edit_error=True)
+
+    async def handler():
+        await responses.respond_edit(message, "Настройки", reply_markup=_inline())
+
+    _run_handler(handler)
+    assert [call[:2] for call in message.calls] == [("answer", "Настройки")]
+
+
+def test_respond_without_middleware_sends_immediately():
+    message = FakeMessage()
+    asyncio.run(responses.respond(message, "Привет"))
+    assert message.calls == [("answer", "Привет", None)]
+
+
+def test_on_sent_receives_the_message_carrying_the_keyboard():
+    sent_ids = []
+
+    async def remember(bot_message):
+        sent_ids.append(bot_message.message_id)
+
+    message = FakeMessage(message_id=10)
+
+    async def handler():
+        await responses.respond(message, "✅ Рост обновлен!", reply_markup=ReplyKeyboardRemove())
+        await responses.respond(message, "Настройки", reply_markup=_inline(), on_sent=remember)
+        assert sent_ids == [] # Меню еще в буфере
+
+    _run_handler(handler)
+    assert sent_ids == [12] # Второе отправленное сообщение
+
+    pressed = FakeMessage(message_id=20)
+
+    async def edit_handler():
+        await responses.respond_edit(pressed, "Настройки", reply_markup=_inline(), on_sent=remember)
+
+    _run_handler(edit_handler)
+    assert sent_ids == [12, 20] # Меню заменило сообщение с нажатой кнопкой
@@ -0,0 +1,86 @@
+import asyncio
+import os
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DB_USER", "test-user")
+os.environ.setdefault("DB_PASS", "test-pass")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_NAME", "test-db")
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import GetUpdates, SendMessage
+
+import send_queue
+
+
+def test_token_bucket_reserves_in_order():
+    bucket = send_queue.TokenBucket(rate=10, capacity=2)
+    assert bucket.take() == 0.0
+    assert bucket.take() == 0.0
+    assert bucket.take() == pytest.approx(0.1, abs=0.01)
+    assert bucket.take() == pytest.approx(0.2, abs=0.01)
+
+
+def test_interactive_requests_overtake_bulk():
+    async def scenario():
+        queue = send_queue.SendQueue(global_rate=50, chat_rate=1000)
+        queue._global.tokens = 0 # общий лимит исчерпан - запросы копятся в очереди
+        order = []
+
+        async def send(chat_id, bulk):
+            if bulk:
+                with send_queue.bulk_sends():
+                    await queue.acquire(chat_id, send_queue.send_priority.get())
+            else:
+                await queue.acquire(chat_id, send_queue.send_priority.get())
+            order.append(chat_id)
+
+        tasks = [asyncio.create_task(send(chat_id, bulk=True)) for chat_id in range(1, 6)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(send(100, bulk=False)))
+        await asyncio.gather(*tasks)
+        await queue.close()
+        return order, queue.stats()
+
+    order, stats = asyncio.run(scenario())
+    assert order[0] == 100
+    assert sorted(order[1:]) == [1, 2, 3, 4, 5]
+    assert stats["depth"] == 0
+
+
+def test_per_chat_limit_spaces_messages():
+    async def scenario():
+        queue = send_queue.SendQueue(global_rate=1000, chat_rate=10)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await asyncio.gather(*(queue.acquire(1, send_queue.PRIORITY_INTERACTIVE) for _ in range(5)))
+        elapsed = loop.time() - started
+        await queue.close()
+        return elapsed
+
+    # 3 сообщения из запаса CHAT_BURST, еще 2 - по одному в 0.1 с
+    assert asyncio.run(scenario()) >= 0.19
+
+
+def test_middleware_retries_after_retry_after():
+    async def scenario():
+        queue = send_queue.SendQueue(global_rate=1000, chat_rate=1000)
+        middleware = send_queue.SendQueueMiddleware(queue)
+        calls = []
+
+        async def make_request(bot, method):
+            calls.append(type(method).__name__)
+            if len(calls) == 1:
+                raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=0)
+            return "ok"
+
+        result = await middleware(make_request, None, SendMessage(chat_id=1, text="hi"))
+        passthrough = await middleware(make_request, None, GetUpdates())
+        await queue.close()
+        return result, passthrough, calls, queue.stats()
+
+    result, passthrough, calls, stats = asyncio.run(scenario())
+    assert result == "ok" and passthrough == "ok"
+    assert calls == ["SendMessage", "SendMessage", "GetUpdates"]
+    assert stats["retries"] == 1 and stats["sent"] == 1
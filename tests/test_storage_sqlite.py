@@ -0,0 +1,157 @@
+import asyncio
+import os
+from datetime import date, datetime, timedelta, timezone
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DB_USER", "test-user")
+os.environ.setdefault("DB_PASS", "test-pass")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_NAME", "test-db")
+
+import pytz
+
+import database as db
+import storage_sqlite
+
+
+def run_with_pool(tmp_path, scenario):
+    async def runner():
+        pool = await storage_sqlite.create_pool(str(tmp_path / "bot.sqlite3"))
+        try:
+            await db.create_tables_if_not_exist(pool)
+            return await scenario(pool)
+        finally:
+            await pool.close()
+    return asyncio.run(runner())
+
+
+def test_translate_sql_placeholders_and_now():
+    sql, uses_now = storage_sqlite.translate_sql("UPDATE users SET goal = $1, updated_at = NOW() WHERE user_id = $2;")
+    assert sql == "UPDATE users SET goal = ?1, updated_at = ?3 WHERE user_id = ?2;"
+    assert uses_now is True
+
+
+def test_users_profile_roundtrip(tmp_path):
+    async def scenario(pool):
+        assert await db.add_or_update_user(pool, 1, "Ann", None, "ann")
+        assert not await db.add_or_update_user(pool, 1, "Ann", "B", "ann")
+        assert await db.update_user_profile_field(pool, 1, "height", 170) is True
+        assert await db.update_user_profile_field(pool, 2, "height", 170) is False
+        await db.update_user_timezone_db(pool, 1, "Europe/Moscow")
+        profile = await db.get_user_profile_data(pool, 1)
+        return profile, await db.get_user_timezone(pool, 1)
+
+    profile, tz_name = run_with_pool(tmp_path, scenario)
+    assert profile["height"] == 170
+    assert profile.get("daily_calorie_goal") is None
+    assert tz_name == "Europe/Moscow"
+
+
+def test_goal_history_returns_previous_norm_and_period_changes(tmp_path):
+    async def scenario(pool):
+        await db.add_or_update_user(pool, 1, "Ann", None, None)
+        await db.add_goal_history_entry(pool, 1, date(2026, 1, 1), 2000)
+        await db.add_goal_history_entry(pool, 1, date(2026, 1, 10), 2100)
+        await db.add_goal_history_entry(pool, 1, date(2026, 1, 20), 2200)
+        await db.add_goal_history_entry(pool, 1, date(2026, 1, 20), 2300)
+        rows = await db.get_historical_norms(pool, 1, date(2026, 1, 15), date(2026, 1, 31))
+        first = await db.get_first_goal_history_date(pool, 1)
+        return rows, first
+
+    rows, first = run_with_pool(tmp_path, scenario)
+    assert [(r["effective_date"], r["daily_calorie_goal"]) for r in rows] == [
+        (date(2026, 1, 10), 2100), (date(2026, 1, 20), 2300)
+    ]
+    assert first == date(2026, 1, 1)
+
+
+def test_products_and_food_entries(tmp_path):
+    async def scenario(pool):
+        await db.add_or_update_user(pool, 1, "Ann", None, None)
+        name = await db.add_user_product(pool, 1, "  Гречка   Вареная ", 110)
+        await db.add_user_product(pool, 1, "гречка вареная", 120)
+        found = await db.get_user_product(pool, 1, "ГРЕЧКА вареная")
+        by_id = await db.get_user_product_by_id(pool, 1, found["product_id"])
+        suggestions = await db.search_user_products(pool, 1, "греч")
+        await db.add_food_entry(pool, 1, name, 200, 240)
+        entries = await db.get_todays_food_entries(pool, 1, "Europe/Moscow")
+        tz = pytz.timezone("Europe/Moscow")
+        start = tz.localize(datetime(2000, 1, 1))
+        old = await db.get_food_entries_for_period(pool, 1, start, start + timedelta(days=1))
+        return name, found, by_id, suggestions, entries, old
+
+    name, found, by_id, suggestions, entries, old = run_with_pool(tmp_path, scenario)
+    assert name == "гречка вареная"
+    assert found["calories_per_100g"] == 120
+    assert by_id["product_name"] == name
+    assert [s["product_name"] for s in suggestions] == [name]
+    assert len(entries) == 1 and entries[0]["calories_consumed"] == 240
+    assert entries[0]["entry_timestamp"].tzinfo is not None
+    assert entries[0]["entry_timestamp"] <= datetime.now(timezone.utc)
+    assert old == []
+
+
+def test_todays_summary_without_redis_reads_database(tmp_path, monkeypatch):
+    monkeypatch.setattr(db.cache, "redis_client", None)
+
+    async def scenario(pool):
+        await db.add_or_update_user(pool, 1, "Ann", None, None)
+        await db.add_food_entry(pool, 1, "яблоко", 150, 78)
+        await db.add_food_entry(pool, 1, "кефир", 200, 100)
+        return await db.get_todays_summary(pool, 1, "UTC")
+
+    total, entries = run_with_pool(tmp_path, scenario)
+    assert total == 178
+    assert [e["product_name"] for e in entries] == ["яблоко", "кефир"]
+
+
+def test_load_calories_by_day_groups_by_local_date(tmp_path, monkeypatch):
+    from handlers import reports
+
+    monkeypatch.setattr(db.cache, "redis_client", None)
+    tz = pytz.timezone("Asia/Tokyo")
+    today = datetime.now(tz).date()
+    yesterday = today - timedelta(days=1)
+
+    async def scenario(pool):
+        monkeypatch.setattr(db, "db_pool", pool)
+        await db.add_or_update_user(pool, 1, "Ann", None, None)
+        # 23:30 и 00:30 по Токио попадают в разные локальные дни
+        late = tz.localize(datetime.combine(yesterday - timedelta(days=1), datetime.min.time())) + timedelta(hours=23, minutes=30)
+        for ts, calories in [(late, 300), (late + timedelta(hours=1), 200), (late + timedelta(hours=2), 50)]:
+            async with pool.acquire() as connection:
+                await connection.execute(
+                    "INSERT INTO food_entries (user_id, product_name, weight_grams, calories_consumed, entry_timestamp) VALUES ($1, $2, $3, $4, $5);",
+                    1, "рис", 100, calories, ts
+                )
+        await db.add_food_entry(pool, 1, "яблоко", 100, 52)
+        return await reports.load_calories_by_day(1, "Asia/Tokyo", tz, today - timedelta(days=6), today)
+
+    by_day = run_with_pool(tmp_path, scenario)
+    assert by_day == {yesterday - timedelta(days=1): 300, yesterday: 250, today: 52}
+
+
+def test_recalculate_all_goals_updates_only_changed_profiles(tmp_path):
+    from tools.recalculate_goals import recalculate_all_goals
+
+    async def scenario(pool):
+        for user_id in range(1, 6):
+            await db.add_or_update_user(pool, user_id, f"U{user_id}", None, None)
+            await db.update_user_profile_field(pool, user_id, "current_weight", 70.0 + user_id)
+            await db.update_user_profile_field(pool, user_id, "height", 175)
+            await db.update_user_profile_field(pool, user_id, "gender", "female" if user_id % 2 else "male")
+            await db.update_user_profile_field(pool, user_id, "goal", "maintenance")
+        await db.update_user_profile_field(pool, 5, "goal", None) # неполный профиль - норма сбрасывается
+        await db.update_user_profile_field(pool, 5, "daily_calorie_goal", 1234)
+        first = await recalculate_all_goals(pool, batch_size=2)
+        second = await recalculate_all_goals(pool, batch_size=2)
+        profiles = {row["user_id"]: row for row in await db.get_user_profiles_batch(pool, 0, 10)}
+        history = await db.get_historical_norms(pool, 1, date(2000, 1, 1), date(2100, 1, 1))
+        return first, second, profiles, history
+
+    first, second, profiles, history = run_with_pool(tmp_path, scenario)
+    assert (first["processed"], first["changed"], first["updated"]) == (5, 5, 5)
+    assert (second["processed"], second["changed"], second["updated"]) == (5, 0, 0)
+    assert profiles[5]["daily_calorie_goal"] is None
+    assert profiles[1]["daily_calorie_goal"] > 0
+    assert [row["daily_calorie_goal"] for row in history] == [profiles[1]["daily_calorie_goal"]]
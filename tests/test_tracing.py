@@ -0,0 +1,156 @@
+import asyncio
+import json
+import os
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DB_USER", "test-user")
+os.environ.setdefault("DB_PASS", "test-pass")
+os.environ.setdefault("DB_HOST", "localhost")
+os.environ.setdefault("DB_NAME", "test-db")
+
+import time
+from types import ModuleType, SimpleNamespace
+
+import pytest
+from aiogram.methods import SendMessage
+from aiogram.types import Update
+
+import config
+import tracing
+
+
+@pytest.fixture(autouse=True)
+def clean_buffer():
+    tracing._buffer.clear()
+    yield
+    tracing._buffer.clear()
+
+
+def spans_by_name():
+    return {item.name: item for item in tracing._buffer}
+
+
+def test_span_outside_trace_records_nothing():
+    with tracing.span("db.get_user") as current:
+        assert current is None
+    tracing.record_span("off.request", time.perf_counter())
+
+    assert tracing._buffer == []
+
+
+def test_child_spans_share_trace_and_link_to_parent():
+    with tracing.span("update", root=True, user_id=1):
+        with tracing.span("handler"):
+            with tracing.span("db.get_user"):
+                pass
+        tracing.record_span("off.request", time.perf_counter() - 0.2, attempt=1, outcome="found")
+
+    spans = spans_by_name()
+    root = spans["update"]
+    assert root.parent_id is None
+    assert {item.trace_id for item in spans.values()} == {root.trace_id}
+    assert spans["handler"].parent_id == root.span_id
+    assert spans["db.get_user"].parent_id == spans["handler"].span_id
+    assert spans["off.request"].parent_id == root.span_id
+    # Записанный задним числом интервал начинается до момента записи
+    assert spans["off.request"].end_ns - spans["off.request"].start_ns >= 0.2e9
+    assert spans["off.request"].end_ns <= root.end_ns
+
+
+def test_exception_marks_span_as_error():
+    with pytest.raises(ValueError):
+        with tracing.span("update", root=True):
+            with tracing.span("db.add_food_entry"):
+                raise ValueError("boom")
+
+    spans = spans_by_name()
+    assert spans["db.add_food_entry"].error
+    assert spans["db.add_food_entry"].attributes["exception"] == "ValueError"
+    assert spans["update"].error
+
+
+def test_instrument_module_traces_pool_queries():
+    module = ModuleType("fake_db_tracing")
+
+    async def get_entries(pool, user_id):
+        return [user_id]
+
+    get_entries.__module__ = module.__name__
+    module.get_entries = get_entries
+
+    assert tracing.instrument_module(module) == 1
+    assert tracing.instrument_module(module) == 0
+
+    async def scenario():
+        await module.get_entries("pool", 1) # вне трассы
+        with tracing.span("update", root=True):
+            return await module.get_entries("pool", 2)
+
+    assert asyncio.run(scenario()) == [2]
+    assert [item.name for item in tracing._buffer] == ["db.get_entries", "update"]
+
+
+def test_tracing_middleware_respects_sample_rate(monkeypatch):
+    middleware = tracing.TracingMiddleware()
+    update = Update.model_validate({"update_id": 5, "message": {
+        "message_id": 1, "date": 0, "chat": {"id": 42, "type": "private"}, "text": "/today",
+    }})
+    data = {"event_from_user": SimpleNamespace(id=42)}
+
+    async def handler(event, data):
+        with tracing.span("handler"):
+            return "ok"
+
+    monkeypatch.setattr(config, "TRACE_SAMPLE_RATE", 0.0)
+    assert asyncio.run(middleware(handler, update, data)) == "ok"
+    assert tracing._buffer == []
+
+    monkeypatch.setattr(config, "TRACE_SAMPLE_RATE", 1.0)
+    assert asyncio.run(middleware(handler, update, data)) == "ok"
+    root = spans_by_name()["update"]
+    assert root.attributes == {"update_id": 5, "event_type": "message", "user_id": 42}
+    assert spans_by_name()["handler"].parent_id == root.span_id
+
+
+def test_request_middleware_names_span_after_api_method():
+    middleware = tracing.TracingRequestMiddleware()
+
+    async def make_request(bot, method):
+        return "sent"
+
+    async def scenario():
+        with tracing.span("update", root=True):
+            return await middleware(make_request, None, SendMessage(chat_id=7, text="hi"))
+
+    assert asyncio.run(scenario()) == "sent"
+    assert spans_by_name()["telegram.sendMessage"].attributes == {"chat_id": 7}
+
+
+def test_flush_writes_jsonl(tmp_path, monkeypatch):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(config, "TRACE_FILE", str(path))
+    monkeypatch.setattr(config, "TRACE_OTLP_URL", "")
+    with tracing.span("update", root=True, user_id=1):
+        with tracing.span("db.get_user"):
+            pass
+
+    assert asyncio.run(tracing.flush_traces()) == 2
+
+    lines = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [line["name"] for line in lines] == ["db.get_user", "update"]
+    assert lines[0]["parent_id"] == lines[1]["span_id"]
+    assert lines[1]["attributes"] == {"user_id": 1}
+    assert tracing._buffer == []
+
+
+def test_otlp_payload_shape():
+    with tracing.span("update", root=True, user_id=1, note=None):
+        pass
+
+    payload = tracing.otlp_payload(tracing._buffer)
+    exported = payload["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+    assert exported["name"] == "update"
+    assert exported["parentSpanId"] == ""
+    assert len(exported["traceId"]) == 32 and len(exported["spanId"]) == 16
+    assert exported["attributes"] == [{"key": "user_id", "value": {"intValue": "1"}}]
+    assert exported["status"] == {"code": 1}
@@ -0,0 +1,379 @@
+"""
+Нагрузочный тест: синтетические пользователи прогоняют апдейты через настоящий Dispatcher.
+
+Диспетчер собирается так же, как в main.py (все middleware, роутеры, startup/shutdown), и
+работает с настроенными БД и FSM-хранилищем (PostgreSQL/Redis или DB_BACKEND=sqlite).
+Вместо Telegram - FakeTelegramSession: запросы к Bot API не уходят в сеть, а отвечают
+через --api-latency секунд; ответы бота (текст и инлайн-кнопки) видны виртуальному пользователю.
+Вместо Open Food Facts - tools/off_stub.py (записанные и детерминированные ответы; задержка
+--off-latency, доли ошибок, таймаутов и испорченных ответов --off-error-rate, --off-timeout-rate,
+--off-malformed-rate).
+
+Каждый виртуальный пользователь выполняет /start, а затем до конца теста сценарии:
+добавление еды (подсказки, поиск в OFF с выбором варианта, ручной ввод калорий),
+изменение настроек, /today, /week, /month - с паузой --think между действиями.
+Итог: апдейтов в секунду, p50/p95/p99 времени обработки по обработчикам и
+запросов к БД на апдейт.
+
+Пользователи создаются с id от --user-id-base: запускайте на отдельной базе, например
+    DB_BACKEND=sqlite SQLITE_PATH=/tmp/load.sqlite3 python tools/loadgen.py --users 50 --duration 60
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import EditMessageReplyMarkup, EditMessageText, SendMessage, TelegramMethod
+from aiogram.types import InlineKeyboardMarkup, Message, TelegramObject, Update
+
+import admission
+import config
+import main
+import metrics
+import query_log
+from keyboards import CONFIRM_API_TEXT, FIND_CALORIES_TEXT, GoalCode, GoalSelect, SettingsAction, SettingsMenuAction
+from tools.off_stub import OffStub
+
+logger = logging.getLogger("loadgen")
+
+LOADGEN_TOKEN = "42:LOADGEN"
+FOODS = [
+    "гречка", "овсянка", "куриная грудка", "творог", "банан", "яблоко", "рис отварной",
+    "омлет", "кефир", "сыр", "борщ", "макароны", "хлеб ржаной", "йогурт", "лосось",
+]
+SCENARIO_WEIGHTS = {
+    "add_food": 50,
+    "today": 20,
+    "week": 10,
+    "month": 5,
+    "settings": 15,
+}
+
+_message_ids = itertools.count(1)
+_update_ids = itertools.count(1)
+
+
+# --- Заглушки внешних сервисов ---
+class FakeTelegramSession(BaseSession):
+    """Сессия бота без сети: отвечает на запросы к Bot API и запоминает ответы по чатам."""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.requests: Counter = Counter()
+        # chat_id -> ответы бота с момента последнего действия пользователя
+        self.texts: Dict[int, List[str]] = defaultdict(list)
+        self.keyboards: Dict[int, List[Message]] = defaultdict(list)
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None) -> Any:
+        self.requests[method.__api_method__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if not isinstance(method, (SendMessage, EditMessageText, EditMessageReplyMarkup)):
+            return True
+        message = Message.model_validate(
+            {
+                "message_id": getattr(method, "message_id", None) or next(_message_ids),
+                "date": int(time.time()),
+                "chat": {"id": method.chat_id, "type": "private"},
+                "text": getattr(method, "text", None) or "",
+                "reply_markup": method.reply_markup if isinstance(method.reply_markup, InlineKeyboardMarkup) else None,
+            },
+            context={"bot": bot},
+        )
+        if message.text:
+            self.texts[method.chat_id].append(message.text)
+        if message.reply_markup is not None:
+            self.keyboards[method.chat_id].append(message)
+        return message
+
+    async def stream_content(self, url: str, headers=None, timeout: int = 30, chunk_size: int = 65536, raise_for_status: bool = True):
+        # Абстрактный метод BaseSession (bot.download). Обработчики бота файлы не скачивают,
+        # поэтому имитация отдает пустое содержимое
+        for chunk in ():
+            yield chunk
+
+    async def close(self):
+        pass
+
+
+# --- Измерения ---
+class _HandlerProbe(BaseMiddleware):
+    """Inner middleware: записывает имя выбранного обработчика в data["loadgen_probe"]."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        probe = data.get("loadgen_probe")
+        if probe is not None:
+            probe["handler"] = metrics.handler_name(event, data)
+        return await handler(event, data)
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class LoadStats:
+    """Время обработки и число запросов к БД по обработчикам."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.queries: Dict[str, List[int]] = defaultdict(list)
+        self.errors: Counter = Counter()
+
+    def record(self, handler: str, seconds: float, queries: int, error: bool = False):
+        self.latencies[handler].append(seconds)
+        self.queries[handler].append(queries)
+        if error:
+            self.errors[handler] += 1
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        updates = sum(len(values) for values in self.latencies.values())
+        queries = sum(sum(values) for values in self.queries.values())
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        handlers = {
+            name: {
+                "count": len(values),
+                "errors": self.errors[name],
+                "p50_ms": percentile(values, 0.5) * 1000,
+                "p95_ms": percentile(values, 0.95) * 1000,
+                "p99_ms": percentile(values, 0.99) * 1000,
+                "db_queries_avg": sum(self.queries[name]) / len(values),
+            }
+            for name, values in sorted(self.latencies.items(), key=lambda item: -len(item[1]))
+        }
+        return {
+            "seconds": elapsed,
+            "updates": updates,
+            "updates_per_second": updates / elapsed if elapsed else 0.0,
+            "errors": sum(self.errors.values()),
+            "p50_ms": percentile(all_latencies, 0.5) * 1000,
+            "p95_ms": percentile(all_latencies, 0.95) * 1000,
+            "p99_ms": percentile(all_latencies, 0.99) * 1000,
+            "db_queries_per_update": queries / updates if updates else 0.0,
+            "handlers": handlers,
+        }
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    off = report.get("off", {})
+    lines = [
+        f"Апдейтов: {report['updates']} за {report['seconds']:.1f} с - {report['updates_per_second']:.1f}/с, "
+        f"ошибок {report['errors']}",
+        f"Время обработки: p50 {report['p50_ms']:.1f} мс, p95 {report['p95_ms']:.1f} мс, p99 {report['p99_ms']:.1f} мс",
+        f"Запросов к БД на апдейт: {report['db_queries_per_update']:.2f}",
+        f"Запросов к OFF: {off.get('requests', 0)} (ошибок {off.get('error', 0)}, "
+        f"таймаутов {off.get('timeout', 0)}, испорченных {off.get('malformed', 0)})",
+        "",
+        f"{'обработчик':<36} {'кол-во':>7} {'ошибок':>7} {'p50 мс':>8} {'p95 мс':>8} {'p99 мс':>8} {'БД/апд':>7}",
+    ]
+    for name, stats in report["handlers"].items():
+        lines.append(
+            f"{name:<36} {stats['count']:>7} {stats['errors']:>7} {stats['p50_ms']:>8.1f} "
+            f"{stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f} {stats['db_queries_avg']:>7.2f}"
+        )
+    return "\n".join(lines)
+
+
+# --- Виртуальные пользователи ---
+class VirtualUser:
+    """Пользователь, который пишет боту и нажимает кнопки, глядя на его ответы."""
+
+    def __init__(self, user_id: int, bot: Bot, dispatcher, session: FakeTelegramSession, stats: LoadStats, rng: random.Random, think: float):
+        self.user_id = user_id
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.session = session
+        self.stats = stats
+        self.rng = rng
+        self.think = think
+        self.products: List[str] = [] # Продукты, уже сохраненные в базе пользователя
+
+    @property
+    def _user(self) -> Dict[str, Any]:
+        return {"id": self.user_id, "is_bot": False, "first_name": "Load", "last_name": str(self.user_id)}
+
+    async def _feed(self, payload: Dict[str, Any]):
+        self.session.texts.pop(self.user_id, None)
+        self.session.keyboards.pop(self.user_id, None)
+        update = Update.model_validate({"update_id": next(_update_ids), **payload}, context={"bot": self.bot})
+        probe: Dict[str, str] = {}
+        error = False
+        started = time.perf_counter()
+        async with query_log.count_queries() as counter:
+            try:
+                await self.dispatcher.feed_update(self.bot, update, loadgen_probe=probe)
+            except Exception as e:
+                error = True
+                logger.warning(f"Ошибка обработки апдейта пользователя {self.user_id}: {e}")
+        self.stats.record(probe.get("handler", "(не обработано)"), time.perf_counter() - started, counter.count, error)
+        await asyncio.sleep(self.think * self.rng.uniform(0.5, 1.5))
+
+    async def send(self, text: str):
+        await self._feed({"message": {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": {"id": self.user_id, "type": "private"},
+            "from": self._user,
+            "text": text,
+        }})
+
+    def button(self, prefix: str) -> Optional[tuple]:
+        """Последнее сообщение бота с инлайн-кнопкой, callback_data которой начинается с prefix."""
+        for message in reversed(self.session.keyboards.get(self.user_id, [])):
+            for row in message.reply_markup.inline_keyboard:
+                for button in row:
+                    if button.callback_data and button.callback_data.startswith(prefix):
+                        return message, button.callback_data
+        return None
+
+    async def press(self, prefix: str, callback_data: Optional[str] = None) -> bool:
+        found = self.button(prefix)
+        if found is None:
+            return False
+        message, data = found
+        await self._feed({"callback_query": {
+            "id": str(next(_update_ids)),
+            "from": self._user,
+            "chat_instance": "loadgen",
+            "data": callback_data or data,
+            "message": {
+                "message_id": message.message_id,
+                "date": int(time.time()),
+                "chat": {"id": self.user_id, "type": "private"},
+                "from": {"id": self.bot.id, "is_bot": True, "first_name": "Bot"},
+                "text": message.text or "",
+            },
+        }})
+        return True
+
+    def replied(self, fragment: str) -> bool:
+        return any(fragment in text for text in self.session.texts.get(self.user_id, []))
+
+    # --- Сценарии ---
+    async def add_food(self):
+        known = self.products and self.rng.random() < 0.5
+        name = self.rng.choice(self.products) if known else self.rng.choice(FOODS)
+        await self.send("/add")
+        await self.send(name[:3] if known else name)
+        await self.press("p:") # Подсказка из базы пользователя, если бот ее показал
+        await self.send(str(self.rng.randint(50, 400)))
+        if not self.replied("Введите калорийность"):
+            return # Продукт из базы - запись уже сохранена
+        if self.rng.random() < 0.6:
+            await self.send(FIND_CALORIES_TEXT)
+            await self.press("a:0")
+            if self.replied("Использовать?"):
+                await self.send(CONFIRM_API_TEXT)
+                self.products.append(name)
+                return
+        await self.send(str(self.rng.randint(40, 600)))
+        self.products.append(name)
+
+    async def settings(self):
+        await self.send("/settings")
+        await self.press(SettingsAction(action=SettingsMenuAction.GOAL).pack())
+        goal = self.rng.choice([GoalCode.DEFICIT, GoalCode.MAINTENANCE, GoalCode.SURPLUS])
+        await self.press("sg:", GoalSelect(goal=goal).pack())
+        await self.press(SettingsAction(action=SettingsMenuAction.HEIGHT).pack())
+        await self.send(str(self.rng.randint(150, 200)))
+        await self.press(SettingsAction(action=SettingsMenuAction.WEIGHT).pack())
+        await self.send(f"{self.rng.uniform(50, 110):.1f}")
+        await self.press(SettingsAction(action=SettingsMenuAction.CLOSE).pack())
+
+    async def run(self, deadline: float):
+        await self.send("/start")
+        scenarios = list(SCENARIO_WEIGHTS)
+        weights = [SCENARIO_WEIGHTS[name] for name in scenarios]
+        while time.monotonic() < deadline:
+            scenario = self.rng.choices(scenarios, weights)[0]
+            if scenario in ("today", "week", "month"):
+                await self.send(f"/{scenario}")
+            else:
+                await getattr(self, scenario)()
+
+
+async def run_load(
+    users: int, duration: float, think: float, api_latency: float, off_latency: float, user_id_base: int, seed: int,
+    off_error_rate: float = 0.0, off_timeout_rate: float = 0.0, off_malformed_rate: float = 0.0,
+) -> Dict[str, Any]:
+    session = FakeTelegramSession(api_latency)
+    bot = main.create_bot(LOADGEN_TOKEN, session=session)
+    dispatcher = main.create_dispatcher()
+    for observer in (dispatcher.message, dispatcher.callback_query):
+        observer.middleware(_HandlerProbe())
+    off_stub = OffStub(
+        latency=off_latency, error_rate=off_error_rate, timeout_rate=off_timeout_rate, malformed_rate=off_malformed_rate, seed=seed,
+    )
+    config.OFF_BASE_URL = await off_stub.start()
+    stats = LoadStats()
+    admission_before = dict(admission.admission_stats)
+    await dispatcher.emit_startup(bot=bot, dispatcher=dispatcher, bots=[bot])
+    try:
+        started = time.monotonic()
+        virtual_users = [
+            VirtualUser(user_id_base + index, bot, dispatcher, session, stats, random.Random(seed + index), think)
+            for index in range(users)
+        ]
+        await asyncio.gather(*(user.run(started + duration) for user in virtual_users))
+        elapsed = time.monotonic() - started
+    finally:
+        await dispatcher.emit_shutdown(bot=bot, dispatcher=dispatcher, bots=[bot])
+        await off_stub.close()
+    report = stats.report(elapsed)
+    report["admission"] = {kind: value - admission_before.get(kind, 0) for kind, value in admission.admission_stats.items()}
+    report["bot_api_requests"] = dict(session.requests)
+    report["off"] = dict(off_stub.stats)
+    return report
+
+
+async def amain() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="виртуальных пользователей")
+    parser.add_argument("--duration", type=float, default=30, help="длительность теста, с")
+    parser.add_argument("--think", type=float, default=0.5, help="средняя пауза между действиями пользователя, с")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="задержка ответа Bot API, с")
+    parser.add_argument("--off-latency", type=float, default=0.3, help="задержка ответа OFF, с")
+    parser.add_argument("--off-error-rate", type=float, default=0.0, help="доля ответов OFF 5xx")
+    parser.add_argument("--off-timeout-rate", type=float, default=0.0, help="доля зависающих запросов к OFF")
+    parser.add_argument("--off-malformed-rate", type=float, default=0.0, help="доля ответов OFF с испорченными nutriments")
+    parser.add_argument("--user-id-base", type=int, default=9_000_000_000, help="id первого виртуального пользователя")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-send-limits", action="store_true", help="без лимитов отправки Telegram (SEND_*_RATE)")
+    parser.add_argument("--json", help="сохранить отчет в JSON-файл")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+    if args.no_send_limits:
+        config.SEND_GLOBAL_RATE = config.SEND_CHAT_RATE = 1_000_000
+
+    report = await run_load(
+        args.users, args.duration, args.think, args.api_latency, args.off_latency, args.user_id_base, args.seed,
+        args.off_error_rate, args.off_timeout_rate, args.off_malformed_rate,
+    )
+    print(format_report(report))
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(amain()))
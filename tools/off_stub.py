@@ -0,0 +1,188 @@
+"""
+Локальная замена поиска Open Food Facts (GET /cgi/search.pl) с задержками и сбоями.
+
+Отвечает записанными ответами из tools/off_recordings/*.json (по точному search_terms),
+на остальные запросы - детерминированными синтетическими (0, 1 или 4 продукта по crc32 термина).
+Сбои выбираются генератором с --seed, поэтому прогон воспроизводим:
+- --latency / --jitter - задержка каждого ответа (фиксированная + случайная до jitter), с;
+- --timeout-rate - доля запросов, ответ на которые задерживается на --hang с (дольше API_TIMEOUT бота);
+- --error-rate - доля ответов 500/502/503;
+- --malformed-rate - доля ответов с испорченными nutriments (null, строки, отрицательные и
+  нечисловые значения).
+GET /__stub/stats - счетчики ответов по видам.
+
+Запуск из корня проекта:
+    python tools/off_stub.py --port 8181 --latency 0.3 --error-rate 0.1 --malformed-rate 0.2
+и бот с OFF_BASE_URL=http://127.0.0.1:8181. Тесты и tools/loadgen.py запускают OffStub в своем процессе.
+"""
+import argparse
+import asyncio
+import copy
+import json
+import logging
+import random
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger("off_stub")
+
+RECORDINGS_DIR = Path(__file__).resolve().parent / "off_recordings"
+SEARCH_PATH = "/cgi/search.pl" # Тот же путь, что handlers.add_food.OFF_SEARCH_PATH
+ERROR_STATUSES = (500, 502, 503)
+
+# Испорченные nutriments в том виде, в каком они встречаются в реальных данных OFF
+MALFORMED_NUTRIMENTS: List[Callable[[Dict[str, Any]], Any]] = [
+    lambda nutriments: None,
+    lambda nutriments: "n/a",
+    lambda nutriments: {**nutriments, "energy-kcal_100g": "n/a"},
+    lambda nutriments: {"energy-kcal_100g": -120},
+    lambda nutriments: {"energy_100g": "1e999", "energy_unit": None},
+    lambda nutriments: {"energy-kcal_100g": {"value": 100, "unit": "kcal"}},
+]
+
+
+def load_recordings(directory: Path = RECORDINGS_DIR) -> Dict[str, Dict[str, Any]]:
+    """Записанные ответы: search_terms -> тело ответа поиска."""
+    recordings = {}
+    for path in sorted(directory.glob("*.json")):
+        recording = json.loads(path.read_text(encoding="utf-8"))
+        recordings[recording["search_terms"]] = recording["response"]
+    return recordings
+
+
+def synthetic_products(search_term: str) -> List[Dict[str, Any]]:
+    """Ответ для термина без записи: детерминированно ничего, один или несколько продуктов."""
+    variant = zlib.crc32(search_term.encode()) % 3
+    count = (0, 1, 4)[variant]
+    return [
+        {"product_name": f"{search_term} {index + 1}", "nutriments": {"energy-kcal_100g": 80 + 37 * index}}
+        for index in range(count)
+    ]
+
+
+class OffStub:
+    """aiohttp-сервер поиска OFF с внедряемыми задержками, ошибками, таймаутами и испорченными данными."""
+
+    def __init__(
+        self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, timeout_rate: float = 0.0,
+        malformed_rate: float = 0.0, hang: float = 30.0, seed: int = 1, recordings: Optional[Dict[str, Dict[str, Any]]] = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.malformed_rate = malformed_rate
+        self.hang = hang
+        self.rng = random.Random(seed)
+        self.recordings = load_recordings() if recordings is None else recordings
+        self.stats: Counter = Counter() # requests, ok, timeout, error, malformed
+        self.url: Optional[str] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._closing: Optional[asyncio.Event] = None
+
+    def response_for(self, search_term: str, page_size: Optional[int] = None) -> Dict[str, Any]:
+        response = self.recordings.get(search_term)
+        if response is None:
+            products = synthetic_products(search_term)
+            response = {"count": len(products), "page": 1, "page_size": page_size or len(products), "products": products}
+        response = copy.deepcopy(response)
+        if page_size:
+            response["products"] = response["products"][:page_size]
+        return response
+
+    def malform(self, response: Dict[str, Any]) -> Dict[str, Any]:
+        for product in response["products"]:
+            product["nutriments"] = self.rng.choice(MALFORMED_NUTRIMENTS)(product.get("nutriments") or {})
+        return response
+
+    async def search(self, request: web.Request) -> web.Response:
+        self.stats["requests"] += 1
+        roll = self.rng.random()
+        delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0.0)
+        try: page_size = int(request.query.get("page_size", 0)) or None
+        except ValueError: page_size = None
+        response = self.response_for(request.query.get("search_terms", ""), page_size)
+
+        if roll < self.timeout_rate:
+            self.stats["timeout"] += 1
+            try: await asyncio.wait_for(self._closing.wait(), self.hang)
+            except asyncio.TimeoutError: pass
+            return web.json_response(response)
+        elif roll < self.timeout_rate + self.error_rate:
+            self.stats["error"] += 1
+            if delay:
+                await asyncio.sleep(delay)
+            return web.Response(status=self.rng.choice(ERROR_STATUSES), text="Service temporarily unavailable")
+        elif roll < self.timeout_rate + self.error_rate + self.malformed_rate:
+            self.stats["malformed"] += 1
+            response = self.malform(response)
+        else:
+            self.stats["ok"] += 1
+        if delay:
+            await asyncio.sleep(delay)
+        return web.json_response(response)
+
+    async def stats_view(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(self.stats))
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get(SEARCH_PATH, self.search)
+        app.router.add_get("/__stub/stats", self.stats_view)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Запускает сервер (port=0 - случайный свободный порт) и возвращает базовый URL для OFF_BASE_URL."""
+        self._closing = asyncio.Event()
+        self._runner = web.AppRunner(self.create_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def close(self):
+        if self._runner is not None:
+            self._closing.set() # Зависшие ответы (--timeout-rate) отпускаем сразу, иначе остановка ждет --hang секунд
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def amain() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8181)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке (до), с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 5xx")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="доля запросов, зависающих на --hang с")
+    parser.add_argument("--hang", type=float, default=30.0, help="задержка зависшего ответа, с")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="доля ответов с испорченными nutriments")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+    stub = OffStub(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, timeout_rate=args.timeout_rate,
+        malformed_rate=args.malformed_rate, hang=args.hang, seed=args.seed,
+    )
+    url = await stub.start(args.host, args.port)
+    logger.info(f"Заглушка OFF слушает {url} (записанных ответов: {len(stub.recordings)}), запустите бота с OFF_BASE_URL={url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await stub.close()
+        logger.info(f"Итог: {dict(stub.stats)}")
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        raise SystemExit(asyncio.run(amain()))
+    except KeyboardInterrupt:
+        pass
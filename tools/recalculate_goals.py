@@ -0,0 +1,87 @@
+"""
+Офлайн-пересчет daily_calorie_goal для всех пользователей.
+
+Нужен после изменения utils.MACRO_TARGETS_PER_LBM_KG или utils.CALORIES_PER_GRAM:
+без него сохраненные нормы устаревают, пока пользователь сам не зайдет в /settings.
+Профили читаются порциями по первичному ключу, нормы считаются пакетно
+(analytics.calculate_daily_goals_batch, NumPy при наличии), а записываются
+только изменившиеся - одним UPDATE ... FROM unnest(...) и одним upsert в goal_history на порцию.
+
+Запуск из корня проекта (переменные окружения те же, что у бота):
+    python tools/recalculate_goals.py [--batch-size 5000] [--dry-run]
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import analytics
+import database as db
+
+logger = logging.getLogger("recalculate_goals")
+
+
+async def recalculate_all_goals(pool, batch_size: int = 5000, dry_run: bool = False, use_numpy: bool = True) -> dict:
+    """
+    Пересчитывает нормы всех пользователей. Возвращает статистику:
+    processed (прочитано профилей), changed (норма изменилась), updated (записано строк), seconds, rows_per_second.
+    """
+    effective_date = datetime.now(timezone.utc).date() # Как в recalculate_and_save_goal
+    processed = changed = updated = 0
+    last_user_id = -1
+    started = time.perf_counter()
+    while True:
+        profiles = await db.get_user_profiles_batch(pool, last_user_id, batch_size)
+        if not profiles:
+            break
+        last_user_id = profiles[-1]['user_id']
+        new_goals = analytics.calculate_daily_goals_batch(profiles, use_numpy=use_numpy)
+        changed_rows = [
+            (profile['user_id'], goal)
+            for profile, goal in zip(profiles, new_goals)
+            if goal != profile['daily_calorie_goal']
+        ]
+        processed += len(profiles)
+        changed += len(changed_rows)
+        if changed_rows and not dry_run:
+            user_ids, goals = (list(column) for column in zip(*changed_rows))
+            updated += await db.bulk_update_daily_goals(pool, user_ids, goals, effective_date)
+        elapsed = time.perf_counter() - started
+        logger.info(f"Обработано {processed} профилей (изменено {changed}), {processed / elapsed:.0f} строк/с")
+    elapsed = time.perf_counter() - started
+    return {
+        'processed': processed, 'changed': changed, 'updated': updated,
+        'seconds': elapsed, 'rows_per_second': processed / elapsed if elapsed else 0.0,
+    }
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=5000, help="профилей в одной порции")
+    parser.add_argument("--dry-run", action="store_true", help="только посчитать изменения, ничего не записывать")
+    parser.add_argument("--no-numpy", action="store_true", help="построчный расчет без NumPy (для сравнения)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+    # Построчные функции utils пишут в лог каждый расчет - для миллионов профилей это лишнее
+    logging.getLogger("utils").setLevel(logging.ERROR)
+
+    pool = await db.create_db_pool()
+    try:
+        stats = await recalculate_all_goals(pool, args.batch_size, args.dry_run, use_numpy=not args.no_numpy)
+    finally:
+        await db.close_db_pool()
+    logger.info(
+        f"Готово{' (dry-run)' if args.dry_run else ''}: профилей {stats['processed']}, изменено {stats['changed']}, "
+        f"записано {stats['updated']} за {stats['seconds']:.2f} с ({stats['rows_per_second']:.0f} строк/с)"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
@@ -0,0 +1,306 @@
+"""
+Трассировка обработки апдейтов: где ушло время в конкретном медленном апдейте.
+
+Для выбранного апдейта (доля TRACE_SAMPLE_RATE, 0 - выключено) создается корневой span "update",
+внутри него - дочерние:
+- handler - обработчик (HandlerTracingMiddleware);
+- db.<функция> - запросы database.py (instrument_module);
+- off.request - каждая попытка запроса к Open Food Facts;
+- telegram.<метод> - запросы к Bot API, включая ожидание в очереди отправки (TracingRequestMiddleware).
+
+Для невыбранных апдейтов span() ничего не делает, поэтому накладные расходы - одна проверка contextvar.
+Завершенные трассы копятся в памяти и раз в TRACE_FLUSH_INTERVAL секунд выгружаются:
+в JSONL-файл TRACE_FILE (по строке на span) или, если задан TRACE_OTLP_URL, в коллектор
+по OTLP/HTTP в JSON-кодировке (Jaeger, Tempo, otel-collector).
+"""
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from types import ModuleType
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+import aiohttp
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.types import TelegramObject, Update
+
+import config
+from metrics import handler_name, query_functions
+
+logger = logging.getLogger(__name__)
+
+TRACE_FLUSH_INTERVAL = 5 # Секунд между выгрузками
+MAX_BUFFERED_SPANS = 10_000 # Сверх этого span'ы отбрасываются (выгрузка не успевает или недоступна)
+SERVICE_NAME = "meal-taken-bot"
+OTLP_TIMEOUT = aiohttp.ClientTimeout(total=5)
+
+# traces - выбранных апдейтов, spans - записано span'ов, exported - выгружено, dropped - отброшено
+trace_stats: Dict[str, int] = {"traces": 0, "spans": 0, "exported": 0, "dropped": 0}
+
+_buffer: List["Span"] = []
+_flush_task: Optional[asyncio.Task] = None
+
+
+class Span:
+    """Интервал трассы. Время начала - unix-время в наносекундах, длительность - по perf_counter."""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "error", "_started")
+
+    def __init__(self, trace_id: str, parent_id: Optional[str], name: str, attributes: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.error = False
+        self.start_ns = time.time_ns()
+        self.end_ns = self.start_ns
+        self._started = time.perf_counter()
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def finish(self):
+        self.end_ns = self.start_ns + int((time.perf_counter() - self._started) * 1e9)
+        trace_stats["spans"] += 1
+        if len(_buffer) >= MAX_BUFFERED_SPANS:
+            trace_stats["dropped"] += 1
+            return
+        _buffer.append(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Строка JSONL-файла."""
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "status": "error" if self.error else "ok",
+            "attributes": self.attributes,
+        }
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def is_sampled() -> bool:
+    return config.TRACE_SAMPLE_RATE > 0 and random.random() < config.TRACE_SAMPLE_RATE
+
+
+@contextmanager
+def span(name: str, root: bool = False, **attributes: Any) -> Iterator[Optional[Span]]:
+    """
+    Дочерний span текущей трассы (root=True - начать новую трассу).
+    Вне трассы ничего не записывает и возвращает None.
+    """
+    parent = _current_span.get()
+    if parent is None and not root:
+        yield None
+        return
+    if root:
+        trace_stats["traces"] += 1
+    new_span = Span(os.urandom(16).hex() if root else parent.trace_id, None if root else parent.span_id, name, attributes)
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.error = True
+        new_span.set_attribute("exception", type(e).__name__)
+        raise
+    finally:
+        _current_span.reset(token)
+        new_span.finish()
+
+
+def record_span(name: str, started: float, error: bool = False, **attributes: Any):
+    """Записывает уже завершившийся интервал (started - time.perf_counter() в начале)."""
+    parent = _current_span.get()
+    if parent is None:
+        return
+    elapsed = time.perf_counter() - started
+    finished = Span(parent.trace_id, parent.span_id, name, attributes)
+    finished.start_ns -= int(elapsed * 1e9)
+    finished._started -= elapsed
+    finished.error = error
+    finished.finish()
+
+
+def traced(name: str):
+    """Декоратор асинхронной функции: вызов - дочерний span."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if _current_span.get() is None:
+                return await func(*args, **kwargs)
+            with span(name):
+                return await func(*args, **kwargs)
+        wrapper.__wrapped_tracing__ = True
+        return wrapper
+    return decorator
+
+
+def instrument_module(module: ModuleType, prefix: str = "db.") -> int:
+    """Оборачивает запросы модуля (см. metrics.query_functions) в span'ы. Возвращает число обернутых."""
+    count = 0
+    for name in query_functions(module):
+        func = getattr(module, name)
+        if getattr(func, "__wrapped_tracing__", False):
+            continue
+        setattr(module, name, traced(prefix + name)(func))
+        count += 1
+    return count
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Outer-middleware апдейта: корневой span для выбранных апдейтов."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, Update) or not is_sampled():
+            return await handler(event, data)
+        user = data.get("event_from_user")
+        with span("update", root=True, update_id=event.update_id, event_type=event.event_type,
+                  user_id=user.id if user else None):
+            return await handler(event, data)
+
+
+class HandlerTracingMiddleware(BaseMiddleware):
+    """Inner-middleware: span обработчика с именем функции (отделяет его от загрузки FSM и middleware)."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if _current_span.get() is None:
+            return await handler(event, data)
+        with span("handler", handler=handler_name(event, data)):
+            return await handler(event, data)
+
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    """Request middleware сессии бота: span на каждый запрос к Bot API из трассируемого апдейта."""
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        if _current_span.get() is None:
+            return await make_request(bot, method)
+        with span(f"telegram.{method.__api_method__}", chat_id=getattr(method, "chat_id", None)):
+            return await make_request(bot, method)
+
+
+# --- Выгрузка ---
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_payload(spans: List[Span]) -> Dict[str, Any]:
+    """Тело запроса OTLP/HTTP (JSON) для /v1/traces."""
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{
+            "scope": {"name": __name__},
+            "spans": [{
+                "traceId": item.trace_id,
+                "spanId": item.span_id,
+                "parentSpanId": item.parent_id or "",
+                "name": item.name,
+                "kind": 2 if item.parent_id is None else 1, # SERVER для апдейта, INTERNAL для остальных
+                "startTimeUnixNano": str(item.start_ns),
+                "endTimeUnixNano": str(item.end_ns),
+                "attributes": [
+                    {"key": key, "value": _otlp_value(value)}
+                    for key, value in item.attributes.items() if value is not None
+                ],
+                "status": {"code": 2 if item.error else 1},
+            } for item in spans],
+        }],
+    }]}
+
+
+def _append_jsonl(path: str, spans: List[Span]):
+    with open(path, "a", encoding="utf-8") as f:
+        for item in spans:
+            f.write(json.dumps(item.to_dict(), ensure_ascii=False) + "\n")
+
+
+async def _export(spans: List[Span]):
+    if config.TRACE_OTLP_URL:
+        async with aiohttp.ClientSession(timeout=OTLP_TIMEOUT) as session:
+            async with session.post(config.TRACE_OTLP_URL, json=otlp_payload(spans)) as response:
+                response.raise_for_status()
+    else:
+        # Запись в файл - в потоке, чтобы не блокировать цикл событий
+        await asyncio.to_thread(_append_jsonl, config.TRACE_FILE, spans)
+
+
+async def flush_traces() -> int:
+    """Выгружает накопленные span'ы. Возвращает число выгруженных."""
+    if not _buffer:
+        return 0
+    spans = _buffer[:]
+    _buffer.clear()
+    try:
+        await _export(spans)
+    except Exception as e:
+        trace_stats["dropped"] += len(spans)
+        logger.warning(f"Не удалось выгрузить трассы ({len(spans)} span'ов): {e}")
+        return 0
+    trace_stats["exported"] += len(spans)
+    return len(spans)
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(TRACE_FLUSH_INTERVAL)
+        await flush_traces()
+
+
+async def start_tracing():
+    """Запускает периодическую выгрузку трасс (если TRACE_SAMPLE_RATE > 0)."""
+    global _flush_task
+    if config.TRACE_SAMPLE_RATE <= 0 or _flush_task is not None:
+        return
+    _flush_task = asyncio.create_task(_flush_loop())
+    target = config.TRACE_OTLP_URL or config.TRACE_FILE
+    logger.info(f"Трассировка включена: доля апдейтов {config.TRACE_SAMPLE_RATE}, выгрузка в {target}.")
+
+
+async def stop_tracing():
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+        _flush_task = None
+    await flush_traces()
+
+
+def install_tracing(bot: Bot):
+    """Подключает span'ы запросов к Bot API. Вызывать до install_send_queue, чтобы учитывалась очередь."""
+    bot.session.middleware(TracingRequestMiddleware())
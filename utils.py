@@ -21,6 +21,15 @@ MACRO_TARGETS_PER_LBM_KG = {
     }
 }
 
+# Коэффициенты формул LBM по полу: LBM(кг) = (k_w×W[кг]) + (k_h×H[см]) − c
+LBM_COEFFICIENTS = {
+    "male": (0.407, 0.267, 19.2),
+    "female": (0.252, 0.473, 48.3)
+}
+
+# LBM больше этой доли веса считается неправдоподобной (небольшая погрешность сверх 100%)
+LBM_MAX_WEIGHT_RATIO = 1.05
+
 def calculate_lbm(weight_kg: float, height_cm: int, gender: str) -> Optional[float]:
     """
     Рассчитывает сухую массу тела (LBM) по формулам.
@@ -29,19 +38,14 @@ def calculate_lbm(weight_kg: float, height_cm: int, gender: str) -> Optional[flo
     if not weight_kg or not height_cm or not gender:
         return None
 
-    lbm = None
-    if gender == 'male':
-        # Для мужчин: LBM(кг)=(0.407×W[кг])+(0.267×H[см])−19.2
-        lbm = (0.407 * weight_kg) + (0.267 * height_cm) - 19.2
-    elif gender == 'female':
-        # Для женщин: LBM(кг)=(0.252×W[кг])+(0.473×H[см])−48.3
-        lbm = (0.252 * weight_kg) + (0.473 * height_cm) - 48.3
-    else:
+    if gender not in LBM_COEFFICIENTS:
         logger.warning(f"Неизвестный пол '{gender}' для расчета LBM.")
         return None
+    weight_coef, height_coef, offset = LBM_COEFFICIENTS[gender]
+    lbm = (weight_coef * weight_kg) + (height_coef * height_cm) - offset
 
     # LBM не может быть отрицательной или больше общего веса (добавим небольшую погрешность)
-    if lbm <= 0 or lbm > weight_kg * 1.05:
+    if lbm <= 0 or lbm > weight_kg * LBM_MAX_WEIGHT_RATIO:
         logger.warning(f"Неправдоподобный LBM ({lbm:.2f} кг) для W={weight_kg} кг, H={height_cm} см, Пол={gender}. Возвращаем None.")
         return None
 